@@ -53,22 +53,30 @@ PROルール：
 
 ★市場前の no_bars の扱い（合意）
 - 「まだデータ来てないだけ」は eval_exit_reason を空のままでスキップ（DB更新しない）
+
+★先読み（評価前に1回だけ）
+- targets から必要な (code, 日付) を全部洗い出し、日付ごとにまとめて並行に読む（bars_5m.prefetch_5m_bars）
+- 寄り値（日足Open）も必要な分を1回の複数銘柄 download でまとめて取る
+- 評価本体はメモリ上の結果だけを見る（先読みに漏れた分だけ従来どおり個別に読む）
 """
 
 from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import date as _date, datetime as _dt, time as _time, timedelta as _timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
+import numpy as np
 from django.core.management.base import BaseCommand
-from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 
 from aiapp.models.vtrade import VirtualTrade
 from aiapp.models.behavior_stats import BehaviorStats
-from aiapp.services.bars_5m import load_5m_bars
+from aiapp.services import sim_eval_engine as eng
+from aiapp.services.bars_5m import load_5m_bars, prefetch_5m_bars
+from aiapp.services.bulk_writer import BulkWriter
+from aiapp.services.sim_policy import reanchor_tp_sl_A
 
 
 # ==============================
@@ -263,6 +271,154 @@ def _yf_daily_open(code: str, d: _date) -> Optional[float]:
         return None
 
 
+def _yf_daily_opens(pairs: Iterable[Tuple[str, _date]]) -> Optional[Dict[Tuple[str, _date], Optional[float]]]:
+    """
+    _yf_daily_open の複数銘柄・複数日版（yf.download 1回）。
+    download 自体が失敗したら None（呼び出し側は個別取得に戻る）。
+    取れなかった組は None を入れて返す（個別に取り直さない）。
+    """
+    pairs = list(dict.fromkeys((str(c), d) for c, d in pairs))
+    if not pairs:
+        return {}
+    try:
+        import yfinance as yf  # type: ignore
+        import pandas as pd  # type: ignore
+    except Exception:
+        return None
+
+    tickers = sorted({f"{c}.T" for c, _ in pairs})
+    d_min = min(d for _, d in pairs)
+    d_max = max(d for _, d in pairs)
+    try:
+        df = yf.download(
+            tickers=tickers if len(tickers) > 1 else tickers[0],
+            start=pd.Timestamp(d_min),
+            end=pd.Timestamp(d_max) + pd.Timedelta(days=1),
+            interval="1d",
+            auto_adjust=False,
+            progress=False,
+            group_by="ticker",
+            threads=len(tickers) > 1,
+        )
+    except Exception:
+        return None
+    if df is None:
+        return None
+
+    out: Dict[Tuple[str, _date], Optional[float]] = {p: None for p in pairs}
+    if len(df) == 0:
+        return out
+
+    dates = [pd.Timestamp(x).date() for x in df.index]
+    multi = isinstance(df.columns, pd.MultiIndex)
+    top = set(df.columns.get_level_values(0)) if multi else set()
+    opens: Dict[str, Dict[_date, Any]] = {}
+    for t in tickers:
+        if multi:
+            if t not in top or "Open" not in df[t].columns:
+                continue
+            col = df[t]["Open"]
+        else:
+            if "Open" not in df.columns:
+                continue
+            col = df["Open"]
+        opens[t] = dict(zip(dates, col.to_numpy()))
+
+    for c, d in pairs:
+        out[(c, d)] = _safe_float(opens.get(f"{c}.T", {}).get(d))
+    return out
+
+
+# ==============================
+# prefetch（評価前にまとめて読む）
+# ==============================
+
+# {(code, date): 5分足 DataFrame}（load_5m_bars と同じ形。None / 空 = その日は無し）
+_BARS_MEM: Dict[Tuple[str, _date], Any] = {}
+# {(code, date): 寄り値 or None}
+_YORI_MEM: Dict[Tuple[str, _date], Optional[float]] = {}
+
+
+def _clear_prefetch() -> None:
+    _BARS_MEM.clear()
+    _YORI_MEM.clear()
+    _PREP_MEM.clear()
+
+
+def _bars(code: str, d: _date):
+    """
+    load_5m_bars のメモ付き版（先読み済みならメモリから。呼び出し側は copy() して使う）
+    """
+    key = (str(code), d)
+    if key not in _BARS_MEM:
+        _BARS_MEM[key] = load_5m_bars(code, d)
+    return _BARS_MEM[key]
+
+
+def _daily_open(code: str, d: _date) -> Optional[float]:
+    key = (str(code), d)
+    if key not in _YORI_MEM:
+        _YORI_MEM[key] = _yf_daily_open(code, d)
+    return _YORI_MEM[key]
+
+
+def _plan_dates(trade_date: _date, horizon_bd: int, date_cap: _date) -> List[_date]:
+    """
+    1件の評価で見にいく日付の見込み（trade_date から horizon 営業日 + 祝日の余裕 5日、date_cap まで）。
+    足りなければ評価側が個別に読むので、ここは多少短くても結果は変わらない。
+    """
+    out: List[_date] = []
+    d = trade_date
+    weekdays = 0
+    end: Optional[_date] = None
+    while d <= date_cap:
+        if end is not None and d > end:
+            break
+        out.append(d)
+        if d.weekday() < 5:
+            weekdays += 1
+            if weekdays >= max(1, int(horizon_bd)) and end is None:
+                end = d + _timedelta(days=5)
+        d = d + _timedelta(days=1)
+    return out
+
+
+def _prefetch(targets: List[VirtualTrade], *, horizon_bd: int, date_cap: _date) -> Dict[str, int]:
+    """
+    targets の評価に要る 5分足と寄り値をまとめて読み、_BARS_MEM / _YORI_MEM に入れる。
+    - 土日は 5分足が無いので読まずに空を入れる
+    - 寄り値は opened_at が寄り前（評価開始 = 09:00）の件だけ
+    """
+    bar_keys: Set[Tuple[str, _date]] = set()
+    yori_keys: Set[Tuple[str, _date]] = set()
+
+    for v in targets:
+        if int(v.qty_pro or 0) <= 0 or not v.trade_date:
+            continue
+        code = str(v.code)
+        for d in _plan_dates(v.trade_date, horizon_bd, date_cap):
+            bar_keys.add((code, d))
+
+        opened_local = _to_local(v.opened_at)
+        if opened_local is not None and opened_local <= _jst_session_range(v.trade_date)[0]:
+            yori_keys.add((code, v.trade_date))
+
+    weekend = {k for k in bar_keys if k[1].weekday() >= 5}
+    for k in weekend:
+        _BARS_MEM[k] = None
+
+    _BARS_MEM.update(prefetch_5m_bars(bar_keys - weekend))
+
+    n_yori = 0
+    if yori_keys:
+        opens = _yf_daily_opens(sorted(yori_keys))
+        if opens is not None:
+            _YORI_MEM.update(opens)
+            n_yori = len(opens)
+
+    return {"bar_keys": len(bar_keys), "bar_days": len({d for _, d in bar_keys}), "yori": n_yori}
+
+
 def _side(v: VirtualTrade) -> str:
     s = str(getattr(v, "side", "") or "BUY").upper().strip()
     return "SELL" if s == "SELL" else "BUY"
@@ -289,58 +445,6 @@ def _plan_params(v: VirtualTrade) -> Tuple[Optional[float], Optional[float], Opt
     return entry, tp, sl
 
 
-def _reanchor_tp_sl_A(
-    *,
-    side: str,
-    entry_plan: float,
-    tp_plan: Optional[float],
-    sl_plan: Optional[float],
-    exec_entry_px: float,
-) -> Tuple[Optional[float], Optional[float], Dict[str, Any]]:
-    """
-    A案：R基準でTP/SLを再配置（有利ズレのときのみ）
-    戻り値： (tp_use, sl_use, meta)
-    """
-    meta: Dict[str, Any] = {}
-
-    if sl_plan is None:
-        meta["a_rule"] = "no_sl_plan"
-        return tp_plan, sl_plan, meta
-
-    r = abs(float(entry_plan) - float(sl_plan))
-    if r <= 0:
-        meta["a_rule"] = "bad_r"
-        return tp_plan, sl_plan, meta
-
-    tp_ratio = None
-    if tp_plan is not None:
-        tp_ratio = abs(float(tp_plan) - float(entry_plan)) / r
-
-    meta["r_plan"] = float(r)
-    meta["tp_ratio"] = float(tp_ratio) if tp_ratio is not None else None
-
-    if side == "BUY":
-        favorable = float(exec_entry_px) < float(entry_plan)
-    else:
-        favorable = float(exec_entry_px) > float(entry_plan)
-
-    if not favorable:
-        meta["a_rule"] = "not_favorable_keep_plan"
-        return tp_plan, sl_plan, meta
-
-    if side == "BUY":
-        sl_use = float(exec_entry_px) - r
-        tp_use = (float(exec_entry_px) + r * float(tp_ratio)) if tp_ratio is not None else tp_plan
-    else:
-        sl_use = float(exec_entry_px) + r
-        tp_use = (float(exec_entry_px) - r * float(tp_ratio)) if tp_ratio is not None else tp_plan
-
-    meta["a_rule"] = "reanchored_by_exec"
-    meta["tp_use"] = float(tp_use) if tp_use is not None else None
-    meta["sl_use"] = float(sl_use) if sl_use is not None else None
-    return tp_use, sl_use, meta
-
-
 def _pl_per_share(side: str, exec_entry_px: float, exit_px: float) -> float:
     if side == "SELL":
         return float(exec_entry_px) - float(exit_px)
@@ -352,7 +456,7 @@ def _is_trade_day_by_bars(code: str, d: _date) -> bool:
     休日除外の営業日カウント用：
     その日の5分足が取れる＝営業日としてカウント
     """
-    bars = load_5m_bars(code, d)
+    bars = _bars(code, d)
     return (bars is not None) and (len(bars) > 0)
 
 
@@ -405,25 +509,46 @@ def _ev_true_from_behavior(code: str) -> float:
     return float(v)
 
 
-def _rank_within_run(run_id: str) -> int:
+def _pro_fields(v: VirtualTrade, **state: Any) -> Dict[str, Any]:
     """
-    run_id 内で ev_true_pro 降順に rank_pro を振る
+    書き込み後の状態での pro_status / pro_label / pro_pl（state に無いものは v の今の値）
     """
+    cur = {
+        "replay": v.replay,
+        "eval_exit_reason": v.eval_exit_reason,
+        "closed_at": v.closed_at,
+        "eval_entry_px": v.eval_entry_px,
+    }
+    cur.update(state)
+    return VirtualTrade.compute_pro_fields(**cur)
+
+
+def _rank_runs(run_ids: Iterable[str], writer: BulkWriter) -> int:
+    """
+    run_id ごとに ev_true_pro 降順で rank_pro を振る（SELECT 1回。書き込みは writer に積むだけ）
+    戻り値: rank_pro が変わる件数
+    """
+    run_ids = sorted({str(r) for r in run_ids if r})
+    if not run_ids:
+        return 0
+
     qs = (
         VirtualTrade.objects
-        .filter(run_id=run_id)
-        .order_by("-ev_true_pro", "code", "id")
-        .only("id", "ev_true_pro")
+        .filter(run_id__in=run_ids)
+        .order_by("run_id", "-ev_true_pro", "code", "id")
+        .only("id", "run_id", "rank_pro")
     )
 
     updated = 0
-    with transaction.atomic():
-        i = 0
-        for v in qs:
-            i += 1
-            if v.rank_pro != i:
-                VirtualTrade.objects.filter(id=v.id).update(rank_pro=i)
-                updated += 1
+    cur = None
+    i = 0
+    for v in qs:
+        if v.run_id != cur:
+            cur = v.run_id
+            i = 0
+        i += 1
+        if writer.set(v, rank_pro=i):
+            updated += 1
     return updated
 
 
@@ -449,30 +574,50 @@ class EvalResult:
 
 
 # ==============================
-# core evaluation（PRO only）
+# bars の前処理（(code, 日付) ごとに1回）
 # ==============================
 
-def _evaluate_entry_on_trade_date(
-    v: VirtualTrade,
-    *,
-    verbose: int = 1,
-) -> Tuple[bool, str, Optional[float], Optional[_dt], Optional[float], Optional[float], Optional[float], Dict[str, Any]]:
+@dataclass
+class _DayBars:
     """
-    entry は起票日当日のみ（trade_date のみで約定判定）
-    - opened_at（JST）以降で評価開始
-    - 寄り判定は日足Open（=寄り値）を使う（opened_atが寄り前のときのみ）
-    - marketable limit を再現
+    1銘柄・1日分の 5分足を評価用の配列にしたもの。
+    reason が空なら使える（それ以外は no_bars / no_ts / bad_ts / no_ohlc。rule は entry_rule 用）
     """
-    trade_date = v.trade_date
-    side = _side(v)
+    reason: str = ""
+    rule: str = ""
+    ts: Any = None                       # pd.Series（Asia/Tokyo）。約定・決済時刻はここから取る
+    ts_ns: Optional[np.ndarray] = None   # 比較用（UTC ns。NaT は int64 最小値）
+    o: Optional[np.ndarray] = None
+    h: Optional[np.ndarray] = None
+    l: Optional[np.ndarray] = None
+    c: Optional[np.ndarray] = None
+
+
+# {(code, date): _DayBars}
+_PREP_MEM: Dict[Tuple[str, _date], _DayBars] = {}
+
+
+def _ts_ns(ts) -> np.ndarray:
+    import pandas as pd  # type: ignore
+
+    try:
+        return np.asarray(ts.dt.tz_convert("UTC").dt.tz_localize(None), dtype="datetime64[ns]").view("int64")
+    except Exception:
+        nat = np.iinfo(np.int64).min
+        return np.array([nat if pd.isna(x) else pd.Timestamp(x).value for x in ts], dtype=np.int64)
 
-    entry_plan, tp_plan, sl_plan = _plan_params(v)
-    if entry_plan is None:
-        return False, "no_entry", None, None, None, None, None, {"entry_rule": "no_entry_plan"}
 
-    bars = load_5m_bars(v.code, trade_date)
+def _col_f(df, col) -> np.ndarray:
+    import pandas as pd  # type: ignore
+
+    if col is None:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64")
+
+
+def _prep_bars(bars) -> _DayBars:
     if bars is None or len(bars) == 0:
-        return False, "no_bars", None, None, None, None, None, {"entry_rule": "no_bars"}
+        return _DayBars(reason="no_bars", rule="no_bars")
 
     df = bars.copy()
 
@@ -482,35 +627,109 @@ def _evaluate_entry_on_trade_date(
             if isinstance(df.index, pd.DatetimeIndex):
                 df = df.reset_index().rename(columns={df.index.name or "index": "ts"})
             else:
-                return False, "no_ts", None, None, None, None, None, {"entry_rule": "no_ts"}
+                return _DayBars(reason="no_ts", rule="no_ts")
         except Exception:
-            return False, "no_ts", None, None, None, None, None, {"entry_rule": "no_ts_exc"}
+            return _DayBars(reason="no_ts", rule="no_ts_exc")
 
     df2 = _ensure_ts_jst(df)
     if df2 is None:
-        return False, "bad_ts", None, None, None, None, None, {"entry_rule": "bad_ts"}
+        return _DayBars(reason="bad_ts", rule="bad_ts")
     df = df2
 
     open_col, low_col, high_col, close_col = _find_ohlc_columns(df)
     if low_col is None or high_col is None or close_col is None:
-        return False, "no_ohlc", None, None, None, None, None, {"entry_rule": "no_ohlc"}
+        return _DayBars(reason="no_ohlc", rule="no_ohlc")
+
+    ts = df["ts"].reset_index(drop=True)
+    return _DayBars(
+        ts=ts,
+        ts_ns=_ts_ns(ts),
+        o=_col_f(df, open_col),
+        h=_col_f(df, high_col),
+        l=_col_f(df, low_col),
+        c=_col_f(df, close_col),
+    )
+
+
+def _prep_day(code: str, d: _date) -> _DayBars:
+    key = (str(code), d)
+    hit = _PREP_MEM.get(key)
+    if hit is None:
+        hit = _prep_bars(_bars(code, d))
+        _PREP_MEM[key] = hit
+    return hit
+
+
+def _window(day: _DayBars, start: _dt, end: _dt) -> np.ndarray:
+    """
+    start <= ts <= end の足（ループ版の df[(df["ts"] >= start) & (df["ts"] <= end)]）
+    """
+    import pandas as pd  # type: ignore
+
+    lo = pd.Timestamp(start).value
+    hi = pd.Timestamp(end).value
+    return (day.ts_ns >= lo) & (day.ts_ns <= hi)
+
+
+# ==============================
+# core evaluation（PRO only）
+# ==============================
+
+_FILL_NAMES = {
+    eng.FILL_YORI: "yori_open_marketable",
+    eng.FILL_OPEN: "bar_open_marketable",
+    eng.FILL_TOUCH: "bar_touch_entry",
+}
+
+
+def _entry_setup(v: VirtualTrade, *, force: bool) -> Any:
+    """
+    約定判定の前段（1件ずつ）。
+    - 評価できない / しない件は EvalResult を返す（ループ版と同じ reason / meta）
+    - 評価する件は約定判定の入力を dict で返す
+    entry は起票日当日のみ（trade_date のみで約定判定）
+    - opened_at（JST）以降で評価開始
+    - 寄り判定は日足Open（=寄り値）を使う（opened_atが寄り前のときのみ）
+    """
+    current_reason = str(v.eval_exit_reason or "").strip()
+    if (not force) and (current_reason not in ("", "carry")):
+        return EvalResult(
+            ok=True,
+            reason="already_closed",
+            eval_exit_reason=current_reason,
+            meta={"guard": "already_closed", "force": False},
+        )
+
+    def _fail(reason: str, rule: str) -> EvalResult:
+        return EvalResult(ok=False, reason=reason, eval_exit_reason=reason, meta={"entry_rule": rule})
+
+    trade_date = v.trade_date
+    side = _side(v)
+
+    entry_plan, tp_plan, sl_plan = _plan_params(v)
+    if entry_plan is None:
+        return _fail("no_entry", "no_entry_plan")
+
+    day = _prep_day(v.code, trade_date)
+    if day.reason:
+        return _fail(day.reason, day.rule)
 
     opened_local = _to_local(v.opened_at)
     if opened_local is None:
-        return False, "no_opened_at", None, None, None, None, None, {"entry_rule": "no_opened_at"}
+        return _fail("no_opened_at", "no_opened_at")
 
     session_start, session_end = _jst_session_range(trade_date)
 
     if opened_local < session_start:
         active_start = session_start
     elif opened_local > session_end:
-        return False, "no_bars_after_active", None, None, None, None, None, {"entry_rule": "after_session"}
+        return _fail("no_bars_after_active", "after_session")
     else:
         active_start = opened_local
 
-    df_eff = df[(df["ts"] >= active_start) & (df["ts"] <= session_end)]
-    if df_eff is None or len(df_eff) == 0:
-        return False, "no_bars_after_active", None, None, None, None, None, {"entry_rule": "no_bars_after_active"}
+    live = _window(day, active_start, session_end)
+    if not live.any():
+        return _fail("no_bars_after_active", "no_bars_after_active")
 
     meta: Dict[str, Any] = {
         "entry_rule": "limit",
@@ -518,108 +737,33 @@ def _evaluate_entry_on_trade_date(
         "session_start": str(session_start),
     }
 
-    exec_entry_px: Optional[float] = None
-    entry_ts: Optional[_dt] = None
-
     # --- 寄り(09:00)の特別判定（opened_atが寄り前のときだけ） ---
+    yori = None
     if active_start == session_start:
-        yori = _yf_daily_open(str(v.code), trade_date)
+        yori = _daily_open(str(v.code), trade_date)
         meta["yori_open"] = yori
 
-        if yori is not None:
-            if side == "BUY":
-                if float(yori) <= float(entry_plan):
-                    exec_entry_px = float(yori)
-                    entry_ts = session_start
-                    meta["entry_fill"] = "yori_open_marketable"
-            else:
-                if float(yori) >= float(entry_plan):
-                    exec_entry_px = float(yori)
-                    entry_ts = session_start
-                    meta["entry_fill"] = "yori_open_marketable"
-
-    # --- 5分足での判定（寄りで刺さらなかった場合） ---
-    if exec_entry_px is None or entry_ts is None:
-        for _, row in df_eff.iterrows():
-            try:
-                lo = _safe_float(row[low_col])
-                hi = _safe_float(row[high_col])
-            except Exception:
-                lo = hi = None
-
-            o = None
-            if open_col is not None:
-                try:
-                    o = _safe_float(row[open_col])
-                except Exception:
-                    o = None
-
-            bar_ts = _coerce_ts(row["ts"], fallback=active_start)
-
-            if side == "SELL":
-                if o is not None and float(o) >= float(entry_plan):
-                    exec_entry_px = float(o)
-                    entry_ts = bar_ts
-                    meta["entry_fill"] = "bar_open_marketable"
-                    break
-                if lo is not None and hi is not None and float(lo) <= float(entry_plan) <= float(hi):
-                    exec_entry_px = float(entry_plan)
-                    entry_ts = bar_ts
-                    meta["entry_fill"] = "bar_touch_entry"
-                    break
-            else:
-                if o is not None and float(o) <= float(entry_plan):
-                    exec_entry_px = float(o)
-                    entry_ts = bar_ts
-                    meta["entry_fill"] = "bar_open_marketable"
-                    break
-                if lo is not None and hi is not None and float(lo) <= float(entry_plan) <= float(hi):
-                    exec_entry_px = float(entry_plan)
-                    entry_ts = bar_ts
-                    meta["entry_fill"] = "bar_touch_entry"
-                    break
-
-    if exec_entry_px is None or entry_ts is None:
-        meta["entry_fill"] = "no_position"
-        return True, "no_position", None, None, None, None, None, meta
-
-    # --- A案：有利ズレのときだけ TP/SL を exec 基準に再配置 ---
-    tp_use, sl_use, a_meta = _reanchor_tp_sl_A(
-        side=side,
-        entry_plan=float(entry_plan),
-        tp_plan=tp_plan,
-        sl_plan=sl_plan,
-        exec_entry_px=float(exec_entry_px),
-    )
-    meta.update({"A": a_meta})
-
-    r_plan = _safe_float(a_meta.get("r_plan")) if isinstance(a_meta, dict) else None
-
-    return True, "entry_ok", float(exec_entry_px), entry_ts, tp_use, sl_use, r_plan, meta
+    return {
+        "side": side,
+        "entry_plan": float(entry_plan),
+        "tp_plan": tp_plan,
+        "sl_plan": sl_plan,
+        "yori": np.nan if yori is None else float(yori),
+        "day": day,
+        "live": live,
+        "active_start": active_start,
+        "session_start": session_start,
+        "meta": meta,
+    }
 
 
-def _evaluate_exit_across_horizon(
-    v: VirtualTrade,
-    *,
-    exec_entry_px: float,
-    entry_ts: _dt,
-    tp_use: Optional[float],
-    sl_use: Optional[float],
-    horizon_bd: int,
-    verbose: int = 1,
-) -> EvalResult:
+def _exit_setup(v: VirtualTrade, *, entry_ts: _dt, horizon_bd: int) -> Any:
     """
-    entry 後の exit を horizon_bd 営業日で判定（PRO）
-    - TP/SL ヒットで即CLOSED
-    - 最終営業日の最後の足で time_stop
-    - 未来データ不足は carry
-
-    ★重要：未来日データが揃っていなくても、
-      「取れてる日だけ」で TP/SL 判定は必ず先にやる（合意の実運用）
-      → これで「今日TPタッチしたのにcarry」が起きない
+    決済判定の前段（1件ずつ）。horizon の営業日を集めて、評価範囲の足をつなぐ。
+    - 対象日が1日も無ければ carry の EvalResult
+    - 評価する件は dict（parts = [(day, live, start_ts, session_end), ...]）
     """
     trade_date = v.trade_date
-    side = _side(v)
 
     if horizon_bd <= 0:
         horizon_bd = 1
@@ -634,135 +778,109 @@ def _evaluate_exit_across_horizon(
     if not horizon_dates:
         return EvalResult(ok=True, reason="carry", eval_exit_reason="carry", meta={**meta, "carry_rule": "no_horizon_dates"})
 
-    # ここが修正ポイント：
-    # 「horizon分の営業日が揃ってない＝即carryでreturn」をやめる
-    # → まず取れてる日でTP/SL判定を実行し、それでも決済できないなら carry
+    # horizon分の営業日が揃っていなくても、まず取れてる日でTP/SL判定する（それでも決済できなければ carry）
     horizon_complete = (len(horizon_dates) >= int(horizon_bd))
     meta["horizon_complete"] = bool(horizon_complete)
 
     last_target_date: Optional[_date] = horizon_dates[int(horizon_bd) - 1] if horizon_complete else None
     meta["last_target_date"] = str(last_target_date) if last_target_date else None
 
+    parts: List[Tuple[_DayBars, np.ndarray, _dt, _dt]] = []
     last_available_date: Optional[_date] = None
-    last_close_px: Optional[float] = None
-    last_close_ts: Optional[_dt] = None
 
-    # 評価に使う日付は「今ある分だけ」
     for d in horizon_dates:
-        bars = load_5m_bars(v.code, d)
-        if bars is None or len(bars) == 0:
-            continue
-
-        df = bars.copy()
-
-        if "ts" not in df.columns:
-            try:
-                import pandas as pd  # type: ignore
-                if isinstance(df.index, pd.DatetimeIndex):
-                    df = df.reset_index().rename(columns={df.index.name or "index": "ts"})
-                else:
-                    continue
-            except Exception:
-                continue
-
-        df2 = _ensure_ts_jst(df)
-        if df2 is None:
-            continue
-        df = df2
-
-        open_col, low_col, high_col, close_col = _find_ohlc_columns(df)
-        if low_col is None or high_col is None or close_col is None:
+        day = _prep_day(v.code, d)
+        if day.reason:
             continue
 
         session_start, session_end = _jst_session_range(d)
-
         if d == trade_date:
-            start_ts = entry_ts
-            if start_ts < session_start:
-                start_ts = session_start
+            start_ts = max(entry_ts, session_start)
         else:
             start_ts = session_start
 
-        df_eff = df[(df["ts"] >= start_ts) & (df["ts"] <= session_end)]
-        if df_eff is None or len(df_eff) == 0:
-            last_available_date = d
-            continue
-
+        parts.append((day, _window(day, start_ts, session_end), start_ts, session_end))
         last_available_date = d
 
-        last_row = df_eff.iloc[-1]
-        try:
-            last_close_px = _safe_float(last_row[close_col])
-            last_close_ts = _coerce_ts(last_row["ts"], fallback=session_end)
-        except Exception:
-            last_close_px = None
-            last_close_ts = session_end
+        if last_target_date is not None and d >= last_target_date:
+            break
 
-        hit_tp_idx = None
-        hit_sl_idx = None
+    return {
+        "meta": meta,
+        "parts": parts,
+        "horizon_dates": horizon_dates,
+        "horizon_complete": horizon_complete,
+        "last_target_date": last_target_date,
+        "last_available_date": last_available_date,
+    }
 
-        if tp_use is not None:
-            try:
-                tp_mask = df_eff[high_col] >= float(tp_use)
-                if tp_mask.to_numpy().any():
-                    hit_tp_idx = df_eff[tp_mask].index[0]
-            except Exception:
-                hit_tp_idx = None
 
-        if sl_use is not None:
-            try:
-                sl_mask = df_eff[low_col] <= float(sl_use)
-                if sl_mask.to_numpy().any():
-                    hit_sl_idx = df_eff[sl_mask].index[0]
-            except Exception:
-                hit_sl_idx = None
-
-        if hit_tp_idx is not None or hit_sl_idx is not None:
-            if hit_tp_idx is not None and hit_sl_idx is not None:
-                tp_first = hit_tp_idx <= hit_sl_idx
-            else:
-                tp_first = hit_tp_idx is not None
+def _part_at(parts: List[Tuple[_DayBars, np.ndarray, _dt, _dt]], idx: int) -> Tuple[_DayBars, int, _dt, _dt]:
+    """
+    つないだ足の列 idx → (その日の _DayBars, 日の中の位置, start_ts, session_end)
+    """
+    for day, live, start_ts, session_end in parts:
+        n = len(live)
+        if idx < n:
+            return day, idx, start_ts, session_end
+        idx -= n
+    raise IndexError(idx)
 
-            if tp_first:
-                row2 = df_eff.loc[hit_tp_idx]
-                exit_ts = _coerce_ts(row2["ts"], fallback=start_ts)
-                exit_px = float(tp_use)
-                exit_reason = "hit_tp"
-            else:
-                row2 = df_eff.loc[hit_sl_idx]
-                exit_ts = _coerce_ts(row2["ts"], fallback=start_ts)
-                exit_px = float(sl_use)
-                exit_reason = "hit_sl"
-
-            plps = _pl_per_share(side, float(exec_entry_px), float(exit_px))
-            return EvalResult(
-                ok=True,
-                reason="exit_ok",
-                eval_exit_px=float(exit_px),
-                eval_exit_ts=exit_ts,
-                eval_exit_reason=exit_reason,
-                pl_per_share=plps,
-                meta=meta,
-            )
 
-        # 完了していない状態で「ターゲット最終日」より先の判定は不要だが、
-        # horizon_dates自体が「barsがある日だけ」なので、ここでbreakしても問題ない
-        if last_target_date is not None and d >= last_target_date:
-            # 目標最終日まで見終わった
-            break
+def _exit_result(
+    v: VirtualTrade,
+    x: Dict[str, Any],
+    *,
+    side: str,
+    exec_entry_px: float,
+    tp_use: Optional[float],
+    sl_use: Optional[float],
+    reason: int,
+    idx: int,
+    last_idx: int,
+) -> EvalResult:
+    """
+    exit_hits の結果 → EvalResult（carry / time_stop の決め方はループ版のまま）
+    """
+    meta = x["meta"]
+    parts = x["parts"]
+
+    if reason != eng.EXIT_NONE:
+        day, k, start_ts, _ = _part_at(parts, idx)
+        exit_ts = _coerce_ts(day.ts.iloc[k], fallback=start_ts)
+        if reason == eng.EXIT_TP:
+            exit_px = float(tp_use)
+            exit_reason = "hit_tp"
+        else:
+            exit_px = float(sl_use)
+            exit_reason = "hit_sl"
+
+        plps = _pl_per_share(side, float(exec_entry_px), float(exit_px))
+        return EvalResult(
+            ok=True,
+            reason="exit_ok",
+            eval_exit_px=float(exit_px),
+            eval_exit_ts=exit_ts,
+            eval_exit_reason=exit_reason,
+            pl_per_share=plps,
+            meta=meta,
+        )
 
     # TP/SLで決済できなかった → ここから carry / time_stop を決める
 
     # horizon分が揃っていない＝未来未到達 → carry
-    if not horizon_complete:
+    if not x["horizon_complete"]:
         return EvalResult(
             ok=True,
             reason="carry",
             eval_exit_reason="carry",
             pl_per_share=None,
-            meta={**meta, "carry_rule": "horizon_incomplete_future", "got": len(horizon_dates), "need": int(horizon_bd)},
+            meta={**meta, "carry_rule": "horizon_incomplete_future", "got": len(x["horizon_dates"]), "need": int(meta["horizon_bd"])},
         )
 
+    last_target_date = x["last_target_date"]
+    last_available_date = x["last_available_date"]
+
     # horizon分は揃っているのに、最後のターゲット日がまだ bars 的に揃ってない → carry
     if last_target_date is None:
         return EvalResult(ok=True, reason="carry", eval_exit_reason="carry", meta={**meta, "carry_rule": "no_last_target_date"})
@@ -780,7 +898,14 @@ def _evaluate_exit_across_horizon(
             },
         )
 
-    # 最終日まで見たがTP/SL未達 → time_stop（最終足の終値でクローズ）
+    # 最終日まで見たがTP/SL未達 → time_stop（評価範囲の最後の足の終値でクローズ）
+    last_close_px: Optional[float] = None
+    last_close_ts: Optional[_dt] = None
+    if last_idx >= 0:
+        day, k, _, session_end = _part_at(parts, last_idx)
+        last_close_px = _safe_float(day.c[k])
+        last_close_ts = _coerce_ts(day.ts.iloc[k], fallback=session_end)
+
     if last_close_px is None or last_close_ts is None:
         return EvalResult(
             ok=False,
@@ -801,70 +926,154 @@ def _evaluate_exit_across_horizon(
     )
 
 
-def _evaluate_one(
-    v: VirtualTrade,
+def _evaluate_many(
+    targets: List[VirtualTrade],
     *,
     horizon_bd: int,
     force: bool = False,
     verbose: int = 1,
-) -> EvalResult:
+) -> List[Any]:
     """
-    PRO専用評価
-    - entry：trade_date 当日のみ
-    - exit：horizon_bd 営業日
+    PRO専用評価（まとめて）。戻り値は targets と同じ順の EvalResult（その件で例外が出たら Exception）。
+    - entry：trade_date 当日のみ（sim_eval_engine.entry_fills で全件一括）
+    - exit：horizon_bd 営業日（horizon の足をつないで sim_eval_engine.exit_hits で全件一括）
     - carry：未確定なら carry のまま
     """
-    current_reason = str(v.eval_exit_reason or "").strip()
+    out: List[Any] = [None] * len(targets)
 
-    if (not force) and (current_reason not in ("", "carry")):
-        return EvalResult(
-            ok=True,
-            reason="already_closed",
-            eval_exit_reason=current_reason,
-            meta={"guard": "already_closed", "force": False},
-        )
+    # --- 約定 ---
+    ent: List[Tuple[int, Dict[str, Any]]] = []
+    for i, v in enumerate(targets):
+        try:
+            r = _entry_setup(v, force=force)
+        except Exception as e:
+            out[i] = e
+            continue
+        if isinstance(r, EvalResult):
+            out[i] = r
+        else:
+            ent.append((i, r))
+
+    if not ent:
+        return out
+
+    fills = eng.entry_fills(
+        np.array([e["side"] == "SELL" for _, e in ent]),
+        np.array([e["entry_plan"] for _, e in ent]),
+        np.array([e["yori"] for _, e in ent]),
+        eng.stack_ragged([e["day"].o for _, e in ent]),
+        eng.stack_ragged([e["day"].h for _, e in ent]),
+        eng.stack_ragged([e["day"].l for _, e in ent]),
+        eng.stack_ragged([e["live"] for _, e in ent], fill=False, dtype=bool),
+    )
 
-    ok, reason, exec_entry_px, entry_ts, tp_use, sl_use, r_plan, meta_entry = _evaluate_entry_on_trade_date(v, verbose=verbose)
+    # --- 決済の前段（A案の再配置 → horizon の足を集める） ---
+    exits: List[Tuple[int, Dict[str, Any], Dict[str, Any]]] = []
+    for j, (i, e) in enumerate(ent):
+        v = targets[i]
+        meta = e["meta"]
+        try:
+            kind = int(fills["kind"][j])
+            if kind == eng.FILL_NONE:
+                meta["entry_fill"] = "no_position"
+                out[i] = EvalResult(
+                    ok=True,
+                    reason="no_position",
+                    eval_entry_px=None,
+                    eval_entry_ts=None,
+                    eval_exit_px=None,
+                    eval_exit_ts=None,
+                    eval_exit_reason="no_position",
+                    pl_per_share=0.0,
+                    meta=meta,
+                )
+                continue
 
-    if not ok:
-        return EvalResult(ok=False, reason=reason, eval_exit_reason=reason, meta=meta_entry)
+            exec_entry_px = float(fills["px"][j])
+            if kind == eng.FILL_YORI:
+                entry_ts = e["session_start"]
+            else:
+                entry_ts = _coerce_ts(e["day"].ts.iloc[int(fills["idx"][j])], fallback=e["active_start"])
+            meta["entry_fill"] = _FILL_NAMES[kind]
+
+            # --- A案：有利ズレのときだけ TP/SL を exec 基準に再配置 ---
+            tp_use, sl_use, a_meta = reanchor_tp_sl_A(
+                side=e["side"],
+                entry_plan=e["entry_plan"],
+                tp_plan=e["tp_plan"],
+                sl_plan=e["sl_plan"],
+                exec_entry_px=exec_entry_px,
+            )
+            meta.update({"A": a_meta})
 
-    if reason == "no_position":
-        return EvalResult(
-            ok=True,
-            reason="no_position",
-            eval_entry_px=None,
-            eval_entry_ts=None,
-            eval_exit_px=None,
-            eval_exit_ts=None,
-            eval_exit_reason="no_position",
-            pl_per_share=0.0,
-            meta=meta_entry,
-        )
+            x = _exit_setup(v, entry_ts=entry_ts, horizon_bd=horizon_bd)
+        except Exception as ex:
+            out[i] = ex
+            continue
 
-    if exec_entry_px is None or entry_ts is None:
-        return EvalResult(ok=False, reason="bad_entry_state", eval_exit_reason="bad_entry_state", meta=meta_entry)
-
-    res_exit = _evaluate_exit_across_horizon(
-        v,
-        exec_entry_px=float(exec_entry_px),
-        entry_ts=entry_ts,
-        tp_use=tp_use,
-        sl_use=sl_use,
-        horizon_bd=horizon_bd,
-        verbose=verbose,
+        state = {
+            "side": e["side"],
+            "exec_entry_px": exec_entry_px,
+            "entry_ts": entry_ts,
+            "tp_use": tp_use,
+            "sl_use": sl_use,
+            "meta": meta,
+        }
+        if isinstance(x, EvalResult):
+            out[i] = _merge_result(state, x)
+        else:
+            exits.append((i, state, x))
+
+    if not exits:
+        return out
+
+    # --- 決済 ---
+    def _cat(pick, fill, dtype) -> np.ndarray:
+        rows = [
+            np.concatenate([pick(p) for p in x["parts"]]) if x["parts"] else np.array([], dtype=dtype)
+            for _, _, x in exits
+        ]
+        return eng.stack_ragged(rows, fill=fill, dtype=dtype)
+
+    hits = eng.exit_hits(
+        np.array([np.nan if s["tp_use"] is None else float(s["tp_use"]) for _, s, _ in exits]),
+        np.array([np.nan if s["sl_use"] is None else float(s["sl_use"]) for _, s, _ in exits]),
+        _cat(lambda p: p[0].h, np.nan, "float64"),
+        _cat(lambda p: p[0].l, np.nan, "float64"),
+        _cat(lambda p: p[1], False, bool),
     )
 
+    for j, (i, s, x) in enumerate(exits):
+        try:
+            res_exit = _exit_result(
+                targets[i],
+                x,
+                side=s["side"],
+                exec_entry_px=s["exec_entry_px"],
+                tp_use=s["tp_use"],
+                sl_use=s["sl_use"],
+                reason=int(hits["reason"][j]),
+                idx=int(hits["idx"][j]),
+                last_idx=int(hits["last_idx"][j]),
+            )
+            out[i] = _merge_result(s, res_exit)
+        except Exception as ex:
+            out[i] = ex
+
+    return out
+
+
+def _merge_result(state: Dict[str, Any], res_exit: EvalResult) -> EvalResult:
     meta: Dict[str, Any] = {}
-    meta.update(meta_entry or {})
+    meta.update(state["meta"] or {})
     if isinstance(res_exit.meta, dict):
         meta["exit"] = res_exit.meta
 
     return EvalResult(
         ok=bool(res_exit.ok),
         reason=str(res_exit.reason),
-        eval_entry_px=float(exec_entry_px),
-        eval_entry_ts=entry_ts,
+        eval_entry_px=float(state["exec_entry_px"]),
+        eval_entry_ts=state["entry_ts"],
         eval_exit_px=res_exit.eval_exit_px,
         eval_exit_ts=res_exit.eval_exit_ts,
         eval_exit_reason=str(res_exit.eval_exit_reason or res_exit.reason),
@@ -873,6 +1082,22 @@ def _evaluate_one(
     )
 
 
+def _evaluate_one(
+    v: VirtualTrade,
+    *,
+    horizon_bd: int,
+    force: bool = False,
+    verbose: int = 1,
+) -> EvalResult:
+    """
+    1件だけ評価する（_evaluate_many の薄いラッパ）
+    """
+    res = _evaluate_many([v], horizon_bd=horizon_bd, force=force, verbose=verbose)[0]
+    if isinstance(res, Exception):
+        raise res
+    return res
+
+
 # ==============================
 # management command
 # ==============================
@@ -885,7 +1110,8 @@ class Command(BaseCommand):
         parser.add_argument("--horizon", type=int, default=3, help="評価期間（休日除外の営業日数）")
         parser.add_argument("--limit", type=int, default=0, help="0なら全件。>0なら最大件数（新しい opened_at 優先）")
         parser.add_argument("--force", action="store_true", help="すでに評価済みでも再評価して上書きする（再現性注意）")
-        parser.add_argument("--dry-run", action="store_true", help="DB更新せずログだけ")
+        parser.add_argument("--dry-run", action="store_true", help="DB更新せずログだけ（-v 2 で更新される差分を表示）")
+        parser.add_argument("--batch-size", type=int, default=0, help="bulk_update 1文あたりの行数（0なら AIAPP_BULK_BATCH_SIZE）")
 
     def handle(self, *args, **options):
         verbose = int(options.get("verbosity", 1) or 1)
@@ -903,6 +1129,7 @@ class Command(BaseCommand):
 
         force = bool(options.get("force"))
         dry_run = bool(options.get("dry_run"))
+        batch_size = int(options.get("batch_size") or 0)
 
         now_local = timezone.localtime()
         today = now_local.date()  # JST
@@ -944,6 +1171,21 @@ class Command(BaseCommand):
             f"targets={len(targets)} force={force} dry_run={dry_run}"
         )
 
+        # 5分足・寄り値を先にまとめて読む（ここから下はメモリ上で評価）
+        _clear_prefetch()
+        pf = _prefetch(targets, horizon_bd=horizon, date_cap=today)
+        if verbose >= 1:
+            self.stdout.write(
+                f"[ai_sim_eval] prefetch bars={pf['bar_keys']} days={pf['bar_days']} yori={pf['yori']}"
+            )
+
+        # 約定・決済の判定は全件まとめて（sim_eval_engine）。qty_pro が無い件は下のループで skip
+        batch = [v for v in targets if int(v.qty_pro or 0) > 0]
+        evals = dict(zip((id(v) for v in batch), _evaluate_many(batch, horizon_bd=horizon, force=force, verbose=verbose)))
+
+        # 書き込みは溜めて最後に bulk_update（dry_run なら差分だけ）
+        writer = BulkWriter(VirtualTrade, dry_run=dry_run, batch_size=batch_size)
+
         updated = 0
         skipped = 0
         touched_run_ids: set[str] = set()
@@ -958,7 +1200,11 @@ class Command(BaseCommand):
                         self.stdout.write(f"  skip(no_qty_pro) id={v.id} code={v.code} trade_date={v.trade_date}")
                     continue
 
-                res = _evaluate_one(v, horizon_bd=horizon, force=force, verbose=verbose)
+                res = evals.get(id(v))
+                if res is None:
+                    res = _evaluate_one(v, horizon_bd=horizon, force=force, verbose=verbose)
+                if isinstance(res, Exception):
+                    raise res
 
                 # 「まだデータ来てないだけ」は DB更新しない（合意）
                 if res.reason == "no_bars":
@@ -988,10 +1234,8 @@ class Command(BaseCommand):
                         self.stdout.write(
                             f"  skip(hard_fail) id={v.id} code={v.code} trade_date={v.trade_date} reason={res.reason}"
                         )
+                    writer.set(v, eval_exit_reason=res.reason, **_pro_fields(v, eval_exit_reason=res.reason))
                     if not dry_run:
-                        VirtualTrade.objects.filter(id=v.id).update(
-                            eval_exit_reason=res.reason,
-                        )
                         updated += 1
                         touched_run_ids.add(v.run_id)
                     continue
@@ -1046,8 +1290,9 @@ class Command(BaseCommand):
                 ev_true_pro = _ev_true_from_behavior(v.code)
 
                 # replay へ PRO公式の評価結果を刻む（ここが本体）
-                replay = v.replay if isinstance(v.replay, dict) else {}
-                pro = replay.get("pro") if isinstance(replay.get("pro"), dict) else {}
+                # コピーしてから書き換える（BulkWriter が元の値と比べて差分を取る）
+                replay = dict(v.replay) if isinstance(v.replay, dict) else {}
+                pro = dict(replay.get("pro")) if isinstance(replay.get("pro"), dict) else {}
 
                 pro.update({
                     "last_eval": {
@@ -1074,43 +1319,35 @@ class Command(BaseCommand):
 
                 replay["pro"] = pro
 
-                if not dry_run:
-                    # PRO公式：entry
-                    if exit_reason == "no_position":
-                        v.eval_entry_px = None
-                        v.eval_entry_ts = None
-                    else:
-                        v.eval_entry_px = res.eval_entry_px
-                        v.eval_entry_ts = res.eval_entry_ts
+                # PRO公式：entry / exit
+                if exit_reason == "no_position":
+                    eval_entry_px, eval_entry_ts = None, None
+                else:
+                    eval_entry_px, eval_entry_ts = res.eval_entry_px, res.eval_entry_ts
 
-                    # PRO公式：exit
-                    if exit_reason == "carry":
-                        v.eval_exit_px = None
-                        v.eval_exit_ts = None
-                    else:
-                        v.eval_exit_px = res.eval_exit_px
-                        v.eval_exit_ts = res.eval_exit_ts
-
-                    v.eval_exit_reason = exit_reason
-                    v.closed_at = closed_at
-                    v.ev_true_pro = ev_true_pro
-                    v.eval_horizon_days = int(horizon)
-                    v.replay = replay
-
-                    # 旧ブローカー系は一切触らない（混ざる原因）
-                    # - eval_label_* / eval_pl_* / result_r_* は更新しない
-                    # - recompute_r() も呼ばない（旧ロジックを動かさない）
-
-                    v.save(update_fields=[
-                        "eval_entry_px", "eval_entry_ts",
-                        "eval_exit_px", "eval_exit_ts",
-                        "eval_exit_reason",
-                        "closed_at",
-                        "ev_true_pro",
-                        "eval_horizon_days",
-                        "replay",
-                    ])
+                if exit_reason == "carry":
+                    eval_exit_px, eval_exit_ts = None, None
+                else:
+                    eval_exit_px, eval_exit_ts = res.eval_exit_px, res.eval_exit_ts
+
+                # 旧ブローカー系は一切触らない（混ざる原因）
+                # - eval_label_* / eval_pl_* / result_r_* は更新しない
+                # - recompute_r() も呼ばない（旧ロジックを動かさない）
+                writer.set(
+                    v,
+                    eval_entry_px=eval_entry_px,
+                    eval_entry_ts=eval_entry_ts,
+                    eval_exit_px=eval_exit_px,
+                    eval_exit_ts=eval_exit_ts,
+                    eval_exit_reason=exit_reason,
+                    closed_at=closed_at,
+                    ev_true_pro=ev_true_pro,
+                    eval_horizon_days=int(horizon),
+                    replay=replay,
+                    **_pro_fields(v, replay=replay, eval_exit_reason=exit_reason, closed_at=closed_at, eval_entry_px=eval_entry_px),
+                )
 
+                if not dry_run:
                     updated += 1
                     touched_run_ids.add(v.run_id)
 
@@ -1128,20 +1365,28 @@ class Command(BaseCommand):
                         f"  skip(exception) id={v.id} code={v.code} trade_date={v.trade_date} "
                         f"exception={type(e).__name__} {e}"
                     )
+                writer.set(v, eval_exit_reason="exception", **_pro_fields(v, eval_exit_reason="exception"))
                 if not dry_run:
-                    VirtualTrade.objects.filter(id=v.id).update(
-                        eval_exit_reason="exception",
-                    )
                     updated += 1
                     touched_run_ids.add(v.run_id)
                 continue
 
+        # 評価結果を書いてから rank（rank は書いた ev_true_pro を読む）
+        writer.flush()
+
         ranked_rows = 0
         if not dry_run:
-            for rid in sorted(touched_run_ids):
-                ranked_rows += _rank_within_run(rid)
+            rank_writer = BulkWriter(VirtualTrade, batch_size=batch_size)
+            ranked_rows = _rank_runs(touched_run_ids, rank_writer)
+            rank_writer.flush()
+            writer.statements += rank_writer.statements
+
+        if dry_run and verbose >= 2:
+            for line in writer.format_diffs():
+                self.stdout.write(f"  diff {line}")
 
         self.stdout.write(
             f"[ai_sim_eval] done(PRO) updated={updated} skipped={skipped} touched_run_ids={len(touched_run_ids)} "
-            f"ranked_rows={ranked_rows} dry_run={dry_run}"
+            f"ranked_rows={ranked_rows} dry_run={dry_run} "
+            f"{'diff_rows' if dry_run else 'written_rows'}={writer.rows} statements={writer.statements}"
         )
\ No newline at end of file
@@ -71,6 +71,30 @@ except Exception:  # pragma: no cover
     make_features = None  # type: ignore
     FeatureConfig = None  # type: ignore
 
+# ★picks_build の特徴量サイドカー（feat_last / distance の組み立ても共通）
+try:
+    from aiapp.services.picks_build.feature_sidecar_service import (
+        SIDECAR_LATEST,
+        distance_payload,
+        feat_last_from_row,
+        load_feature_sidecar,
+        same_distance_inputs,
+    )
+except Exception:  # pragma: no cover
+    SIDECAR_LATEST = "latest_full_features.json"  # type: ignore
+    distance_payload = None  # type: ignore
+    feat_last_from_row = None  # type: ignore
+    load_feature_sidecar = None  # type: ignore
+    same_distance_inputs = None  # type: ignore
+
+# ★特徴量の時点別ストア（picks_build が書いた最終行を再利用）
+try:
+    from aiapp.services import feature_store
+    from aiapp.services.price_store import expected_last_date
+except Exception:  # pragma: no cover
+    feature_store = None  # type: ignore
+    expected_last_date = None  # type: ignore
+
 # ★PRO仕様：ポリシー＆口座サイズ＆同時建玉制限
 try:
     from aiapp.services.pro_account import load_policy_yaml, compute_pro_sizing_and_filter
@@ -78,6 +102,13 @@ except Exception:  # pragma: no cover
     load_policy_yaml = None  # type: ignore
     compute_pro_sizing_and_filter = None  # type: ignore
 
+from aiapp.services.sim_policy import (
+    apply_per_trade_cap_to_pro_res,
+    get_pro_profile,
+    merge_policy_for_mode,
+    policy_path_default,
+)
+
 try:
     from aiapp.services.position_limits import LimitConfig, PositionLimitManager
 except Exception:  # pragma: no cover
@@ -87,8 +118,10 @@ except Exception:  # pragma: no cover
 # ★②ML推論（LightGBM latest）
 try:
     from aiapp.services.ml_predict import predict_latest
+    from aiapp.services.ml_registry import set_engine as set_ml_engine
 except Exception:  # pragma: no cover
     predict_latest = None  # type: ignore
+    set_ml_engine = None  # type: ignore
 
 # ★B: shape係数（simulate側で必ず吐く）
 try:
@@ -202,82 +235,6 @@ def _safe_int(x) -> Optional[int]:
         return None
 
 
-# ========= lot ルール（policy由来） =========
-def _lot_size_from_policy(code: str, policy: Dict[str, Any]) -> int:
-    """
-    policy.lot_rule を尊重して lot を返す。
-    - ETF/ETN prefix なら etf_lot
-    - それ以外は stock_lot
-    """
-    try:
-        lr = policy.get("lot_rule") if isinstance(policy.get("lot_rule"), dict) else {}
-        prefixes = lr.get("etf_codes_prefix") or ["13", "15"]
-        etf_lot = int(lr.get("etf_lot", 1) or 1)
-        stock_lot = int(lr.get("stock_lot", 100) or 100)
-
-        s = str(code)
-        for p in prefixes:
-            if s.startswith(str(p)):
-                return max(1, etf_lot)
-        return max(1, stock_lot)
-    except Exception:
-        return 100
-
-
-# ========= PRO profile 合成 =========
-def _get_pro_profile(policy: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
-    """
-    policy.pro.learn_mode と profiles から、現在のプロファイルを返す。
-    戻り値: (learn_mode, profile_dict)
-    """
-    pro = policy.get("pro") if isinstance(policy.get("pro"), dict) else {}
-    learn_mode = str(pro.get("learn_mode") or "collect").strip().lower()
-    if learn_mode not in ("collect", "strict"):
-        learn_mode = "collect"
-    profiles = pro.get("profiles") if isinstance(pro.get("profiles"), dict) else {}
-    prof = profiles.get(learn_mode) if isinstance(profiles.get(learn_mode), dict) else {}
-    return learn_mode, prof
-
-
-def _merge_policy_for_mode(policy: Dict[str, Any], *, learn_mode: str, profile: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    learn_mode/profile に合わせて policy を合成する。
-    - limits は profile.limits を最優先で policy['limits'] に反映（下流統一）
-    - strict のとき tighten を filters に上乗せ（min_reward_risk / min_net_profit_yen）
-    """
-    merged: Dict[str, Any] = dict(policy or {})
-
-    # limits を profile 側から採用
-    plimits = profile.get("limits") if isinstance(profile.get("limits"), dict) else {}
-    base_limits = merged.get("limits") if isinstance(merged.get("limits"), dict) else {}
-    limits_new = dict(base_limits)
-    for k, v in (plimits or {}).items():
-        limits_new[k] = v
-    merged["limits"] = limits_new
-
-    # strict tighten を filters に反映
-    if str(learn_mode) == "strict":
-        tighten = profile.get("tighten") if isinstance(profile.get("tighten"), dict) else {}
-        filters = merged.get("filters") if isinstance(merged.get("filters"), dict) else {}
-        filters_new = dict(filters)
-
-        # tighten: min_reward_risk / min_net_profit_yen（強化）
-        if "min_reward_risk" in tighten and tighten.get("min_reward_risk") is not None:
-            try:
-                filters_new["min_reward_risk"] = float(tighten.get("min_reward_risk"))
-            except Exception:
-                pass
-        if "min_net_profit_yen" in tighten and tighten.get("min_net_profit_yen") is not None:
-            try:
-                filters_new["min_net_profit_yen"] = float(tighten.get("min_net_profit_yen"))
-            except Exception:
-                pass
-
-        merged["filters"] = filters_new
-
-    return merged
-
-
 # =========================================================
 # ★NEW: entry_reason（6択のみ。other/未設定は作らない）
 # =========================================================
@@ -359,6 +316,39 @@ def _pick_entry_reason_from_item(it: Dict[str, Any]) -> str:
 
 
 # ========= 本体化：特徴量・距離の保存 =========
+def _feat_last_row(code: str, cfg) -> Optional[Dict[str, Any]]:
+    """
+    特徴量の最終行を返す。
+    1) feature_store に「最新の確定足」の行があればそれを使う（picks_build が書いたもの）
+    2) 無ければ従来通り get_prices + make_features で作り、ストアにも書き戻す
+    """
+    if feature_store is not None and expected_last_date is not None:
+        try:
+            hit = feature_store.read_last_row(code, cfg=cfg)
+            if hit is not None and hit[0] >= expected_last_date():
+                return hit[1]
+        except Exception:
+            pass
+
+    if get_prices is None or make_features is None:
+        return None
+    raw = get_prices(code, nbars=260, period="3y")
+    if raw is None or len(raw) == 0:
+        return None
+    feat_df = make_features(raw, cfg=cfg)
+    if feat_df is None or len(feat_df) == 0:
+        return None
+
+    if feature_store is not None and feature_store.FEATURE_STORE_ENABLED:
+        try:
+            snap = feature_store.last_row_of(feat_df)
+            if snap is not None:
+                feature_store.write_last_rows({code: snap}, cfg=cfg)
+        except Exception:
+            pass
+    return feat_df.iloc[-1].to_dict()
+
+
 def _build_feat_last_and_distance(
     code: str,
     *,
@@ -367,11 +357,14 @@ def _build_feat_last_and_distance(
     sl: Optional[float],
     last_close: Optional[float],
     atr_pick: Optional[float],
+    sidecar: Optional[Dict[str, Dict[str, Any]]] = None,
 ) -> Dict[str, Any]:
     """
     VirtualTrade.replay に入れる payload を組み立てる。
     - feat_last: 特徴量スナップショット（安定性評価の材料）
     - distance: 距離妥当性評価の材料（ATR正規化）
+    sidecar（picks_build の latest_full_features.json）に銘柄があればそれを使い、
+    無い銘柄だけ feature_store / get_prices + make_features で作る。
     """
     out: Dict[str, Any] = {}
 
@@ -379,71 +372,16 @@ def _build_feat_last_and_distance(
     feat_last: Optional[Dict[str, Any]] = None
     atr_from_feat: Optional[float] = None
 
-    if get_prices is not None and make_features is not None and FeatureConfig is not None:
+    ent = (sidecar or {}).get(str(code))
+    if ent is not None:
+        feat_last = ent.get("feat_last")
+        atr_from_feat = _safe_float((feat_last or {}).get("ATR14"))
+    elif FeatureConfig is not None and feat_last_from_row is not None:
         try:
-            raw = get_prices(code, nbars=260, period="3y")
-            if raw is not None and len(raw) > 0:
-                cfg = FeatureConfig()
-                feat_df = make_features(raw, cfg=cfg)
-                if feat_df is not None and len(feat_df) > 0:
-                    row = feat_df.iloc[-1]
-
-                    keep_keys = [
-                        f"RSI{getattr(cfg, 'rsi_period', 14)}",
-                        "BB_Z",
-                        "VWAP_GAP_PCT",
-                        "RET_1",
-                        "RET_5",
-                        "RET_20",
-                        f"SLOPE_{getattr(cfg, 'slope_short', 5)}",
-                        f"SLOPE_{getattr(cfg, 'slope_mid', 25)}",
-                        f"ATR{getattr(cfg, 'atr_period', 14)}",
-                        "GCROSS",
-                        "DCROSS",
-                    ]
-
-                    tmp: Dict[str, Any] = {}
-                    for k in keep_keys:
-                        if k in row.index:
-                            v = row.get(k)
-                            if v is None:
-                                tmp[k] = None
-                            else:
-                                try:
-                                    fv = float(v)
-                                    if fv != fv:
-                                        tmp[k] = None
-                                    else:
-                                        if k in ("GCROSS", "DCROSS"):
-                                            tmp[k] = int(fv)
-                                        else:
-                                            tmp[k] = fv
-                                except Exception:
-                                    try:
-                                        tmp[k] = int(v)
-                                    except Exception:
-                                        tmp[k] = str(v)
-
-                    def pick_float(key: str) -> Optional[float]:
-                        return _safe_float(tmp.get(key))
-
-                    atr_key = f"ATR{getattr(cfg, 'atr_period', 14)}"
-                    atr_from_feat = pick_float(atr_key)
-
-                    feat_last = {
-                        "RSI14": pick_float(f"RSI{getattr(cfg, 'rsi_period', 14)}"),
-                        "BB_Z": pick_float("BB_Z"),
-                        "VWAP_GAP_PCT": pick_float("VWAP_GAP_PCT"),
-                        "RET_1": pick_float("RET_1"),
-                        "RET_5": pick_float("RET_5"),
-                        "RET_20": pick_float("RET_20"),
-                        "SLOPE_5": pick_float(f"SLOPE_{getattr(cfg, 'slope_short', 5)}"),
-                        "SLOPE_25": pick_float(f"SLOPE_{getattr(cfg, 'slope_mid', 25)}"),
-                        "ATR14": atr_from_feat,
-                        "GCROSS": tmp.get("GCROSS"),
-                        "DCROSS": tmp.get("DCROSS"),
-                        "raw": tmp,
-                    }
+            cfg = FeatureConfig()
+            row = _feat_last_row(code, cfg)
+            if row is not None:
+                feat_last, atr_from_feat = feat_last_from_row(row, cfg)
         except Exception:
             feat_last = None
             atr_from_feat = None
@@ -453,46 +391,13 @@ def _build_feat_last_and_distance(
 
     # 2) 距離妥当性（ATR正規化）
     atr = atr_from_feat if atr_from_feat is not None else atr_pick
-    atr = _safe_float(atr)
-
-    e = _safe_float(entry)
-    t = _safe_float(tp)
-    s = _safe_float(sl)
-    lc = _safe_float(last_close)
-
-    dist: Dict[str, Any] = {
-        "entry": e,
-        "tp": t,
-        "sl": s,
-        "last_close": lc,
-        "atr": atr,
-    }
+    inputs = {"entry": entry, "tp": tp, "sl": sl, "last_close": last_close, "atr": atr}
 
-    if e is not None and t is not None and s is not None and atr is not None and atr > 0:
-        dist_tp_atr = (t - e) / atr
-        dist_sl_atr = (e - s) / atr
-        rr = None
-        if dist_sl_atr is not None and dist_sl_atr > 0:
-            rr = dist_tp_atr / dist_sl_atr
-
-        def clamp(x: Optional[float], lo: float, hi: float) -> Optional[float]:
-            if x is None or x != x:
-                return None
-            if x < lo:
-                return lo
-            if x > hi:
-                return hi
-            return x
-
-        dist["dist_tp_atr"] = clamp(_safe_float(dist_tp_atr), -50.0, 50.0)
-        dist["dist_sl_atr"] = clamp(_safe_float(dist_sl_atr), -50.0, 50.0)
-        dist["rr"] = clamp(_safe_float(rr), -50.0, 50.0)
-    else:
-        dist["dist_tp_atr"] = None
-        dist["dist_sl_atr"] = None
-        dist["rr"] = None
-
-    out["distance"] = dist
+    dist = (ent or {}).get("distance")
+    if isinstance(dist, dict) and same_distance_inputs is not None and same_distance_inputs(dist, **inputs):
+        out["distance"] = dist
+    elif distance_payload is not None:
+        out["distance"] = distance_payload(**inputs)
     return out
 
 
@@ -513,32 +418,6 @@ def _ev_true_from_behavior(code: str) -> float:
     return float(v)
 
 
-# ========= PRO: policy path =========
-def _policy_path_default() -> Path:
-    """
-    デフォルトのポリシーパスを返す。
-
-    対応方針：
-    - 真実ソースは short_aggressive.runtime.yml（Git管理外）
-    - runtime が無ければ policy_loader 側でテンプレから自動生成される前提
-    - もし policy_loader が使えない状況でも落とさず .yml にフォールバック
-    """
-    # まず runtime を正とする（policy_loader があれば確実に作る）
-    try:
-        from aiapp.services.policy_loader import ensure_runtime_policy  # ★追加
-        runtime_path = ensure_runtime_policy("short_aggressive")
-        return Path(runtime_path)
-    except Exception:
-        pass
-
-    # フォールバック：従来通り .yml
-    base_dir = getattr(settings, "BASE_DIR", None)
-    if base_dir:
-        return Path(base_dir) / "aiapp" / "policies" / "short_aggressive.yml"
-
-    return Path(__file__).resolve().parents[4] / "aiapp" / "policies" / "short_aggressive.yml"
-
-
 # ========= PRO: open positions snapshot =========
 def _load_open_positions_for_limits(user) -> Tuple[Dict[str, Dict[str, Any]], float, float]:
     """
@@ -560,7 +439,7 @@ def _load_open_positions_for_limits(user) -> Tuple[Dict[str, Dict[str, Any]], fl
     qs = (
         VirtualTrade.objects
         .filter(user=user, closed_at=None)
-        .filter(replay__pro__status="accepted")
+        .filter(pro_status="accepted")
         .filter(Q(eval_exit_reason="carry") | Q(eval_exit_reason=""))
         .exclude(eval_entry_px=None)
         .only("code", "eval_exit_reason", "eval_entry_px", "trade_date", "opened_at", "replay", "required_cash_pro")
@@ -582,86 +461,7 @@ def _load_open_positions_for_limits(user) -> Tuple[Dict[str, Dict[str, Any]], fl
     return positions, total_risk, float(used_cash_yen)
 
 
-def _apply_per_trade_cap_to_pro_res(
-    *,
-    code: str,
-    policy: Dict[str, Any],
-    entry: Optional[float],
-    pro_res: Any,
-    cap_yen: float,
-    min_yen: float,
-) -> Tuple[Any, str]:
-    """
-    ★Cの中枢：
-    - cap_yen に収まるように qty_pro を lot 単位で丸め直す
-    - min_yen（0で無効）未満になるなら reject に倒せるよう reason を返す
-
-    戻り値: (pro_res(書き換え済), cap_reason)
-    cap_reason は "" なら変更なし
-    """
-    e = _safe_float(entry)
-    if e is None or e <= 0:
-        return pro_res, ""
-
-    try:
-        qty0 = int(getattr(pro_res, "qty_pro", 0) or 0)
-    except Exception:
-        qty0 = 0
-
-    if qty0 <= 0:
-        return pro_res, ""
-
-    lot = _lot_size_from_policy(str(code), policy)
-    lot = max(1, int(lot))
-
-    # cap が 0/負なら「資金制約でreject」
-    if cap_yen <= 0:
-        return pro_res, "cap_zero"
-
-    # cap から入れる最大株数（lot切り捨て）
-    max_qty_by_cap = int((cap_yen / e) // lot * lot)
-    if max_qty_by_cap <= 0:
-        return pro_res, "cap_too_small_for_lot"
-
-    qty1 = min(qty0, max_qty_by_cap)
-    qty1 = int(qty1 // lot * lot)
-    if qty1 <= 0:
-        return pro_res, "cap_round_to_zero"
-
-    # min_notional（0で無効）
-    if min_yen and min_yen > 0:
-        if (e * qty1) < float(min_yen):
-            return pro_res, "below_min_notional"
-
-    if qty1 == qty0:
-        return pro_res, ""
-
-    # required_cash_pro は厳密に entry*qty とする（安全側）
-    req1 = float(e * qty1)
-
-    # est_pl_pro / est_loss_pro は数量比例で近似
-    try:
-        pl0 = float(getattr(pro_res, "est_pl_pro", 0.0) or 0.0)
-    except Exception:
-        pl0 = 0.0
-    try:
-        loss0 = float(getattr(pro_res, "est_loss_pro", 0.0) or 0.0)
-    except Exception:
-        loss0 = 0.0
-
-    ratio = (float(qty1) / float(qty0)) if qty0 > 0 else 1.0
-    pl1 = pl0 * ratio
-    loss1 = loss0 * ratio
-
-    try:
-        setattr(pro_res, "qty_pro", int(qty1))
-        setattr(pro_res, "required_cash_pro", float(req1))
-        setattr(pro_res, "est_pl_pro", float(pl1))
-        setattr(pro_res, "est_loss_pro", float(loss1))
-    except Exception:
-        return pro_res, ""
 
-    return pro_res, f"cap_applied({qty0}->{qty1}, cap={cap_yen:.0f})"
 
 
 # =========================================================
@@ -722,6 +522,27 @@ def _make_vtrade_defaults_base(
     )
 
 
+def _upsert_vtrade(*, user, run_id: str, code: str, defaults: Dict[str, Any]) -> None:
+    """
+    VirtualTrade を upsert し、pro_status / pro_label / pro_pl（simulate_list 用の非正規化列）も揃える。
+    - 新規は defaults から計算して1回で書く
+    - 既存（評価済みの行を同じ run_id で起票し直した等）は eval_* も見て、ズレていれば追加で書く
+    """
+    defaults = {
+        **defaults,
+        **VirtualTrade.compute_pro_fields(
+            replay=defaults.get("replay"),
+            eval_exit_reason=defaults.get("eval_exit_reason", ""),
+            closed_at=defaults.get("closed_at"),
+            eval_entry_px=defaults.get("eval_entry_px"),
+        ),
+    }
+    obj, _ = VirtualTrade.objects.update_or_create(user=user, run_id=run_id, code=code, defaults=defaults)
+    changed = obj.sync_pro_fields()
+    if changed:
+        obj.save(update_fields=changed)
+
+
 # =========================================================
 # ★NEW: behavior/latest_behavior.jsonl へ追記（UIが末尾1行を見る）
 # =========================================================
@@ -815,6 +636,13 @@ class Command(BaseCommand):
             help="policy yml path（省略時: aiapp/policies/short_aggressive.runtime.yml を優先。無ければ short_aggressive.yml）",
         )
         parser.add_argument("--dry-run", action="store_true", help="DB/JSONLを書かずにログ（確認用）")
+        parser.add_argument(
+            "--ml-engine",
+            type=str,
+            default=None,
+            choices=["lightgbm", "compiled"],
+            help="ML 推論器（既定: AIAPP_ML_ENGINE or lightgbm。compiled は lightgbm を import しない）",
+        )
 
     def handle(self, *args, **options):
         run_date_str: str = options.get("date") or today_jst_str()
@@ -824,8 +652,11 @@ class Command(BaseCommand):
         mode_period: str = (options.get("mode_period") or "short").strip().lower()
         mode_aggr: str = (options.get("mode_aggr") or "aggr").strip().lower()
 
+        if set_ml_engine is not None:
+            set_ml_engine(options.get("ml_engine"))
+
         # ---------- policy ----------
-        policy_path = Path(options.get("policy") or _policy_path_default())
+        policy_path = Path(options.get("policy") or policy_path_default())
         if load_policy_yaml is None or compute_pro_sizing_and_filter is None:
             self.stdout.write(self.style.ERROR("[ai_simulate_auto] pro_account is not available (import failed)"))
             return
@@ -839,8 +670,8 @@ class Command(BaseCommand):
             return
 
         # ---------- PRO profile (C) ----------
-        learn_mode, profile = _get_pro_profile(policy_raw)
-        policy = _merge_policy_for_mode(policy_raw, learn_mode=learn_mode, profile=profile)
+        learn_mode, profile = get_pro_profile(policy_raw)
+        policy = merge_policy_for_mode(policy_raw, learn_mode=learn_mode, profile=profile)
 
         # profile limits（Cの資金配分に使う）
         prof_limits = profile.get("limits") if isinstance(profile.get("limits"), dict) else {}
@@ -955,6 +786,17 @@ class Command(BaseCommand):
                 f"items={len(cands)}"
             )
 
+        # ★picks_build の特徴量サイドカー（最新の確定足のものだけ使う。無い銘柄は従来通り取得）
+        feat_sidecar: Dict[str, Dict[str, Any]] = {}
+        if load_feature_sidecar is not None:
+            try:
+                min_date = expected_last_date() if expected_last_date is not None else None
+                feat_sidecar = load_feature_sidecar(PICKS_DIR / SIDECAR_LATEST, min_date=min_date)
+            except Exception:
+                feat_sidecar = {}
+        sidecar_hits = sum(1 for it in cands if str(it.get("code") or "").strip() in feat_sidecar)
+        self.stdout.write(f"[ai_simulate_auto] feature sidecar hits={sidecar_hits}/{len(cands)}")
+
         fw = None
         try:
             if not dry_run:
@@ -992,6 +834,7 @@ class Command(BaseCommand):
                     sl=_safe_float(sl),
                     last_close=_safe_float(last_close),
                     atr_pick=_safe_float(atr_pick),
+                    sidecar=feat_sidecar,
                 )
 
                 # ---------- ★② ML predict（latest） ----------
@@ -1229,12 +1072,7 @@ class Command(BaseCommand):
                     )
 
                     if not dry_run:
-                        VirtualTrade.objects.update_or_create(
-                            user=user,
-                            run_id=run_id,
-                            code=code,
-                            defaults=defaults,
-                        )
+                        _upsert_vtrade(user=user, run_id=run_id, code=code, defaults=defaults)
                         upserted += 1
                     continue
 
@@ -1249,7 +1087,7 @@ class Command(BaseCommand):
 
                 min_yen = float(min_notional_per_trade_yen or 0.0)
 
-                pro_res, cap_reason = _apply_per_trade_cap_to_pro_res(
+                pro_res, cap_reason = apply_per_trade_cap_to_pro_res(
                     code=str(code),
                     policy=policy,
                     entry=_safe_float(entry),
@@ -1365,12 +1203,7 @@ class Command(BaseCommand):
                         )
                         continue
 
-                    VirtualTrade.objects.update_or_create(
-                        user=user,
-                        run_id=run_id,
-                        code=code,
-                        defaults=defaults,
-                    )
+                    _upsert_vtrade(user=user, run_id=run_id, code=code, defaults=defaults)
                     upserted += 1
                     continue
 
@@ -1484,12 +1317,7 @@ class Command(BaseCommand):
                         )
                         continue
 
-                    VirtualTrade.objects.update_or_create(
-                        user=user,
-                        run_id=run_id,
-                        code=code,
-                        defaults=defaults,
-                    )
+                    _upsert_vtrade(user=user, run_id=run_id, code=code, defaults=defaults)
                     upserted += 1
                     continue
 
@@ -1603,12 +1431,7 @@ class Command(BaseCommand):
                         )
                         continue
 
-                    VirtualTrade.objects.update_or_create(
-                        user=user,
-                        run_id=run_id,
-                        code=code,
-                        defaults=defaults,
-                    )
+                    _upsert_vtrade(user=user, run_id=run_id, code=code, defaults=defaults)
                     upserted += 1
                     continue
 
@@ -1788,12 +1611,7 @@ class Command(BaseCommand):
                     written += 1
 
                 # DB upsert
-                VirtualTrade.objects.update_or_create(
-                    user=user,
-                    run_id=run_id,
-                    code=code,
-                    defaults=defaults,
-                )
+                _upsert_vtrade(user=user, run_id=run_id, code=code, defaults=defaults)
                 upserted += 1
 
         finally:
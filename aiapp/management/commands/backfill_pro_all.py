@@ -6,12 +6,12 @@ from dataclasses import dataclass
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from django.core.management.base import BaseCommand
-from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 
 from aiapp.models.vtrade import VirtualTrade
 from aiapp.models.behavior_stats import BehaviorStats
+from aiapp.services.bulk_writer import BulkWriter
 
 
 # =========================================================
@@ -135,28 +135,25 @@ def _ev_true_from_behavior(bs: Optional[BSRow]) -> float:
 # =========================================================
 # ランク付け（run_id ごとに ev_true_pro 降順）
 # =========================================================
-def _assign_rank_for_run_id(run_id: str, *, dry_run: bool) -> int:
+def _assign_rank_for_run_id(run_id: str, *, writer: BulkWriter) -> int:
     """
-    run_id 内で ev_true_pro の降順で rank_pro を 1..N に付与。
+    run_id 内で ev_true_pro の降順で rank_pro を 1..N に付与（書き込みは writer に積むだけ）。
     同値は安定ソート（code昇順）で決める。
-    戻り値：更新件数
+    戻り値：ランクを付けた件数
     """
-    qs = VirtualTrade.objects.filter(run_id=run_id).only("id", "code", "ev_true_pro", "rank_pro")
-    rows = list(qs.values("id", "code", "ev_true_pro"))
+    rows = list(VirtualTrade.objects.filter(run_id=run_id).only("id", "code", "ev_true_pro", "rank_pro"))
 
     # ev_true_pro None は 0.0 扱い
-    def sort_key(r: Dict[str, Any]):
-        ev = r.get("ev_true_pro")
+    def sort_key(v: VirtualTrade):
+        ev = v.ev_true_pro
         evf = float(ev) if ev is not None else 0.0
-        return (-evf, str(r.get("code") or ""))
+        return (-evf, str(v.code or ""))
 
     rows.sort(key=sort_key)
 
     updated = 0
-    for i, r in enumerate(rows, start=1):
-        rid = r["id"]
-        if not dry_run:
-            VirtualTrade.objects.filter(id=rid).update(rank_pro=i)
+    for i, v in enumerate(rows, start=1):
+        writer.set(v, rank_pro=i)
         updated += 1
 
     return updated
@@ -170,7 +167,8 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--policy", type=str, required=True, help="PROポリシーyml（例: aiapp/policies/short_aggressive.yml）")
-        parser.add_argument("--dry-run", action="store_true", help="DBに書き込まない（ログだけ）")
+        parser.add_argument("--dry-run", action="store_true", help="DBに書き込まない（ログだけ。-v 2 で更新される差分を表示）")
+        parser.add_argument("--batch-size", type=int, default=0, help="bulk_update 1文あたりの行数（0なら AIAPP_BULK_BATCH_SIZE）")
         parser.add_argument("--run-id", type=str, default=None, help="対象run_idを1つに絞る（省略で全期間）")
         parser.add_argument("--user-id", type=int, default=None, help="対象ユーザーを絞る（省略で全ユーザー）")
         parser.add_argument("--period", type=str, default=None, help="BehaviorStats優先 period（省略時は vtrade.mode_period）")
@@ -179,6 +177,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         policy_path: str = str(options["policy"])
         dry_run: bool = bool(options.get("dry_run"))
+        batch_size: int = int(options.get("batch_size") or 0)
+        verbose: int = int(options.get("verbosity", 1) or 1)
         only_run_id: Optional[str] = (options.get("run_id") or None)
         only_user_id: Optional[int] = options.get("user_id") or None
         force_period: Optional[str] = (options.get("period") or None)
@@ -216,8 +216,9 @@ class Command(BaseCommand):
         updated = 0
         skipped = 0
 
-        # 大量更新でも落ちないように小分け
+        # 大量更新でも落ちないように小分け（書き込みは BulkWriter でチャンクごとにまとめて）
         BATCH = 200
+        writer = BulkWriter(VirtualTrade, dry_run=dry_run, batch_size=batch_size)
 
         # ※ここでは「PROのqty/資金/PL/Loss」は、すでに replay['pro'] に入っている前提でも良いし、
         #   無い場合でも最低限 EV_true_pro / rank_pro を埋められるようにしている。
@@ -237,61 +238,84 @@ class Command(BaseCommand):
                     "replay",
                     "ev_true_pro",
                     "rank_pro",
+                    "eval_exit_reason",
+                    "closed_at",
+                    "eval_entry_px",
+                    "pro_status",
+                    "pro_label",
+                    "pro_pl",
                 )
             )
 
-            with transaction.atomic():
-                for v in chunk:
-                    try:
-                        touched_run_ids.add(str(v.run_id or ""))
-
-                        replay = _as_dict(v.replay)
-                        pro = _as_dict(replay.get("pro"))
-                        # policy の記録は揃える
-                        pro["policy"] = policy_path
-
-                        # prefer の period/aggr は vtrade 優先（強制指定があればそれ）
-                        prefer_period = (force_period or v.mode_period or "short").strip().lower()
-                        prefer_aggr = (force_aggr or v.mode_aggr or "aggr").strip().lower()
-
-                        bs = _get_behavior_stats_with_fallback(
-                            code=v.code,
-                            prefer_period=prefer_period,
-                            prefer_aggr=prefer_aggr,
-                            fallback_period="all",
-                            fallback_aggr="all",
-                        )
-
-                        ev_true = _ev_true_from_behavior(bs)
-
-                        # DB側（検索/ソート用）
-                        if not dry_run:
-                            v.ev_true_pro = float(ev_true)
-                        # replay側（デバッグ・監査）
-                        pro["ev_true_pro"] = float(ev_true)
-                        pro["ev_source"] = {
-                            "prefer": {"mode_period": prefer_period, "mode_aggr": prefer_aggr},
-                            "used": None if bs is None else {"mode_period": bs.mode_period, "mode_aggr": bs.mode_aggr, "n": bs.n},
-                        }
-
-                        # rank は run_id 内一括で後段付け（ここでは None のままでもOK）
-                        replay["pro"] = pro
-                        if not dry_run:
-                            v.replay = replay
-                            v.save(update_fields=["ev_true_pro", "replay"])
-                        updated += 1
-                    except Exception:
-                        skipped += 1
-                        continue
-
-        # run_id ごとに rank を付与
+            for v in chunk:
+                try:
+                    touched_run_ids.add(str(v.run_id or ""))
+
+                    # コピーしてから書き換える（BulkWriter が元の値と比べて差分を取る）
+                    replay = dict(_as_dict(v.replay))
+                    pro = dict(_as_dict(replay.get("pro")))
+                    # policy の記録は揃える
+                    pro["policy"] = policy_path
+
+                    # prefer の period/aggr は vtrade 優先（強制指定があればそれ）
+                    prefer_period = (force_period or v.mode_period or "short").strip().lower()
+                    prefer_aggr = (force_aggr or v.mode_aggr or "aggr").strip().lower()
+
+                    bs = _get_behavior_stats_with_fallback(
+                        code=v.code,
+                        prefer_period=prefer_period,
+                        prefer_aggr=prefer_aggr,
+                        fallback_period="all",
+                        fallback_aggr="all",
+                    )
+
+                    ev_true = _ev_true_from_behavior(bs)
+
+                    # replay側（デバッグ・監査）
+                    pro["ev_true_pro"] = float(ev_true)
+                    pro["ev_source"] = {
+                        "prefer": {"mode_period": prefer_period, "mode_aggr": prefer_aggr},
+                        "used": None if bs is None else {"mode_period": bs.mode_period, "mode_aggr": bs.mode_aggr, "n": bs.n},
+                    }
+
+                    # rank は run_id 内一括で後段付け（ここでは None のままでもOK）
+                    replay["pro"] = pro
+
+                    # DB側（検索/ソート用）+ replay
+                    writer.set(
+                        v,
+                        ev_true_pro=float(ev_true),
+                        replay=replay,
+                        **VirtualTrade.compute_pro_fields(
+                            replay=replay,
+                            eval_exit_reason=v.eval_exit_reason,
+                            closed_at=v.closed_at,
+                            eval_entry_px=v.eval_entry_px,
+                        ),
+                    )
+                    updated += 1
+                except Exception:
+                    skipped += 1
+                    continue
+
+            # チャンクごとに書く（1チャンク = 1トランザクション）
+            writer.flush()
+
+        # run_id ごとに rank を付与（全 run_id 分を溜めてまとめて書く）
+        rank_writer = BulkWriter(VirtualTrade, dry_run=dry_run, batch_size=batch_size)
         rank_updated_total = 0
         for rid in sorted([x for x in touched_run_ids if x]):
             try:
-                rank_updated_total += _assign_rank_for_run_id(rid, dry_run=dry_run)
+                rank_updated_total += _assign_rank_for_run_id(rid, writer=rank_writer)
             except Exception:
                 continue
+        rank_writer.flush()
+
+        if dry_run and verbose >= 2:
+            for line in writer.format_diffs() + rank_writer.format_diffs():
+                self.stdout.write(f"  diff {line}")
 
         self.stdout.write(
-            f"[backfill_pro_all] done updated={updated} skipped={skipped} touched_run_ids={len(touched_run_ids)} rank_rows={rank_updated_total} (dry_run={dry_run})"
+            f"[backfill_pro_all] done updated={updated} skipped={skipped} touched_run_ids={len(touched_run_ids)} rank_rows={rank_updated_total} "
+            f"{'diff_rows' if dry_run else 'written_rows'}={writer.rows + rank_writer.rows} statements={writer.statements + rank_writer.statements} (dry_run={dry_run})"
         )
\ No newline at end of file
@@ -0,0 +1,72 @@
+# aiapp/management/commands/backfill_pro_status.py
+# -*- coding: utf-8 -*-
+"""
+backfill_pro_status
+
+VirtualTrade の非正規化列（pro_status / pro_label / pro_pl）を replay / eval_* から埋め直す。
+
+- 列を追加した直後に1回（既存行は空のまま。simulate_list は pro_status='accepted' で絞るので必須）
+- 以後は ai_simulate_auto / ai_sim_eval / backfill_pro_all / sim_sync_db が書くときに一緒に更新する
+- 値が変わる行だけ bulk_update（BulkWriter）。何度流しても同じ結果
+
+例:
+  python manage.py backfill_pro_status
+  python manage.py backfill_pro_status --user-id 1 --dry-run -v 2
+"""
+
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from aiapp.models.vtrade import VirtualTrade
+from aiapp.services.bulk_writer import BulkWriter
+
+# 1回に読む行数（replay を読むのでメモリを見て小分け）
+READ_CHUNK = 2000
+
+
+class Command(BaseCommand):
+    help = "VirtualTrade の pro_status / pro_label / pro_pl を replay・eval_* から埋め直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, default=None, help="対象ユーザーを絞る（省略で全ユーザー）")
+        parser.add_argument("--dry-run", action="store_true", help="DBに書き込まない（-v 2 で差分を表示）")
+        parser.add_argument("--batch-size", type=int, default=0, help="bulk_update 1文あたりの行数（0なら AIAPP_BULK_BATCH_SIZE）")
+
+    def handle(self, *args, **options):
+        dry_run = bool(options.get("dry_run"))
+        verbose = int(options.get("verbosity", 1) or 1)
+        batch_size = int(options.get("batch_size") or 0)
+        user_id = options.get("user_id") or None
+
+        qs = VirtualTrade.objects.all()
+        if user_id:
+            qs = qs.filter(user_id=int(user_id))
+
+        ids = list(qs.order_by("id").values_list("id", flat=True))
+        self.stdout.write(f"[backfill_pro_status] target={len(ids)} dry_run={dry_run}")
+
+        writer = BulkWriter(VirtualTrade, dry_run=dry_run, batch_size=batch_size)
+        changed = 0
+        for start in range(0, len(ids), READ_CHUNK):
+            chunk = VirtualTrade.objects.filter(id__in=ids[start : start + READ_CHUNK]).only(
+                "id",
+                "replay",
+                "eval_exit_reason",
+                "closed_at",
+                "eval_entry_px",
+                *VirtualTrade.PRO_FIELDS,
+            )
+            for v in chunk:
+                if writer.set(v, **v.pro_fields()):
+                    changed += 1
+            writer.flush()
+
+        if dry_run and verbose >= 2:
+            for line in writer.format_diffs():
+                self.stdout.write(f"  diff {line}")
+
+        self.stdout.write(
+            f"[backfill_pro_status] done changed={changed} "
+            f"{'diff_rows' if dry_run else 'written_rows'}={writer.rows} statements={writer.statements} (dry_run={dry_run})"
+        )
@@ -0,0 +1,636 @@
+# aiapp/management/commands/backtest_swing.py
+# -*- coding: utf-8 -*-
+"""
+backtest_swing
+
+picks_build（ランキング）→ ai_simulate_auto（PRO sizing / 資金枠 / 同時建玉制限）→ ai_sim_eval（約定・TP/SL・time_stop）
+の一連を、price_store の日足で過去の1日ずつ再生するポートフォリオ・バックテスト。
+
+流れ（各営業日 d の引け後）:
+  1) 前日に accepted した注文を d の足で約定判定（trade_date 当日のみ。刺さらなければ no_position）
+  2) 保有中を d の足で決済判定（TP 優先 → SL → horizon_bd 営業日目の終値で time_stop）
+  3) d 時点の特徴量でユニバースをランキング（picks_build と同じ並び）→ TopK
+  4) TopK を ai_simulate_auto と同じ順序で PRO sizing → cap → 資金 → 同時建玉制限 → accepted（翌営業日に約定判定）
+
+高速化:
+  - 特徴量は make_features_panel で全日付 × 全銘柄を1回だけ計算
+  - score_sample / confirm / Entry・TP・SL もパネル版で一括（scoring_service.score_panel / confirm_service.compute_confirm_panel /
+    entry_service.compute_entry_tp_sl_vec）。日ごとのループは候補の PickItem 化と建玉管理だけ
+
+本番との違い（日足での近似）:
+  - 約定・決済は日足 OHLC（寄りで指値以下なら寄り値、それ以外は Low <= entry <= High で指値約定。同じ足の中は TP 優先）
+  - 約定が有利にズレたときの TP/SL 再配置（A案）は ai_sim_eval と同じ
+  - 営業日は「その銘柄の足がある日」で数える（ai_sim_eval と同じ）。全銘柄の日付の和集合をカレンダーにする
+  - EV_true の主キーは --ml のときだけ（ML モデルで pTP を出し、sizing_service と同じ pTP*RR_net - pSL）。
+    無いときは picks_build の ML 無し運用と同じく qty → confirm → score_100 の順
+  - ai_simulate_auto の BehaviorStats 勝率ソートは過去時点の値が無いので使わない（TopK の順のまま）
+  - score_sample の z スコアは「全履歴で作った特徴量」の直近 --nbars 本で取る（picks_build は nbars 本から特徴量を作る）
+
+出力:
+  - media/aiapp/backtest/swing/latest_backtest.json（条件 / サマリー / 年別 / 日次エクイティ）
+  - media/aiapp/backtest/swing/backtest_<stamp>_trades.csv（1トレード1行）
+
+使い方:
+  python manage.py backtest_swing --universe nk225 --since 2022-01-01
+  python manage.py backtest_swing --codes 7203,6758 --topk 5 --ml
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from aiapp.models.features import FeatureConfig
+from aiapp.models.features_panel import make_features_panel
+from aiapp.services import price_store
+from aiapp.services.entry_service import compute_entry_tp_sl_vec
+from aiapp.services.picks_build.confirm_service import compute_confirm_panel
+from aiapp.services.picks_build.ranking_service import select_topk, sort_items_inplace
+from aiapp.services.picks_build.schema import PickItem
+from aiapp.services.picks_build.settings import JST
+from aiapp.services.picks_build.universe_service import load_universe
+from aiapp.services.picks_build.utils import score_to_0_100
+from aiapp.services.position_limits import LimitConfig, PositionLimitManager
+from aiapp.services.pro_account import compute_pro_sizing_and_filter, load_policy_yaml
+from aiapp.services.scoring_service import score_panel
+from aiapp.services.sim_policy import (
+    apply_per_trade_cap_to_pro_res,
+    get_pro_profile,
+    merge_policy_for_mode,
+    policy_path_default,
+    reanchor_tp_sl_A,
+)
+
+try:
+    from aiapp.services.picks_filters import FilterContext, check_all as picks_check_all
+except Exception:  # pragma: no cover
+    FilterContext = None  # type: ignore
+    picks_check_all = None  # type: ignore
+
+try:
+    from aiapp.services.ml_infer_service import infer_batch as ml_infer_batch
+    from aiapp.services.ml_registry import set_engine as set_ml_engine
+except Exception:  # pragma: no cover
+    ml_infer_batch = None  # type: ignore
+    set_ml_engine = None  # type: ignore
+
+OUT_DIR = Path(settings.MEDIA_ROOT) / "aiapp" / "backtest" / "swing"
+
+# picks_filters.check_all が見る列（FilterContext.feat に渡す分だけ）
+FILTER_COLS = ("Close", "Volume", "ATR14", "RET_5", "RET_20")
+
+CAP_REJECTS = ("cap_zero", "cap_too_small_for_lot", "cap_round_to_zero", "below_min_notional")
+
+
+@dataclass
+class _Position:
+    code: str
+    j: int
+    signal_t: int
+    entry_plan: float
+    tp_plan: float
+    sl_plan: float
+    qty: int
+    required_cash: float
+    est_pl: float
+    est_loss: float
+    score_100: int
+    ev_true: Optional[float] = None
+    exec_px: Optional[float] = None
+    entry_t: Optional[int] = None
+    tp_use: Optional[float] = None
+    sl_use: Optional[float] = None
+    days: int = 0
+
+
+def _safe_float(x: Any) -> Optional[float]:
+    try:
+        if x is None:
+            return None
+        f = float(x)
+        if not np.isfinite(f):
+            return None
+        return f
+    except Exception:
+        return None
+
+
+def _load_frames(codes: List[str]) -> Tuple[Dict[str, pd.DataFrame], List[str]]:
+    frames: Dict[str, pd.DataFrame] = {}
+    missing: List[str] = []
+    for code in codes:
+        df = price_store.completed_only(price_store.load(code))
+        if df is None or len(df) == 0:
+            missing.append(code)
+            continue
+        frames[str(code)] = df
+    return frames, missing
+
+
+def _align_to_calendar(frames: Dict[str, pd.DataFrame]) -> Tuple[Dict[str, pd.DataFrame], pd.DatetimeIndex, Dict[str, np.ndarray]]:
+    """
+    全銘柄の日付の和集合をカレンダーにして、各銘柄を「自分の初日〜最終日」まで reindex する。
+    こうすると右詰めパネルの行 = 同じ日付になる。足が無い日は has_bar=False（売買しない）。
+    """
+    cal = pd.DatetimeIndex(sorted(set().union(*[set(df.index) for df in frames.values()])))
+    out: Dict[str, pd.DataFrame] = {}
+    has: Dict[str, np.ndarray] = {}
+    for code, df in frames.items():
+        idx = cal[cal >= df.index[0]]
+        out[code] = df.reindex(idx)
+        has[code] = idx.isin(df.index)
+    return out, cal, has
+
+
+def _equity_stats(equity: np.ndarray) -> Dict[str, float]:
+    if len(equity) == 0:
+        return {"max_drawdown_yen": 0.0, "max_drawdown_pct": 0.0}
+    peak = np.maximum.accumulate(equity)
+    dd = equity - peak
+    i = int(np.argmin(dd))
+    return {
+        "max_drawdown_yen": float(-dd[i]),
+        "max_drawdown_pct": float(-dd[i] / peak[i] * 100.0) if peak[i] > 0 else 0.0,
+    }
+
+
+def _trade_summary(trades: pd.DataFrame) -> Dict[str, Any]:
+    closed = trades[trades["exit_reason"].isin(["hit_tp", "hit_sl", "time_stop"])] if len(trades) else trades
+    n = int(len(closed))
+    if n == 0:
+        return {"trades": 0}
+    pl = closed["pl"].to_numpy(dtype=float)
+    wins = pl > 0
+    gross_win = float(pl[wins].sum())
+    gross_loss = float(-pl[pl < 0].sum())
+    return {
+        "trades": n,
+        "win_rate": float(wins.mean()),
+        "pl_sum": float(pl.sum()),
+        "pl_net_sum": float(closed["pl_net"].sum()),
+        "pl_mean": float(pl.mean()),
+        "r_mean": float(closed["r"].mean()),
+        "profit_factor": (gross_win / gross_loss) if gross_loss > 0 else None,
+        "hold_days_mean": float(closed["hold_bd"].mean()),
+        "exit_reasons": {str(k): int(v) for k, v in closed["exit_reason"].value_counts().items()},
+    }
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class Command(BaseCommand):
+    help = "picks_build → ai_simulate_auto(PRO) → ai_sim_eval を日足で過去に再生するスイング用ポートフォリオ・バックテスト"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--universe", type=str, default="nk225", help="all_jpx / nk225 / <file name>")
+        parser.add_argument("--codes", type=str, default="", help="対象銘柄（カンマ区切り。指定時は --universe より優先）")
+        parser.add_argument("--since", type=str, default="", help="シグナルを作り始める日（YYYY-MM-DD。空ならデータ先頭+warmup）")
+        parser.add_argument("--until", type=str, default="", help="シグナルを作る最終日（YYYY-MM-DD。空なら最後まで）")
+        parser.add_argument("--topk", type=int, default=int(os.getenv("AIAPP_TOPK", "10")), help="picks_build の TopK")
+        parser.add_argument("--nbars", type=int, default=260, help="score_sample の z スコア窓（picks_build の --nbars）")
+        parser.add_argument("--warmup", type=int, default=60, help="各銘柄の先頭何本はシグナルに使わないか")
+        parser.add_argument("--horizon", type=int, default=0, help="評価営業日数（0なら policy の horizon_bd、無ければ3）")
+        parser.add_argument("--policy", type=str, default=None, help="policy yml path（省略時は ai_simulate_auto と同じ）")
+        parser.add_argument("--equity", type=float, default=None, help="PRO 資金（省略時 settings.AIAPP_PRO_EQUITY_YEN）")
+        parser.add_argument("--ml", action="store_true", help="ML モデルで pTP / ml_rank を出して EV_true で並べる")
+        parser.add_argument("--ml-engine", type=str, default=None, choices=["lightgbm", "compiled"], help="ML 推論器")
+        parser.add_argument("--out", type=str, default="", help="出力先ディレクトリ（空なら media/aiapp/backtest/swing）")
+
+    # ------------------------------------------------------------------
+    def handle(self, *args, **opts):
+        t_start = time.perf_counter()
+
+        # ---------- policy（ai_simulate_auto と同じ合成） ----------
+        policy_path = Path(opts.get("policy") or policy_path_default())
+        try:
+            policy_raw = load_policy_yaml(str(policy_path))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"[backtest_swing] policy load error: {e} path={policy_path}"))
+            return
+        learn_mode, profile = get_pro_profile(policy_raw)
+        policy = merge_policy_for_mode(policy_raw, learn_mode=learn_mode, profile=profile)
+
+        prof_limits = profile.get("limits") if isinstance(profile.get("limits"), dict) else {}
+        max_notional_per_trade_yen = float(prof_limits.get("max_notional_per_trade_yen", 0) or 0)
+        min_notional_per_trade_yen = float(prof_limits.get("min_notional_per_trade_yen", 0) or 0)
+        max_total_notional_yen = float(prof_limits.get("max_total_notional_yen", 0) or 0)
+        reserve_cash_yen = float(prof_limits.get("reserve_cash_yen", 0) or 0)
+
+        limits_cfg = policy.get("limits") if isinstance(policy.get("limits"), dict) else {}
+        max_positions = int(limits_cfg.get("max_positions", 5) or 5)
+        max_total_risk_r = float(limits_cfg.get("max_total_risk_r", 3.0) or 3.0)
+
+        horizon_bd = int(opts.get("horizon") or 0) or int(limits_cfg.get("horizon_bd", 3) or 3)
+        horizon_bd = max(1, horizon_bd)
+
+        equity_opt = opts.get("equity")
+        total_equity_yen = float(equity_opt) if equity_opt else float(getattr(settings, "AIAPP_PRO_EQUITY_YEN", 3_000_000) or 3_000_000)
+        total_notional_cap = max_total_notional_yen if max_total_notional_yen > 0 else float(total_equity_yen)
+
+        topk = max(1, int(opts.get("topk") or 10))
+        nbars = max(3, int(opts.get("nbars") or 260))
+        warmup = max(0, int(opts.get("warmup") or 0))
+
+        use_ml = bool(opts.get("ml"))
+        if use_ml and ml_infer_batch is None:
+            self.stdout.write(self.style.WARNING("[backtest_swing] ml_infer_service not available; --ml ignored"))
+            use_ml = False
+        if use_ml and set_ml_engine is not None:
+            set_ml_engine(opts.get("ml_engine"))
+
+        # ---------- universe / prices ----------
+        codes_opt = [c.strip() for c in str(opts.get("codes") or "").split(",") if c.strip()]
+        universe = "codes" if codes_opt else str(opts.get("universe") or "nk225")
+        codes = codes_opt or load_universe(universe)
+        if not codes:
+            self.stdout.write(self.style.ERROR(f"[backtest_swing] universe empty: {universe}"))
+            return
+
+        frames, missing = _load_frames(codes)
+        if not frames:
+            self.stdout.write(self.style.ERROR(f"[backtest_swing] no prices in {price_store.STORE_DIR}"))
+            return
+        frames, cal, has_map = _align_to_calendar(frames)
+
+        # ---------- パネル（全日付 × 全銘柄を1回だけ） ----------
+        t0 = time.perf_counter()
+        fcfg = FeatureConfig()
+        panel = make_features_panel(frames, cfg=fcfg)
+        cols = panel.columns
+        T, N = panel.dates.shape
+        pcodes = list(panel.codes)
+
+        first = (T - panel.lengths)[None, :]
+        t_idx = np.arange(T)[:, None]
+        valid = t_idx >= first
+        has_bar = np.zeros((T, N), dtype=bool)
+        for j, code in enumerate(pcodes):
+            has_bar[T - int(panel.lengths[j]):, j] = has_map[code]
+
+        o, hi, lo, c = cols["Open"], cols["High"], cols["Low"], cols["Close"]
+        atr = cols[f"ATR{fcfg.atr_period}"]
+
+        score01 = score_panel(cols, valid, window=nbars)
+        confirm = compute_confirm_panel(
+            cols,
+            valid,
+            ma_short_col=f"MA{fcfg.ma_short}",
+            ma_mid_col=f"MA{fcfg.ma_mid}",
+            rsi_col=f"RSI{fcfg.rsi_period}",
+            atr_col=f"ATR{fcfg.atr_period}",
+        )
+        with np.errstate(invalid="ignore"):
+            entry_a, tp_a, sl_a = compute_entry_tp_sl_vec(c, atr, "aggressive", "short")
+            sig_ok = (
+                has_bar
+                & (t_idx >= first + warmup)
+                & np.isfinite(c) & (c > 0)
+                & np.isfinite(atr) & (atr > 0)
+                & np.isfinite(entry_a) & np.isfinite(tp_a) & np.isfinite(sl_a)
+            )
+        prep_sec = time.perf_counter() - t0
+
+        # シグナルを作る日付の範囲
+        since = (opts.get("since") or "").strip()
+        until = (opts.get("until") or "").strip()
+        day_ok = np.ones(T, dtype=bool)
+        if since:
+            day_ok &= cal.values >= np.datetime64(since)
+        if until:
+            day_ok &= cal.values <= np.datetime64(until)
+        day_ok[-1] = False  # 最終日のシグナルは約定日が無い
+
+        use_filters = FilterContext is not None and picks_check_all is not None
+
+        # ---------- 再生 ----------
+        mgr = PositionLimitManager(LimitConfig(max_positions=max_positions, max_total_risk_r=max_total_risk_r))
+        pending: List[_Position] = []
+        open_pos: Dict[str, _Position] = {}
+        trades: List[Dict[str, Any]] = []
+        equity_rows: List[Dict[str, Any]] = []
+        realized = 0.0
+        counters = {
+            "signal_days": 0,
+            "candidates": 0,
+            "filtered": 0,
+            "topk": 0,
+            "skipped_pro_filter": 0,
+            "rejected_by_cash": 0,
+            "skipped_limits": 0,
+            "accepted": 0,
+            "no_position": 0,
+        }
+        fees = policy.get("fees") if isinstance(policy.get("fees"), dict) else {}
+        commission_rate = float(fees.get("commission_rate", 0.0005) or 0.0005)
+        min_commission = float(fees.get("min_commission", 100.0) or 100.0)
+        slippage_rate = float(fees.get("slippage_rate", 0.001) or 0.001)
+
+        def _close_trade(p: _Position, t: int, px: float, reason: str) -> None:
+            nonlocal realized
+            pl = (px - float(p.exec_px)) * p.qty
+            notional = float(p.exec_px) * p.qty
+            cost = 2.0 * max(min_commission, commission_rate * notional) + slippage_rate * notional
+            r_plan = abs(p.entry_plan - p.sl_plan)
+            realized += pl
+            trades.append({
+                "code": p.code,
+                "signal_date": str(cal[p.signal_t].date()),
+                "trade_date": str(cal[p.signal_t + 1].date()),
+                "exit_date": str(cal[t].date()),
+                "entry_plan": p.entry_plan,
+                "tp_plan": p.tp_plan,
+                "sl_plan": p.sl_plan,
+                "exec_entry_px": p.exec_px,
+                "tp_use": p.tp_use,
+                "sl_use": p.sl_use,
+                "exit_px": px,
+                "exit_reason": reason,
+                "qty": p.qty,
+                "required_cash": p.required_cash,
+                "pl": pl,
+                "pl_net": pl - cost,
+                "r": ((px - float(p.exec_px)) / r_plan) if r_plan > 0 else None,
+                "hold_bd": p.days,
+                "score_100": p.score_100,
+                "ev_true": p.ev_true,
+            })
+
+        t_begin = int(np.argmax(day_ok)) if day_ok.any() else T
+        for t in range(t_begin, T):
+            # 1) 前日 accepted → 当日の足で約定判定（trade_date 当日のみ）
+            for p in pending:
+                j = p.j
+                filled_px = None
+                if has_bar[t, j]:
+                    if o[t, j] <= p.entry_plan:
+                        filled_px = float(o[t, j])
+                    elif lo[t, j] <= p.entry_plan <= hi[t, j]:
+                        filled_px = float(p.entry_plan)
+                if filled_px is None:
+                    counters["no_position"] += 1
+                    trades.append({
+                        "code": p.code,
+                        "signal_date": str(cal[p.signal_t].date()),
+                        "trade_date": str(cal[t].date()),
+                        "exit_reason": "no_position",
+                        "qty": p.qty,
+                        "pl": 0.0,
+                        "pl_net": 0.0,
+                        "score_100": p.score_100,
+                        "ev_true": p.ev_true,
+                    })
+                    continue
+                tp_use, sl_use, _meta = reanchor_tp_sl_A(
+                    side="BUY", entry_plan=p.entry_plan, tp_plan=p.tp_plan, sl_plan=p.sl_plan, exec_entry_px=filled_px
+                )
+                p.exec_px, p.entry_t, p.tp_use, p.sl_use = filled_px, t, tp_use, sl_use
+                open_pos[p.code] = p
+            pending = []
+
+            # 2) 保有中の決済判定（約定日も含めて、足がある日だけ数える）
+            for code in list(open_pos):
+                p = open_pos[code]
+                j = p.j
+                if not has_bar[t, j]:
+                    continue
+                p.days += 1
+                if p.tp_use is not None and hi[t, j] >= p.tp_use:
+                    _close_trade(p, t, float(p.tp_use), "hit_tp")
+                elif p.sl_use is not None and lo[t, j] <= p.sl_use:
+                    _close_trade(p, t, float(p.sl_use), "hit_sl")
+                elif p.days >= horizon_bd:
+                    _close_trade(p, t, float(c[t, j]), "time_stop")
+                else:
+                    continue
+                del open_pos[code]
+
+            unreal = sum((float(c[t, p.j]) - float(p.exec_px)) * p.qty for p in open_pos.values())
+            used_cash = sum(p.required_cash for p in open_pos.values())
+            equity_rows.append({
+                "date": str(cal[t].date()),
+                "equity": float(total_equity_yen + realized + unreal),
+                "realized": float(realized),
+                "open": len(open_pos),
+                "used_cash": float(used_cash),
+            })
+
+            if not day_ok[t]:
+                continue
+            counters["signal_days"] += 1
+
+            # 3) ランキング（picks_build と同じキー / TopK）
+            js = np.nonzero(sig_ok[t])[0]
+            ml_res: Dict[str, Any] = {}
+            items: List[PickItem] = []
+            sizing: Dict[str, Tuple[Any, str]] = {}
+            for j in js:
+                code = pcodes[j]
+                last = float(c[t, j])
+                atr_v = float(atr[t, j])
+                if use_filters:
+                    feat_row = {k: (float(cols[k][t, j]) if k in cols else None) for k in FILTER_COLS}
+                    dec = picks_check_all(FilterContext(code=code, feat=feat_row, last=last, atr=atr_v))
+                    if dec and getattr(dec, "skip", False):
+                        counters["filtered"] += 1
+                        continue
+                e, tp, sl = float(entry_a[t, j]), float(tp_a[t, j]), float(sl_a[t, j])
+                pro_res, pro_reason = compute_pro_sizing_and_filter(
+                    code=code, side="BUY", entry=e, tp=tp, sl=sl, policy=policy, total_equity_yen=total_equity_yen
+                )
+                sizing[code] = (pro_res, pro_reason)
+                s01 = float(score01[t, j])
+                items.append(PickItem(
+                    code=code,
+                    last_close=last,
+                    atr=atr_v,
+                    entry=e,
+                    tp=tp,
+                    sl=sl,
+                    score=s01,
+                    score_100=score_to_0_100(s01),
+                    confirm_score=int(confirm[t, j]),
+                    qty_rakuten=int(pro_res.qty_pro) if pro_res is not None else 0,
+                ))
+            counters["candidates"] += len(items)
+
+            if use_ml and items:
+                rows = {it.code: {k: float(v[t, panel._pos[it.code]]) for k, v in cols.items()} for it in items}
+                ml_res = ml_infer_batch(rows)
+                for it in items:
+                    r = ml_res.get(it.code)
+                    if r is None:
+                        continue
+                    it.ml_rank = r.ml_rank
+                    it.ml_p_win = r.p_win
+                    probs = r.tp_first_probs if isinstance(r.tp_first_probs, dict) else {}
+                    p_tp = _safe_float(probs.get("tp_first"))
+                    pro_res = sizing[it.code][0]
+                    if p_tp is None or pro_res is None or not pro_res.qty_pro:
+                        continue
+                    # sizing_service と同じ EV_true（R換算）= pTP * RR_net - pSL（pSL = 1 - pTP）
+                    p_tp = min(1.0, max(0.0, p_tp))
+                    loss_value = max(float(it.entry) - float(it.sl), float(it.atr) * 0.6) * pro_res.qty_pro
+                    if loss_value > 0:
+                        it.ev_true_rakuten = p_tp * (float(pro_res.est_pl_pro) / loss_value) - (1.0 - p_tp)
+
+            sort_items_inplace(items)
+            top_items, _mode = select_topk(items, topk)
+            counters["topk"] += len(top_items)
+
+            # 4) ai_simulate_auto: PRO sizing → cap → 資金 → 同時建玉制限
+            mgr.load_open_positions({k: {"risk_r": 1.0} for k in open_pos}, total_risk_r=float(len(open_pos)))
+            cash_left = max(0.0, total_notional_cap - reserve_cash_yen - sum(p.required_cash for p in open_pos.values()))
+            for it in top_items:
+                pro_res, _reason = sizing[it.code]
+                if pro_res is None:
+                    counters["skipped_pro_filter"] += 1
+                    continue
+                remaining_slots = max(1, int(max_positions) - int(mgr.count_open()))
+                cap_yen = float(cash_left) / float(remaining_slots)
+                if max_notional_per_trade_yen > 0:
+                    cap_yen = min(cap_yen, max_notional_per_trade_yen)
+                pro_res, cap_reason = apply_per_trade_cap_to_pro_res(
+                    code=it.code,
+                    policy=policy,
+                    entry=it.entry,
+                    pro_res=pro_res,
+                    cap_yen=cap_yen,
+                    min_yen=min_notional_per_trade_yen,
+                )
+                if cap_reason in CAP_REJECTS:
+                    counters["rejected_by_cash"] += 1
+                    continue
+                req_cash = float(pro_res.required_cash_pro or 0.0)
+                if req_cash <= 0 or req_cash > cash_left:
+                    counters["rejected_by_cash"] += 1
+                    continue
+                can, _skip = mgr.can_open(it.code, risk_r=1.0)
+                if not can:
+                    counters["skipped_limits"] += 1
+                    continue
+                mgr.open(it.code, risk_r=1.0)
+                cash_left -= req_cash
+                counters["accepted"] += 1
+                pending.append(_Position(
+                    code=it.code,
+                    j=panel._pos[it.code],
+                    signal_t=t,
+                    entry_plan=float(it.entry),
+                    tp_plan=float(it.tp),
+                    sl_plan=float(it.sl),
+                    qty=int(pro_res.qty_pro),
+                    required_cash=req_cash,
+                    est_pl=float(pro_res.est_pl_pro),
+                    est_loss=float(pro_res.est_loss_pro),
+                    score_100=int(it.score_100 or 0),
+                    ev_true=_safe_float(it.ev_true_rakuten),
+                ))
+
+        # 最終日まで決済されなかった建玉は carry（最終終値で評価額だけ出す）
+        for p in open_pos.values():
+            trades.append({
+                "code": p.code,
+                "signal_date": str(cal[p.signal_t].date()),
+                "trade_date": str(cal[p.signal_t + 1].date()),
+                "exec_entry_px": p.exec_px,
+                "exit_px": float(c[T - 1, p.j]),
+                "exit_reason": "carry",
+                "qty": p.qty,
+                "pl": (float(c[T - 1, p.j]) - float(p.exec_px)) * p.qty,
+                "pl_net": None,
+                "hold_bd": p.days,
+                "score_100": p.score_100,
+                "ev_true": p.ev_true,
+            })
+
+        # ---------- 集計・出力 ----------
+        trades_df = pd.DataFrame(trades)
+        eq = pd.DataFrame(equity_rows)
+        summary = _trade_summary(trades_df) if len(trades_df) else {"trades": 0}
+        summary.update(counters)
+        if len(eq):
+            summary.update(_equity_stats(eq["equity"].to_numpy(dtype=float)))
+            summary["equity_start"] = float(total_equity_yen)
+            summary["equity_end"] = float(eq["equity"].iloc[-1])
+            summary["avg_open_positions"] = float(eq["open"].mean())
+            summary["avg_used_cash_yen"] = float(eq["used_cash"].mean())
+
+        by_year: Dict[str, Any] = {}
+        if len(trades_df) and "exit_date" in trades_df:
+            done = trades_df[trades_df["exit_reason"].isin(["hit_tp", "hit_sl", "time_stop"])]
+            for y, g in done.groupby(done["exit_date"].str.slice(0, 4)):
+                by_year[str(y)] = _trade_summary(g)
+
+        elapsed = time.perf_counter() - t_start
+        stamp = datetime.now(JST).strftime("%Y%m%d_%H%M%S")
+        out_dir = Path(opts.get("out") or "") if opts.get("out") else OUT_DIR
+        trades_path = out_dir / f"backtest_{stamp}_trades.csv"
+        report = {
+            "created_at": datetime.now(JST).isoformat(timespec="seconds"),
+            "params": {
+                "universe": universe,
+                "codes": len(frames),
+                "missing_codes": len(missing),
+                "since": since or (str(cal[t_begin].date()) if t_begin < T else None),
+                "until": until or str(cal[-1].date()),
+                "topk": topk,
+                "nbars": nbars,
+                "warmup": warmup,
+                "horizon_bd": horizon_bd,
+                "ml": use_ml,
+                "policy": str(policy_path),
+                "pro_mode": learn_mode,
+                "equity_yen": float(total_equity_yen),
+                "notional_cap_yen": float(total_notional_cap),
+                "reserve_cash_yen": float(reserve_cash_yen),
+                "max_positions": max_positions,
+                "max_total_risk_r": max_total_risk_r,
+                "max_notional_per_trade_yen": max_notional_per_trade_yen,
+            },
+            "summary": summary,
+            "by_year": by_year,
+            "equity": equity_rows,
+            "trades_csv": str(trades_path),
+            "timing": {"prepare_sec": round(prep_sec, 3), "total_sec": round(elapsed, 3), "dates": int(T), "panel_codes": int(N)},
+        }
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        tmp = trades_path.with_name(trades_path.name + ".tmp")
+        trades_df.to_csv(tmp, index=False, encoding="utf-8")
+        os.replace(tmp, trades_path)
+        _write_atomic(out_dir / "latest_backtest.json", json.dumps(report, ensure_ascii=False, indent=2, default=str))
+
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS("===== backtest_swing summary ====="))
+        self.stdout.write(
+            f"  codes={len(frames)} (missing={len(missing)}) dates={T} signal_days={counters['signal_days']} "
+            f"topk={topk} horizon_bd={horizon_bd} ml={use_ml}"
+        )
+        self.stdout.write(
+            f"  candidates={counters['candidates']} filtered={counters['filtered']} accepted={counters['accepted']} "
+            f"no_position={counters['no_position']} skip_pro={counters['skipped_pro_filter']} "
+            f"reject_cash={counters['rejected_by_cash']} skip_limits={counters['skipped_limits']}"
+        )
+        if summary.get("trades"):
+            self.stdout.write(
+                f"  trades={summary['trades']} win_rate={summary['win_rate']:.3f} pl_sum={summary['pl_sum']:.0f} "
+                f"pl_net_sum={summary['pl_net_sum']:.0f} r_mean={summary['r_mean']:.3f} "
+                f"max_dd={summary.get('max_drawdown_yen', 0.0):.0f}"
+            )
+        self.stdout.write(f"  elapsed={elapsed:.1f}s (prepare={prep_sec:.1f}s)")
+        self.stdout.write(f"  report: {out_dir / 'latest_backtest.json'}")
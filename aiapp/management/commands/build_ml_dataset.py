@@ -13,12 +13,23 @@ build_ml_dataset.py
 
   ついでに:
   - media/aiapp/ml/train/latest_train.parquet または latest_train.csv
+    （月パーティションを pyarrow で連結して作る。正規化はやり直さない）
+  - media/aiapp/ml/train/build_state.json（差分ビルドの状態）
+
+差分ビルド:
+  - latest_behavior.jsonl の各行を内容ハッシュで識別し、前回ビルドから増えた/変わった行だけ json.loads + 正規化
+  - 消えた行（評価が付いて書き換わった行など）は、その行が入っていた月パーティションから外す
+  - 書き直すのは行が増減した YYYY_MM だけ。ソースが前回と同じ (size, mtime) なら何も読まない
+  - 条件（--days / --min-qty / --include-live / 出力形式 / feature_store）が変わったら全件作り直し（--full でも）
+  - 各行に src_hash（元の行ハッシュ）と src_ts（run_date/ts）を持たせ、latest の --days 窓は src_ts で掛け直す
 
 設計方針:
   - 1行JSON = 1トレード = 1サンプル
   - “未来情報リーク” を入れない（Xは当日確定情報のみ）
   - yは eval_* から作る（win/lose/flat, pl, R, hold_days, tp_first/sl_first）
   - 文字の不可視混入に耐える（NFKC + 制御文字除去）
+  - feature_snapshot に欠けているコア特徴量は feature_store（picks_build が書いた時点別ストア）から
+    「trade_date より前の直近の確定足」の値で埋める（--no-feature-store で無効）
 
 使い方:
   python manage.py build_ml_dataset --days 180
@@ -26,19 +37,26 @@ build_ml_dataset.py
 
 from __future__ import annotations
 
+import hashlib
 import json
+import os
 import re
 import unicodedata
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta, timezone as dt_timezone
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandParser
 
+try:
+    from aiapp.services import feature_store
+except Exception:  # pragma: no cover
+    feature_store = None  # type: ignore
+
 JST = dt_timezone(timedelta(hours=9))
 
 BROKERS = ("rakuten", "sbi", "matsui")
@@ -221,6 +239,65 @@ def _y_r_from_cashrisk(d: Dict[str, Any], y_pl: float) -> Optional[float]:
     return float(y_pl) / float(risk_cash)
 
 
+CORE_FEATURES = ("ATR14", "SLOPE_25", "RET_20", "RSI14", "BB_Z", "VWAP_GAP_PCT")
+
+
+def _fill_from_feature_store(df: pd.DataFrame) -> int:
+    """
+    コア特徴量の欠損を feature_store から埋める（point-in-time: trade_date より前の直近行）。
+    埋めたセル数を返す。
+    """
+    if feature_store is None or df.empty:
+        return 0
+    miss = df[list(CORE_FEATURES)].isna().any(axis=1)
+    if not miss.any():
+        return 0
+
+    td = pd.to_datetime(df["trade_date"].astype(str).str[:10], errors="coerce")
+    need = df.loc[miss & td.notna()]
+    if need.empty:
+        return 0
+    td_need = td[need.index]
+    lookback = pd.Timedelta(days=feature_store.ASOF_LOOKBACK_DAYS)
+    store = feature_store.read_range(
+        td_need.min() - lookback,
+        td_need.max(),
+        codes=need["code"].unique().tolist(),
+        columns=list(CORE_FEATURES),
+    )
+    if store.empty:
+        return 0
+
+    left = pd.DataFrame({"_i": need.index, "code": need["code"].astype(str).values, "_td": td_need.values})
+    left["_td"] = left["_td"].astype("datetime64[ns]")
+    left = left.sort_values("_td", kind="mergesort")
+    right = store.rename(columns={"date": "_fd"})
+    right["_fd"] = pd.to_datetime(right["_fd"]).astype("datetime64[ns]")
+    right["code"] = right["code"].astype(str)
+    right = right.sort_values("_fd", kind="mergesort")
+    m = pd.merge_asof(
+        left,
+        right,
+        left_on="_td",
+        right_on="_fd",
+        by="code",
+        allow_exact_matches=False,
+        tolerance=lookback,
+        direction="backward",
+    ).set_index("_i")
+
+    filled = 0
+    for c in CORE_FEATURES:
+        if c not in m.columns:
+            continue
+        hole = df.loc[m.index, c].isna() & m[c].notna()
+        if hole.any():
+            idx = hole[hole].index
+            df.loc[idx, c] = m.loc[idx, c].astype(float)
+            filled += int(hole.sum())
+    return filled
+
+
 def _extract_feature_snapshot(d: Dict[str, Any]) -> Dict[str, Any]:
     """
     Xコア:
@@ -300,24 +377,240 @@ class Row:
     y_touch_tp_first: str   # tp_first/sl_first/none
 
 
-def _iter_jsonl(path: Path) -> Iterable[Dict[str, Any]]:
-    if not path.exists():
-        return []
-    def gen():
-        with path.open("r", encoding="utf-8") as f:
-            for line in f:
-                s = line.strip()
-                if not s:
-                    continue
-                try:
-                    yield json.loads(s)
-                except Exception:
-                    continue
-    return gen()
+def _row_from_record(
+    d: Dict[str, Any],
+    *,
+    include_live: bool,
+    cutoff: datetime,
+    min_qty: int,
+    maps: Dict[str, Dict[str, int]],
+) -> Tuple[Optional[Row], str, Optional[datetime]]:
+    """
+    1レコード → Row。学習対象外なら (None, 理由, dt_run)。
+    理由: "live" / "time" / "label" / "qty" / "pl"
+    """
+    mode = _clean_text(d.get("mode")).lower() or "unknown"
+    if (not include_live) and mode == "live":
+        return None, "live", None
+
+    # 日付フィルタ: run_date → ts の順に使う
+    dt_run = _to_dt_any(d.get("run_date")) or _to_dt_any(d.get("ts"))
+    if dt_run is not None and dt_run < cutoff:
+        return None, "time", dt_run
+
+    label = _get_label(d)
+    if label not in ("win", "lose", "flat"):
+        return None, "label", dt_run
+
+    qty_total = _sum_qty(d)
+    if qty_total < min_qty:
+        return None, "qty", dt_run
+
+    y_pl = _sum_pl(d)
+    if y_pl is None:
+        return None, "pl", dt_run
+
+    code = _norm_code(d.get("code"))
+    run_id = _clean_text(d.get("run_id")) or "unknown_run"
+    trade_date = _clean_text(d.get("trade_date") or d.get("run_date") or "")
+    if not trade_date:
+        # 最後の砦
+        if dt_run is not None:
+            trade_date = dt_run.date().isoformat()
+        else:
+            trade_date = "1970-01-01"
+
+    fs = _extract_feature_snapshot(d)
+
+    # context (IDs)
+    side = _clean_text(d.get("side")).upper() or "UNKNOWN"
+    style = _clean_text(d.get("style")).lower() or "unknown"
+    horizon = _clean_text(d.get("horizon")).lower() or "unknown"
+    sector = _clean_text(d.get("sector")) or "UNKNOWN"
+    universe = _clean_text(d.get("universe")).lower() or "unknown"
+    mode_s = mode or "unknown"
+
+    row = Row(
+        run_id=run_id,
+        code=code,
+        trade_date=trade_date,
+
+        # コア特徴量（当日確定）
+        ATR14=_safe_float(fs.get("ATR14")) or _safe_float(d.get("atr_14")),
+        SLOPE_25=_safe_float(fs.get("SLOPE_25")) or _safe_float(d.get("slope_25")),
+        RET_20=_safe_float(fs.get("RET_20")) or _safe_float(d.get("ret_20")),
+        RSI14=_safe_float(fs.get("RSI14")),
+        BB_Z=_safe_float(fs.get("BB_Z")),
+        VWAP_GAP_PCT=_safe_float(fs.get("VWAP_GAP_PCT")),
+
+        # design
+        design_rr=_safe_float(d.get("design_rr")),
+        design_risk=_safe_float(d.get("design_risk")),
+        design_reward=_safe_float(d.get("design_reward")),
+        risk_atr=_safe_float(d.get("risk_atr")),
+        reward_atr=_safe_float(d.get("reward_atr")),
+
+        score_100=_safe_int(d.get("score_100")),
+
+        side_id=_get_id(maps["side"], side),
+        style_id=_get_id(maps["style"], style),
+        horizon_id=_get_id(maps["horizon"], horizon),
+        sector_id=_get_id(maps["sector"], sector),
+        universe_id=_get_id(maps["universe"], universe),
+        mode_id=_get_id(maps["mode"], mode_s),
+
+        # y (optional)
+        y_label=label,
+        y_pl=float(y_pl),
+        y_r=_y_r_from_cashrisk(d, float(y_pl)),
+        y_hold_days=_hold_days(d),
+        y_touch_tp_first=_touch_first(d),
+    )
+    return row, "", dt_run
+
+
+# ----------------------------
+# partitions（差分ビルド）
+# ----------------------------
+
+STATE_NAME = "build_state.json"
+STATE_VERSION = 1
+
+# 元レコードの行ハッシュ / 日付フィルタに使った時刻（latest の --days 窓を後から掛け直す）
+SRC_COLS = ("src_hash", "src_ts")
+
+_STR_COLS = ("run_id", "code", "trade_date", "y_label", "y_touch_tp_first", "src_hash", "src_ts")
+_INT_COLS = ("side_id", "style_id", "horizon_id", "sector_id", "universe_id", "mode_id")
+_NULLABLE_INT_COLS = ("score_100", "y_hold_days")
+
+
+def _line_key(raw: bytes) -> str:
+    """
+    jsonl 1行（strip 済み bytes）の内容ハッシュ。json.loads せずに「前回から変わったか」を判定する。
+    """
+    return hashlib.blake2b(raw, digest_size=10).hexdigest()
+
+
+def _typed(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    パーティション間でスキーマを揃える（CSV 読み戻し / 欠損だけの月でも同じ型）。
+    """
+    cols = [f.name for f in fields(Row)] + list(SRC_COLS)
+    d = df.reindex(columns=cols)
+    for c in cols:
+        if c in _STR_COLS:
+            d[c] = d[c].astype(object).where(d[c].notna(), None)
+            d[c] = d[c].map(lambda x: None if x is None else str(x))
+        elif c in _INT_COLS:
+            d[c] = pd.to_numeric(d[c], errors="coerce").fillna(0).astype("int64")
+        elif c in _NULLABLE_INT_COLS:
+            d[c] = pd.to_numeric(d[c], errors="coerce").round().astype("Int64")
+        else:
+            d[c] = pd.to_numeric(d[c], errors="coerce").astype("float64")
+    return d
+
+
+def _to_yyyymm(s: str, now: datetime) -> str:
+    # trade_date から YYYY_MM を作る（壊れてたら実行月で fallback）
+    try:
+        dt = datetime.fromisoformat(str(s)[:10])
+        return dt.strftime("%Y_%m")
+    except Exception:
+        return now.strftime("%Y_%m")
+
+
+def _load_state(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        st = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if not isinstance(st, dict) or st.get("version") != STATE_VERSION or not isinstance(st.get("records"), dict):
+        return None
+    return st
+
+
+def _save_state(path: Path, state: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _read_part(out_month: Path) -> Optional[pd.DataFrame]:
+    p_parq = out_month / "train.parquet"
+    p_csv = out_month / "train.csv"
+    if p_parq.exists():
+        return _typed(pd.read_parquet(p_parq))
+    if p_csv.exists():
+        return _typed(pd.read_csv(p_csv, dtype={c: str for c in _STR_COLS}, keep_default_na=True))
+    return None
+
+
+def _write_part(out_month: Path, df: pd.DataFrame, can_parquet: bool) -> Path:
+    """
+    tmp に書いてから os.replace。形式が変わったら古い方は消す。
+    """
+    out_month.mkdir(parents=True, exist_ok=True)
+    name, other = ("train.parquet", "train.csv") if can_parquet else ("train.csv", "train.parquet")
+    outp = out_month / name
+    tmp = out_month / (name + ".tmp")
+    if can_parquet:
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False, encoding="utf-8")
+    os.replace(tmp, outp)
+    if (out_month / other).exists():
+        (out_month / other).unlink()
+    return outp
+
+
+def _drop_part(out_month: Path) -> None:
+    for name in ("train.parquet", "train.csv"):
+        p = out_month / name
+        if p.exists():
+            p.unlink()
+
+
+def _assemble_latest(base_out: Path, months: List[str], can_parquet: bool, cutoff_s: str) -> Tuple[Path, int]:
+    """
+    latest_train = 月パーティションの連結（正規化し直さない）。
+    --days の窓は src_ts で掛け直す（前回までに取り込んだ行も古くなったら外れる）。
+    """
+    if can_parquet:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        tables = []
+        for m in months:
+            p = base_out / m / "train.parquet"
+            if p.exists():
+                tables.append(pq.read_table(p))
+        if tables:
+            schema = tables[0].schema
+            table = pa.concat_tables([t.select(schema.names).cast(schema) for t in tables])
+            ts = table["src_ts"]
+            table = table.filter(pc.or_kleene(pc.is_null(ts), pc.greater_equal(ts, cutoff_s)))
+        else:
+            table = pa.Table.from_pandas(_typed(pd.DataFrame()), preserve_index=False)
+        latest = base_out / "latest_train.parquet"
+        tmp = base_out / "latest_train.parquet.tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, latest)
+        return latest, int(table.num_rows)
+
+    frames = [f for f in (_read_part(base_out / m) for m in months) if f is not None]
+    df = pd.concat(frames, ignore_index=True) if frames else _typed(pd.DataFrame())
+    ts = df["src_ts"]
+    df = df[ts.isna() | (ts.fillna("") >= cutoff_s)].reset_index(drop=True)
+    latest = base_out / "latest_train.csv"
+    tmp = base_out / "latest_train.csv.tmp"
+    df.to_csv(tmp, index=False, encoding="utf-8")
+    os.replace(tmp, latest)
+    return latest, int(len(df))
 
 
 class Command(BaseCommand):
-    help = "紙シミュJSONL → ML学習用データセット（Parquet/CSV）を生成"
+    help = "紙シミュJSONL → ML学習用データセット（Parquet/CSV）を生成（前回から増えた/変わった行だけ処理）"
 
     def add_arguments(self, parser: CommandParser) -> None:
         parser.add_argument("--days", type=int, default=180, help="直近何日分を見るか（run_date/ts基準）")
@@ -326,6 +619,8 @@ class Command(BaseCommand):
         parser.add_argument("--force-csv", action="store_true", help="Parquetを使わずCSV出力に固定")
         parser.add_argument("--min-qty", type=int, default=1, help="学習対象にする最小数量（合算qty）")
         parser.add_argument("--dry-run", action="store_true", help="書き出さず件数だけ表示")
+        parser.add_argument("--no-feature-store", action="store_true", help="feature_store からの欠損補完をしない")
+        parser.add_argument("--full", action="store_true", help="build_state.json を無視して全件を作り直す")
 
     def handle(self, *args, **opts) -> None:
         days = int(opts.get("days") or 180)
@@ -333,6 +628,8 @@ class Command(BaseCommand):
         force_csv = bool(opts.get("force_csv") or False)
         min_qty = int(opts.get("min_qty") or 1)
         dry_run = bool(opts.get("dry_run") or False)
+        use_feature_store = not bool(opts.get("no_feature_store") or False)
+        full = bool(opts.get("full") or False)
 
         out_dir_opt = _clean_text(opts.get("out") or "")
         base_out = Path(out_dir_opt) if out_dir_opt else (Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "train")
@@ -345,211 +642,187 @@ class Command(BaseCommand):
 
         now = datetime.now(JST).replace(tzinfo=None)
         cutoff = now - timedelta(days=days)
+        cutoff_s = cutoff.isoformat(timespec="seconds")
+
+        # parquet可否
+        can_parquet = False
+        if not force_csv:
+            try:
+                import pyarrow  # noqa: F401
+                can_parquet = True
+            except Exception:
+                can_parquet = False
+
+        # 前回の状態（行ハッシュ → [件数, YYYY_MM]）。条件が変わったら全件作り直し
+        options = {
+            "days": days,
+            "include_live": include_live,
+            "min_qty": min_qty,
+            "feature_store": use_feature_store,
+            "format": "parquet" if can_parquet else "csv",
+        }
+        state_path = base_out / STATE_NAME
+        loaded = _load_state(state_path)
+        prev = None if full else loaded
+        rebuild_reason = "--full" if full else ("no state" if prev is None else "")
+        if prev is not None and prev.get("options") != options:
+            prev = None
+            rebuild_reason = "options changed"
+        prev_records: Dict[str, List[Any]] = dict(prev["records"]) if prev else {}
 
         # id maps（永続）
         meta_dir = Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "meta"
-        mp_side = _load_map(meta_dir / "side_map.json")
-        mp_style = _load_map(meta_dir / "style_map.json")
-        mp_horizon = _load_map(meta_dir / "horizon_map.json")
-        mp_sector = _load_map(meta_dir / "sector_map.json")
-        mp_univ = _load_map(meta_dir / "universe_map.json")
-        mp_mode = _load_map(meta_dir / "mode_map.json")
-
-        rows: List[Row] = []
+        maps = {
+            "side": _load_map(meta_dir / "side_map.json"),
+            "style": _load_map(meta_dir / "style_map.json"),
+            "horizon": _load_map(meta_dir / "horizon_map.json"),
+            "sector": _load_map(meta_dir / "sector_map.json"),
+            "universe": _load_map(meta_dir / "universe_map.json"),
+            "mode": _load_map(meta_dir / "mode_map.json"),
+        }
+
+        # ---- 差分: 行ハッシュで「新規 / 消えた / 件数が変わった」を出す（json.loads は新規行だけ）
+        st = behavior_path.stat()
+        source = {"size": int(st.st_size), "mtime_ns": int(st.st_mtime_ns)}
+        counts: Dict[str, int] = {}
+        new_lines: Dict[str, bytes] = {}
+        if prev is not None and prev.get("source") == source:
+            counts = {h: int(v[0]) for h, v in prev_records.items()}
+        else:
+            with behavior_path.open("rb") as f:
+                for line in f:
+                    s = line.strip()
+                    if not s:
+                        continue
+                    h = _line_key(s)
+                    counts[h] = counts.get(h, 0) + 1
+                    if h not in prev_records and h not in new_lines:
+                        new_lines[h] = s
+
+        removed = {h for h in prev_records if h not in counts}
+        recount = {h: n for h, n in counts.items() if h in prev_records and int(prev_records[h][0]) != n}
 
         scanned = 0
         kept = 0
-        skipped_label = 0
-        skipped_qty = 0
-        skipped_time = 0
-        skipped_pl = 0
-
-        for d in _iter_jsonl(behavior_path):
-            scanned += 1
-
-            mode = _clean_text(d.get("mode")).lower() or "unknown"
-            if (not include_live) and mode == "live":
-                continue
+        skipped = {"time": 0, "label": 0, "qty": 0, "pl": 0}
+        records: Dict[str, List[Any]] = {h: [n, str(prev_records[h][1] or "")] for h, n in counts.items() if h in prev_records}
+        new_rows: List[Dict[str, Any]] = []
 
-            # 日付フィルタ: run_date → ts の順に使う
-            dt_run = _to_dt_any(d.get("run_date")) or _to_dt_any(d.get("ts"))
-            if dt_run is not None and dt_run < cutoff:
-                skipped_time += 1
-                continue
-
-            label = _get_label(d)
-            if label not in ("win", "lose", "flat"):
-                skipped_label += 1
-                continue
-
-            qty_total = _sum_qty(d)
-            if qty_total < min_qty:
-                skipped_qty += 1
+        for h, s in new_lines.items():
+            try:
+                d = json.loads(s)
+            except Exception:
+                records[h] = [counts[h], ""]
                 continue
-
-            y_pl = _sum_pl(d)
-            if y_pl is None:
-                skipped_pl += 1
+            scanned += 1
+            row, reason, dt_run = _row_from_record(d, include_live=include_live, cutoff=cutoff, min_qty=min_qty, maps=maps)
+            if row is None:
+                if reason in skipped:
+                    skipped[reason] += 1
+                records[h] = [counts[h], ""]
                 continue
-
-            code = _norm_code(d.get("code"))
-            run_id = _clean_text(d.get("run_id")) or "unknown_run"
-            trade_date = _clean_text(d.get("trade_date") or d.get("run_date") or "")
-            if not trade_date:
-                # 最後の砦
-                if dt_run is not None:
-                    trade_date = dt_run.date().isoformat()
-                else:
-                    trade_date = "1970-01-01"
-
-            fs = _extract_feature_snapshot(d)
-
-            # コア特徴量（当日確定）
-            ATR14 = _safe_float(fs.get("ATR14")) or _safe_float(d.get("atr_14"))
-            SLOPE_25 = _safe_float(fs.get("SLOPE_25")) or _safe_float(d.get("slope_25"))
-            RET_20 = _safe_float(fs.get("RET_20")) or _safe_float(d.get("ret_20"))
-            RSI14 = _safe_float(fs.get("RSI14"))
-            BB_Z = _safe_float(fs.get("BB_Z"))
-            VWAP_GAP_PCT = _safe_float(fs.get("VWAP_GAP_PCT"))
-
-            # design
-            design_rr = _safe_float(d.get("design_rr"))
-            design_risk = _safe_float(d.get("design_risk"))
-            design_reward = _safe_float(d.get("design_reward"))
-            risk_atr = _safe_float(d.get("risk_atr"))
-            reward_atr = _safe_float(d.get("reward_atr"))
-
-            # context (IDs)
-            side = _clean_text(d.get("side")).upper() or "UNKNOWN"
-            style = _clean_text(d.get("style")).lower() or "unknown"
-            horizon = _clean_text(d.get("horizon")).lower() or "unknown"
-            sector = _clean_text(d.get("sector")) or "UNKNOWN"
-            universe = _clean_text(d.get("universe")).lower() or "unknown"
-            mode_s = mode or "unknown"
-
-            side_id = _get_id(mp_side, side)
-            style_id = _get_id(mp_style, style)
-            horizon_id = _get_id(mp_horizon, horizon)
-            sector_id = _get_id(mp_sector, sector)
-            universe_id = _get_id(mp_univ, universe)
-            mode_id = _get_id(mp_mode, mode_s)
-
-            score_100 = _safe_int(d.get("score_100"))
-
-            # y (optional)
-            y_hold = _hold_days(d)
-            y_touch = _touch_first(d)
-            y_r = _y_r_from_cashrisk(d, float(y_pl))
-
-            rows.append(
-                Row(
-                    run_id=run_id,
-                    code=code,
-                    trade_date=trade_date,
-
-                    ATR14=ATR14,
-                    SLOPE_25=SLOPE_25,
-                    RET_20=RET_20,
-                    RSI14=RSI14,
-                    BB_Z=BB_Z,
-                    VWAP_GAP_PCT=VWAP_GAP_PCT,
-
-                    design_rr=design_rr,
-                    design_risk=design_risk,
-                    design_reward=design_reward,
-                    risk_atr=risk_atr,
-                    reward_atr=reward_atr,
-
-                    score_100=score_100,
-
-                    side_id=side_id,
-                    style_id=style_id,
-                    horizon_id=horizon_id,
-                    sector_id=sector_id,
-                    universe_id=universe_id,
-                    mode_id=mode_id,
-
-                    y_label=label,
-                    y_pl=float(y_pl),
-                    y_r=y_r,
-                    y_hold_days=y_hold,
-                    y_touch_tp_first=y_touch,
-                )
-            )
+            rec = dict(row.__dict__)
+            rec["src_hash"] = h
+            rec["src_ts"] = dt_run.isoformat(timespec="seconds") if dt_run is not None else None
+            # 同じ内容の行が複数あれば、その件数ぶん学習行にする（従来と同じ）
+            for _ in range(counts[h]):
+                new_rows.append(rec)
             kept += 1
 
         # map保存（カテゴリが増えてもIDが安定する）
-        _save_map(meta_dir / "side_map.json", mp_side)
-        _save_map(meta_dir / "style_map.json", mp_style)
-        _save_map(meta_dir / "horizon_map.json", mp_horizon)
-        _save_map(meta_dir / "sector_map.json", mp_sector)
-        _save_map(meta_dir / "universe_map.json", mp_univ)
-        _save_map(meta_dir / "mode_map.json", mp_mode)
+        _save_map(meta_dir / "side_map.json", maps["side"])
+        _save_map(meta_dir / "style_map.json", maps["style"])
+        _save_map(meta_dir / "horizon_map.json", maps["horizon"])
+        _save_map(meta_dir / "sector_map.json", maps["sector"])
+        _save_map(meta_dir / "universe_map.json", maps["universe"])
+        _save_map(meta_dir / "mode_map.json", maps["mode"])
 
         self.stdout.write("")
         self.stdout.write(self.style.SUCCESS("===== build_ml_dataset summary ====="))
         self.stdout.write(f"  source: {behavior_path}")
         self.stdout.write(f"  days={days} include_live={include_live} min_qty={min_qty} dry_run={dry_run}")
+        self.stdout.write(
+            f"  mode={'full (' + rebuild_reason + ')' if rebuild_reason else 'incremental'} "
+            f"lines={sum(counts.values())} unchanged={len(counts) - len(new_lines) - len(recount)} "
+            f"new={len(new_lines)} removed={len(removed)} recount={len(recount)}"
+        )
         self.stdout.write(f"  scanned={scanned} kept={kept}")
-        self.stdout.write(f"  skipped: time={skipped_time} label={skipped_label} qty={skipped_qty} pl_missing={skipped_pl}")
-
-        if kept <= 0:
-            self.stdout.write(self.style.WARNING("[build_ml_dataset] no rows kept. (win/lose/flat & pl が足りない可能性)"))
-            return
+        self.stdout.write(
+            f"  skipped: time={skipped['time']} label={skipped['label']} qty={skipped['qty']} pl_missing={skipped['pl']}"
+        )
 
         if dry_run:
             self.stdout.write(self.style.WARNING("[build_ml_dataset] dry-run: write skipped."))
             return
 
-        df = pd.DataFrame([r.__dict__ for r in rows])
-
-        # 月単位に分割
-        # trade_date から YYYY_MM を作る（壊れてたら run_date相当で fallback）
-        def _to_yyyymm(s: str) -> str:
+        new_df = _typed(pd.DataFrame(new_rows))
+        if use_feature_store and not new_df.empty:
             try:
-                dt = datetime.fromisoformat(str(s)[:10])
-                return dt.strftime("%Y_%m")
-            except Exception:
-                return now.strftime("%Y_%m")
-
-        df["yyyymm"] = df["trade_date"].apply(_to_yyyymm)
-
-        # parquet可否
-        can_parquet = False
-        if not force_csv:
-            try:
-                import pyarrow  # noqa: F401
-                can_parquet = True
-            except Exception:
-                can_parquet = False
-
+                n_fill = _fill_from_feature_store(new_df)
+                if n_fill:
+                    self.stdout.write(f"  feature_store: filled {n_fill} cells")
+            except Exception as ex:
+                self.stdout.write(self.style.WARNING(f"[build_ml_dataset] feature_store fill skipped: {ex}"))
+
+        # 月単位に分割（変わった月だけ書き直す）
+        new_months = new_df["trade_date"].map(lambda s: _to_yyyymm(s, now)) if not new_df.empty else pd.Series([], dtype=object)
+        for h, m in zip(new_df["src_hash"], new_months):
+            records[h] = [counts[h], m]
+
+        prev_months = {str(v[1]) for v in prev_records.values() if v[1]}
+        touched = set(new_months.unique().tolist())
+        touched |= {str(prev_records[h][1]) for h in removed if prev_records[h][1]}
+        touched |= {str(prev_records[h][1]) for h in recount if prev_records[h][1]}
+        cur_months = {str(v[1]) for v in records.values() if v[1]}
+        # 作り直し時: 前回の状態にあって今回行が無くなった月も消す
+        if prev is None and loaded is not None:
+            touched |= {str(v[1]) for v in loaded["records"].values() if v[1]} - cur_months
+
+        drop_keys = removed | set(recount)
         written_files: List[Path] = []
-
-        for yyyymm, g in df.groupby("yyyymm"):
+        for yyyymm in sorted(touched):
             out_month = base_out / yyyymm
-            out_month.mkdir(parents=True, exist_ok=True)
-
-            g2 = g.drop(columns=["yyyymm"], errors="ignore").reset_index(drop=True)
-
-            if can_parquet:
-                outp = out_month / "train.parquet"
-                g2.to_parquet(outp, index=False)
-                written_files.append(outp)
-            else:
-                outc = out_month / "train.csv"
-                g2.to_csv(outc, index=False, encoding="utf-8")
-                written_files.append(outc)
-
-        # latest（全件）
-        latest = base_out / ("latest_train.parquet" if can_parquet else "latest_train.csv")
-        df2 = df.drop(columns=["yyyymm"], errors="ignore").reset_index(drop=True)
-        if can_parquet:
-            df2.to_parquet(latest, index=False)
-        else:
-            df2.to_csv(latest, index=False, encoding="utf-8")
+            parts = []
+
+            # 前回の状態に無い月のファイル（旧版の出力など）は読まずに上書き（従来と同じ）
+            base = _read_part(out_month) if yyyymm in prev_months else None
+            if base is not None and not base.empty:
+                parts.append(base[~base["src_hash"].isin(drop_keys)])
+                rc = base[base["src_hash"].isin(list(recount))].drop_duplicates("src_hash")
+                if not rc.empty:
+                    parts.append(rc.loc[rc.index.repeat(rc["src_hash"].map(recount).astype(int))])
+            g = new_df[new_months.values == yyyymm] if not new_df.empty else new_df
+            if not g.empty:
+                parts.append(g)
+
+            g2 = _typed(pd.concat(parts, ignore_index=True)) if parts else _typed(pd.DataFrame())
+            if g2.empty:
+                _drop_part(out_month)
+                continue
+            g2 = g2.sort_values(["trade_date", "code", "run_id"], kind="mergesort").reset_index(drop=True)
+            written_files.append(_write_part(out_month, g2, can_parquet))
+
+        # latest（全月の連結）
+        latest, latest_rows = _assemble_latest(base_out, sorted(cur_months), can_parquet, cutoff_s)
         written_files.append(latest)
 
+        # 状態は最後に（途中で落ちたら次回は前回の状態から差分を取り直す）
+        _save_state(
+            state_path,
+            {
+                "version": STATE_VERSION,
+                "built_at": datetime.now(JST).isoformat(),
+                "options": options,
+                "source": source,
+                "records": records,
+            },
+        )
+
+        if latest_rows <= 0:
+            self.stdout.write(self.style.WARNING("[build_ml_dataset] no rows kept. (win/lose/flat & pl が足りない可能性)"))
+
         self.stdout.write("")
         self.stdout.write(self.style.SUCCESS(f"[build_ml_dataset] written: {len(written_files)} files"))
         self.stdout.write(f"  out_dir: {base_out}")
-        self.stdout.write(f"  latest: {latest}")
\ No newline at end of file
+        self.stdout.write(f"  months: rewritten={len(written_files) - 1} total={len(cur_months)}")
+        self.stdout.write(f"  latest: {latest} rows={latest_rows}")
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+build_replay_dataset.py
+
+目的:
+  price_store の日足（全銘柄 × 数年分）に work_one と同じ Entry/TP/SL 提案を過去の全営業日で当て、
+  TP/SL どちらに先に当たったかで ML ラベルを付けた「リプレイ学習データ」を作る。
+  （紙シミュ由来の build_ml_dataset は1日数十件しか増えないので、その補強用）
+
+出力:
+  - media/aiapp/ml/replay/YYYY_MM/train.parquet   (pyarrow が無ければ train.csv)
+  - media/aiapp/ml/replay/latest_train.parquet     (全月の連結)
+  列は build_ml_dataset と同じ（Row + src_hash / src_ts）。train_lgbm_models --with-replay で紙シミュ分に連結して学習する。
+  ml/train（紙シミュ側の差分ビルド）とは別ディレクトリ。毎回作り直す。
+
+ラベルの作り方:
+  - aiapp.services.label_replay を参照（日足での ai_sim_eval 近似 / 未約定は除外 / score_100 は空）
+  - カテゴリ ID は build_ml_dataset と同じ meta/*_map.json を使う（mode=replay, BUY / aggressive / short）
+
+並列:
+  - 銘柄を --chunk 本ずつに分け、ProcessPoolExecutor(fork) で特徴量パネル + 先当たり判定を回す
+  - 親プロセスはチャンクの結果を受け取り次第、月ごとのファイルに追記していく（全件をメモリに溜めない）
+
+使い方:
+  python manage.py build_replay_dataset --jobs 0
+  python manage.py build_replay_dataset --since 2023-01-01 --horizon-days 5 --stride 2
+"""
+
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from aiapp.management.commands.build_ml_dataset import (
+    _get_id,
+    _load_map,
+    _norm_code,
+    _save_map,
+    _typed,
+)
+from aiapp.services import price_store
+from aiapp.services.label_replay import ReplayConfig, replay_frames
+from aiapp.services.picks_build.scan_service import resolve_jobs
+
+try:
+    from django.db import connections
+except Exception:  # pragma: no cover
+    connections = None  # type: ignore
+
+try:
+    from aiapp.models.master import StockMaster
+except Exception:  # pragma: no cover
+    StockMaster = None  # type: ignore
+
+BUILD_LOG = True
+
+# リプレイ行の文脈（work_one / ai_simulate_auto と同じ提案条件）
+REPLAY_SIDE = "BUY"
+REPLAY_STYLE = "aggressive"
+REPLAY_HORIZON = "short"
+REPLAY_MODE = "replay"
+REPLAY_UNIVERSE = "all"
+
+MAP_KEYS = ("side", "style", "horizon", "sector", "universe", "mode")
+
+# ワーカープロセス側の共有コンテキスト（initializer で1回だけ入れる）
+_WORKER_CTX: Dict[str, Any] = {}
+
+
+def _list_store_codes() -> List[str]:
+    if not price_store.STORE_DIR.exists():
+        return []
+    names = set()
+    for p in price_store.STORE_DIR.iterdir():
+        if p.suffix in (".parquet", ".csv") and not p.name.endswith(".tmp"):
+            names.add(p.stem)
+    return sorted(names)
+
+
+def _load_sectors() -> Dict[str, str]:
+    if StockMaster is None:
+        return {}
+    try:
+        return {
+            _norm_code(c): (s or "")
+            for c, s in StockMaster.objects.values_list("code", "sector_name")
+        }
+    except Exception:
+        return {}
+
+
+def _init_worker(ctx: Dict[str, Any]) -> None:
+    _WORKER_CTX.clear()
+    _WORKER_CTX.update(ctx)
+
+
+def _replay_chunk(codes: List[str]) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    ctx = _WORKER_CTX
+    frames: Dict[str, pd.DataFrame] = {}
+    for code in codes:
+        df = price_store.completed_only(price_store.load(code))
+        if df is not None and len(df) > 0:
+            frames[code] = df
+    df, stats = replay_frames(frames, ctx["cfg"])
+    if df.empty:
+        return df, stats
+    # ID 付け + 型揃えもワーカー側で済ませる（親は書くだけ）
+    for k, v in ctx["fixed_ids"].items():
+        df[k] = v
+    df["sector_id"] = df["code"].map(ctx["sector_ids"]).fillna(ctx["unknown_sector_id"])
+    return _typed(df), stats
+
+
+class _MonthSink:
+    """
+    月パーティション + latest への追記（tmp に書き、finish で os.replace）。
+    """
+
+    def __init__(self, base_out: Path, can_parquet: bool) -> None:
+        self.base_out = base_out
+        self.can_parquet = can_parquet
+        self.name = "train.parquet" if can_parquet else "train.csv"
+        self.latest_name = "latest_train.parquet" if can_parquet else "latest_train.csv"
+        self.writers: Dict[str, Any] = {}
+        self.rows: Dict[str, int] = {}
+        self.schema = None
+
+    def _tmp(self, key: str) -> Path:
+        if key == "latest":
+            return self.base_out / (self.latest_name + ".tmp")
+        return self.base_out / key / (self.name + ".tmp")
+
+    def _append(self, key: str, df: pd.DataFrame) -> None:
+        tmp = self._tmp(key)
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        if self.can_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            w = self.writers.get(key)
+            if w is None:
+                w = pq.ParquetWriter(tmp, self.schema)
+                self.writers[key] = w
+            w.write_table(table)
+        else:
+            first = key not in self.writers
+            df.to_csv(tmp, mode="w" if first else "a", header=first, index=False, encoding="utf-8")
+            self.writers[key] = True
+        self.rows[key] = self.rows.get(key, 0) + int(len(df))
+
+    def write(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        if self.can_parquet and self.schema is None:
+            import pyarrow as pa
+
+            self.schema = pa.Schema.from_pandas(_typed(pd.DataFrame()), preserve_index=False)
+            # 空 DF だと object 列が null 型になるので、文字列列は string に固定する
+            self.schema = pa.schema(
+                [pa.field(f.name, pa.string()) if f.type == pa.null() else f for f in self.schema]
+            )
+        months = df["trade_date"].str.slice(0, 7).str.replace("-", "_", regex=False)
+        for m, part in df.groupby(months, sort=False):
+            self._append(str(m), part)
+        self._append("latest", df)
+
+    def finish(self) -> List[str]:
+        if self.can_parquet:
+            for w in self.writers.values():
+                w.close()
+        months = sorted(k for k in self.writers if k != "latest")
+        for m in months:
+            os.replace(self._tmp(m), self.base_out / m / self.name)
+        # 今回1行も無かった月（--since を変えた等）の古いファイルは消す
+        for d in self.base_out.iterdir():
+            if d.is_dir() and re.fullmatch(r"\d{4}_\d{2}", d.name) and d.name not in self.writers:
+                for name in ("train.parquet", "train.csv"):
+                    try:
+                        (d / name).unlink()
+                    except FileNotFoundError:
+                        pass
+        if "latest" in self.writers:
+            os.replace(self._tmp("latest"), self.base_out / self.latest_name)
+        return months
+
+    def abort(self) -> None:
+        for key, w in self.writers.items():
+            if self.can_parquet:
+                try:
+                    w.close()
+                except Exception:
+                    pass
+            try:
+                self._tmp(key).unlink()
+            except Exception:
+                pass
+
+
+class Command(BaseCommand):
+    help = "日足ストア × work_one の Entry/TP/SL を過去に当てて、TP/SL 先当たりの ML 学習データを作る"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--jobs", type=int, default=0, help="ワーカープロセス数（0=CPU数, 1=直列）")
+        parser.add_argument("--chunk", type=int, default=200, help="1ワーカーがまとめて処理する銘柄数")
+        parser.add_argument("--horizon-days", type=int, default=5, help="何営業日で打ち切るか（ai_sim_eval と同じ意味）")
+        parser.add_argument("--warmup", type=int, default=60, help="各銘柄の先頭何本をシグナルに使わないか")
+        parser.add_argument("--stride", type=int, default=1, help="何営業日おきにシグナルを作るか")
+        parser.add_argument("--since", type=str, default="", help="この日付（YYYY-MM-DD）以降のシグナルだけ")
+        parser.add_argument("--qty", type=int, default=100, help="y_pl 計算用の株数")
+        parser.add_argument("--codes", type=str, default="", help="対象銘柄（カンマ区切り。空ならストア全銘柄）")
+        parser.add_argument("--limit", type=int, default=0, help="先頭から何銘柄だけ（0=全部）")
+        parser.add_argument("--out", type=str, default="", help="出力先ディレクトリ（空なら media/aiapp/ml/replay）")
+        parser.add_argument("--force-csv", action="store_true", help="Parquetを使わずCSV出力に固定")
+
+    def handle(self, *args, **opts) -> None:
+        t0 = time.perf_counter()
+        cfg = ReplayConfig(
+            horizon_days=max(1, int(opts.get("horizon_days") or 5)),
+            warmup=max(0, int(opts.get("warmup") or 0)),
+            stride=max(1, int(opts.get("stride") or 1)),
+            qty=max(1, int(opts.get("qty") or 100)),
+            mode=REPLAY_STYLE,
+            horizon=REPLAY_HORIZON,
+            since=(opts.get("since") or "").strip() or None,
+        )
+        jobs = resolve_jobs(int(opts.get("jobs") or 0))
+        chunk = max(1, int(opts.get("chunk") or 200))
+
+        codes_opt = [c.strip() for c in str(opts.get("codes") or "").split(",") if c.strip()]
+        codes = codes_opt or _list_store_codes()
+        limit = int(opts.get("limit") or 0)
+        if limit > 0:
+            codes = codes[:limit]
+        if not codes:
+            self.stdout.write(self.style.ERROR(f"[build_replay_dataset] no codes in {price_store.STORE_DIR}"))
+            return
+
+        out_dir_opt = str(opts.get("out") or "").strip()
+        base_out = Path(out_dir_opt) if out_dir_opt else (Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "replay")
+        base_out.mkdir(parents=True, exist_ok=True)
+
+        can_parquet = False
+        if not opts.get("force_csv"):
+            try:
+                import pyarrow  # noqa: F401
+                can_parquet = True
+            except Exception:
+                can_parquet = False
+
+        # id maps（build_ml_dataset と共有。ここで増えた分も保存する）
+        meta_dir = Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "meta"
+        maps = {k: _load_map(meta_dir / f"{k}_map.json") for k in MAP_KEYS}
+        fixed_ids = {
+            "side_id": _get_id(maps["side"], REPLAY_SIDE),
+            "style_id": _get_id(maps["style"], REPLAY_STYLE),
+            "horizon_id": _get_id(maps["horizon"], REPLAY_HORIZON),
+            "universe_id": _get_id(maps["universe"], REPLAY_UNIVERSE),
+            "mode_id": _get_id(maps["mode"], REPLAY_MODE),
+        }
+        # sector は親で1回だけ引いて ID にしておく（ワーカーは DB を触らない）
+        sectors = _load_sectors()
+        sector_ids = {c: _get_id(maps["sector"], sectors.get(_norm_code(c)) or "UNKNOWN") for c in codes}
+        ctx = {
+            "cfg": cfg,
+            "fixed_ids": fixed_ids,
+            "sector_ids": sector_ids,
+            "unknown_sector_id": _get_id(maps["sector"], "UNKNOWN"),
+        }
+
+        chunks = [codes[i:i + chunk] for i in range(0, len(codes), chunk)]
+        if BUILD_LOG:
+            print(
+                f"[build_replay_dataset] codes={len(codes)} chunks={len(chunks)} jobs={jobs} "
+                f"H={cfg.horizon_days} warmup={cfg.warmup} stride={cfg.stride} since={cfg.since}"
+            )
+
+        stats = {"signals": 0, "no_fill": 0, "tp": 0, "sl": 0, "horizon": 0, "no_price": 0}
+        sink = _MonthSink(base_out, can_parquet)
+
+        def _consume(df: pd.DataFrame, st: Dict[str, int]) -> None:
+            for k, v in st.items():
+                stats[k] = stats.get(k, 0) + int(v)
+            sink.write(df)
+
+        try:
+            if jobs <= 1 or len(chunks) <= 1:
+                _init_worker(ctx)
+                for ch in chunks:
+                    _consume(*_replay_chunk(ch))
+            else:
+                # fork 前に親のコネクションを閉じておく（子に共有させない）
+                if connections is not None:
+                    try:
+                        connections.close_all()
+                    except Exception:
+                        pass
+                try:
+                    mp_ctx = mp.get_context("fork")
+                except ValueError:  # pragma: no cover
+                    mp_ctx = None
+                with ProcessPoolExecutor(
+                    max_workers=min(jobs, len(chunks)),
+                    mp_context=mp_ctx,
+                    initializer=_init_worker,
+                    initargs=(ctx,),
+                ) as ex:
+                    for i, (df, st) in enumerate(ex.map(_replay_chunk, chunks), 1):
+                        _consume(df, st)
+                        if BUILD_LOG and (i % 10 == 0 or i == len(chunks)):
+                            print(f"[build_replay_dataset] chunk {i}/{len(chunks)} rows={sink.rows.get('latest', 0)}")
+        except BaseException:
+            sink.abort()
+            raise
+
+        months = sink.finish()
+        for k in MAP_KEYS:
+            _save_map(meta_dir / f"{k}_map.json", maps[k])
+
+        rows = sink.rows.get("latest", 0)
+        filled = stats["signals"] - stats["no_fill"] - stats["no_price"]
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS("===== build_replay_dataset summary ====="))
+        self.stdout.write(f"  codes={len(codes)} jobs={jobs} elapsed={time.perf_counter() - t0:.1f}s")
+        self.stdout.write(
+            f"  signals={stats['signals']} no_fill={stats['no_fill']} rows={rows} "
+            f"(tp={stats['tp']} sl={stats['sl']} horizon={stats['horizon']} no_price={stats['no_price']})"
+        )
+        if filled > 0:
+            self.stdout.write(f"  tp_first_rate={stats['tp'] / filled:.3f}")
+        self.stdout.write(f"  months={len(months)} ({months[0] if months else '-'} .. {months[-1] if months else '-'})")
+        if rows:
+            self.stdout.write(f"  latest: {base_out / sink.latest_name}")
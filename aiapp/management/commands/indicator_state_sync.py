@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+aiapp.management.commands.indicator_state_sync
+
+日足ストア（media/aiapp/prices/daily）の中身で、銘柄ごとの指標ステート
+（media/aiapp/prices/state/<symbol>.json）を最新足まで進めるバッチ。
+
+- 既存ステートは増えた足だけ advance()（1本あたり O(1)）
+- 無い / 設定が違う / 履歴が書き換わった銘柄だけ先頭から作り直す
+- --verify でフル再計算（make_features）の最終行と突き合わせ、ズレた銘柄を表示する
+
+想定フロー:
+    python manage.py prices_snapshot_nightly --universe all
+    python manage.py indicator_state_sync --universe all
+"""
+
+from __future__ import annotations
+
+import pathlib
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from aiapp.models import StockMaster
+from aiapp.services.indicator_state import sync_from_store
+
+UNIVERSE_DIR = pathlib.Path("aiapp/data/universe")
+
+
+def _load_universe(name: str) -> list[str]:
+    if name.lower() in ("all", "jp-all", "jpall"):
+        return list(StockMaster.objects.values_list("code", flat=True))
+    path = UNIVERSE_DIR / f"{name}.txt"
+    if not path.exists():
+        raise CommandError(f"universe file not found: {path}")
+    return [c.strip() for c in path.read_text().splitlines() if c.strip()]
+
+
+class Command(BaseCommand):
+    help = "日足ストアから銘柄ごとの指標ステートを最新足まで進める（--verify でフル再計算と照合）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--universe", default="all", help="all / nk225 / quick_100 / <file name>")
+        parser.add_argument("--rebuild", action="store_true", help="既存ステートを捨てて先頭から作り直す")
+        parser.add_argument("--verify", action="store_true", help="make_features のフル再計算と最終行を照合する")
+        parser.add_argument("--rtol", type=float, default=1e-9, help="--verify の相対許容誤差")
+        parser.add_argument("--atol", type=float, default=1e-9, help="--verify の絶対許容誤差")
+        parser.add_argument("--show", type=int, default=20, help="--verify でズレを表示する最大銘柄数")
+
+    def handle(self, *args, **opts):
+        universe = opts["universe"]
+        verify = bool(opts["verify"])
+        show = int(opts["show"])
+
+        codes = _load_universe(universe)
+        if not codes:
+            self.stdout.write(self.style.WARNING("[indicator_state] universe empty"))
+            return
+
+        self.stdout.write(f"[indicator_state] start universe={universe} codes={len(codes)} verify={verify}")
+        start = time.time()
+
+        n_adv = n_new = n_same = n_empty = n_err = 0
+        n_bad = 0
+        bars = 0
+        for code in codes:
+            try:
+                res = sync_from_store(
+                    str(code),
+                    rebuild=bool(opts["rebuild"]),
+                    verify=verify,
+                    rtol=float(opts["rtol"]),
+                    atol=float(opts["atol"]),
+                )
+            except Exception as ex:
+                n_err += 1
+                self.stdout.write(self.style.WARNING(f"[indicator_state] {code}: error {ex}"))
+                continue
+
+            if res.state is None:
+                n_empty += 1
+                continue
+            if res.rebuilt:
+                n_new += 1
+            elif res.advanced:
+                n_adv += 1
+            else:
+                n_same += 1
+            bars += res.advanced
+
+            rep = res.verify
+            if rep is not None and not rep.get("ok"):
+                n_bad += 1
+                if n_bad <= show:
+                    detail = rep.get("error") or ", ".join(
+                        f"{k}: state={a!r} full={b!r}" for k, (a, b) in list(rep["mismatches"].items())[:5]
+                    )
+                    self.stdout.write(self.style.WARNING(f"[indicator_state] {code} {rep.get('date')}: {detail}"))
+
+        msg = (
+            f"[indicator_state] done advanced={n_adv} rebuilt={n_new} unchanged={n_same} "
+            f"empty={n_empty} error={n_err} bars={bars} dur={time.time()-start:.1f}s"
+        )
+        if verify:
+            msg += f" verify_ng={n_bad}"
+        self.stdout.write(self.style.SUCCESS(msg) if n_bad == 0 else self.style.WARNING(msg))
@@ -2,6 +2,19 @@
 """
 AIピック生成コマンド（FULL + TopK + Sizing + 理由テキスト）
 
+========================================
+▼ 二段構え（lite → full）
+========================================
+  stage 1 (lite): --nbars-lite N 本だけで picks_filters.check_all を全銘柄に適用（既定 0 = 無効）
+                  → 生き残りだけを stage 2 へ（--jobs N ならプロセス並列）
+                  → 指標ステート（indicator_state_sync / prices_snapshot_nightly --with-state）が
+                    最新の確定足まで進んでいる銘柄は、価格を取らずにステートの最終行で判定
+                  ※ ATR / 流動性は窓の長さで変わるので、境界付近の銘柄が full と食い違うことがある
+                    full と同じ結果になることを確かめてから有効にする
+                  → --lite-only なら latest_lite.json を出して終了
+  stage 2 (full): 下記の1銘柄フローを生き残りに対して実行
+  各 stage の in/out/秒数は meta.pipeline_stages に入る
+
 ========================================
 ▼ 全体フロー（1銘柄あたり）
 ========================================
@@ -38,12 +51,15 @@ AIピック生成コマンド（FULL + TopK + Sizing + 理由テキスト）
 ========================================
   ・価格取得:
       aiapp.services.fetch_price.get_prices
+      （--use-snapshot 時は aiapp.services.picks_build.price_source_service.SnapshotPriceSource
+        が夜間スナップショット CSV を優先し、欠けた銘柄だけ get_prices に落ちる）
 
   ・特徴量生成:
       aiapp.models.features.make_features
 
   ・スコア:
       aiapp.services.scoring_service.score_sample
+        （score_batch で一括スコア。panel は走査前に全銘柄、ticker は走査後に生き残りへ付ける。どちらもフィルタ前の全銘柄で横断パーセンタイル → score_pct）
 
   ・⭐️（本番）:
       aiapp.services.confidence_service.compute_confidence_star
@@ -51,16 +67,21 @@ AIピック生成コマンド（FULL + TopK + Sizing + 理由テキスト）
   ・ML推論（主役の一部）:
       aiapp.services.ml_infer_service.infer_from_features
         ※ p_win / EV / hold_days_pred / tp_first / probs / ml_rank を返す
+        （実際は infer_batch で1回の predict にまとめる。panel は全銘柄を走査前に、ticker は生き残りを走査後に）
 
   ・Entry / TP / SL:
       aiapp.services.entry_service.compute_entry_tp_sl
 
   ・数量 / 必要資金 / 想定PL / 想定損失 / 見送り理由 / EV_true:
       aiapp.services.sizing_service.compute_position_sizing
+        （UserSetting / policy / 口座は build_sizing_context で run に1回。走査後に compute_position_sizing_batch で一括）
 
   ・理由5つ + 懸念（日本語テキスト）:
       aiapp.services.reasons.make_reasons
 
+  ・ユニバース走査（--jobs N でプロセス並列、結果は直列と同一）:
+      aiapp.services.picks_build.scan_service.scan_universe
+
   ・銘柄フィルタ層:
       aiapp.services.picks_filters.FilterContext
       aiapp.services.picks_filters.check_all
@@ -73,11 +94,17 @@ AIピック生成コマンド（FULL + TopK + Sizing + 理由テキスト）
 ========================================
   - media/aiapp/picks/latest_full_all.json
   - media/aiapp/picks/latest_full.json
+  - media/aiapp/picks/latest_lite.json（--lite-only 時のみ）
+  - media/aiapp/picks/latest_full_features.json
+      出力銘柄ごとの feat_last（特徴量最終行）+ distance（ATR正規化距離）。ai_simulate_auto が再取得せずに使う
+  - media/aiapp/features/<cfg_hash>/date=YYYY-MM-DD/features.parquet
+      走査した全銘柄の特徴量最終行（aiapp.services.feature_store。AIAPP_FEATURE_STORE=0 で無効）
 """
 
 from __future__ import annotations
 
 import os
+import time
 from datetime import datetime
 
 from django.contrib.auth import get_user_model
@@ -87,9 +114,16 @@ from aiapp.services.picks_build.settings import BUILD_LOG, JST
 from aiapp.services.picks_build.utils import mode_aggr_from_style, mode_period_from_horizon
 from aiapp.services.picks_build.universe_service import load_universe, enrich_meta
 from aiapp.services.picks_build.behavior_cache_service import load_behavior_cache
-from aiapp.services.picks_build.worker_service import work_one
+from aiapp.services.picks_build.scan_service import scan_universe
+from aiapp.services.picks_build.price_source_service import SnapshotPriceSource
+from aiapp.services.picks_build.lite_screen_service import lite_screen
 from aiapp.services.picks_build.ranking_service import sort_items_inplace, select_topk
-from aiapp.services.picks_build.emit_service import emit_json
+from aiapp.services.picks_build.emit_service import emit_json, emit_lite_json
+from aiapp.services.picks_build.feature_sidecar_service import emit_feature_sidecar
+from aiapp.services import feature_store
+from aiapp.services.ml_infer_service import MODELS_ROOT as ML_MODELS_ROOT
+from aiapp.services.ml_registry import get_models as get_ml_models, set_engine as set_ml_engine
+from aiapp.models.features import FeatureConfig
 
 # optional: bias / macro regime
 try:
@@ -112,13 +146,16 @@ class Command(BaseCommand):
         parser.add_argument("--head", type=int, default=None)
         parser.add_argument("--budget", type=int, default=None)
         parser.add_argument("--nbars", type=int, default=260)
-        parser.add_argument("--nbars-lite", type=int, default=45)
-        parser.add_argument("--use-snapshot", action="store_true")
-        parser.add_argument("--lite-only", action="store_true")
+        parser.add_argument("--nbars-lite", type=int, default=0, help="一次スクリーニングの本数（既定0 = 一次スクリーニング無し。例: 45）")
+        parser.add_argument("--use-snapshot", action="store_true", help="prices_snapshot_nightly の最新CSVを優先して使う")
+        parser.add_argument("--lite-only", action="store_true", help="一次スクリーニングだけ実行して latest_lite.json を出す")
         parser.add_argument("--force", action="store_true")
         parser.add_argument("--style", type=str, default="aggressive")
         parser.add_argument("--horizon", type=str, default="short")
+        parser.add_argument("--jobs", type=int, default=1, help="work_one を並列に回すプロセス数（1=直列, 0=CPU数）")
+        parser.add_argument("--feature-engine", type=str, default="ticker", choices=["ticker", "panel"], help="特徴量を1銘柄ずつ(ticker) / 全銘柄まとめて(panel)計算")
         parser.add_argument("--topk", type=int, default=int(os.getenv("AIAPP_TOPK", "10")), help="上位何銘柄を latest_full.json に出すか")
+        parser.add_argument("--ml-engine", type=str, default=None, choices=["lightgbm", "compiled"], help="ML 推論器（既定: AIAPP_ML_ENGINE or lightgbm。compiled は lightgbm を import しない）")
 
     def handle(self, *args, **opts):
         universe = opts.get("universe") or "nk225"
@@ -126,6 +163,14 @@ class Command(BaseCommand):
         style = (opts.get("style") or "aggressive").lower()
         horizon = (opts.get("horizon") or "short").lower()
         topk = int(opts.get("topk") or 10)
+        jobs = int(opts.get("jobs") or 1)
+        feature_engine = (opts.get("feature_engine") or "ticker").lower()
+        ml_engine = set_ml_engine(opts.get("ml_engine"))
+        use_snapshot = bool(opts.get("use_snapshot"))
+        nbars_lite = int(opts.get("nbars_lite") or 0)
+        lite_only = bool(opts.get("lite_only"))
+        if lite_only and nbars_lite <= 0:
+            nbars_lite = 45
 
         mode_period = mode_period_from_horizon(horizon)
         mode_aggr = mode_aggr_from_style(style)
@@ -153,35 +198,90 @@ class Command(BaseCommand):
         User = get_user_model()
         user = User.objects.first()
 
-        items = []
         meta_extra = {}
         filter_stats = {}
+        pipeline_stages = {}
+
+        price_source = None
+        if use_snapshot:
+            price_source = SnapshotPriceSource()
+            if BUILD_LOG:
+                print(f"[picks_build] use snapshot dir={price_source.snap_dir}")
+
+        # stage 1: lite（短い窓でフィルタだけ）→ 生き残りだけを full に回す
+        full_codes = codes
+        if nbars_lite > 0:
+            lite = lite_screen(
+                codes,
+                nbars_lite=nbars_lite,
+                price_fn=price_source,
+                filter_stats=filter_stats,
+                jobs=jobs,
+            )
+            pipeline_stages["lite"] = dict(lite.stage_meta(), nbars=nbars_lite, jobs=jobs)
+            full_codes = lite.codes
+            if BUILD_LOG:
+                print(f"[picks_build] lite stage: {lite.n_in} -> {len(full_codes)} ({lite.seconds:.1f}s)")
+
+            if lite_only:
+                lite_meta = {
+                    "stockmaster_total": stockmaster_total,
+                    "filter_stats": filter_stats,
+                    "pipeline_stages": pipeline_stages,
+                }
+                if price_source is not None:
+                    lite_meta.update(price_source.meta())
+                emit_lite_json(
+                    lite.survivors,
+                    style=style,
+                    horizon=horizon,
+                    universe=universe,
+                    meta_extra=lite_meta,
+                )
+                return
 
-        behavior_cache = load_behavior_cache(codes)
+        behavior_cache = load_behavior_cache(full_codes)
         if BUILD_LOG:
             print(f"[picks_build] BehaviorStats cache rows: {len(behavior_cache)}")
 
-        for code in codes:
-            res = work_one(
-                user,
-                code,
-                nbars=nbars,
-                mode_period=mode_period,
-                mode_aggr=mode_aggr,
-                behavior_cache=behavior_cache,
-                filter_stats=filter_stats,
-                regime=macro_regime,
-            )
-            if res is None:
-                continue
-            item, sizing_meta = res
-            items.append(item)
-
-            if sizing_meta:
-                if sizing_meta.get("risk_pct") is not None and "risk_pct" not in meta_extra:
-                    meta_extra["risk_pct"] = float(sizing_meta["risk_pct"])
-                if sizing_meta.get("lot_size") is not None and "lot_size" not in meta_extra:
-                    meta_extra["lot_size"] = int(sizing_meta["lot_size"])
+        # ML モデルは親で1回だけ読む（--jobs のワーカーは fork で引き継ぐので、各自でパースしない）
+        ml_models = get_ml_models(ML_MODELS_ROOT)
+
+        # stage 2: full（260本の特徴量・スコア・⭐️・ML・Sizing）
+        t_full = time.perf_counter()
+        scan = scan_universe(
+            full_codes,
+            user=user,
+            nbars=nbars,
+            mode_period=mode_period,
+            mode_aggr=mode_aggr,
+            behavior_cache=behavior_cache,
+            regime=macro_regime,
+            price_fn=price_source,
+            jobs=jobs,
+            feature_engine=feature_engine,
+        )
+        items = scan.items
+        for k, v in scan.filter_stats.items():
+            filter_stats[k] = filter_stats.get(k, 0) + v
+        for k, v in scan.sizing_meta.items():
+            meta_extra.setdefault(k, v)
+        pipeline_stages["full"] = {
+            "in": len(full_codes),
+            "out": len(items),
+            "nbars": nbars,
+            "jobs": jobs,
+            "sec": round(time.perf_counter() - t_full, 3),
+        }
+
+        # 特徴量の最終行を時点別ストアへ（ai_simulate_auto / build_ml_dataset が読む）
+        if feature_store.FEATURE_STORE_ENABLED and scan.feature_rows:
+            try:
+                n_feat = feature_store.write_last_rows(scan.feature_rows)
+                meta_extra["feature_store"] = {"hash": feature_store.config_hash(), "rows": n_feat}
+            except Exception as ex:
+                if BUILD_LOG:
+                    print(f"[picks_build] feature_store write error: {ex}")
 
         enrich_meta(items)
 
@@ -195,8 +295,12 @@ class Command(BaseCommand):
         sort_items_inplace(items)
         top_items, topk_mode = select_topk(items, topk)
 
+        meta_extra["built_at"] = datetime.now(JST).isoformat()
         meta_extra["stockmaster_total"] = stockmaster_total
         meta_extra["filter_stats"] = filter_stats
+        meta_extra["pipeline_stages"] = pipeline_stages
+        if price_source is not None:
+            meta_extra.update(price_source.meta())
 
         if macro_regime is not None:
             d = getattr(macro_regime, "date", None)
@@ -204,13 +308,18 @@ class Command(BaseCommand):
             meta_extra["regime_label"] = getattr(macro_regime, "regime_label", None)
             meta_extra["regime_summary"] = getattr(macro_regime, "summary", None)
 
+        meta_extra["feature_engine"] = feature_engine
         meta_extra["stars_engine"] = "confidence_service"
         meta_extra["stars_mode_period"] = mode_period
         meta_extra["stars_mode_aggr"] = mode_aggr
         meta_extra["behaviorstats_cache_rows"] = len(behavior_cache)
 
-        meta_extra["ml_engine"] = "lightgbm"
-        meta_extra["ml_models_dir"] = "media/aiapp/ml/models/latest"
+        meta_extra["ml_engine"] = ml_engine
+        meta_extra["ml_models_dir"] = ML_MODELS_ROOT
+        meta_extra["ml_model_version"] = ml_models.version if ml_models is not None else None
+        meta_extra["ml_model_load_sec"] = round(ml_models.load_sec, 3) if ml_models is not None else None
+        meta_extra["ml_infer_batch"] = scan.ml_batch
+        meta_extra["score_batch"] = scan.score_batch
 
         meta_extra["rank_mode"] = "EV_true_rakuten"
         meta_extra["topk_rule"] = "EV_true_rakuten>0 and qty_rakuten>0"
@@ -227,5 +336,20 @@ class Command(BaseCommand):
             meta_extra=meta_extra,
         )
 
+        try:
+            n_side = emit_feature_sidecar(
+                items,
+                scan.feature_rows,
+                cfg=FeatureConfig(),
+                style=style,
+                horizon=horizon,
+                meta_extra={"universe": universe, "cfg_hash": feature_store.config_hash()},
+            )
+            if BUILD_LOG:
+                print(f"[picks_build] feature sidecar items={n_side}")
+        except Exception as ex:
+            if BUILD_LOG:
+                print(f"[picks_build] feature sidecar error: {ex}")
+
         if BUILD_LOG:
             print(f"[picks_build] done stockmaster_total={stockmaster_total} total={len(items)} topk={len(top_items)}")
\ No newline at end of file
@@ -11,6 +11,14 @@ B側：AIピック生成（テクニカル×ファンダ×政策）。
 追加（運用で迷子防止）:
 - この実行で読んだ fundamentals / policy の “asof” を meta に埋め込む
   → picks_debug 側で「材料がいつのものか」が見えるようになる
+
+--from-base（A側の結果を再利用）:
+- A側の latest_full_all.json（スコア・⭐️・ML・Sizing・bias 適用済み）を読み、
+  ファンダ×政策の合成（apply_hybrid_adjust）と B側ランキングだけをやり直す
+- style / horizon / universe が違う、または --base-max-age-min より古い場合だけ
+  従来通りユニバースをフル走査する（meta.hybrid_source で分かる）
+- --universe を省略したときは A側の universe をそのまま使う（A側 picks_build の既定は nk225、
+  こちらのフル走査の既定は all_jpx なので、省略時に突き合わせると必ず universe_mismatch になる）
 """
 
 from __future__ import annotations
@@ -20,7 +28,7 @@ import os
 from dataclasses import asdict
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
@@ -29,8 +37,11 @@ from aiapp.services.picks_build.settings import BUILD_LOG, JST, PICKS_DIR, dt_no
 from aiapp.services.picks_build.utils import mode_aggr_from_style, mode_period_from_horizon
 from aiapp.services.picks_build.universe_service import load_universe, enrich_meta
 from aiapp.services.picks_build.behavior_cache_service import load_behavior_cache
-from aiapp.services.picks_build.worker_service import work_one
+from aiapp.services.picks_build.scan_service import scan_universe
 from aiapp.services.picks_build.hybrid_adjust_service import apply_hybrid_adjust
+from aiapp.services.ml_registry import current_engine as current_ml_engine, set_engine as set_ml_engine
+from aiapp.services.picks_build.base_run_service import BASE_MAX_AGE_MIN, load_base_run
+from aiapp.services import feature_store
 
 # optional: bias / macro regime
 try:
@@ -145,48 +156,32 @@ class Command(BaseCommand):
     help = "AIピック生成（B側: テクニカル×ファンダ×政策）"
 
     def add_arguments(self, parser):
-        parser.add_argument("--universe", type=str, default="all_jpx", help="all_jpx / nk225 / nikkei_225 / <file name> など")
+        parser.add_argument("--universe", type=str, default=None, help="all_jpx / nk225 / nikkei_225 / <file name> など（既定: all_jpx。--from-base では A側と同じ）")
         parser.add_argument("--nbars", type=int, default=260)
         parser.add_argument("--style", type=str, default="aggressive")
         parser.add_argument("--horizon", type=str, default="short")
+        parser.add_argument("--jobs", type=int, default=1, help="work_one を並列に回すプロセス数（1=直列, 0=CPU数）")
+        parser.add_argument("--feature-engine", type=str, default="ticker", choices=["ticker", "panel"], help="特徴量を1銘柄ずつ(ticker) / 全銘柄まとめて(panel)計算")
         parser.add_argument("--topk", type=int, default=int(os.getenv("AIAPP_TOPK", "10")), help="上位何銘柄を latest_full_hybrid.json に出すか")
+        parser.add_argument("--ml-engine", type=str, default=None, choices=["lightgbm", "compiled"], help="ML 推論器（既定: AIAPP_ML_ENGINE or lightgbm。compiled は lightgbm を import しない）")
+        parser.add_argument("--from-base", action="store_true", help="A側の latest_full_all.json を再利用し、合成とランキングだけやり直す")
+        parser.add_argument("--base-max-age-min", type=int, default=BASE_MAX_AGE_MIN, help="--from-base で再利用してよい A側出力の経過時間（分）。超えたらフル走査")
 
     def handle(self, *args, **opts):
-        universe = opts.get("universe") or "nk225"
+        universe_opt = opts.get("universe") or None
+        universe = universe_opt or "all_jpx"
         nbars = int(opts.get("nbars") or 260)
         style = (opts.get("style") or "aggressive").lower()
         horizon = (opts.get("horizon") or "short").lower()
         topk = int(opts.get("topk") or 10)
+        jobs = int(opts.get("jobs") or 1)
+        feature_engine = (opts.get("feature_engine") or "ticker").lower()
+        set_ml_engine(opts.get("ml_engine"))
 
-        mode_period = mode_period_from_horizon(horizon)
-        mode_aggr = mode_aggr_from_style(style)
-
-        codes = load_universe(universe)
-        stockmaster_total = len(codes)
+        from_base = bool(opts.get("from_base") or False)
+        base_max_age_min = int(opts.get("base_max_age_min") or BASE_MAX_AGE_MIN)
 
-        # macro regime
-        macro_regime = None
-        if MacroRegimeSnapshot is not None:
-            try:
-                today = datetime.now(JST).date()
-                macro_regime = (
-                    MacroRegimeSnapshot.objects
-                    .filter(date__lte=today)
-                    .order_by("-date")
-                    .first()
-                )
-                if BUILD_LOG and macro_regime is not None:
-                    print(f"[picks_build_hybrid] use MacroRegimeSnapshot date={macro_regime.date} regime={macro_regime.regime_label}")
-            except Exception as ex:
-                if BUILD_LOG:
-                    print(f"[picks_build_hybrid] macro regime load error: {ex}")
-
-        User = get_user_model()
-        user = User.objects.first()
-
-        items = []
         meta_extra: Dict[str, Any] = {}
-        filter_stats: Dict[str, Any] = {}
 
         # ★ 追加：この実行が参照した材料（fund / policy）を meta に埋める
         fund_meta = _extract_fund_meta()
@@ -204,40 +199,40 @@ class Command(BaseCommand):
         except Exception:
             pass
 
-        behavior_cache = load_behavior_cache(codes)
-        if BUILD_LOG:
-            print(f"[picks_build_hybrid] BehaviorStats cache rows: {len(behavior_cache)}")
-
-        for code in codes:
-            res = work_one(
-                user,
-                code,
+        base = None
+        if from_base:
+            base, base_reason = load_base_run(
+                style=style,
+                horizon=horizon,
+                universe=universe_opt,
+                max_age_min=base_max_age_min,
+            )
+            meta_extra["hybrid_base_reason"] = base_reason
+            if BUILD_LOG:
+                print(f"[picks_build_hybrid] base run: {base_reason}")
+
+        if base is not None:
+            # A側の結果（bias 適用済み）をそのまま使う
+            items = base.items
+            universe = str(base.meta.get("universe") or universe)
+            for k, v in base.carry_meta().items():
+                meta_extra.setdefault(k, v)
+            filter_stats = base.meta.get("filter_stats") or {}
+            stockmaster_total = base.meta.get("stockmaster_total", len(items))
+            meta_extra["hybrid_source"] = "base_run"
+            meta_extra["hybrid_base_path"] = str(base.path)
+            meta_extra["hybrid_base_age_min"] = round(base.age_min, 1)
+        else:
+            items, filter_stats, stockmaster_total = self._scan_items(
+                universe=universe,
                 nbars=nbars,
-                mode_period=mode_period,
-                mode_aggr=mode_aggr,
-                behavior_cache=behavior_cache,
-                filter_stats=filter_stats,
-                regime=macro_regime,
+                style=style,
+                horizon=horizon,
+                jobs=jobs,
+                feature_engine=feature_engine,
+                meta_extra=meta_extra,
             )
-            if res is None:
-                continue
-            item, sizing_meta = res
-            items.append(item)
-
-            if sizing_meta:
-                if sizing_meta.get("risk_pct") is not None and "risk_pct" not in meta_extra:
-                    meta_extra["risk_pct"] = float(sizing_meta["risk_pct"])
-                if sizing_meta.get("lot_size") is not None and "lot_size" not in meta_extra:
-                    meta_extra["lot_size"] = int(sizing_meta["lot_size"])
-
-        enrich_meta(items)
-
-        if apply_bias_all is not None and items:
-            try:
-                apply_bias_all(items)
-            except Exception as ex:
-                if BUILD_LOG:
-                    print(f"[picks_build_hybrid] bias error: {ex}")
+            meta_extra["hybrid_source"] = "full_scan"
 
         # ★ B側：ファンダ×政策を合成（ev_true_rakuten_hybrid を作る）
         hybrid_stats = apply_hybrid_adjust(items)
@@ -281,20 +276,6 @@ class Command(BaseCommand):
         meta_extra["stockmaster_total"] = stockmaster_total
         meta_extra["filter_stats"] = filter_stats
 
-        if macro_regime is not None:
-            d = getattr(macro_regime, "date", None)
-            meta_extra["regime_date"] = d.isoformat() if d is not None else None
-            meta_extra["regime_label"] = getattr(macro_regime, "regime_label", None)
-            meta_extra["regime_summary"] = getattr(macro_regime, "summary", None)
-
-        meta_extra["stars_engine"] = "confidence_service"
-        meta_extra["stars_mode_period"] = mode_period
-        meta_extra["stars_mode_aggr"] = mode_aggr
-        meta_extra["behaviorstats_cache_rows"] = len(behavior_cache)
-
-        meta_extra["ml_engine"] = "lightgbm"
-        meta_extra["ml_models_dir"] = "media/aiapp/ml/models/latest"
-
         meta_extra["rank_mode"] = "EV_true_rakuten_hybrid"
         meta_extra["topk_rule"] = "hybrid_ev>0 and qty_rakuten>0"
         meta_extra["topk_mode"] = topk_mode
@@ -315,6 +296,100 @@ class Command(BaseCommand):
         if BUILD_LOG:
             print(f"[picks_build_hybrid] done stockmaster_total={stockmaster_total} total={len(items)} topk={len(top_items)}")
 
+    def _scan_items(
+        self,
+        *,
+        universe: str,
+        nbars: int,
+        style: str,
+        horizon: str,
+        jobs: int,
+        feature_engine: str,
+        meta_extra: Dict[str, Any],
+    ) -> Tuple[List[Any], Dict[str, int], int]:
+        """
+        従来のフル走査（work_one を全銘柄に回す → enrich → bias）。
+        戻り値: (items, filter_stats, stockmaster_total)
+        """
+        mode_period = mode_period_from_horizon(horizon)
+        mode_aggr = mode_aggr_from_style(style)
+
+        codes = load_universe(universe)
+        stockmaster_total = len(codes)
+
+        # macro regime
+        macro_regime = None
+        if MacroRegimeSnapshot is not None:
+            try:
+                today = datetime.now(JST).date()
+                macro_regime = (
+                    MacroRegimeSnapshot.objects
+                    .filter(date__lte=today)
+                    .order_by("-date")
+                    .first()
+                )
+                if BUILD_LOG and macro_regime is not None:
+                    print(f"[picks_build_hybrid] use MacroRegimeSnapshot date={macro_regime.date} regime={macro_regime.regime_label}")
+            except Exception as ex:
+                if BUILD_LOG:
+                    print(f"[picks_build_hybrid] macro regime load error: {ex}")
+
+        User = get_user_model()
+        user = User.objects.first()
+
+        behavior_cache = load_behavior_cache(codes)
+        if BUILD_LOG:
+            print(f"[picks_build_hybrid] BehaviorStats cache rows: {len(behavior_cache)}")
+
+        scan = scan_universe(
+            codes,
+            user=user,
+            nbars=nbars,
+            mode_period=mode_period,
+            mode_aggr=mode_aggr,
+            behavior_cache=behavior_cache,
+            regime=macro_regime,
+            jobs=jobs,
+            feature_engine=feature_engine,
+        )
+        items = scan.items
+        filter_stats = scan.filter_stats
+        for k, v in scan.sizing_meta.items():
+            meta_extra.setdefault(k, v)
+
+        if feature_store.FEATURE_STORE_ENABLED and scan.feature_rows:
+            try:
+                feature_store.write_last_rows(scan.feature_rows)
+            except Exception as ex:
+                if BUILD_LOG:
+                    print(f"[picks_build_hybrid] feature_store write error: {ex}")
+
+        enrich_meta(items)
+
+        if apply_bias_all is not None and items:
+            try:
+                apply_bias_all(items)
+            except Exception as ex:
+                if BUILD_LOG:
+                    print(f"[picks_build_hybrid] bias error: {ex}")
+
+        if macro_regime is not None:
+            d = getattr(macro_regime, "date", None)
+            meta_extra["regime_date"] = d.isoformat() if d is not None else None
+            meta_extra["regime_label"] = getattr(macro_regime, "regime_label", None)
+            meta_extra["regime_summary"] = getattr(macro_regime, "summary", None)
+
+        meta_extra["feature_engine"] = feature_engine
+        meta_extra["stars_engine"] = "confidence_service"
+        meta_extra["stars_mode_period"] = mode_period
+        meta_extra["stars_mode_aggr"] = mode_aggr
+        meta_extra["behaviorstats_cache_rows"] = len(behavior_cache)
+
+        meta_extra["ml_engine"] = current_ml_engine()
+        meta_extra["ml_models_dir"] = "media/aiapp/ml/models/latest"
+
+        return items, filter_stats, stockmaster_total
+
     def _emit_hybrid(
         self,
         all_items,
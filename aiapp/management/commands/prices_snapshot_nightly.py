@@ -5,13 +5,13 @@ import csv
 import time
 import pathlib
 import datetime as dt
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 from django.core.management.base import BaseCommand, CommandError
 
 from aiapp.models import StockMaster
-from aiapp.services.fetch_price import get_prices, SNAP_DIR
+from aiapp.services.fetch_price import get_prices_batch, BATCH_CHUNK, SNAP_DIR
+from aiapp.services.indicator_state import sync_from_store
 
 
 UNIVERSE_DIR = pathlib.Path("aiapp/data/universe")
@@ -58,12 +58,25 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--universe", default="all", help="all / nk225 / quick_100 / <file name>")
-        parser.add_argument("--jobs", type=int, default=12)
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=4,
+            help="同時に投げるチャンク数（1チャンク = --chunk 銘柄の1リクエスト。"
+            "旧版の既定 12 は銘柄単位のスレッド数だったので、チャンク単位の 4 に下げている）",
+        )
+        parser.add_argument("--chunk", type=int, default=BATCH_CHUNK, help="1リクエストにまとめる銘柄数")
         parser.add_argument("--nbars", type=int, default=800, help="保存本数の上限（古い方は落ちる）")
+        parser.add_argument(
+            "--with-state",
+            action="store_true",
+            help="取得後に指標ステート（indicator_state_sync と同じ）も最新足まで進める",
+        )
 
     def handle(self, *args, **opts):
         universe = opts["universe"]
         jobs = int(opts["jobs"])
+        chunk = int(opts["chunk"])
         nbars = int(opts["nbars"])
 
         codes = _load_universe(universe)
@@ -77,17 +90,29 @@ class Command(BaseCommand):
         self.stdout.write(f"[snapshot] start universe={universe} codes={len(codes)} save={day_dir}")
         start = time.time()
 
+        frames = get_prices_batch(
+            codes, nbars, completed_only=True, chunk_size=chunk, max_workers=max(1, jobs)
+        )
+
         ok = 0
-        with ThreadPoolExecutor(max_workers=max(4, jobs)) as ex:
-            futs = {ex.submit(get_prices, c, nbars): c for c in codes}
-            for fut in as_completed(futs):
-                code = futs[fut]
+        for code in codes:
+            df = frames.get(str(code))
+            try:
+                if isinstance(df, pd.DataFrame) and (not df.empty):
+                    _save_csv(day_dir, str(code), df)
+                    ok += 1
+            except Exception:
+                pass
+
+        self.stdout.write(f"[snapshot] done ok={ok}/{len(codes)} dur={time.time()-start:.1f}s out={day_dir}")
+
+        if opts.get("with_state"):
+            t0 = time.time()
+            n_state = 0
+            for code in codes:
                 try:
-                    df = fut.result(timeout=60)
-                    if isinstance(df, pd.DataFrame) and (not df.empty):
-                        _save_csv(day_dir, str(code), df)
-                        ok += 1
+                    if sync_from_store(str(code)).state is not None:
+                        n_state += 1
                 except Exception:
                     pass
-
-        self.stdout.write(f"[snapshot] done ok={ok}/{len(codes)} dur={time.time()-start:.1f}s out={day_dir}")
\ No newline at end of file
+            self.stdout.write(f"[snapshot] indicator state ok={n_state}/{len(codes)} dur={time.time()-t0:.1f}s")
\ No newline at end of file
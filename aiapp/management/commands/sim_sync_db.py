@@ -194,9 +194,9 @@ class Command(BaseCommand):
                     defaults=defaults,
                 )
 
-                # R計算
+                # R計算 + PRO非正規化列（eval_* を書き換えたので追従）
                 obj.recompute_r()
-                obj.save(update_fields=["result_r_rakuten", "result_r_sbi", "result_r_matsui"])
+                obj.save(update_fields=["result_r_rakuten", "result_r_sbi", "result_r_matsui"] + obj.sync_pro_fields())
 
                 if is_created:
                     created += 1
@@ -5,6 +5,9 @@ train_lgbm_models.py
 目的:
   build_ml_dataset で生成した学習データ（latest_train.parquet/csv）から
   LightGBM のモデル群を学習し、スナップショットとして保存する。
+  --with-replay で build_replay_dataset の ml/replay/latest_train も学習に足す（列は同じ）。
+    replay 行は train 側にだけ入れる（valid は紙シミュの実績だけ = 指標が replay で水増しされない）。
+    replay データが無ければ警告して紙シミュだけで学習する。
 
 出力:
   media/aiapp/ml/models/YYYYMMDD_HHMMSS/
@@ -15,6 +18,20 @@ train_lgbm_models.py
     - model_tp_first.txt    (任意)
     - feature_cols.json
     - label_maps.json       (tp_first用)
+    - compiled_<key>.npz    (NumPy 推論器。valid で Booster.predict と一致したものだけ)
+  → latest/ へコピーし、最後に manifest.json（aiapp.services.ml_registry.publish_latest）
+
+学習の進め方:
+  特徴量のビン化（lgb.Dataset 構築）は train / valid で1回だけ行い、各ターゲットは subset() で共有する。
+  独立な p_win / EV / hold_days / tp_first はスレッドで同時に学習（--threads を等分、--sequential で従来通り順番）。
+  モデルごとの学習秒数は meta.json の timing に残す。
+
+walk-forward（--walk-forward）:
+  media/aiapp/ml/train/YYYY_MM/train.parquet|csv を月順に並べ、拡張窓（先頭〜前月）で学習 → 翌月で評価。
+  窓ごとの train 側ビン化済み Dataset は walkforward/cache/<key>.bin に save_binary してキャッシュ
+  （学習に使う月ファイルが変わらなければ再利用）。窓は --wf-jobs 本ずつ同時に回す。
+  → media/aiapp/ml/walkforward/latest_walkforward.json（behavior ダッシュボードの ML 説明に出る）
+  latest のモデルは更新しない。
 
 追加（今回）:
   meta.json に評価指標 metrics を保存
@@ -27,6 +44,9 @@ train_lgbm_models.py
 from __future__ import annotations
 
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone as dt_timezone
 from pathlib import Path
@@ -42,13 +62,16 @@ JST = dt_timezone(timedelta(hours=9))
 # LightGBM は外部依存（本番で使うので try せず必須扱い）
 import lightgbm as lgb
 
+from aiapp.services.ml_compiled import compile_and_check, compiled_name
+from aiapp.services.ml_registry import publish_latest
+
 
 def _now_stamp() -> str:
     return datetime.now(JST).strftime("%Y%m%d_%H%M%S")
 
 
-def _read_latest_train() -> pd.DataFrame:
-    base = Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "train"
+def _read_latest_train(subdir: str = "train") -> pd.DataFrame:
+    base = Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / subdir
     p_parq = base / "latest_train.parquet"
     p_csv = base / "latest_train.csv"
 
@@ -247,10 +270,8 @@ def _accuracy(y_true: np.ndarray, y_pred: np.ndarray) -> float:
 # train functions
 # =========================
 
-def _train_classifier_pwin(Xtr, ytr, Xva=None, yva=None, seed: int = 42) -> lgb.Booster:
-    params = {
-        "objective": "binary",
-        "metric": ["auc", "binary_logloss"],
+def _base_params(seed: int) -> Dict[str, Any]:
+    return {
         "learning_rate": 0.05,
         "num_leaves": 63,
         "min_data_in_leaf": 50,
@@ -261,78 +282,67 @@ def _train_classifier_pwin(Xtr, ytr, Xva=None, yva=None, seed: int = 42) -> lgb.
         "seed": seed,
         "verbosity": -1,
     }
-    dtr = lgb.Dataset(Xtr, label=ytr, free_raw_data=False)
-    valid_sets = [dtr]
-    valid_names = ["train"]
-    if Xva is not None and yva is not None and len(Xva) > 0:
-        dva = lgb.Dataset(Xva, label=yva, free_raw_data=False)
-        valid_sets.append(dva)
-        valid_names.append("valid")
 
-    booster = lgb.train(
-        params,
-        dtr,
-        num_boost_round=2000,
-        valid_sets=valid_sets,
-        valid_names=valid_names,
-        callbacks=[lgb.early_stopping(stopping_rounds=80, verbose=False)],
-    )
-    return booster
 
+def _params_pwin(seed: int) -> Dict[str, Any]:
+    return {"objective": "binary", "metric": ["auc", "binary_logloss"], **_base_params(seed)}
 
-def _train_regressor_ev(Xtr, ytr, Xva=None, yva=None, seed: int = 42) -> lgb.Booster:
-    params = {
-        "objective": "regression",
-        "metric": ["l2", "l1"],
-        "learning_rate": 0.05,
-        "num_leaves": 63,
-        "min_data_in_leaf": 50,
-        "feature_fraction": 0.9,
-        "bagging_fraction": 0.8,
-        "bagging_freq": 1,
-        "lambda_l2": 1.0,
-        "seed": seed,
-        "verbosity": -1,
-    }
-    dtr = lgb.Dataset(Xtr, label=ytr, free_raw_data=False)
-    valid_sets = [dtr]
-    valid_names = ["train"]
-    if Xva is not None and yva is not None and len(Xva) > 0:
-        dva = lgb.Dataset(Xva, label=yva, free_raw_data=False)
-        valid_sets.append(dva)
-        valid_names.append("valid")
 
-    booster = lgb.train(
-        params,
-        dtr,
-        num_boost_round=2000,
-        valid_sets=valid_sets,
-        valid_names=valid_names,
-        callbacks=[lgb.early_stopping(stopping_rounds=80, verbose=False)],
-    )
-    return booster
+def _params_ev(seed: int) -> Dict[str, Any]:
+    return {"objective": "regression", "metric": ["l2", "l1"], **_base_params(seed)}
 
 
-def _train_regressor_hold_days(Xtr, ytr, Xva=None, yva=None, seed: int = 42) -> lgb.Booster:
+def _params_hold_days(seed: int) -> Dict[str, Any]:
     # 保有日数は外れ値が出るのでHuber寄りに（L1/quantileでもOKだが今回は安定優先）
-    params = {
-        "objective": "regression",
-        "metric": ["l1"],
-        "learning_rate": 0.05,
-        "num_leaves": 63,
-        "min_data_in_leaf": 50,
-        "feature_fraction": 0.9,
-        "bagging_fraction": 0.8,
-        "bagging_freq": 1,
-        "lambda_l2": 1.0,
-        "seed": seed,
-        "verbosity": -1,
-    }
-    dtr = lgb.Dataset(Xtr, label=ytr, free_raw_data=False)
+    return {"objective": "regression", "metric": ["l1"], **_base_params(seed)}
+
+
+def _params_tp_first(seed: int) -> Dict[str, Any]:
+    return {"objective": "multiclass", "num_class": 3, "metric": ["multi_logloss"], **_base_params(seed)}
+
+
+@dataclass
+class SharedBins:
+    """
+    特徴量のビン化を1回だけやった Dataset（train / valid）。
+    各ターゲットは subset() でビン化済みデータを共有し、ラベルだけ差し替える。
+    """
+    train: Any
+    valid: Optional[Any]
+    n_train: int
+    n_valid: int
+    sec: float
+
+    def for_target(self, ytr, yva=None) -> Tuple[Any, Optional[Any]]:
+        # subset はビン化済みの行をコピーするだけ（生データから作り直さない）。ラベルは構築後に差し替える
+        dtr = self.train.subset(np.arange(self.n_train)).construct()
+        dtr.set_label(ytr)
+        dva = None
+        if self.valid is not None and yva is not None:
+            dva = self.valid.subset(np.arange(self.n_valid)).construct()
+            dva.set_label(yva)
+        return dtr, dva
+
+
+def _build_shared_bins(Xtr, Xva=None, seed: int = 42) -> SharedBins:
+    """
+    ビン境界はデータセット側のパラメータ（seed / min_data_in_leaf 等）だけで決まるので、全ターゲット共通でよい。
+    """
+    t0 = time.perf_counter()
+    params = _base_params(seed)
+    base = lgb.Dataset(Xtr, label=np.zeros(len(Xtr)), params=params, free_raw_data=False).construct()
+    valid = None
+    n_valid = 0
+    if Xva is not None and len(Xva) > 0:
+        valid = lgb.Dataset(Xva, label=np.zeros(len(Xva)), reference=base, params=params, free_raw_data=False).construct()
+        n_valid = len(Xva)
+    return SharedBins(train=base, valid=valid, n_train=len(Xtr), n_valid=n_valid, sec=time.perf_counter() - t0)
+
+
+def _train_one(params: Dict[str, Any], dtr, dva=None) -> lgb.Booster:
     valid_sets = [dtr]
     valid_names = ["train"]
-    if Xva is not None and yva is not None and len(Xva) > 0:
-        dva = lgb.Dataset(Xva, label=yva, free_raw_data=False)
+    if dva is not None:
         valid_sets.append(dva)
         valid_names.append("valid")
 
@@ -347,38 +357,250 @@ def _train_regressor_hold_days(Xtr, ytr, Xva=None, yva=None, seed: int = 42) ->
     return booster
 
 
-def _train_multiclass_tp_first(Xtr, ytr, Xva=None, yva=None, seed: int = 42) -> lgb.Booster:
-    params = {
-        "objective": "multiclass",
-        "num_class": 3,
-        "metric": ["multi_logloss"],
-        "learning_rate": 0.05,
-        "num_leaves": 63,
-        "min_data_in_leaf": 50,
-        "feature_fraction": 0.9,
-        "bagging_fraction": 0.8,
-        "bagging_freq": 1,
-        "lambda_l2": 1.0,
-        "seed": seed,
-        "verbosity": -1,
+def _train_all(
+    bins: SharedBins,
+    jobs: List[Tuple[str, Dict[str, Any], Any, Any]],
+    *,
+    threads: int,
+    parallel: bool,
+) -> Tuple[Dict[str, lgb.Booster], Dict[str, float]]:
+    """
+    jobs: [(key, params, ytr, yva)]。独立なモデルなのでスレッドで同時に学習する
+    （LightGBM は学習中 GIL を離す）。スレッド数は threads を等分して各モデルの num_threads に入れる。
+    戻り値: ({key: booster}, {key: 学習にかかった秒})
+    """
+    per_model = max(1, threads // max(1, len(jobs))) if parallel else max(1, threads)
+
+    # ラベル差し替え済みの Dataset は先にメインスレッドで作っておく
+    prepared = []
+    for key, params, ytr, yva in jobs:
+        dtr, dva = bins.for_target(ytr, yva)
+        prepared.append((key, {**params, "num_threads": per_model}, dtr, dva))
+
+    def run(item):
+        key, params, dtr, dva = item
+        t0 = time.perf_counter()
+        booster = _train_one(params, dtr, dva)
+        return key, booster, time.perf_counter() - t0
+
+    if parallel and len(prepared) > 1:
+        with ThreadPoolExecutor(max_workers=len(prepared)) as ex:
+            results = list(ex.map(run, prepared))
+    else:
+        results = [run(item) for item in prepared]
+
+    boosters = {k: b for k, b, _ in results}
+    secs = {k: round(t, 3) for k, _, t in results}
+    return boosters, secs
+
+
+# =========================
+# walk-forward（--walk-forward）
+# =========================
+
+def _list_month_partitions(base: Path) -> List[Tuple[str, Path]]:
+    """
+    media/aiapp/ml/train/YYYY_MM/train.parquet|csv を月順に返す。[(YYYY_MM, path)]
+    """
+    out: List[Tuple[str, Path]] = []
+    if not base.exists():
+        return out
+    for d in sorted(base.iterdir()):
+        name = d.name
+        if not d.is_dir() or len(name) != 7 or name[4] != "_" or not (name[:4] + name[5:]).isdigit():
+            continue
+        for fn in ("train.parquet", "train.csv"):
+            p = d / fn
+            if p.exists():
+                out.append((name, p))
+                break
+    return out
+
+
+def _read_partition(path: Path) -> pd.DataFrame:
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def _window_cache_key(parts: List[Tuple[str, Path]], feat_cols: List[str], seed: int, valid_ratio: float) -> str:
+    """
+    窓の学習データ（= 学習に使う月の集合）が変わらなければ同じキー。月ファイルの (mtime, size) も入れる。
+    """
+    import hashlib
+
+    sig: List[Any] = [seed, round(valid_ratio, 6), feat_cols, lgb.__version__]
+    for month, p in parts:
+        st = p.stat()
+        sig.append([month, p.name, int(st.st_mtime_ns), int(st.st_size)])
+    return hashlib.sha1(json.dumps(sig, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _cached_bins(Xtr, Xva, *, seed: int, cache_path: Optional[Path]) -> Tuple[SharedBins, bool]:
+    """
+    train 側のビン化済み Dataset を save_binary で窓ごとにキャッシュする。
+    次回以降は同じ窓（月が増えても過去の窓は同じ）を生データから作り直さない。
+    valid はキャッシュした train を reference にして作る（ビン境界を揃える）。
+    戻り値: (SharedBins, cache_hit)
+    """
+    if cache_path is None:
+        return _build_shared_bins(Xtr, Xva, seed=seed), False
+
+    if not cache_path.exists():
+        bins = _build_shared_bins(Xtr, Xva, seed=seed)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_name(cache_path.name + ".tmp")
+        bins.train.save_binary(str(tmp))
+        os.replace(tmp, cache_path)
+        return bins, False
+
+    t0 = time.perf_counter()
+    params = _base_params(seed)
+    base = lgb.Dataset(str(cache_path), params=params).construct()
+    valid = None
+    n_valid = 0
+    if Xva is not None and len(Xva) > 0:
+        valid = lgb.Dataset(Xva, label=np.zeros(len(Xva)), reference=base, params=params, free_raw_data=False).construct()
+        n_valid = len(Xva)
+    bins = SharedBins(train=base, valid=valid, n_train=int(base.num_data()), n_valid=n_valid, sec=time.perf_counter() - t0)
+    return bins, True
+
+
+def _tp_first_y(df: pd.DataFrame) -> np.ndarray:
+    tp_map = _tp_first_map()
+    return df["y_touch_tp_first"].astype(str).str.lower().str.strip().map(lambda x: tp_map.get(x, 0)).astype(int).to_numpy()
+
+
+def _window_metrics(boosters: Dict[str, lgb.Booster], test_df: pd.DataFrame, feat_cols: List[str]) -> Tuple[Dict[str, Any], float]:
+    """
+    翌月（test）での指標。metrics の形は通常学習の meta.json と揃える。
+    戻り値: (metrics, predict_sec)
+    """
+    Xte = test_df[feat_cols]
+    metrics: Dict[str, Any] = {"test_rows": int(len(test_df))}
+    t0 = time.perf_counter()
+
+    m = boosters["pwin"]
+    y = _bin_y_win(test_df["y_label"])
+    p = np.asarray(m.predict(Xte, num_iteration=getattr(m, "best_iteration", None)), dtype=float)
+    auc = _auc_roc(y, p)
+    metrics["p_win"] = {
+        "auc": float(auc) if auc is not None else None,
+        "logloss": _binary_logloss(y, p),
+        "base_rate": float(np.mean(y)) if len(y) else None,
     }
-    dtr = lgb.Dataset(Xtr, label=ytr, free_raw_data=False)
-    valid_sets = [dtr]
-    valid_names = ["train"]
-    if Xva is not None and yva is not None and len(Xva) > 0:
-        dva = lgb.Dataset(Xva, label=yva, free_raw_data=False)
-        valid_sets.append(dva)
-        valid_names.append("valid")
 
-    booster = lgb.train(
-        params,
-        dtr,
-        num_boost_round=2000,
-        valid_sets=valid_sets,
-        valid_names=valid_names,
-        callbacks=[lgb.early_stopping(stopping_rounds=80, verbose=False)],
-    )
-    return booster
+    m = boosters["ev"]
+    y = _ev_target(test_df)
+    p = np.asarray(m.predict(Xte, num_iteration=getattr(m, "best_iteration", None)), dtype=float)
+    metrics["ev"] = {"rmse": _rmse(y, p), "mae": _mae(y, p)}
+
+    m = boosters.get("hold_days")
+    if m is not None:
+        y = pd.to_numeric(test_df["y_hold_days"], errors="coerce").fillna(0).to_numpy(dtype=float)
+        p = np.asarray(m.predict(Xte, num_iteration=getattr(m, "best_iteration", None)), dtype=float)
+        metrics["hold_days_pred"] = {"mae": _mae(y, p)}
+
+    m = boosters.get("tp_first")
+    if m is not None:
+        y = _tp_first_y(test_df)
+        proba = np.asarray(m.predict(Xte, num_iteration=getattr(m, "best_iteration", None)), dtype=float)
+        pred_cls = np.argmax(proba, axis=1).astype(int) if proba.ndim == 2 else np.zeros(len(y), dtype=int)
+        metrics["tp_first"] = {"accuracy": _accuracy(y, pred_cls), "logloss": _multiclass_logloss(y, proba, num_class=3)}
+
+    return metrics, time.perf_counter() - t0
+
+
+def _run_window(
+    months: List[Tuple[str, Path, pd.DataFrame]],
+    i: int,
+    feat_cols: List[str],
+    *,
+    seed: int,
+    valid_ratio: float,
+    with_hold: bool,
+    with_tp_first: bool,
+    threads: int,
+    cache_dir: Optional[Path],
+) -> Dict[str, Any]:
+    """
+    months[:i] で学習（early stopping 用に _split_train_valid）→ months[i] で評価。
+    """
+    t_wall = time.perf_counter()
+    train_all = pd.concat([d for _, _, d in months[:i]], ignore_index=True)
+    test_df = months[i][2]
+    train_df, valid_df = _split_train_valid(train_all, valid_ratio=valid_ratio, seed=seed)
+
+    Xtr = train_df[feat_cols]
+    Xva = valid_df[feat_cols] if len(valid_df) > 0 else None
+
+    cache_path = None
+    if cache_dir is not None:
+        key = _window_cache_key([(m, p) for m, p, _ in months[:i]], feat_cols, seed, valid_ratio)
+        cache_path = cache_dir / f"{key}.bin"
+    bins, cache_hit = _cached_bins(Xtr, Xva, seed=seed, cache_path=cache_path)
+
+    jobs: List[Tuple[str, Dict[str, Any], Any, Any]] = [
+        ("pwin", _params_pwin(seed), _bin_y_win(train_df["y_label"]), _bin_y_win(valid_df["y_label"]) if Xva is not None else None),
+        ("ev", _params_ev(seed), _ev_target(train_df), _ev_target(valid_df) if Xva is not None else None),
+    ]
+    if with_hold and "y_hold_days" in train_all.columns and "y_hold_days" in test_df.columns:
+        yd_tr = pd.to_numeric(train_df["y_hold_days"], errors="coerce").fillna(0).to_numpy(dtype=float)
+        yd_va = pd.to_numeric(valid_df["y_hold_days"], errors="coerce").fillna(0).to_numpy(dtype=float) if Xva is not None else None
+        jobs.append(("hold_days", _params_hold_days(seed), yd_tr, yd_va))
+    if with_tp_first and "y_touch_tp_first" in train_all.columns and "y_touch_tp_first" in test_df.columns:
+        jobs.append(("tp_first", _params_tp_first(seed), _tp_first_y(train_df), _tp_first_y(valid_df) if Xva is not None else None))
+
+    boosters, train_sec = _train_all(bins, jobs, threads=threads, parallel=True)
+    metrics, predict_sec = _window_metrics(boosters, test_df, feat_cols)
+
+    return {
+        "train_months": [m for m, _, _ in months[:i]],
+        "test_month": months[i][0],
+        "train_rows": int(len(train_df)),
+        "valid_rows": int(len(valid_df)),
+        "test_rows": int(len(test_df)),
+        "metrics": metrics,
+        "best_iteration": {k: int(getattr(b, "best_iteration", 0) or 0) for k, b in boosters.items()},
+        "timing": {
+            "binning_sec": round(bins.sec, 3),
+            "cache_hit": bool(cache_hit),
+            "train_sec": train_sec,
+            "predict_sec": round(predict_sec, 4),
+            "predict_us_per_row": round(predict_sec * 1e6 / max(1, len(test_df)), 2),
+            "wall_sec": round(time.perf_counter() - t_wall, 3),
+            "threads": threads,
+        },
+    }
+
+
+def _mean(vals: List[Any]) -> Optional[float]:
+    xs = [float(v) for v in vals if v is not None]
+    return round(float(np.mean(xs)), 6) if xs else None
+
+
+def _walk_forward_summary(windows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def pick(*path):
+        out = []
+        for w in windows:
+            cur: Any = w
+            for k in path:
+                cur = cur.get(k) if isinstance(cur, dict) else None
+            out.append(cur)
+        return out
+
+    return {
+        "windows": len(windows),
+        "p_win_auc_mean": _mean(pick("metrics", "p_win", "auc")),
+        "p_win_logloss_mean": _mean(pick("metrics", "p_win", "logloss")),
+        "ev_rmse_mean": _mean(pick("metrics", "ev", "rmse")),
+        "ev_mae_mean": _mean(pick("metrics", "ev", "mae")),
+        "hold_days_mae_mean": _mean(pick("metrics", "hold_days_pred", "mae")),
+        "tp_first_accuracy_mean": _mean(pick("metrics", "tp_first", "accuracy")),
+        "train_sec_total": round(sum(sum((w.get("timing") or {}).get("train_sec", {}).values()) for w in windows), 3),
+        "predict_sec_total": round(sum(float((w.get("timing") or {}).get("predict_sec") or 0.0) for w in windows), 4),
+        "cache_hits": sum(1 for w in windows if (w.get("timing") or {}).get("cache_hit")),
+    }
 
 
 class Command(BaseCommand):
@@ -390,7 +612,15 @@ class Command(BaseCommand):
         parser.add_argument("--out", type=str, default="", help="出力先（空なら media/aiapp/ml/models/<stamp>/）")
         parser.add_argument("--with-hold-days", action="store_true", help="hold_days_pred も学習する")
         parser.add_argument("--with-tp-first", action="store_true", help="tp_first/sl_first/none も学習する")
+        parser.add_argument("--with-replay", action="store_true", help="build_replay_dataset の ml/replay/latest_train も学習データに足す（train 側だけ。walk-forward では使わない）")
         parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument("--threads", type=int, default=0, help="学習に使う総スレッド数（0=CPU数）。同時学習するモデルで等分する")
+        parser.add_argument("--sequential", action="store_true", help="モデルを1つずつ学習する（各モデルが全スレッドを使う）")
+        parser.add_argument("--walk-forward", action="store_true", help="月パーティション（train/YYYY_MM）で拡張窓学習→翌月評価のレポートだけ作る（latest は触らない）")
+        parser.add_argument("--wf-min-train-months", type=int, default=3, help="walk-forward: 最初の窓の学習月数")
+        parser.add_argument("--wf-last", type=int, default=0, help="walk-forward: 直近 N 窓だけ（0=全部）")
+        parser.add_argument("--wf-jobs", type=int, default=2, help="walk-forward: 同時に回す窓の数（--threads を等分）")
+        parser.add_argument("--wf-no-cache", action="store_true", help="walk-forward: 窓ごとのビン化キャッシュを使わない")
 
     def handle(self, *args, **opts) -> None:
         seed = int(opts.get("seed") or 42)
@@ -399,13 +629,27 @@ class Command(BaseCommand):
         with_tp_first = bool(opts.get("with_tp_first") or False)
         dry_run = bool(opts.get("dry_run") or False)
 
-        df = _read_latest_train()
-        df = _clean_df(df)
-
-        feat_cols = _feature_cols(df)
+        if opts.get("walk_forward"):
+            self._walk_forward(opts, seed=seed, valid_ratio=valid_ratio, with_hold=with_hold, with_tp_first=with_tp_first, dry_run=dry_run)
+            return
 
+        df = _clean_df(_read_latest_train())
         train_df, valid_df = _split_train_valid(df, valid_ratio=valid_ratio, seed=seed)
 
+        # replay 行は train にだけ足す（valid に混ぜると検証指標が replay 側に寄る）
+        n_replay = 0
+        if opts.get("with_replay"):
+            try:
+                replay_df = _clean_df(_read_latest_train("replay"))
+            except FileNotFoundError as ex:
+                self.stdout.write(self.style.WARNING(f"[train_lgbm_models] --with-replay: {ex} (continue without replay rows)"))
+            else:
+                n_replay = int(len(replay_df))
+                train_df = pd.concat([train_df, replay_df], ignore_index=True, sort=False)
+                df = pd.concat([df, replay_df], ignore_index=True, sort=False)
+
+        feat_cols = _feature_cols(df)
+
         Xtr = train_df[feat_cols]
         Xva = valid_df[feat_cols] if len(valid_df) > 0 else None
 
@@ -423,28 +667,53 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS("===== train_lgbm_models ====="))
         self.stdout.write(f"rows={len(df)} train={len(train_df)} valid={len(valid_df)} feat_cols={len(feat_cols)}")
-        self.stdout.write(f"with_hold_days={with_hold} with_tp_first={with_tp_first} seed={seed}")
+        self.stdout.write(f"with_hold_days={with_hold} with_tp_first={with_tp_first} replay_rows={n_replay} seed={seed}")
 
         if dry_run:
             self.stdout.write(self.style.WARNING("[train_lgbm_models] dry-run: training skipped."))
             return
 
-        # train
-        model_pwin = _train_classifier_pwin(Xtr, ytr_win, Xva, yva_win, seed=seed)
-        model_ev = _train_regressor_ev(Xtr, ytr_ev, Xva, yva_ev, seed=seed)
+        # train（ビン化は1回だけ、独立な4モデルは同時に学習）
+        threads = int(opts.get("threads") or 0) or (os.cpu_count() or 1)
+        parallel = not bool(opts.get("sequential") or False)
+
+        t_wall = time.perf_counter()
+        bins = _build_shared_bins(Xtr, Xva, seed=seed)
+
+        jobs: List[Tuple[str, Dict[str, Any], Any, Any]] = [
+            ("pwin", _params_pwin(seed), ytr_win, yva_win),
+            ("ev", _params_ev(seed), ytr_ev, yva_ev),
+        ]
 
-        model_hold = None
         if with_hold and "y_hold_days" in df.columns:
             yd_tr = pd.to_numeric(train_df["y_hold_days"], errors="coerce").fillna(0).to_numpy(dtype=float)
             yd_va = pd.to_numeric(valid_df["y_hold_days"], errors="coerce").fillna(0).to_numpy(dtype=float) if Xva is not None else None
-            model_hold = _train_regressor_hold_days(Xtr, yd_tr, Xva, yd_va, seed=seed)
+            jobs.append(("hold_days", _params_hold_days(seed), yd_tr, yd_va))
 
-        model_tp = None
         tp_map = _tp_first_map()
         if with_tp_first and "y_touch_tp_first" in df.columns:
             yt_tr = train_df["y_touch_tp_first"].astype(str).str.lower().str.strip().map(lambda x: tp_map.get(x, 0)).astype(int).to_numpy()
             yt_va = valid_df["y_touch_tp_first"].astype(str).str.lower().str.strip().map(lambda x: tp_map.get(x, 0)).astype(int).to_numpy() if Xva is not None else None
-            model_tp = _train_multiclass_tp_first(Xtr, yt_tr, Xva, yt_va, seed=seed)
+            jobs.append(("tp_first", _params_tp_first(seed), yt_tr, yt_va))
+
+        boosters, train_sec = _train_all(bins, jobs, threads=threads, parallel=parallel)
+        wall_sec = time.perf_counter() - t_wall
+
+        model_pwin = boosters["pwin"]
+        model_ev = boosters["ev"]
+        model_hold = boosters.get("hold_days")
+        model_tp = boosters.get("tp_first")
+
+        timing = {
+            "binning_sec": round(bins.sec, 3),
+            "train_sec": train_sec,
+            "wall_sec": round(wall_sec, 3),
+            "threads": threads,
+            "parallel": parallel,
+        }
+        for key, sec in train_sec.items():
+            self.stdout.write(f"[train_lgbm_models] {key}: {sec:.1f}s iters={boosters[key].current_iteration()}")
+        self.stdout.write(f"[train_lgbm_models] binning={bins.sec:.1f}s wall={wall_sec:.1f}s threads={threads} parallel={parallel}")
 
         # --------------------
         # metrics (valid)
@@ -517,6 +786,7 @@ class Command(BaseCommand):
         meta = {
             "created_at": datetime.now(JST).isoformat(),
             "rows": int(len(df)),
+            "replay_rows": n_replay,
             "train_rows": int(len(train_df)),
             "valid_rows": int(len(valid_df)),
             "valid_ratio": float(valid_ratio),
@@ -535,7 +805,19 @@ class Command(BaseCommand):
                 "tp_first": int(getattr(model_tp, "best_iteration", 0) or 0) if model_tp is not None else 0,
             },
             "metrics": metrics,
+            "timing": timing,
         }
+
+        # NumPy 推論器（compiled_<key>.npz）。valid で Booster.predict と 1e-9 以内に一致したものだけ出す
+        compiled: Dict[str, Any] = {}
+        for key, booster in [("pwin", model_pwin), ("ev", model_ev), ("hold_days", model_hold), ("tp_first", model_tp)]:
+            if booster is None:
+                continue
+            compiled[key] = compile_and_check(booster, out_dir / compiled_name(key), Xva)
+            if not compiled[key].get("ok"):
+                self.stdout.write(self.style.WARNING(f"[train_lgbm_models] compile {key}: {compiled[key].get('reason')}"))
+        meta["compiled"] = compiled
+
         (out_dir / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
 
         model_pwin.save_model(str(out_dir / "model_pwin.txt"))
@@ -545,15 +827,127 @@ class Command(BaseCommand):
         if model_tp is not None:
             model_tp.save_model(str(out_dir / "model_tp_first.txt"))
 
-        # latest symlink-like（ファイルコピーで簡易運用）
+        # latest symlink-like（ファイルコピーで簡易運用。manifest.json を最後に書き、推論側はそれで差し替えを検知）
         latest_dir = Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "models" / "latest"
-        latest_dir.mkdir(parents=True, exist_ok=True)
-        for name in ["meta.json", "feature_cols.json", "label_maps.json", "model_pwin.txt", "model_ev.txt", "model_hold_days.txt", "model_tp_first.txt"]:
-            src = out_dir / name
-            if src.exists():
-                (latest_dir / name).write_text(src.read_text(encoding="utf-8"), encoding="utf-8")
+        publish_latest(
+            out_dir,
+            latest_dir,
+            [
+                "meta.json", "feature_cols.json", "label_maps.json",
+                "model_pwin.txt", "model_ev.txt", "model_hold_days.txt", "model_tp_first.txt",
+                compiled_name("pwin"), compiled_name("ev"), compiled_name("hold_days"), compiled_name("tp_first"),
+            ],
+        )
 
         self.stdout.write(self.style.SUCCESS(f"[train_lgbm_models] saved: {out_dir}"))
         self.stdout.write(self.style.SUCCESS(f"[train_lgbm_models] latest: {latest_dir}"))
         if metrics.get("valid_rows", 0) > 0:
-            self.stdout.write(self.style.SUCCESS("[train_lgbm_models] metrics(valid): " + json.dumps(metrics, ensure_ascii=False)))
\ No newline at end of file
+            self.stdout.write(self.style.SUCCESS("[train_lgbm_models] metrics(valid): " + json.dumps(metrics, ensure_ascii=False)))
+
+    def _walk_forward(self, opts, *, seed: int, valid_ratio: float, with_hold: bool, with_tp_first: bool, dry_run: bool) -> None:
+        """
+        拡張窓の walk-forward:
+          窓 k: 学習 = 先頭〜(k-1)ヶ月目、評価 = k ヶ月目（翌月）
+        窓ごとの AUC / logloss / RMSE と学習・推論時間を
+        media/aiapp/ml/walkforward/latest_walkforward.json に出す（behavior ダッシュボードが読む）。
+        """
+        ml_dir = Path(settings.MEDIA_ROOT) / "aiapp" / "ml"
+        parts = _list_month_partitions(ml_dir / "train")
+        min_months = max(1, int(opts.get("wf_min_train_months") or 3))
+        last = max(0, int(opts.get("wf_last") or 0))
+        wf_jobs = max(1, int(opts.get("wf_jobs") or 1))
+        threads = int(opts.get("threads") or 0) or (os.cpu_count() or 1)
+        use_cache = not bool(opts.get("wf_no_cache") or False)
+
+        self.stdout.write(self.style.SUCCESS("===== train_lgbm_models (walk-forward) ====="))
+        if len(parts) <= min_months:
+            self.stdout.write(self.style.WARNING(
+                f"[train_lgbm_models] walk-forward: months={len(parts)} <= min_train_months={min_months} -> skip"
+            ))
+            return
+
+        # 月ごとに1回だけ読む（窓をまたいで使い回す）
+        months: List[Tuple[str, Path, pd.DataFrame]] = []
+        for month, p in parts:
+            months.append((month, p, _clean_df(_read_partition(p))))
+        feat_cols = _feature_cols(pd.concat([d.head(1) for _, _, d in months], ignore_index=True))
+        # 途中の月で増えた列は、古い月では欠損として扱う
+        for k, (month, p, d) in enumerate(months):
+            missing = [c for c in feat_cols if c not in d.columns]
+            if missing:
+                months[k] = (month, p, d.assign(**{c: np.nan for c in missing}))
+
+        targets = list(range(min_months, len(months)))
+        if last > 0:
+            targets = targets[-last:]
+
+        self.stdout.write(
+            f"months={len(months)} ({months[0][0]}..{months[-1][0]}) windows={len(targets)} "
+            f"feat_cols={len(feat_cols)} jobs={wf_jobs} threads={threads} cache={use_cache}"
+        )
+        if dry_run:
+            self.stdout.write(self.style.WARNING("[train_lgbm_models] dry-run: training skipped."))
+            return
+
+        cache_dir = (ml_dir / "walkforward" / "cache") if use_cache else None
+        per_window = max(1, threads // min(wf_jobs, len(targets)))
+
+        def run(i: int) -> Dict[str, Any]:
+            return _run_window(
+                months, i, feat_cols,
+                seed=seed, valid_ratio=valid_ratio,
+                with_hold=with_hold, with_tp_first=with_tp_first,
+                threads=per_window, cache_dir=cache_dir,
+            )
+
+        t_wall = time.perf_counter()
+        if wf_jobs > 1 and len(targets) > 1:
+            with ThreadPoolExecutor(max_workers=min(wf_jobs, len(targets))) as ex:
+                windows = list(ex.map(run, targets))
+        else:
+            windows = [run(i) for i in targets]
+        wall_sec = time.perf_counter() - t_wall
+
+        for w in windows:
+            pw = w["metrics"].get("p_win") or {}
+            ev = w["metrics"].get("ev") or {}
+            tm = w["timing"]
+            auc = pw.get("auc")
+            self.stdout.write(
+                f"[walk-forward] {w['train_months'][0]}..{w['train_months'][-1]} -> {w['test_month']} "
+                f"train={w['train_rows']} test={w['test_rows']} "
+                f"auc={'-' if auc is None else f'{auc:.4f}'} logloss={pw.get('logloss', 0.0):.4f} rmse={ev.get('rmse', 0.0):.4f} "
+                f"train={sum(tm['train_sec'].values()):.1f}s predict={tm['predict_sec']:.3f}s cache={'hit' if tm['cache_hit'] else 'miss'}"
+            )
+
+        report = {
+            "created_at": datetime.now(JST).isoformat(),
+            "mode": "expanding",
+            "params": {
+                "seed": seed,
+                "valid_ratio": valid_ratio,
+                "min_train_months": min_months,
+                "last": last,
+                "jobs": wf_jobs,
+                "threads": threads,
+                "threads_per_window": per_window,
+                "cache": use_cache,
+                "with_hold_days": with_hold,
+                "with_tp_first": with_tp_first,
+            },
+            "features": feat_cols,
+            "months": [{"month": m, "rows": int(len(d))} for m, _, d in months],
+            "windows": windows,
+            "summary": {**_walk_forward_summary(windows), "wall_sec": round(wall_sec, 3)},
+        }
+
+        out_dir = ml_dir / "walkforward"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        body = json.dumps(report, ensure_ascii=False, indent=2)
+        for name in (f"walkforward_{_now_stamp()}.json", "latest_walkforward.json"):
+            tmp = out_dir / (name + ".tmp")
+            tmp.write_text(body, encoding="utf-8")
+            os.replace(tmp, out_dir / name)
+
+        self.stdout.write(self.style.SUCCESS(f"[train_lgbm_models] walk-forward: {out_dir / 'latest_walkforward.json'}"))
+        self.stdout.write(self.style.SUCCESS("[train_lgbm_models] walk-forward summary: " + json.dumps(report["summary"], ensure_ascii=False)))
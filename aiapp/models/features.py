@@ -136,8 +136,17 @@ def _sma(s: pd.Series, window: int) -> pd.Series:
     return s.rolling(window=window, min_periods=window).mean()
 
 
+# 窓平均に対してこれ以下の std は「横ばい窓の丸め誤差」とみなして 0 にする
+# （pandas の rolling std は横ばいでも 1e-9 程度の相対誤差が残ることがある。実際の値幅はこれより何桁も大きい）
+FLAT_STD_REL = 1e-7
+
+# MA 同士の比較（GCROSS/DCROSS）で「同じ」とみなす相対差（平均の計算順による丸め誤差で交差が立たないように）
+MA_CROSS_REL = 1e-9
+
+
 def _std(s: pd.Series, window: int) -> pd.Series:
-    return s.rolling(window=window, min_periods=window).std()
+    sd = s.rolling(window=window, min_periods=window).std()
+    return sd.mask(sd <= FLAT_STD_REL * _sma(s, window).abs(), 0.0)
 
 
 def _true_range(high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
@@ -183,7 +192,8 @@ def _bollinger(close: pd.Series, window: int = 20, n_sigma: float = 2.0) -> Tupl
 def _zscore(s: pd.Series, window: int = 20) -> pd.Series:
     mu = _sma(s, window)
     sd = _std(s, window)
-    return (s - mu) / sd.replace(0, np.nan)
+    # 横ばい窓（sd=0）は値 = 平均なので 0
+    return ((s - mu) / sd.replace(0, np.nan)).mask(sd == 0, 0.0)
 
 
 def _slope(s: pd.Series, window: int = 5) -> pd.Series:
@@ -308,7 +318,8 @@ def make_features(raw: pd.DataFrame, cfg: Optional[FeatureConfig] = None) -> pd.
 
     # --- ゴールデンクロス/デッドクロスのフラグ（例：短中期）---
     ma_s, ma_m = df[f"MA{cfg.ma_short}"], df[f"MA{cfg.ma_mid}"]
-    cross = (ma_s > ma_m).astype(int) - (ma_s.shift(1) > ma_m.shift(1)).astype(int)
+    above = (ma_s - ma_m) > MA_CROSS_REL * ma_m.abs()
+    cross = above.astype(int) - above.shift(1, fill_value=False).astype(int)
     df["GCROSS"] = (cross == 1).astype(int)
     df["DCROSS"] = (cross == -1).astype(int)
 
@@ -358,6 +369,29 @@ def make_features(raw: pd.DataFrame, cfg: Optional[FeatureConfig] = None) -> pd.
     return df
 
 
+def make_lite_features(raw: pd.DataFrame, cfg: Optional[FeatureConfig] = None) -> pd.DataFrame:
+    """
+    picks_build の一次スクリーニング（picks_filters.check_all）に要る列だけを作る軽量版。
+    - Close / Volume / ATR / RET_5 / RET_20
+    - 計算式は make_features と同じ（短い窓だと ATR の EMA 初期値ぶんだけ僅かにズレる）
+    """
+    cfg = cfg or FeatureConfig()
+    df = _ensure_ohlcv(raw)
+
+    df["Close"] = df["Close"].ffill()
+    df["Open"] = df["Open"].fillna(df["Close"])
+    df["High"] = df["High"].fillna(df[["Open", "Close"]].max(axis=1))
+    df["Low"] = df["Low"].fillna(df[["Open", "Close"]].min(axis=1))
+    df["Volume"] = df["Volume"].fillna(0)
+
+    close = df["Close"].astype("float64")
+    out = df[["Close", "Volume"]].copy()
+    out[f"ATR{cfg.atr_period}"] = _atr(df["High"], df["Low"], close, cfg.atr_period).ffill().bfill()
+    out["RET_5"] = _safe_pct_change(close, 5).ffill().bfill()
+    out["RET_20"] = _safe_pct_change(close, 20).ffill().bfill()
+    return out
+
+
 # ========= 代表的な単品API =========
 
 def vwap_series(df: pd.DataFrame) -> pd.Series:
@@ -0,0 +1,425 @@
+# aiapp/models/features_panel.py
+# -*- coding: utf-8 -*-
+"""
+aiapp.models.features_panel
+ユニバース全銘柄をまとめて特徴量計算するパネル版エンジン（日足専用）。
+
+考え方:
+- 各銘柄の OHLCV を (本数 T × 銘柄数 N) の NumPy 行列に並べる
+  - 行は「各銘柄自身のバー位置」で右詰め（末尾=最新バー）。短い銘柄は上側が NaN
+  - 同じ取引所カレンダーなら行=日付になる。各銘柄の実日付は dates 行列に持つ
+  - 右詰めなので、休場・上場日の違いがあっても各列の計算は make_features と同じ系列になる
+- FeatureConfig の全指標を列方向にまとめて1パスで計算
+  - MA / BB / ローリングstd / 回帰傾きは窓のずらし和（Python コールバック無し）
+  - EMA 系（RSI / MACD / ATR）は時間方向だけループし、銘柄方向はベクトル化
+  - 52週高安は van Herk/Gil-Werman 法のローリング max/min
+- panel.frame(code) で 1銘柄ぶんの DataFrame を取り出せる
+  → make_features(raw, cfg) と浮動小数の誤差範囲で一致する（列順も同じ）
+
+使い方:
+    panel = make_features_panel({"7203": df1, "6758": df2}, cfg=FeatureConfig())
+    feat = panel.frame("7203")      # make_features 互換
+    last = panel.last_rows()        # index=code の最終行テーブル（横断用）
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+from .features import FLAT_STD_REL, MA_CROSS_REL, FeatureConfig, _ensure_ohlcv
+
+
+# ========= パネル用の列方向ヘルパ（a: shape=(T, N)） =========
+
+def _shift(a: np.ndarray, k: int) -> np.ndarray:
+    out = np.full_like(a, np.nan)
+    if k <= 0:
+        return a.copy()
+    if k < a.shape[0]:
+        out[k:] = a[:-k]
+    return out
+
+
+def _ffill(a: np.ndarray) -> np.ndarray:
+    T = a.shape[0]
+    idx = np.where(~np.isnan(a), np.arange(T)[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(a, idx, axis=0)
+
+
+def _bfill(a: np.ndarray) -> np.ndarray:
+    return _ffill(a[::-1])[::-1]
+
+
+def _first_valid(a: np.ndarray) -> np.ndarray:
+    """各列の最初の有効値（全NaN列は 0）。"""
+    valid = ~np.isnan(a)
+    pos = np.argmax(valid, axis=0)
+    ref = a[pos, np.arange(a.shape[1])]
+    return np.where(valid.any(axis=0), ref, 0.0)
+
+
+def _flat_run(a: np.ndarray) -> np.ndarray:
+    """
+    各位置で「同じ値が何本続いているか」（NaN は続かない扱い）。
+    pandas の rolling mean/std は窓内がすべて同じ値なら mean=その値 / std=0 を厳密に返すので、それを再現する用。
+    """
+    T = a.shape[0]
+    if T == 0:
+        return np.zeros(a.shape, dtype=np.int64)
+    same = np.zeros(a.shape, dtype=bool)
+    same[1:] = a[1:] == a[:-1]
+    t = np.arange(T)[:, None]
+    start = np.where(same, 0, t)
+    np.maximum.accumulate(start, axis=0, out=start)
+    return t - start + 1
+
+
+def _rolling_mean(a: np.ndarray, w: int, flat: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    rolling(w, min_periods=w).mean() 相当。
+    桁落ちを避けるため列ごとの基準値を引いてから累積和で窓和を取る。
+    窓内がすべて同じ値ならその値そのもの（pandas と同じ。MA どうしの比較 = GCROSS/DCROSS が誤差で反転しない）。
+    """
+    T = a.shape[0]
+    out = np.full_like(a, np.nan)
+    if w <= 0 or w > T:
+        return out
+    ref = _first_valid(a)
+    valid = ~np.isnan(a)
+    x = np.where(valid, a - ref, 0.0)
+    cs = np.vstack([np.zeros((1, a.shape[1])), np.cumsum(x, axis=0)])
+    cn = np.vstack([np.zeros((1, a.shape[1]), dtype=np.int64), np.cumsum(valid, axis=0)])
+    s = cs[w:] - cs[:-w]
+    n = cn[w:] - cn[:-w]
+    out[w - 1:] = np.where(n >= w, ref + s / w, np.nan)
+    if flat is None:
+        flat = _flat_run(a)
+    return np.where(flat >= w, a, out)
+
+
+def _rolling_std(
+    a: np.ndarray,
+    w: int,
+    mean: Optional[np.ndarray] = None,
+    flat: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    rolling(w, min_periods=w).std()（ddof=1）。窓内偏差の二乗和で計算。
+    窓内がすべて同じ値なら厳密に 0。それ以外でも窓平均に対して相対 FLAT_STD_REL 以下の std は
+    丸め誤差とみなして 0 にする（features._std と同じ規則。BB_Z が誤差 / 誤差で暴れないように）。
+    """
+    if flat is None:
+        flat = _flat_run(a)
+    if mean is None:
+        mean = _rolling_mean(a, w, flat=flat)
+    if w < 2:
+        return np.full_like(a, np.nan)
+    ss = np.zeros_like(a)
+    for k in range(w):
+        d = _shift(a, k) - mean
+        ss += d * d
+    sd = np.sqrt(ss / (w - 1))
+    with np.errstate(invalid="ignore"):
+        tiny = sd <= FLAT_STD_REL * np.abs(mean)
+    return np.where((flat >= w) | tiny, 0.0, sd)
+
+
+def _rolling_extreme(a: np.ndarray, w: int, fn) -> np.ndarray:
+    """
+    rolling(w, min_periods=1).max()/min() 相当（van Herk/Gil-Werman 法）。
+    fn は np.fmax / np.fmin（NaN をスキップ）。
+    """
+    T, N = a.shape
+    if T == 0:
+        return a.copy()
+    w = max(1, min(int(w), T))
+    L = T + w - 1
+    L_pad = ((L + w - 1) // w) * w
+    b = np.full((L_pad, N), np.nan)
+    b[w - 1:w - 1 + T] = a
+    blocks = b.reshape(L_pad // w, w, N)
+    pre = fn.accumulate(blocks, axis=1).reshape(L_pad, N)
+    suf = fn.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(L_pad, N)
+    t = np.arange(T)
+    return fn(suf[t], pre[t + w - 1])
+
+
+def _ewm(a: np.ndarray, span: int) -> np.ndarray:
+    """
+    s.ewm(span, adjust=False, min_periods=span).mean() 相当。
+    時間方向だけループ（銘柄方向はベクトル演算）。
+    """
+    T, N = a.shape
+    alpha = 2.0 / (span + 1.0)
+    keep = 1.0 - alpha
+    out = np.full_like(a, np.nan)
+    wgt = np.full(N, np.nan)
+    old_wt = np.ones(N)
+    nobs = np.zeros(N, dtype=np.int64)
+    for t in range(T):
+        x = a[t]
+        obs = ~np.isnan(x)
+        nobs += obs
+        has = ~np.isnan(wgt)
+        old_wt = np.where(has, old_wt * keep, old_wt)
+        upd = has & obs & (wgt != x)
+        with np.errstate(invalid="ignore"):
+            cand = (old_wt * wgt + alpha * x) / (old_wt + alpha)
+        wgt = np.where(upd, cand, wgt)
+        old_wt = np.where(has & obs, 1.0, old_wt)
+        wgt = np.where(~has & obs, x, wgt)
+        out[t] = np.where(nobs >= span, wgt, np.nan)
+    return out
+
+
+def _slope(a: np.ndarray, n: int) -> np.ndarray:
+    """
+    features._slope と同じ定義（標準化 x,y の回帰傾き = 相関 × 補正）を閉形式で。
+      slope = Σ x_std[k] * (y_k - ȳ) / ((σ_y + 1e-12) * (n - 1))
+    """
+    if n < 2:
+        return np.full_like(a, np.nan)
+    x = np.arange(n, dtype="float64")
+    x = (x - x.mean()) / (x.std(ddof=0) + 1e-12)
+
+    lags = [_shift(a, n - 1 - k) for k in range(n)]  # lags[k] = 窓内 k 番目
+    mean = np.zeros_like(a)
+    for y in lags:
+        mean += y
+    mean /= n
+    ss = np.zeros_like(a)
+    dot = np.zeros_like(a)
+    for k, y in enumerate(lags):
+        d = y - mean
+        ss += d * d
+        dot += x[k] * d
+    sd = np.sqrt(ss / n)
+    return dot / (sd + 1e-12) / (n - 1)
+
+
+def _safe_div(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return num / np.where(den == 0, np.nan, den)
+
+
+def _pct_change(a: np.ndarray, k: int) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = a / _shift(a, k) - 1.0
+    r[~np.isfinite(r)] = np.nan
+    return r
+
+
+# ========= パネル本体 =========
+
+@dataclass
+class FeaturePanel:
+    codes: List[str]
+    dates: np.ndarray                 # (T, N) datetime64[ns]（右詰め・上側は NaT）
+    lengths: np.ndarray               # (N,) 各銘柄の本数
+    columns: Dict[str, np.ndarray] = field(default_factory=dict)  # 列名 -> (T, N)
+    int_columns: tuple = ("GCROSS", "DCROSS")
+
+    def __post_init__(self):
+        self._pos = {c: i for i, c in enumerate(self.codes)}
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._pos
+
+    def frame(self, code: str) -> pd.DataFrame:
+        """1銘柄ぶんを make_features と同じ形の DataFrame で返す。"""
+        j = self._pos[code]
+        n = int(self.lengths[j])
+        T = self.dates.shape[0]
+        rows = slice(T - n, T)
+        idx = pd.DatetimeIndex(self.dates[rows, j])
+        data = {}
+        for name, arr in self.columns.items():
+            col = arr[rows, j]
+            data[name] = col.astype(np.int64) if name in self.int_columns else col
+        return pd.DataFrame(data, index=idx)
+
+    def last_rows(self) -> pd.DataFrame:
+        """各銘柄の最終行（index=code）。横断スコアや一次フィルタ用。"""
+        data = {name: arr[-1, :] for name, arr in self.columns.items()}
+        df = pd.DataFrame(data, index=pd.Index(self.codes, name="code"))
+        df["date"] = self.dates[-1, :]
+        return df
+
+
+def build_ohlcv_panel(
+    frames: Mapping[str, pd.DataFrame],
+    max_bars: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    {code: OHLCV DataFrame} を右詰めの (T, N) 行列群にする。
+    戻り値: {"codes", "dates", "lengths", "Open", "High", "Low", "Close", "Volume"}
+    """
+    codes: List[str] = []
+    normed: List[pd.DataFrame] = []
+    for code, raw in frames.items():
+        if raw is None or len(raw) == 0:
+            continue
+        df = _ensure_ohlcv(raw)
+        if max_bars is not None and max_bars > 0 and len(df) > max_bars:
+            df = df.iloc[-max_bars:]
+        if len(df) == 0:
+            continue
+        codes.append(str(code))
+        normed.append(df)
+
+    N = len(codes)
+    T = max((len(df) for df in normed), default=0)
+    out: Dict[str, np.ndarray] = {
+        "codes": np.asarray(codes, dtype=object),
+        "dates": np.full((T, N), np.datetime64("NaT"), dtype="datetime64[ns]"),
+        "lengths": np.zeros(N, dtype=np.int64),
+    }
+    for c in ("Open", "High", "Low", "Close", "Volume"):
+        out[c] = np.full((T, N), np.nan)
+
+    for j, df in enumerate(normed):
+        n = len(df)
+        out["lengths"][j] = n
+        out["dates"][T - n:, j] = df.index.values.astype("datetime64[ns]")
+        for c in ("Open", "High", "Low", "Close", "Volume"):
+            out[c][T - n:, j] = df[c].to_numpy(dtype="float64")
+    return out
+
+
+def make_features_panel(
+    frames: Mapping[str, pd.DataFrame],
+    cfg: Optional[FeatureConfig] = None,
+    max_bars: Optional[int] = None,
+) -> FeaturePanel:
+    """
+    make_features のパネル版。frames は {code: get_prices() の戻り値}。
+    """
+    cfg = cfg or FeatureConfig()
+    p = build_ohlcv_panel(frames, max_bars=max_bars)
+    T, N = p["Close"].shape
+
+    # 欠損を軽く埋める（make_features と同じ順序）
+    close = _ffill(p["Close"])
+    open_ = np.where(np.isnan(p["Open"]), close, p["Open"])
+    high = np.where(np.isnan(p["High"]), np.fmax(open_, close), p["High"])
+    low = np.where(np.isnan(p["Low"]), np.fmin(open_, close), p["Low"])
+    vol = np.where(np.isnan(p["Volume"]), 0.0, p["Volume"])
+
+    cols: Dict[str, np.ndarray] = {
+        "Open": open_,
+        "High": high,
+        "Low": low,
+        "Close": close,
+        "Volume": vol,
+    }
+
+    # --- 移動平均・ボリンジャー ---
+    ma_cache: Dict[int, np.ndarray] = {}
+    close_flat = _flat_run(close)
+
+    def ma(w: int) -> np.ndarray:
+        if w not in ma_cache:
+            ma_cache[w] = _rolling_mean(close, w, flat=close_flat)
+        return ma_cache[w]
+
+    for w in (cfg.ma_short, cfg.ma_mid, cfg.ma_long, cfg.ma_extra1, cfg.ma_extra2):
+        cols[f"MA{w}"] = ma(w)
+
+    bb_m = ma(cfg.bb_window)
+    bb_sd = _rolling_std(close, cfg.bb_window, mean=bb_m, flat=close_flat)
+    cols["BBU"] = bb_m + cfg.bb_sigma * bb_sd
+    cols["BBM"] = bb_m
+    cols["BBL"] = bb_m - cfg.bb_sigma * bb_sd
+    # 横ばい窓（sd=0）は値 = 平均なので 0（features._zscore と同じ）
+    cols["BB_Z"] = np.where(bb_sd == 0, 0.0, _safe_div(close - bb_m, bb_sd))
+
+    # --- RSI / MACD / ATR ---
+    delta = close - _shift(close, 1)
+    up = np.where(delta < 0, 0.0, delta)
+    down = -np.where(delta > 0, 0.0, delta)
+    rs = _safe_div(_ewm(up, cfg.rsi_period), _ewm(down, cfg.rsi_period))
+    cols[f"RSI{cfg.rsi_period}"] = 100 - (100 / (1 + rs))
+
+    macd_line = _ewm(close, cfg.macd_fast) - _ewm(close, cfg.macd_slow)
+    macd_signal = _ewm(macd_line, cfg.macd_signal)
+    cols["MACD"] = macd_line
+    cols["MACD_SIGNAL"] = macd_signal
+    cols["MACD_HIST"] = macd_line - macd_signal
+
+    prev_close = _shift(close, 1)
+    tr = np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+    cols[f"ATR{cfg.atr_period}"] = _ewm(tr, cfg.atr_period)
+
+    # --- VWAP（日足なので1本ごとにリセット）とその乖離 ---
+    tp = (high + low + close) / 3.0
+    vwap = _ffill(_safe_div(tp * vol, vol))
+    cols["VWAP"] = vwap
+    cols["VWAP_GAP_PCT"] = (close / vwap - 1) * 100.0
+
+    # --- 収益率・傾き ---
+    cols["RET_1"] = _pct_change(close, 1)
+    cols["RET_5"] = _pct_change(close, 5)
+    cols["RET_20"] = _pct_change(close, 20)
+
+    cols[f"SLOPE_{cfg.slope_short}"] = _slope(close, cfg.slope_short)
+    cols[f"SLOPE_{cfg.slope_mid}"] = _slope(close, cfg.slope_mid)
+
+    # --- ゴールデンクロス/デッドクロス ---
+    ma_s, ma_m = cols[f"MA{cfg.ma_short}"], cols[f"MA{cfg.ma_mid}"]
+    with np.errstate(invalid="ignore"):
+        above = ((ma_s - ma_m) > MA_CROSS_REL * np.abs(ma_m)).astype(np.int64)
+    prev = np.zeros_like(above)
+    prev[1:] = above[:-1]
+    cross = above - prev
+    cols["GCROSS"] = (cross == 1).astype("float64")
+    cols["DCROSS"] = (cross == -1).astype("float64")
+
+    # --- 52週高安値 / 上場来高安値 ---
+    window_52w = 252
+    cols["HIGH_52W"] = _rolling_extreme(close, window_52w, np.fmax)
+    cols["LOW_52W"] = _rolling_extreme(close, window_52w, np.fmin)
+    cols["HIGH_ALL"] = np.fmax.accumulate(close, axis=0)
+    cols["LOW_ALL"] = np.fmin.accumulate(close, axis=0)
+
+    # --- 最終の軽い欠損処理（make_features と同じ列・同じ順） ---
+    for c in ("Open", "High", "Low", "Close", "VWAP", "BBU", "BBM", "BBL"):
+        cols[c] = _ffill(cols[c])
+
+    indi_cols = [
+        f"MA{cfg.ma_short}",
+        f"MA{cfg.ma_mid}",
+        f"MA{cfg.ma_long}",
+        f"MA{cfg.ma_extra1}",
+        f"MA{cfg.ma_extra2}",
+        f"ATR{cfg.atr_period}",
+        f"RSI{cfg.rsi_period}",
+        "MACD",
+        "MACD_SIGNAL",
+        "MACD_HIST",
+        "BB_Z",
+        f"SLOPE_{cfg.slope_short}",
+        f"SLOPE_{cfg.slope_mid}",
+        "VWAP_GAP_PCT",
+        "RET_1",
+        "RET_5",
+        "RET_20",
+        "HIGH_52W",
+        "LOW_52W",
+        "HIGH_ALL",
+        "LOW_ALL",
+    ]
+    # 右詰めの上側パディングは frame() で捨てるので、bfill で埋まっても影響しない
+    for c in indi_cols:
+        cols[c] = _bfill(_ffill(cols[c]))
+
+    return FeaturePanel(
+        codes=[str(c) for c in p["codes"]],
+        dates=p["dates"],
+        lengths=p["lengths"],
+        columns=cols,
+    )
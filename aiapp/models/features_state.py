@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+aiapp.models.features_state
+make_features の「最終行」を 1本ずつ積み上げで更新するための指標ステート。
+
+- make_features は毎回 260本ぶんの EMA/RSI/ATR/MACD/BB を最初から計算し直す
+- ここでは銘柄ごとに
+    EMA の累積状態（重み・観測数） / 移動平均の窓内合計 / 直近の終値バッファ /
+    上場来高安 / ffill 用の直前値
+  を持っておき、新しい日足が1本来たら advance() で O(1)（窓長ぶんの小さな計算だけ）で進める
+- 計算式は make_features と同じ（pandas ewm(adjust=False) の再帰・rolling・ffill を1本ずつ再現）
+- to_dict() / from_dict() で JSON に落とせる（保存は aiapp.services.indicator_state）
+
+注意:
+- ステートが表すのは「積み上げてきた全履歴」に対する make_features の最終行。
+  get_prices(nbars=260) のように窓を切った DF に対する make_features とは
+  EMA の初期値ぶんだけ僅かにズレる（履歴が長いほど正確）。
+- verify_state() で同じ価格列に対するフル再計算と突き合わせられる。
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .features import FeatureConfig, _ensure_ohlcv, make_features
+
+STATE_VERSION = 1
+
+# 52週 ≒ 252営業日（make_features と同じ近似）
+WINDOW_52W = 252
+
+# 窓内合計の誤差が溜まらないよう、この本数ごとにバッファから合計を取り直す
+RESUM_EVERY = 256
+
+# 上場来高安は「ステートが見てきた全履歴」なので、ストアが古い足を捨てた後はフル再計算と一致しない
+ALL_TIME_COLS = ("HIGH_ALL", "LOW_ALL")
+
+
+def cfg_key(cfg: Optional[FeatureConfig] = None) -> Dict[str, Any]:
+    """
+    ステートの互換判定に使う設定値（数値パラメータだけ）。
+    """
+    cfg = cfg or FeatureConfig()
+    out: Dict[str, Any] = {}
+    for f in fields(cfg):
+        v = getattr(cfg, f.name)
+        if isinstance(v, (bool, int, float)):
+            out[f.name] = v
+    return out
+
+
+def _nan() -> float:
+    return float("nan")
+
+
+def _isnan(x: Optional[float]) -> bool:
+    return x is None or x != x
+
+
+def _to_json_float(x: Optional[float]) -> Optional[float]:
+    if x is None:
+        return None
+    x = float(x)
+    return None if math.isnan(x) or math.isinf(x) else x
+
+
+def _from_json_float(x: Any) -> float:
+    return _nan() if x is None else float(x)
+
+
+def _ewm_step(st: List[float], x: float, span: int) -> float:
+    """
+    pandas の ewm(span, adjust=False, min_periods=span).mean() を1本だけ進める。
+    st = [weighted, old_wt, nobs]
+    """
+    alpha = 2.0 / (span + 1.0)
+    wgt, old_wt, nobs = st
+    obs = not _isnan(x)
+    if obs:
+        nobs += 1
+    if not _isnan(wgt):
+        old_wt *= 1.0 - alpha
+        if obs:
+            if wgt != x:
+                wgt = (old_wt * wgt + alpha * x) / (old_wt + alpha)
+            old_wt = 1.0
+    elif obs:
+        wgt = x
+    st[0], st[1], st[2] = wgt, old_wt, nobs
+    return wgt if nobs >= span else _nan()
+
+
+def _std(y: List[float], ddof: int) -> float:
+    n = len(y)
+    mu = sum(y) / n
+    return math.sqrt(sum((v - mu) * (v - mu) for v in y) / (n - ddof))
+
+
+def _slope_fit(y: List[float]) -> float:
+    """
+    features._slope の _fit と同じ式（標準化 x,y の傾き）。
+    窓は高々数十本なので numpy を経由しない方が速い。
+    """
+    n = len(y)
+    xm = (n - 1) / 2.0
+    xs = _std([float(k) for k in range(n)], 0) + 1e-12
+    ym = sum(y) / n
+    ys = _std(y, 0) + 1e-12
+    dot = sum(((k - xm) / xs) * ((v - ym) / ys) for k, v in enumerate(y))
+    return dot / (n - 1)
+
+
+@dataclass
+class IndicatorState:
+    """
+    1銘柄ぶんの指標ステート。advance() で日足を1本ずつ進める。
+    """
+
+    cfg: Dict[str, Any] = field(default_factory=cfg_key)
+    n_bars: int = 0
+    last_date: Optional[str] = None
+    # 直近の確定終値（ffill 後）。窓計算用に必要な本数だけ持つ
+    closes: List[float] = field(default_factory=list)
+    # 先頭の欠損を除いた有効終値の本数
+    n_valid: int = 0
+    # 移動平均の窓長 -> 窓内合計
+    sums: Dict[int, float] = field(default_factory=dict)
+    # EMA 名 -> [weighted, old_wt, nobs]
+    ema: Dict[str, List[float]] = field(default_factory=dict)
+    # ffill 用（直前に出した最終行の値）
+    last: Dict[str, float] = field(default_factory=dict)
+    prev_above: bool = False
+    high_all: float = field(default_factory=_nan)
+    low_all: float = field(default_factory=_nan)
+    version: int = STATE_VERSION
+
+    # ---------- 設定 ----------
+
+    @property
+    def config(self) -> FeatureConfig:
+        return FeatureConfig(**self.cfg)
+
+    def _ma_windows(self) -> List[int]:
+        c = self.cfg
+        ws = {c["ma_short"], c["ma_mid"], c["ma_long"], c["ma_extra1"], c["ma_extra2"], c["bb_window"]}
+        return sorted(int(w) for w in ws)
+
+    def _buf_len(self) -> int:
+        c = self.cfg
+        return max(self._ma_windows() + [int(c["slope_mid"]), int(c["slope_short"]), WINDOW_52W, 20]) + 1
+
+    def compatible(self, cfg: Optional[FeatureConfig] = None) -> bool:
+        return self.version == STATE_VERSION and self.cfg == cfg_key(cfg)
+
+    # ---------- 1本進める ----------
+
+    def advance(self, ts, o: float, h: float, l: float, c: float, v: float) -> Dict[str, float]:
+        """
+        日足1本ぶん進めて、その足での make_features 相当の1行を返す。
+        """
+        cfg = self.cfg
+
+        # --- make_features 冒頭の欠損埋め ---
+        prev_close = self.last.get("Close", _nan())
+        if _isnan(c):
+            c = prev_close
+        if _isnan(o):
+            o = c
+        oc = [x for x in (o, c) if not _isnan(x)]
+        if _isnan(h):
+            h = max(oc) if oc else _nan()
+        if _isnan(l):
+            l = min(oc) if oc else _nan()
+        if _isnan(v):
+            v = 0.0
+
+        row: Dict[str, float] = {"Open": o, "High": h, "Low": l, "Close": c, "Volume": v}
+
+        # --- 終値バッファ / 窓内合計 ---
+        valid = not _isnan(c)
+        if valid:
+            self.closes.append(float(c))
+            self.n_valid += 1
+            for w in self._ma_windows():
+                s = self.sums.get(w, 0.0) + c
+                if self.n_valid > w:
+                    s -= self.closes[-(w + 1)]
+                self.sums[w] = s
+            buf = self._buf_len()
+            if len(self.closes) > buf:
+                del self.closes[: len(self.closes) - buf]
+            if self.n_valid % RESUM_EVERY == 0:
+                for w in self._ma_windows():
+                    if self.n_valid >= w:
+                        self.sums[w] = float(np.sum(self.closes[-w:]))
+        closes = self.closes
+
+        def ma(w: int) -> float:
+            return self.sums[w] / w if valid and self.n_valid >= w else _nan()
+
+        def window(w: int) -> Optional[List[float]]:
+            if not valid or self.n_valid < w:
+                return None
+            return closes[-w:]
+
+        def ret(k: int) -> float:
+            if not valid or self.n_valid <= k:
+                return _nan()
+            base = closes[-(k + 1)]
+            if base == 0:
+                return _nan()
+            r = c / base - 1.0
+            return r if math.isfinite(r) else _nan()
+
+        # --- 移動平均・ボリンジャー ---
+        for key in ("ma_short", "ma_mid", "ma_long", "ma_extra1", "ma_extra2"):
+            w = int(cfg[key])
+            row[f"MA{w}"] = ma(w)
+
+        bw = int(cfg["bb_window"])
+        bb_win = window(bw)
+        bbm = ma(bw)
+        sd = _std(bb_win, 1) if bb_win is not None and bw > 1 else _nan()
+        row["BBU"] = bbm + cfg["bb_sigma"] * sd
+        row["BBM"] = bbm
+        row["BBL"] = bbm - cfg["bb_sigma"] * sd
+        row["BB_Z"] = (c - bbm) / sd if not _isnan(sd) and sd != 0 else _nan()
+
+        # --- RSI ---
+        rp = int(cfg["rsi_period"])
+        delta = c - prev_close
+        up = max(delta, 0.0) if not _isnan(delta) else _nan()
+        down = -min(delta, 0.0) if not _isnan(delta) else _nan()
+        ma_up = _ewm_step(self.ema.setdefault("rsi_up", [_nan(), 1.0, 0]), up, rp)
+        ma_down = _ewm_step(self.ema.setdefault("rsi_down", [_nan(), 1.0, 0]), down, rp)
+        if _isnan(ma_up) or _isnan(ma_down) or ma_down == 0:
+            row[f"RSI{rp}"] = _nan()
+        else:
+            row[f"RSI{rp}"] = 100 - (100 / (1 + ma_up / ma_down))
+
+        # --- MACD ---
+        fast = _ewm_step(self.ema.setdefault("macd_fast", [_nan(), 1.0, 0]), c, int(cfg["macd_fast"]))
+        slow = _ewm_step(self.ema.setdefault("macd_slow", [_nan(), 1.0, 0]), c, int(cfg["macd_slow"]))
+        line = fast - slow
+        sig = _ewm_step(self.ema.setdefault("macd_signal", [_nan(), 1.0, 0]), line, int(cfg["macd_signal"]))
+        row["MACD"], row["MACD_SIGNAL"], row["MACD_HIST"] = line, sig, line - sig
+
+        # --- ATR ---
+        trs = [x for x in (h - l, abs(h - prev_close), abs(l - prev_close)) if not _isnan(x)]
+        tr = max(trs) if trs else _nan()
+        ap = int(cfg["atr_period"])
+        row[f"ATR{ap}"] = _ewm_step(self.ema.setdefault("atr", [_nan(), 1.0, 0]), tr, ap)
+
+        # --- VWAP（日足は1日1本なので、その足の TypicalPrice。出来高0なら直前値）---
+        vwap = ((h + l + c) / 3.0 * v) / v if v != 0 else _nan()
+        if _isnan(vwap):
+            vwap = self.last.get("VWAP", _nan())
+        row["VWAP"] = vwap
+        row["VWAP_GAP_PCT"] = (c / vwap - 1) * 100.0 if not _isnan(vwap) and vwap != 0 else _nan()
+
+        # --- 収益率・傾き ---
+        row["RET_1"] = ret(1)
+        row["RET_5"] = ret(5)
+        row["RET_20"] = ret(20)
+        for key in ("slope_short", "slope_mid"):
+            w = int(cfg[key])
+            y = window(w) if w >= 2 else None
+            row[f"SLOPE_{w}"] = _slope_fit(y) if y is not None else _nan()
+
+        # --- GC/DC ---
+        ms, mm = row[f"MA{int(cfg['ma_short'])}"], row[f"MA{int(cfg['ma_mid'])}"]
+        above = bool(ms > mm)  # NaN 比較は False（make_features と同じ）
+        cross = int(above) - int(self.prev_above)
+        self.prev_above = above
+        row["GCROSS"] = int(cross == 1)
+        row["DCROSS"] = int(cross == -1)
+
+        # --- 52週 / 上場来 ---
+        if valid:
+            w52 = closes[-WINDOW_52W:]
+            row["HIGH_52W"] = float(max(w52))
+            row["LOW_52W"] = float(min(w52))
+            self.high_all = c if _isnan(self.high_all) else max(self.high_all, c)
+            self.low_all = c if _isnan(self.low_all) else min(self.low_all, c)
+        else:
+            row["HIGH_52W"] = row["LOW_52W"] = _nan()
+        row["HIGH_ALL"] = self.high_all
+        row["LOW_ALL"] = self.low_all
+
+        # --- 最終の ffill（make_features の price_cols / indi_cols と同じ）---
+        for k, val in row.items():
+            if k in ("Volume", "GCROSS", "DCROSS"):
+                continue
+            if _isnan(val):
+                row[k] = self.last.get(k, _nan())
+        self.last = {k: float(val) for k, val in row.items()}
+
+        self.n_bars += 1
+        self.last_date = pd.Timestamp(ts).strftime("%Y-%m-%d")
+        return row
+
+    def row(self) -> Dict[str, float]:
+        """
+        直近に advance した足の1行（make_features(...).iloc[-1] 相当）。
+        """
+        out = dict(self.last)
+        for k in ("GCROSS", "DCROSS"):
+            if k in out:
+                out[k] = int(out[k])
+        return out
+
+    # ---------- 保存形式 ----------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "cfg": dict(self.cfg),
+            "n_bars": self.n_bars,
+            "last_date": self.last_date,
+            "closes": [_to_json_float(x) for x in self.closes],
+            "n_valid": self.n_valid,
+            "sums": {str(k): _to_json_float(v) for k, v in self.sums.items()},
+            "ema": {k: [_to_json_float(v[0]), _to_json_float(v[1]), int(v[2])] for k, v in self.ema.items()},
+            "last": {k: _to_json_float(v) for k, v in self.last.items()},
+            "prev_above": bool(self.prev_above),
+            "high_all": _to_json_float(self.high_all),
+            "low_all": _to_json_float(self.low_all),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "IndicatorState":
+        return cls(
+            version=int(d.get("version", 0)),
+            cfg=dict(d.get("cfg") or {}),
+            n_bars=int(d.get("n_bars", 0)),
+            last_date=d.get("last_date"),
+            closes=[_from_json_float(x) for x in (d.get("closes") or [])],
+            n_valid=int(d.get("n_valid", 0)),
+            sums={int(k): _from_json_float(v) for k, v in (d.get("sums") or {}).items()},
+            ema={
+                k: [_from_json_float(v[0]), _from_json_float(v[1]), int(v[2])]
+                for k, v in (d.get("ema") or {}).items()
+            },
+            last={k: _from_json_float(v) for k, v in (d.get("last") or {}).items()},
+            prev_above=bool(d.get("prev_above", False)),
+            high_all=_from_json_float(d.get("high_all")),
+            low_all=_from_json_float(d.get("low_all")),
+        )
+
+
+# ========= DataFrame とのやりとり =========
+
+def _bars_after(raw: pd.DataFrame, last_date: Optional[str]) -> pd.DataFrame:
+    df = _ensure_ohlcv(raw)
+    if last_date:
+        idx = df.index.tz_localize(None) if getattr(df.index, "tz", None) is not None else df.index
+        df = df[idx > pd.Timestamp(last_date)]
+    return df
+
+
+def advance_frame(state: IndicatorState, raw: pd.DataFrame) -> int:
+    """
+    raw のうち state.last_date より後ろの足だけを順に積む。積んだ本数を返す。
+    """
+    if raw is None or len(raw) == 0:
+        return 0
+    df = _bars_after(raw, state.last_date)
+    vals = df[["Open", "High", "Low", "Close", "Volume"]].to_numpy(dtype="float64")
+    for ts, (o, h, l, c, v) in zip(df.index, vals):
+        state.advance(ts, o, h, l, c, v)
+    return len(df)
+
+
+def build_state(raw: pd.DataFrame, cfg: Optional[FeatureConfig] = None) -> IndicatorState:
+    """
+    価格列の先頭から積み上げて新しいステートを作る。
+    """
+    state = IndicatorState(cfg=cfg_key(cfg))
+    advance_frame(state, raw)
+    return state
+
+
+def verify_state(
+    state: IndicatorState,
+    raw: pd.DataFrame,
+    *,
+    rtol: float = 1e-9,
+    atol: float = 1e-9,
+) -> Dict[str, Any]:
+    """
+    同じ価格列に対する make_features のフル再計算（最終行）と突き合わせる。
+    戻り値: {"ok": bool, "date": ..., "mismatches": {col: (state, full)}, "skipped": [...]}
+    raw の本数よりステートが長い（ストアが古い足を捨てた）場合、上場来高安は比較しない。
+    """
+    out: Dict[str, Any] = {"ok": True, "date": state.last_date, "mismatches": {}, "skipped": []}
+    if raw is None or len(raw) == 0 or state.last_date is None:
+        out["ok"] = False
+        out["error"] = "no data"
+        return out
+
+    df = _ensure_ohlcv(raw)
+    idx = df.index.tz_localize(None) if getattr(df.index, "tz", None) is not None else df.index
+    df = df[idx <= pd.Timestamp(state.last_date)]
+    if df.empty:
+        out["ok"] = False
+        out["error"] = "state is ahead of prices"
+        return out
+
+    full = make_features(df, cfg=state.config).iloc[-1]
+    if pd.Timestamp(df.index[-1]).strftime("%Y-%m-%d") != state.last_date:
+        out["ok"] = False
+        out["error"] = "last date mismatch"
+        return out
+
+    skip = set(ALL_TIME_COLS) if state.n_bars > len(df) else set()
+    out["skipped"] = sorted(skip)
+    row = state.row()
+    for col, want in full.items():
+        if col in skip or col not in row:
+            continue
+        got = row[col]
+        want = float(want)
+        if _isnan(got) and _isnan(want):
+            continue
+        if _isnan(got) or _isnan(want) or abs(got - want) > atol + rtol * abs(want):
+            out["mismatches"][col] = (got, want)
+    out["ok"] = not out["mismatches"]
+    return out
@@ -1,6 +1,8 @@
 # aiapp/models/vtrade.py
 from __future__ import annotations
 
+from typing import Any, Dict, List
+
 from django.conf import settings
 from django.db import models
 
@@ -96,6 +98,12 @@ class VirtualTrade(models.Model):
     rank_pro = models.IntegerField(null=True, blank=True)
     rank_group_pro = models.CharField(max_length=16, blank=True, default="")
 
+    # PRO公式記録の非正規化（simulate_list の絞り込み・KPI 集計を SQL でやるため）
+    # replay / eval_* から compute_pro_fields() で作る。書く側（ai_simulate_auto / ai_sim_eval 等）が一緒に更新する
+    pro_status = models.CharField(max_length=32, blank=True, default="")  # replay.pro.status（accepted / skipped_by_pro_filter / ...）
+    pro_label = models.CharField(max_length=8, blank=True, default="")    # win / lose / flat / carry / skip
+    pro_pl = models.FloatField(null=True, blank=True)                     # replay.pro.last_eval.pl_pro（carry 中は None）
+
     # ---- sizing per broker (UI表示用に残す) ----
     qty_rakuten = models.IntegerField(null=True, blank=True)
     qty_sbi = models.IntegerField(null=True, blank=True)
@@ -150,6 +158,7 @@ class VirtualTrade(models.Model):
             models.Index(fields=["user", "run_date"]),
             models.Index(fields=["user", "run_date", "rank_pro"]),
             models.Index(fields=["user", "entry_reason", "run_date"]),
+            models.Index(fields=["user", "pro_status", "opened_at"]),
         ]
         constraints = [
             models.UniqueConstraint(fields=["user", "run_id", "code"], name="uq_aiapp_vtrade_user_runid_code"),
@@ -176,4 +185,85 @@ class VirtualTrade(models.Model):
     def recompute_r(self) -> None:
         self.result_r_rakuten = self._safe_r(self.eval_pl_rakuten, self.est_loss_rakuten)
         self.result_r_sbi = self._safe_r(self.eval_pl_sbi, self.est_loss_sbi)
-        self.result_r_matsui = self._safe_r(self.eval_pl_matsui, self.est_loss_matsui)
\ No newline at end of file
+        self.result_r_matsui = self._safe_r(self.eval_pl_matsui, self.est_loss_matsui)
+
+    # ---- PRO公式記録の非正規化 ----
+    PRO_FIELDS = ("pro_status", "pro_label", "pro_pl")
+
+    @staticmethod
+    def compute_pro_fields(*, replay: Any, eval_exit_reason: Any, closed_at: Any, eval_entry_px: Any) -> Dict[str, Any]:
+        """
+        pro_status / pro_label / pro_pl を replay と eval_* から計算する。
+
+        pro_label（PRO公式の「勝ち/負け/引き分け/持ち越し/見送り」統一ラベル）
+          最優先：replay.pro.last_eval.label（ai_sim_evalが確定させる）
+          フォールバック：eval_exit_reason + 状態
+        """
+        replay = replay if isinstance(replay, dict) else {}
+        pro = replay.get("pro") if isinstance(replay.get("pro"), dict) else {}
+        last_eval = pro.get("last_eval") if isinstance(pro.get("last_eval"), dict) else {}
+
+        pl = None
+        try:
+            if last_eval.get("pl_pro") is not None:
+                pl = float(last_eval.get("pl_pro"))
+        except Exception:
+            pl = None
+
+        return {
+            "pro_status": str(pro.get("status") or "")[:32],
+            "pro_label": VirtualTrade._pro_label(last_eval, str(eval_exit_reason or "").strip(), closed_at, eval_entry_px),
+            "pro_pl": pl,
+        }
+
+    @staticmethod
+    def _pro_label(last_eval: Dict[str, Any], exit_reason: str, closed_at: Any, eval_entry_px: Any) -> str:
+        label = str(last_eval.get("label") or "").strip().lower()
+        if label in ("win", "lose", "flat", "carry", "skip"):
+            return label
+
+        if exit_reason == "hit_tp":
+            return "win"
+        if exit_reason == "hit_sl":
+            return "lose"
+        if exit_reason == "time_stop":
+            plps = last_eval.get("pl_per_share")
+            try:
+                if plps is not None:
+                    plps_f = float(plps)
+                    if plps_f > 0:
+                        return "win"
+                    if plps_f < 0:
+                        return "lose"
+                    return "flat"
+            except Exception:
+                pass
+            return "skip"
+        if exit_reason == "carry":
+            return "carry"
+        if exit_reason:
+            return "skip"
+
+        if closed_at is None and (eval_entry_px is not None):
+            return "carry"
+
+        return "skip"
+
+    def pro_fields(self) -> Dict[str, Any]:
+        return self.compute_pro_fields(
+            replay=self.replay,
+            eval_exit_reason=self.eval_exit_reason,
+            closed_at=self.closed_at,
+            eval_entry_px=self.eval_entry_px,
+        )
+
+    def sync_pro_fields(self) -> List[str]:
+        """
+        pro_fields() を自分に反映する。戻り値は変わったフィールド名（save(update_fields=...) 用）
+        """
+        changed: List[str] = []
+        for name, value in self.pro_fields().items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed.append(name)
+        return changed
@@ -1,54 +1,37 @@
 # aiapp/services/bars_5m.py
 # -*- coding: utf-8 -*-
+"""
+ai_sim_eval / preview_simulate_level3 用の 5分足ローダ。
+中身は aiapp.services.intraday_store（1日1ファイル・全銘柄）の薄いアダプタ。
+旧キャッシュ media/aiapp/bars_5m/<code>/YYYYMMDD.parquet は、見つかればストアに取り込まれる。
+"""
 from __future__ import annotations
 
 import logging
-from datetime import date as _date, datetime as _dt, time as _time, timedelta as _td
-from pathlib import Path
-from typing import Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as _date
+from typing import Dict, Iterable, List, Tuple
 
 import pandas as pd
-import yfinance as yf
-from django.conf import settings
-from django.utils import timezone
-
-logger = logging.getLogger(__name__)
-
-# 5分足キャッシュの保存先
-BARS_5M_DIR = Path(settings.MEDIA_ROOT) / "aiapp" / "bars_5m"
 
+from aiapp.services import intraday_store
 
-def _jst_today() -> _date:
-    """JSTベースの「今日の日付」"""
-    return timezone.localdate()
-
+logger = logging.getLogger(__name__)
 
-def _yf_symbol(code: str) -> str:
-    """
-    JPX銘柄コード → yfinance シンボル
-    例: "7508" -> "7508.T"
-    """
-    code = str(code).strip()
-    if not code:
-        return ""
-    if code.endswith(".T"):
-        return code
-    return f"{code}.T"
+# 旧 5分足キャッシュの保存先（読み取りのみ。intraday_store が取り込む）
+BARS_5M_DIR = intraday_store.LEGACY_BARS_5M_DIR
 
+COLS = ["ts", "open", "high", "low", "close", "volume"]
 
-def _cache_path(code: str, d: _date) -> Path:
-    """
-    1銘柄・1日ごとのキャッシュファイルパス
-    例: media/aiapp/bars_5m/7508/20251127.parquet
-    """
-    return BARS_5M_DIR / str(code) / f"{d.strftime('%Y%m%d')}.parquet"
+# prefetch_5m_bars で同時に読む日数（1日 = ファイル1本 + 足りない銘柄の yfinance 1回）
+PREFETCH_WORKERS = int(os.getenv("AIAPP_BARS_5M_WORKERS", "4"))
 
 
 def load_5m_bars(code: str, trade_date: _date) -> pd.DataFrame:
     """
     指定銘柄・指定営業日1日分の 5分足を返す。
-    - まずローカルキャッシュ（parquet）を見て、あればそれを返す
-    - 無ければ yfinance から取得してキャッシュ保存
+    - intraday_store の当日ファイル（無い銘柄は旧キャッシュ → yfinance で埋める）
     - 将来日付（today より後）は取得を試みず、空 DataFrame を返す
 
     戻り値の DataFrame カラム:
@@ -57,87 +40,52 @@ def load_5m_bars(code: str, trade_date: _date) -> pd.DataFrame:
       high    : float
       low     : float
       close   : float
-      volume  : float or int
+      volume  : float
     """
     if not trade_date:
         return pd.DataFrame()
 
-    today = _jst_today()
-    if trade_date > today:
-        # 未来日は問答無用でスキップ（YFに取りに行かない）
-        logger.info(f"[bars_5m] skip future date {trade_date} for {code}")
+    df = intraday_store.load_bars(code, trade_date)
+    if df is None or df.empty:
+        logger.info(f"[bars_5m] no 5m bars for {code} {trade_date}")
         return pd.DataFrame()
+    return df[COLS]
 
-    symbol = _yf_symbol(code)
-    if not symbol:
-        return pd.DataFrame()
-
-    # キャッシュパス
-    path = _cache_path(code, trade_date)
-    path.parent.mkdir(parents=True, exist_ok=True)
 
-    # 1) キャッシュヒット
-    if path.exists():
+def prefetch_5m_bars(
+    keys: Iterable[Tuple[str, _date]],
+    *,
+    max_workers: int = 0,
+) -> Dict[Tuple[str, _date], pd.DataFrame]:
+    """
+    (code, date) の組をまとめて読む。戻り値は {(code, date): load_5m_bars と同じ形}。
+    - 日付ごとに intraday_store.load_day を1回（その日の銘柄をまとめて）
+    - 日付どうしは max_workers 本のスレッドで並行に読む（0 なら PREFETCH_WORKERS）
+    - データが無い組は空 DataFrame（load_5m_bars と同じ）
+    """
+    by_date: Dict[_date, List[str]] = {}
+    for code, d in keys:
+        if d:
+            by_date.setdefault(d, []).append(str(code))
+    if not by_date:
+        return {}
+
+    def _one(d: _date) -> Dict[Tuple[str, _date], pd.DataFrame]:
+        codes = by_date[d]
         try:
-            df = pd.read_parquet(path)
-            # 最低限のカラムチェック
-            if {"ts", "open", "high", "low", "close"}.issubset(df.columns):
-                return df
+            got = intraday_store.load_day(d, codes)
         except Exception as e:
-            logger.warning(f"[bars_5m] failed to read cache {path}: {e}")
-
-    # 2) yfinance から取得
-    start = _dt.combine(trade_date, _time(0, 0))
-    end = start + _td(days=1)
-
-    try:
-        yf_df = yf.download(
-            symbol,
-            interval="5m",
-            start=start,
-            end=end,
-            auto_adjust=False,      # FutureWarning 回避
-            progress=False,
-        )
-    except Exception as e:
-        logger.info(f"[bars_5m] yf.download failed for {symbol} {trade_date}: {e}")
-        return pd.DataFrame()
-
-    if yf_df is None or yf_df.empty:
-        logger.info(f"[bars_5m] no data from yfinance for {symbol} {trade_date}")
-        return pd.DataFrame()
-
-    # yfinance 戻り値を整形
-    # index: Datetime (tz付き or tzなし)
-    idx = yf_df.index
-
-    try:
-        # tz付きなら JST へ変換、tzなしなら JST としてローカライズ
-        if getattr(idx, "tz", None) is None:
-            ts = idx.tz_localize("Asia/Tokyo")
-        else:
-            ts = idx.tz_convert("Asia/Tokyo")
-    except Exception:
-        # 失敗したらそのまま（tzなし）で持つ
-        ts = idx
-
-    df = yf_df[["Open", "High", "Low", "Close", "Volume"]].copy()
-    df.insert(0, "ts", ts)
-    df.rename(
-        columns={
-            "Open": "open",
-            "High": "high",
-            "Low": "low",
-            "Close": "close",
-            "Volume": "volume",
-        },
-        inplace=True,
-    )
-
-    # キャッシュ保存（失敗しても致命的ではない）
-    try:
-        df.to_parquet(path, index=False)
-    except Exception as e:
-        logger.warning(f"[bars_5m] failed to write cache {path}: {e}")
-
-    return df
\ No newline at end of file
+            logger.warning(f"[bars_5m] prefetch failed for {d}: {e}")
+            got = {}
+        out: Dict[Tuple[str, _date], pd.DataFrame] = {}
+        for code in codes:
+            g = got.get(intraday_store._norm_code(code))
+            out[(code, d)] = g[COLS].copy() if g is not None and len(g) else pd.DataFrame()
+        return out
+
+    workers = max(1, min(int(max_workers or PREFETCH_WORKERS), len(by_date)))
+    result: Dict[Tuple[str, _date], pd.DataFrame] = {}
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for part in ex.map(_one, sorted(by_date)):
+            result.update(part)
+    return result
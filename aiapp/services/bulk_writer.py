@@ -0,0 +1,121 @@
+# aiapp/services/bulk_writer.py
+# -*- coding: utf-8 -*-
+"""
+bulk_writer.py（1行ずつの UPDATE をやめて、まとめて bulk_update する）
+
+背景:
+- ai_sim_eval / backfill_pro_all は結果を1件ずつ save() / filter(id=...).update() していた
+- SQLite だと「小さい書き込みトランザクション × 数千」になり、その間 Web 側がロックで待たされる
+
+使い方:
+    w = BulkWriter(VirtualTrade, dry_run=dry_run)
+    w.set(v, eval_exit_reason="carry", closed_at=None)   # 値が変わる件だけ積む
+    ...
+    w.flush()                                            # batch_size 件ごとに1トランザクション・1文
+
+- set() に渡したフィールドは「どれか1つでも変わっていれば」全部書く（同じフィールド組は1文にまとまる）
+- JSONField（replay など）は元の dict をその場で書き換えると差分が取れないので、コピーしてから渡すこと
+- dry_run=True なら書かずに差分（diffs）だけ溜める
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Tuple
+
+from django.db import transaction
+
+# 1文（= 1トランザクション）あたりの行数
+BULK_BATCH_SIZE = int(os.getenv("AIAPP_BULK_BATCH_SIZE", "500"))
+
+
+def _same(a: Any, b: Any) -> bool:
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+class BulkWriter:
+    def __init__(self, model, *, dry_run: bool = False, batch_size: int = 0):
+        self.model = model
+        self.dry_run = bool(dry_run)
+        self.batch_size = max(1, int(batch_size or BULK_BATCH_SIZE))
+
+        # {pk: (obj, [field, ...])}
+        self._pending: Dict[Any, Tuple[Any, List[str]]] = {}
+
+        # [(pk, {field: (old, new)})]
+        self.diffs: List[Tuple[Any, Dict[str, Tuple[Any, Any]]]] = []
+
+        self.rows = 0         # flush で書いた行数（dry_run なら書くはずだった行数）
+        self.statements = 0   # 発行した UPDATE 文の数
+
+    def set(self, obj, **values) -> Dict[str, Tuple[Any, Any]]:
+        """
+        obj に values を代入して書き込み待ちに積む。戻り値は差分 {field: (old, new)}（変化なしなら空）。
+        """
+        diff: Dict[str, Tuple[Any, Any]] = {}
+        for name, new in values.items():
+            old = getattr(obj, name, None)
+            if not _same(old, new):
+                diff[name] = (old, new)
+        if not diff:
+            return diff
+
+        self.diffs.append((obj.pk, diff))
+        if self.dry_run:
+            return diff
+
+        for name, new in values.items():
+            setattr(obj, name, new)
+
+        hit = self._pending.get(obj.pk)
+        if hit is None:
+            self._pending[obj.pk] = (obj, list(values))
+        else:
+            fields = hit[1]
+            fields.extend(f for f in values if f not in fields)
+            self._pending[obj.pk] = (obj, fields)
+        return diff
+
+    def flush(self) -> int:
+        """
+        積んだ分を書き込む。同じフィールド組ごとに batch_size 件ずつ bulk_update（1バッチ = 1トランザクション）。
+        戻り値: 今回書いた行数
+        """
+        if self.dry_run:
+            n = len(self.diffs) - self.rows
+            self.rows = len(self.diffs)
+            return n
+
+        groups: Dict[Tuple[str, ...], List[Any]] = {}
+        for obj, fields in self._pending.values():
+            groups.setdefault(tuple(sorted(fields)), []).append(obj)
+        self._pending = {}
+
+        n = 0
+        for fields, objs in groups.items():
+            for start in range(0, len(objs), self.batch_size):
+                chunk = objs[start : start + self.batch_size]
+                with transaction.atomic():
+                    self.model.objects.bulk_update(chunk, list(fields), batch_size=self.batch_size)
+                self.statements += 1
+                n += len(chunk)
+
+        self.rows += n
+        return n
+
+    def format_diffs(self, limit: int = 80) -> List[str]:
+        """
+        dry-run の表示用（1行 = 1件）。値は limit 文字で切る。
+        """
+        def _short(x: Any) -> str:
+            s = repr(x)
+            return s if len(s) <= limit else s[: limit - 3] + "..."
+
+        out: List[str] = []
+        for pk, diff in self.diffs:
+            parts = [f"{k}: {_short(a)} -> {_short(b)}" for k, (a, b) in diff.items()]
+            out.append(f"id={pk} " + " | ".join(parts))
+        return out
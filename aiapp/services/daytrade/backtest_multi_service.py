@@ -34,7 +34,7 @@ from typing import Any, Dict, List, Tuple, Optional
 import numpy as np
 import pandas as pd
 
-from aiapp.services.daytrade.bars_5m_daytrade import load_daytrade_5m_bars
+from aiapp.services.daytrade.bars_5m_daytrade import load_daytrade_5m_day
 from aiapp.services.daytrade.bar_adapter_5m import df_to_bars_5m
 from aiapp.services.daytrade.backtest_runner import run_backtest_one_day
 
@@ -297,11 +297,14 @@ def run_daytrade_backtest_multi(
         run_log_lines.append(f"tickers = {tickers}")
         run_log_lines.append("")
 
+    # 5分足は日ごとに全銘柄まとめて読む（intraday_store の1日1ファイル）
+    day_bars = {d: load_daytrade_5m_day(tickers, d) for d in dates}
+
     for t in tickers:
         agg = Agg(max_dd_yen=0)
 
         for d in dates:
-            df = load_daytrade_5m_bars(t, d, force_refresh=False)
+            df = day_bars[d].get(t)
             if df is None or df.empty:
                 continue
 
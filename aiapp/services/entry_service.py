@@ -18,6 +18,10 @@ AI Picks 用の Entry / TP / SL を動的に計算するサービス
 - shape（係数）を「simulate 側で吐ける」ように、係数を返す関数を追加する。
   compute_shape_coeffs() -> entry_k / rr_target / tp_k / sl_k
   これを compute_entry_tp_sl() も内部で利用して、価格計算と shape を一致させる。
+
+★配列版
+- compute_entry_tp_sl_vec(): last / atr を配列で受けて、compute_entry_tp_sl と同じ値をまとめて返す
+  （build_replay_dataset が過去の全銘柄×全営業日に一括で当てる用）
 """
 
 from __future__ import annotations
@@ -25,6 +29,8 @@ from typing import Any, Optional, Tuple, Dict
 
 import math
 
+import numpy as np
+
 
 def _safe_float(x: Any) -> Optional[float]:
     """どんな入力でも float or None に丸める"""
@@ -42,6 +48,35 @@ def _clamp(x: float, lo: float, hi: float) -> float:
     return max(lo, min(hi, x))
 
 
+# ベース係数 (entry_k, tp_k, sl_k)。キーは (horizon, mode)
+# compute_shape_coeffs / compute_entry_tp_sl_vec の両方がここを読む（係数を変えるときはここだけ）
+_BASE_COEFFS: Dict[Tuple[str, str], Tuple[float, float, float]] = {
+    ("short", "aggressive"): (0.05, 0.80, 0.60),
+    ("short", "defensive"): (0.02, 0.60, 0.40),
+    ("short", "normal"): (0.03, 0.70, 0.50),
+    ("mid", "aggressive"): (0.03, 1.20, 0.80),
+    ("mid", "defensive"): (0.01, 0.80, 0.50),
+    ("mid", "normal"): (0.02, 1.00, 0.66),
+    ("long", "aggressive"): (0.02, 1.80, 0.80),
+    ("long", "defensive"): (0.00, 1.20, 0.50),
+    ("long", "normal"): (0.01, 1.50, 0.66),
+}
+
+# p(tp_first) → 目標RR（p がしきい値以下なら右の RR。どれにも当たらなければ _RR_TARGET_HIGH_P）
+# ここは運用しながら後で詰められる
+_RR_TARGET_STEPS: Tuple[Tuple[float, float], ...] = ((0.35, 1.6), (0.55, 1.25))
+_RR_TARGET_HIGH_P = 1.05
+
+
+def _base_coeffs(mode: str, horizon: str) -> Tuple[float, float, float]:
+    """
+    (horizon, mode) のベース係数。horizon は short / mid 以外を long、mode は aggressive / defensive 以外を normal 扱い。
+    """
+    h = horizon if horizon in ("short", "mid") else "long"
+    m = mode if mode in ("aggressive", "defensive") else "normal"
+    return _BASE_COEFFS[(h, m)]
+
+
 def _rr_target_from_p_tp_first(p_tp_first: Optional[float]) -> float:
     """
     p(tp_first) に応じた目標RRを返す。
@@ -56,12 +91,10 @@ def _rr_target_from_p_tp_first(p_tp_first: Optional[float]) -> float:
     if not math.isfinite(p):
         return 1.0
 
-    # ここは運用しながら後で詰められる
-    if p <= 0.35:
-        return 1.6
-    if p <= 0.55:
-        return 1.25
-    return 1.05
+    for th, rr in _RR_TARGET_STEPS:
+        if p <= th:
+            return rr
+    return _RR_TARGET_HIGH_P
 
 
 def compute_shape_coeffs(
@@ -113,45 +146,7 @@ def compute_shape_coeffs(
         vol_zone = "wild"
 
     # --- ② ベース係数（horizon / mode） --------------------------------
-    if horizon == "short":
-        if mode == "aggressive":
-            base_entry_k = 0.05
-            base_tp_k = 0.80
-            base_sl_k = 0.60
-        elif mode == "defensive":
-            base_entry_k = 0.02
-            base_tp_k = 0.60
-            base_sl_k = 0.40
-        else:  # normal
-            base_entry_k = 0.03
-            base_tp_k = 0.70
-            base_sl_k = 0.50
-    elif horizon == "mid":
-        if mode == "aggressive":
-            base_entry_k = 0.03
-            base_tp_k = 1.20
-            base_sl_k = 0.80
-        elif mode == "defensive":
-            base_entry_k = 0.01
-            base_tp_k = 0.80
-            base_sl_k = 0.50
-        else:
-            base_entry_k = 0.02
-            base_tp_k = 1.00
-            base_sl_k = 0.66
-    else:  # long
-        if mode == "aggressive":
-            base_entry_k = 0.02
-            base_tp_k = 1.80
-            base_sl_k = 0.80
-        elif mode == "defensive":
-            base_entry_k = 0.00
-            base_tp_k = 1.20
-            base_sl_k = 0.50
-        else:
-            base_entry_k = 0.01
-            base_tp_k = 1.50
-            base_sl_k = 0.66
+    base_entry_k, base_tp_k, base_sl_k = _base_coeffs(mode, horizon)
 
     # --- ③ Entry調整（高値掴み回避） -----------------------------------
     if horizon == "short" and mode == "aggressive":
@@ -257,4 +252,81 @@ def compute_entry_tp_sl(
         tp = max(tp, 0.1)
         sl = max(sl, 0.1)
 
-    return float(entry), float(tp), float(sl)
\ No newline at end of file
+    return float(entry), float(tp), float(sl)
+
+
+def compute_entry_tp_sl_vec(
+    last: Any,
+    atr: Any,
+    mode: str = "aggressive",
+    horizon: str = "short",
+    *,
+    p_tp_first: Any = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    compute_entry_tp_sl の配列版（同じ形の entry / tp / sl 配列を返す）。
+    last / atr が不正（NaN, <=0）な要素は NaN。p_tp_first は None / スカラー / 配列。
+    """
+    last_v = np.asarray(last, dtype="float64")
+    atr_v = np.asarray(atr, dtype="float64")
+    with np.errstate(invalid="ignore"):
+        ok = np.isfinite(last_v) & np.isfinite(atr_v) & (last_v > 0) & (atr_v > 0)
+    last_s = np.where(ok, last_v, 1.0)
+    atr_s = np.where(ok, atr_v, 1.0)
+
+    mode = (mode or "aggressive").lower()
+    horizon = (horizon or "short").lower()
+    sa = horizon == "short" and mode == "aggressive"
+
+    # ① ボラティリティ（%）
+    vol_pct = np.clip(atr_s / last_s * 100.0, 0.1, 20.0)
+
+    # ② ベース係数（compute_shape_coeffs と同じ表 _BASE_COEFFS）
+    base_entry_k, base_tp_k, base_sl_k = _base_coeffs(mode, horizon)
+
+    # ③ Entry調整（高値掴み回避）
+    if sa:
+        entry_k = np.where(vol_pct < 2.0, base_entry_k * 1.2, np.where(vol_pct < 7.0, base_entry_k, -0.20))
+    else:
+        entry_k = np.full_like(vol_pct, base_entry_k)
+
+    p = None
+    if p_tp_first is not None:
+        p = np.broadcast_to(np.asarray(p_tp_first, dtype="float64"), vol_pct.shape)
+        p = np.where(np.isfinite(p), p, np.nan)
+    if sa and p is not None:
+        with np.errstate(invalid="ignore"):
+            entry_k = np.where(p <= 0.35, np.minimum(entry_k, -0.10), np.where(p <= 0.45, np.minimum(entry_k, 0.00), entry_k))
+
+    # ④ TP/SL のボラ調整
+    vol_scale = np.clip(0.9 + (vol_pct - 2.0) * 0.03, 0.7, 1.3)
+    tp_k = base_tp_k * vol_scale
+    sl_k = base_sl_k * vol_scale
+    sl_k = np.maximum(0.2, np.minimum(sl_k, tp_k * 1.2))
+
+    # ⑤ ML 確率で RR ターゲット制御
+    if sa:
+        rr_target = np.ones_like(vol_pct)
+        if p is not None:
+            with np.errstate(invalid="ignore"):
+                rr_target = np.select(
+                    [np.isnan(p)] + [p <= th for th, _rr in _RR_TARGET_STEPS],
+                    [1.0] + [rr for _th, rr in _RR_TARGET_STEPS],
+                    default=_RR_TARGET_HIGH_P,
+                )
+        sl_k = np.clip(sl_k, 0.35, 1.80)
+        tp_k = np.maximum(tp_k, rr_target * sl_k)
+        tp_k = np.clip(tp_k, 0.55, 3.00)
+
+    entry = last_s + entry_k * atr_s
+    tp = entry + tp_k * atr_s
+    sl = entry - sl_k * atr_s
+
+    # 価格がマイナスにならないよう最低0.1でクリップ
+    neg = (entry <= 0) | (tp <= 0) | (sl <= 0)
+    entry = np.where(neg, np.maximum(entry, 0.1), entry)
+    tp = np.where(neg, np.maximum(tp, 0.1), tp)
+    sl = np.where(neg, np.maximum(sl, 0.1), sl)
+
+    nan = np.nan
+    return np.where(ok, entry, nan), np.where(ok, tp, nan), np.where(ok, sl, nan)
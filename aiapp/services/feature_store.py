@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+aiapp.services.feature_store
+- 特徴量（make_features の1行）の時点別ストア
+- キー: (date, code, FeatureConfig のハッシュ)
+- 保存先: media/aiapp/features/<cfg_hash>/date=YYYY-MM-DD/features.parquet
+  （1日 = 1ファイルに全銘柄。pyarrow が無い環境では features.csv にフォールバック）
+- picks_build が書き、ai_simulate_auto / build_ml_dataset が読む
+  （同じ日の同じ銘柄を、別々にダウンロード・計算し直さない）
+
+設計方針:
+- 行 = 1銘柄・1日。列 = code + make_features の列（Open..LOW_ALL）
+- 同じ日付へ書くと code 単位で上書き（後勝ち）する upsert
+- 書き込みは一時ファイル → os.replace で原子的に置き換える（price_store と同じ）
+- upsert の「読む → マージ → 書く」はパーティションごとのロックファイル（date=.../.lock）を
+  flock で排他する（picks_build と build_ml_dataset / バックフィルが同じ日付に書いても行が消えない）
+- 読み出しは日付範囲 / 銘柄リスト / 列の絞り込みでまとめて読む
+- <cfg_hash>/config.json に FeatureConfig の中身を残しておく（人が見て分かるように）
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except Exception:  # pragma: no cover
+    fcntl = None  # Windows など（ロック無しで動かす）
+
+from aiapp.models.features import FeatureConfig
+from aiapp.models.features_state import cfg_key
+
+FEATURE_DIR = Path("media/aiapp/features")
+
+# 0 なら picks_build 等からの書き込みを止める（読み出しは常に可）
+FEATURE_STORE_ENABLED = str(os.getenv("AIAPP_FEATURE_STORE", "1")).strip().lower() in ("1", "true", "yes", "on")
+
+# read_asof で「何日前まで遡って探すか」
+ASOF_LOOKBACK_DAYS = int(os.getenv("AIAPP_FEATURE_STORE_LOOKBACK_DAYS", "10"))
+
+DateLike = Union[str, dt.date, dt.datetime, pd.Timestamp]
+
+_PART_PREFIX = "date="
+
+
+def _can_parquet() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+_PARQUET = _can_parquet()
+
+
+def config_hash(cfg: Optional[FeatureConfig] = None) -> str:
+    """
+    FeatureConfig の数値パラメータから作る短いハッシュ（ディレクトリ名）。
+    """
+    s = json.dumps(cfg_key(cfg), sort_keys=True)
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()[:12]
+
+
+def norm_code(code: Any) -> str:
+    s = str(code).strip()
+    return s[:-2] if s.endswith(".T") else s
+
+
+def _to_date(d: DateLike) -> dt.date:
+    if isinstance(d, dt.datetime):
+        return d.date()
+    if isinstance(d, dt.date):
+        return d
+    return pd.Timestamp(d).date()
+
+
+def cfg_dir(cfg: Optional[FeatureConfig] = None) -> Path:
+    return FEATURE_DIR / config_hash(cfg)
+
+
+def partition_dir(date: DateLike, cfg: Optional[FeatureConfig] = None) -> Path:
+    return cfg_dir(cfg) / f"{_PART_PREFIX}{_to_date(date).isoformat()}"
+
+
+def _partition_file(pdir: Path) -> Optional[Path]:
+    for name in ("features.parquet", "features.csv"):
+        p = pdir / name
+        if p.exists():
+            return p
+    return None
+
+
+def list_dates(cfg: Optional[FeatureConfig] = None) -> List[dt.date]:
+    """
+    保存済みの日付（昇順）。
+    """
+    base = cfg_dir(cfg)
+    if not base.exists():
+        return []
+    out: List[dt.date] = []
+    for p in base.iterdir():
+        if not p.is_dir() or not p.name.startswith(_PART_PREFIX):
+            continue
+        try:
+            out.append(dt.date.fromisoformat(p.name[len(_PART_PREFIX):]))
+        except ValueError:
+            continue
+    return sorted(out)
+
+
+# ========= 読み出し =========
+
+def _read_partition(pdir: Path, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    path = _partition_file(pdir)
+    if path is None:
+        return pd.DataFrame()
+    cols = None if columns is None else ["code"] + [c for c in columns if c != "code"]
+    try:
+        if path.suffix == ".parquet":
+            try:
+                df = pd.read_parquet(path, columns=cols)
+            except Exception:
+                df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, dtype={"code": str})
+    except Exception:
+        return pd.DataFrame()
+    if cols is not None:
+        df = df[[c for c in cols if c in df.columns]]
+    if "code" in df.columns:
+        df["code"] = df["code"].astype(str)
+    return df
+
+
+def read_day(
+    date: DateLike,
+    *,
+    codes: Optional[Iterable[str]] = None,
+    columns: Optional[Sequence[str]] = None,
+    cfg: Optional[FeatureConfig] = None,
+) -> pd.DataFrame:
+    """
+    1日ぶん（code 列つき）。無ければ空DF。
+    """
+    df = _read_partition(partition_dir(date, cfg), columns)
+    if codes is not None and not df.empty:
+        want = {norm_code(c) for c in codes}
+        df = df[df["code"].isin(want)]
+    return df.reset_index(drop=True)
+
+
+def read_range(
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    *,
+    codes: Optional[Iterable[str]] = None,
+    columns: Optional[Sequence[str]] = None,
+    cfg: Optional[FeatureConfig] = None,
+) -> pd.DataFrame:
+    """
+    日付範囲（両端含む）をまとめて読む。戻り値は date, code, <features...> の縦持ちDF。
+    """
+    d0 = _to_date(start) if start is not None else None
+    d1 = _to_date(end) if end is not None else None
+    want = {norm_code(c) for c in codes} if codes is not None else None
+
+    frames: List[pd.DataFrame] = []
+    for d in list_dates(cfg):
+        if (d0 is not None and d < d0) or (d1 is not None and d > d1):
+            continue
+        df = _read_partition(partition_dir(d, cfg), columns)
+        if df.empty:
+            continue
+        if want is not None:
+            df = df[df["code"].isin(want)]
+            if df.empty:
+                continue
+        df.insert(0, "date", pd.Timestamp(d))
+        frames.append(df)
+
+    if not frames:
+        return pd.DataFrame(columns=["date", "code"])
+    out = pd.concat(frames, ignore_index=True, sort=False)
+    return out.sort_values(["date", "code"], kind="mergesort").reset_index(drop=True)
+
+
+def read_asof(
+    codes: Iterable[str],
+    asof: Optional[DateLike] = None,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    cfg: Optional[FeatureConfig] = None,
+    lookback_days: Optional[int] = None,
+) -> Dict[str, Tuple[dt.date, Dict[str, Any]]]:
+    """
+    各銘柄について asof 以前（含む）で一番新しい行を返す。{code: (date, row)}
+    lookback_days より古い行は使わない（古い特徴量で判断しないため）。
+    """
+    want = {norm_code(c) for c in codes}
+    if not want:
+        return {}
+    d_asof = _to_date(asof) if asof is not None else dt.date.today()
+    lb = ASOF_LOOKBACK_DAYS if lookback_days is None else int(lookback_days)
+    d_min = d_asof - dt.timedelta(days=max(0, lb))
+
+    out: Dict[str, Tuple[dt.date, Dict[str, Any]]] = {}
+    for d in reversed(list_dates(cfg)):
+        if d > d_asof:
+            continue
+        if d < d_min:
+            break
+        df = _read_partition(partition_dir(d, cfg), columns)
+        if df.empty:
+            continue
+        df = df[df["code"].isin(want - set(out))]
+        for rec in df.to_dict("records"):
+            code = str(rec.pop("code"))
+            out[code] = (d, rec)
+        if len(out) >= len(want):
+            break
+    return out
+
+
+def read_last_row(
+    code: str,
+    asof: Optional[DateLike] = None,
+    *,
+    cfg: Optional[FeatureConfig] = None,
+    lookback_days: Optional[int] = None,
+) -> Optional[Tuple[dt.date, Dict[str, Any]]]:
+    """
+    read_asof の1銘柄版。無ければ None。
+    """
+    hit = read_asof([code], asof, cfg=cfg, lookback_days=lookback_days)
+    return hit.get(norm_code(code))
+
+
+# ========= 書き込み =========
+
+def _write_atomic(df: pd.DataFrame, pdir: Path) -> Path:
+    pdir.mkdir(parents=True, exist_ok=True)
+    existing = _partition_file(pdir)
+    path = existing if existing is not None else pdir / ("features.parquet" if _PARQUET else "features.csv")
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        if path.suffix == ".parquet":
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            try:
+                tmp.unlink()
+            except Exception:
+                pass
+    return path
+
+
+@contextmanager
+def _partition_lock(pdir: Path):
+    """
+    パーティション単位の排他ロック（別プロセス・別スレッドの upsert を直列にする）。
+    """
+    pdir.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(pdir / ".lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            except Exception:
+                pass
+
+
+def _write_config(cfg: Optional[FeatureConfig]) -> None:
+    p = cfg_dir(cfg) / "config.json"
+    if p.exists():
+        return
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(json.dumps(cfg_key(cfg), ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+    except Exception:
+        pass
+
+
+def write_day(
+    date: DateLike,
+    rows: Union[pd.DataFrame, Dict[str, Dict[str, Any]]],
+    *,
+    cfg: Optional[FeatureConfig] = None,
+) -> int:
+    """
+    1日ぶんを upsert する。rows は {code: {col: value}} か code 列つきDF。
+    書いた行数を返す。
+    """
+    if isinstance(rows, dict):
+        if not rows:
+            return 0
+        new = pd.DataFrame.from_dict(rows, orient="index")
+        new.index.name = "code"
+        new = new.reset_index()
+    else:
+        if rows is None or rows.empty or "code" not in rows.columns:
+            return 0
+        new = rows.copy()
+    new["code"] = new["code"].map(norm_code)
+    new = new.drop(columns=["date"], errors="ignore")
+    new = new[~new["code"].duplicated(keep="last")]
+
+    _write_config(cfg)
+    pdir = partition_dir(date, cfg)
+    with _partition_lock(pdir):
+        old = _read_partition(pdir)
+        if not old.empty:
+            old = old[~old["code"].isin(set(new["code"]))]
+            new = pd.concat([old, new], ignore_index=True, sort=False)
+
+        num_cols = [c for c in new.columns if c != "code"]
+        new[num_cols] = new[num_cols].apply(pd.to_numeric, errors="coerce")
+        new = new.sort_values("code", kind="mergesort").reset_index(drop=True)
+
+        _write_atomic(new, pdir)
+    return len(new)
+
+
+def write_last_rows(
+    rows: Dict[str, Tuple[DateLike, Dict[str, Any]]],
+    *,
+    cfg: Optional[FeatureConfig] = None,
+) -> int:
+    """
+    {code: (date, row)} を日付ごとにまとめて upsert（picks_build の最終行用）。
+    """
+    by_date: Dict[dt.date, Dict[str, Dict[str, Any]]] = {}
+    for code, (d, row) in rows.items():
+        if d is None or not row:
+            continue
+        by_date.setdefault(_to_date(d), {})[norm_code(code)] = row
+    n = 0
+    for d, day_rows in sorted(by_date.items()):
+        write_day(d, day_rows, cfg=cfg)
+        n += len(day_rows)
+    return n
+
+
+def write_frames(
+    frames: Dict[str, pd.DataFrame],
+    *,
+    cfg: Optional[FeatureConfig] = None,
+    start: Optional[DateLike] = None,
+    last_n: Optional[int] = None,
+) -> int:
+    """
+    {code: make_features の DF} を日付パーティションへ展開して書く（バックフィル用）。
+    start 以降 / 末尾 last_n 本だけに絞れる。
+    """
+    parts: List[pd.DataFrame] = []
+    d0 = pd.Timestamp(_to_date(start)) if start is not None else None
+    for code, feat in frames.items():
+        if feat is None or len(feat) == 0:
+            continue
+        f = feat
+        if last_n is not None and last_n > 0:
+            f = f.iloc[-int(last_n):]
+        idx = pd.DatetimeIndex(f.index)
+        if idx.tz is not None:
+            idx = idx.tz_localize(None)
+        f = f.copy()
+        f.index = idx.normalize()
+        if d0 is not None:
+            f = f[f.index >= d0]
+        if f.empty:
+            continue
+        f.insert(0, "code", norm_code(code))
+        f.index.name = "date"
+        parts.append(f.reset_index())
+    if not parts:
+        return 0
+
+    allrows = pd.concat(parts, ignore_index=True, sort=False)
+    n = 0
+    for d, g in allrows.groupby("date", sort=True):
+        write_day(pd.Timestamp(d).date(), g.drop(columns=["date"]), cfg=cfg)
+        n += len(g)
+    return n
+
+
+def last_row_of(feat: Optional[pd.DataFrame]) -> Optional[Tuple[dt.date, Dict[str, Any]]]:
+    """
+    make_features の DF から (最終足の日付, 最終行 dict) を作る（write_last_rows 用）。
+    """
+    if feat is None or len(feat) == 0:
+        return None
+    try:
+        d = pd.Timestamp(feat.index[-1]).date()
+    except Exception:
+        return None
+    row: Dict[str, Any] = {}
+    for k, v in feat.iloc[-1].items():
+        try:
+            fv = float(v)
+        except Exception:
+            continue
+        row[str(k)] = fv if np.isfinite(fv) else None
+    return d, row
@@ -5,11 +5,18 @@ aiapp.services.fetch_price
 - 列名ゆらぎ（MultiIndex/Adj Closeのみ等）を吸収し、必ず
   index=DatetimeIndex, columns=["Open","High","Low","Close","Volume"] で返す
 - nbars指定で末尾N本をスライス
+- ローカル日足ストア（aiapp.services.price_store）を先に読み、
+  足りない末尾だけをダウンロードして追記する
+  （末尾は数日重ねて取り、重なった足が保存済みと食い違えば = 分割・訂正、その銘柄は全期間取り直す）
+- get_prices_batch / download_daily_batch で複数銘柄を1リクエストにまとめて取得
 """
 
 from __future__ import annotations
+import os
+import time
 import datetime as dt
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
 from pathlib import Path
 
 import numpy as np
@@ -20,6 +27,8 @@ try:
 except Exception:
     yf = None  # オフライン環境対策
 
+from aiapp.services import price_store
+
 
 # =========================================================
 # Snapshot 保存先（prices_snapshot_nightly が import する）
@@ -27,9 +36,21 @@ except Exception:
 SNAP_DIR = Path("media/aiapp/prices")
 SNAP_DIR.mkdir(parents=True, exist_ok=True)
 
+# 複数銘柄まとめ取り（download_daily_batch / get_prices_batch）
+BATCH_CHUNK = int(os.getenv("AIAPP_PRICE_BATCH_CHUNK", "100"))
+BATCH_RETRIES = int(os.getenv("AIAPP_PRICE_BATCH_RETRIES", "3"))
+BATCH_BACKOFF_SEC = float(os.getenv("AIAPP_PRICE_BATCH_BACKOFF_SEC", "2.0"))
+
+# 末尾の取り直しで重なった足の OHLC が、保存済みから相対これ以上ずれていたら全期間取り直す
+TAIL_MISMATCH_TOL = float(os.getenv("AIAPP_PRICE_TAIL_MISMATCH_TOL", "0.005"))
+
 
 # ---------- 内部ヘルパ ----------
 
+def _empty_ohlcv() -> pd.DataFrame:
+    return pd.DataFrame(columns=["Open","High","Low","Close","Volume"])
+
+
 def _flatten_columns(df: pd.DataFrame) -> pd.DataFrame:
     if isinstance(df.columns, pd.MultiIndex):
         flat = []
@@ -108,37 +129,359 @@ def _to_symbol(code: str) -> str:
         return c + ".T"
     return c  # それ以外はそのまま
 
-# ---------- 公開API ----------
+def _period_start(period: str, end: Optional[dt.date] = None) -> Optional[pd.Timestamp]:
+    """
+    yfinance の period 文字列（"3y","6mo","60d","max" 等）を開始日に変換。
+    解釈できなければ None（= 絞らない）。
+    """
+    p = str(period or "").strip().lower()
+    end_ts = pd.Timestamp(end or dt.date.today())
+    try:
+        if p.endswith("mo"):
+            return end_ts - pd.DateOffset(months=int(p[:-2]))
+        if p.endswith("y"):
+            return end_ts - pd.DateOffset(years=int(p[:-1]))
+        if p.endswith("d"):
+            return end_ts - pd.Timedelta(days=int(p[:-1]))
+        if p.endswith("wk"):
+            return end_ts - pd.Timedelta(weeks=int(p[:-2]))
+    except Exception:
+        return None
+    return None
 
-def get_prices(code: str, nbars: Optional[int] = None, period: str = "3y") -> pd.DataFrame:
+
+def _download(sym: str, *, period: Optional[str] = None, start: Optional[dt.date] = None) -> pd.DataFrame:
     """
-    yfinanceから code の日足を取得し正規化して返す。
-    - nbars 指定があれば末尾からスライス
-    - 空/欠損に対しても DataFrame を返し、呼び出し側が安全に扱えるようにする
+    yf.download の薄いラッパ（失敗時は空DF）。
     """
-    # yfinance が無い環境でも落とさない
     if yf is None:
         return pd.DataFrame(columns=["Open","High","Low","Close","Volume"])
-
-    sym = _to_symbol(code)
+    kwargs = {"period": period} if start is None else {"start": start.isoformat()}
     try:
         # auto_adjustを明示（将来デフォ変更に影響されない）
         df = yf.download(
             sym,
-            period=period,
             interval="1d",
             progress=False,
             threads=False,
             auto_adjust=False,
+            **kwargs,
         )
     except Exception:
         # ネットワーク・銘柄エラー等
         return pd.DataFrame(columns=["Open","High","Low","Close","Volume"])
 
     # yfinanceは単一銘柄でも MultiIndex になる場合があるので normalize
-    df = _normalize_ohlcv(df)
+    return _normalize_ohlcv(df)
+
+
+def _split_multi(df: pd.DataFrame, syms: List[str]) -> Dict[str, pd.DataFrame]:
+    """
+    複数銘柄まとめての yf.download 結果（列 MultiIndex）を銘柄ごとに分解して正規化。
+    - group_by="ticker"（(sym, field)）でも既定（(field, sym)）でも拾う
+    - 他銘柄の営業日に揃えられて出来た全NaN行は落としてから _normalize_ohlcv に渡す
+    """
+    out: Dict[str, pd.DataFrame] = {}
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return out
+
+    if not isinstance(df.columns, pd.MultiIndex):
+        # 1銘柄だけのチャンクはフラットで返ることがある
+        if len(syms) == 1:
+            one = _normalize_ohlcv(df.dropna(how="all"))
+            if not one.empty:
+                out[syms[0]] = one
+        return out
 
+    level = None
+    for lv in range(df.columns.nlevels):
+        if set(syms) & set(map(str, df.columns.get_level_values(lv))):
+            level = lv
+            break
+    if level is None:
+        return out
+
+    for sym in syms:
+        try:
+            sub = df.xs(sym, axis=1, level=level)
+        except KeyError:
+            continue
+        sub = sub.dropna(how="all")
+        if sub.empty:
+            continue
+        one = _normalize_ohlcv(sub)
+        if not one.empty:
+            out[sym] = one
+    return out
+
+
+def download_daily_batch(
+    symbols: Iterable[str],
+    *,
+    period: Optional[str] = None,
+    start: Optional[dt.date] = None,
+    chunk_size: int = BATCH_CHUNK,
+    auto_adjust: bool = False,
+    retries: int = BATCH_RETRIES,
+    backoff_sec: float = BATCH_BACKOFF_SEC,
+    max_workers: int = 1,
+    downloader: Optional[Callable[..., pd.DataFrame]] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    複数シンボルの日足を chunk_size 件ずつ 1 回の multi-ticker download で取得する。
+    - 戻り値: {symbol: 正規化済みDF}（取れなかったシンボルはキー自体が無い）
+    - チャンク単位でリトライ（指数バックオフ）。1件も取れなかったチャンクも失敗扱い
+    - downloader を渡すとそれを使う（yf.download 互換: tickers=list, **kwargs）
+      → テストやオフライン環境ではローカルの代替プロバイダを差し込める
+    """
+    syms = [str(s) for s in dict.fromkeys(symbols) if str(s or "").strip()]
+    if not syms:
+        return {}
+
+    dl = downloader
+    if dl is None:
+        if yf is None:
+            return {}
+        dl = yf.download
+
+    kwargs: Dict[str, object] = {"period": period} if start is None else {"start": start.isoformat()}
+    chunk_size = max(1, int(chunk_size))
+    chunks = [syms[i:i + chunk_size] for i in range(0, len(syms), chunk_size)]
+
+    def _fetch_chunk(chunk: List[str]) -> Dict[str, pd.DataFrame]:
+        for attempt in range(max(0, int(retries)) + 1):
+            try:
+                df = dl(
+                    tickers=chunk,
+                    interval="1d",
+                    group_by="ticker",
+                    progress=False,
+                    threads=True,
+                    auto_adjust=auto_adjust,
+                    **kwargs,
+                )
+                frames = _split_multi(df, chunk)
+                if frames:
+                    return frames
+            except Exception:
+                pass
+            if attempt < retries:
+                time.sleep(backoff_sec * (2 ** attempt))
+        return {}
+
+    out: Dict[str, pd.DataFrame] = {}
+    if max_workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            out.update(_fetch_chunk(chunk))
+        return out
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        # チャンク順にマージ（結果の並びを決定的にする）
+        for frames in ex.map(_fetch_chunk, chunks):
+            out.update(frames)
+    return out
+
+
+def _store_plan(stored: pd.DataFrame, period: str) -> str:
+    """
+    ストアの状態から取得方針を決める。
+      "full" : ストアが空、または period の先頭まで届いていない → period 全体を取得
+      "tail" : 最終保存日以降だけ取得
+    """
+    if stored.empty:
+        return "full"
+    start = _period_start(period)
+    short_history = (
+        start is not None
+        and stored.index.min() > start + pd.Timedelta(days=30)
+        and len(stored) < price_store.STORE_MAX_BARS
+    )
+    return "full" if short_history else "tail"
+
+
+def _tail_start(stored: pd.DataFrame) -> dt.date:
+    # 数日重ねて取り、重なった足で保存済みと突き合わせる（_tail_mismatch）
+    return pd.Timestamp(stored.index.max()).date() - dt.timedelta(days=7)
+
+
+def _tail_mismatch(stored: pd.DataFrame, fetched: Optional[pd.DataFrame]) -> bool:
+    """
+    末尾の取り直し分と保存済みが重なる日付で、OHLC が相対 TAIL_MISMATCH_TOL を超えてずれているか。
+    ずれていたら分割・訂正で過去分も変わっているので、呼び出し側でその銘柄を全期間取り直す。
+    （出来高は直近の訂正が日常的にあるので見ない）
+    """
+    if stored.empty or fetched is None or fetched.empty:
+        return False
+    idx = stored.index.intersection(fetched.index)
+    if len(idx) == 0:
+        return False
+    cols = ["Open", "High", "Low", "Close"]
+    a = stored.loc[idx, cols].to_numpy(dtype="float64")
+    b = fetched.loc[idx, cols].to_numpy(dtype="float64")
+    with np.errstate(invalid="ignore"):
+        off = np.abs(b - a) > TAIL_MISMATCH_TOL * np.abs(a)
+    return bool(off.any())
+
+
+def _store_covers(period: str) -> bool:
+    """
+    period 全体がストア（末尾 STORE_MAX_BARS 本）に収まるか。
+    "5y" / "max" など収まらない・解釈できない period はストアを通さず直接取得する
+    （ストア経由だと古い方が黙って切れるため）。
+    """
+    if price_store.STORE_MAX_BARS <= 0:
+        return True
+    start = _period_start(period)
+    if start is None:
+        return False
+    need = int(np.busday_count(start.date(), dt.date.today()))
+    return need <= price_store.STORE_MAX_BARS
+
+
+def _needs_live(completed_only: bool) -> bool:
+    # 場中は未確定の当日足がストアに無いので、ストアが新しくても末尾を取り直す
+    return (not completed_only) and price_store.in_session()
+
+
+def _finish(df: pd.DataFrame, completed_only: bool) -> pd.DataFrame:
+    return price_store.completed_only(df) if completed_only else df
+
+
+def _store_commit(sym: str, stored: pd.DataFrame, fetched: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """
+    取得分をストアに重ねて保存する（保存するのは確定足だけ）。
+    戻り値は当日足も含めたマージ結果（確定足に絞るかは呼び出し側）。
+    """
+    merged = price_store.merge(stored, fetched)
+    if merged.empty:
+        return stored
+    try:
+        # 空振り（祝日など）でも保存して同期時刻を進める
+        price_store.save(sym, price_store.completed_only(merged))
+    except Exception:
+        pass
+    return merged
+
+
+def _get_prices_via_store(sym: str, period: str, completed_only: bool) -> pd.DataFrame:
+    """
+    ストア → 足りない末尾だけダウンロード → ストア更新。
+    """
+    stored = price_store.load(sym)
+    if yf is None or (price_store.is_fresh(sym, stored) and not _needs_live(completed_only)):
+        return stored
+
+    if _store_plan(stored, period) == "full":
+        fetched = _download(sym, period=period)
+    else:
+        fetched = _download(sym, start=_tail_start(stored))
+        if _tail_mismatch(stored, fetched):
+            refetched = _download(sym, period=period)
+            if not refetched.empty:
+                # 保存済みは捨てて置き換える（古い方に分割前の値を残さない）
+                return _store_commit(sym, _empty_ohlcv(), refetched)
+    return _store_commit(sym, stored, fetched)
+
+
+def _slice(df: pd.DataFrame, nbars: Optional[int], period: Optional[str]) -> pd.DataFrame:
+    if period and not df.empty:
+        start = _period_start(period)
+        if start is not None:
+            df = df[df.index >= start]
     if nbars is not None and nbars > 0 and len(df) > nbars:
         df = df.iloc[-nbars:].copy()
+    return df
+
+
+# ---------- 公開API ----------
+
+def get_prices(
+    code: str,
+    nbars: Optional[int] = None,
+    period: str = "3y",
+    *,
+    completed_only: bool = False,
+) -> pd.DataFrame:
+    """
+    code の日足を取得し正規化して返す。
+    - ローカルストアを先に読み、最終保存日以降だけ yfinance から取得
+      （AIAPP_PRICE_STORE=0、または period がストアに収まらない場合は従来通り period 全体をダウンロード）
+    - 場中は未確定の当日足も返す（従来通り）。completed_only=True なら確定足だけ
+      （夜間スナップショットなど「確定した日足」が欲しい呼び出し側用）
+    - nbars 指定があれば末尾からスライス
+    - 空/欠損に対しても DataFrame を返し、呼び出し側が安全に扱えるようにする
+    """
+    sym = _to_symbol(code)
+
+    if price_store.STORE_ENABLED and _store_covers(period):
+        df = _get_prices_via_store(sym, period, completed_only)
+        return _slice(_finish(df, completed_only), nbars, period)
+    return _slice(_finish(_download(sym, period=period), completed_only), nbars, None)
+
+
+def get_prices_batch(
+    codes: Iterable[str],
+    nbars: Optional[int] = None,
+    period: str = "3y",
+    *,
+    completed_only: bool = False,
+    chunk_size: int = BATCH_CHUNK,
+    max_workers: int = 1,
+    downloader: Optional[Callable[..., pd.DataFrame]] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    get_prices の複数銘柄版。戻り値は {元のcode: DataFrame}（取れない銘柄は空DF）。
+    - ストアが新しい銘柄はネットに行かない（場中で completed_only=False なら末尾を取り直す）
+    - 残りは「全期間が要る組」と「末尾だけの組」に分け、それぞれ
+      download_daily_batch で chunk_size 件ずつまとめて取得
+    - 末尾の重なりが保存済みと食い違った銘柄だけ、もう1回まとめて全期間取り直す
+    """
+    code_list = [str(c) for c in dict.fromkeys(codes) if str(c or "").strip()]
+    sym_of = {c: _to_symbol(c) for c in code_list}
+    syms = list(dict.fromkeys(sym_of.values()))
+    batch_kw = dict(chunk_size=chunk_size, max_workers=max_workers, downloader=downloader)
+
+    by_sym: Dict[str, pd.DataFrame] = {}
+    if not (price_store.STORE_ENABLED and _store_covers(period)):
+        by_sym = download_daily_batch(syms, period=period, **batch_kw)
+        return {
+            c: _slice(_finish(by_sym.get(sym_of[c], _empty_ohlcv()), completed_only), nbars, None)
+            for c in code_list
+        }
+
+    offline = yf is None and downloader is None
+    live = _needs_live(completed_only)
+    stored: Dict[str, pd.DataFrame] = {}
+    full: List[str] = []
+    tail: List[str] = []
+    for sym in syms:
+        df = price_store.load(sym)
+        if offline or (price_store.is_fresh(sym, df) and not live):
+            by_sym[sym] = df
+            continue
+        stored[sym] = df
+        (full if _store_plan(df, period) == "full" else tail).append(sym)
+
+    fetched: Dict[str, pd.DataFrame] = {}
+    if full:
+        fetched.update(download_daily_batch(full, period=period, **batch_kw))
+    if tail:
+        start = min(_tail_start(stored[s]) for s in tail)
+        fetched.update(download_daily_batch(tail, start=start, **batch_kw))
+        # 重なった足が食い違う銘柄（分割・訂正）は全期間取り直して、保存済みを置き換える
+        redo = [s for s in tail if _tail_mismatch(stored[s], fetched.get(s))]
+        if redo:
+            refetched = download_daily_batch(redo, period=period, **batch_kw)
+            for s in redo:
+                df = refetched.get(s)
+                if df is not None and not df.empty:
+                    stored[s] = _empty_ohlcv()
+                    fetched[s] = df
+
+    for sym in full + tail:
+        by_sym[sym] = _store_commit(sym, stored[sym], fetched.get(sym))
 
-    return df
\ No newline at end of file
+    return {
+        c: _slice(_finish(by_sym.get(sym_of[c], _empty_ohlcv()), completed_only), nbars, period)
+        for c in code_list
+    }
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+aiapp.services.indicator_state
+- 銘柄ごとの指標ステート（aiapp.models.features_state.IndicatorState）の保存・同期
+- 保存先: media/aiapp/prices/state/<symbol>.json（日足ストアの隣。ファイル名もストアと同じ 7203.T 形式）
+- sync_state(code, prices):
+    既存ステートの last_date より後ろの足だけを advance() で積む（O(1)/本）
+    以下の場合だけ価格列の先頭から作り直す
+      - ステートが無い / 壊れている / FeatureConfig やバージョンが違う
+      - last_date の足が価格列に無い、または終値が食い違う（分割調整などで履歴が書き換わった）
+- verify=True でフル再計算（make_features）と突き合わせる
+
+使う側（最終行だけ要る処理。ステートが使えなければフル再計算にフォールバック）:
+- fresh_row(code): picks_build の lite stage（picks_filters.check_all は最終行だけ見る）
+  最新の確定足まで進んでいて FeatureConfig も同じときだけ返す（場中・古い・非互換は None）
+- latest_frame(key, prices): macro_regime（ベンチマークごとのステートを DB の価格で進めて最終行を返す）
+※ picks_build の full stage はチャート・score_sample・⭐️ が 260本の系列を使うので、ステートでは置き換えない
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from aiapp.models.features import FeatureConfig, make_features
+from aiapp.models.features_state import (
+    IndicatorState,
+    advance_frame,
+    build_state,
+    verify_state,
+)
+from aiapp.services import price_store
+from aiapp.services.fetch_price import _to_symbol
+
+STATE_DIR = price_store.STORE_DIR.parent / "state"
+
+# 終値の食い違い判定（分割調整などで履歴が書き換わったか）
+_CLOSE_RTOL = 1e-9
+
+
+@dataclass
+class SyncResult:
+    code: str
+    state: Optional[IndicatorState] = None
+    advanced: int = 0
+    rebuilt: bool = False
+    reason: str = ""
+    verify: Optional[Dict[str, Any]] = field(default=None)
+
+
+def state_path(code: str) -> Path:
+    return STATE_DIR / f"{price_store._safe_code(_to_symbol(code))}.json"
+
+
+def load_state(code: str) -> Optional[IndicatorState]:
+    """
+    保存済みステートを読む。無い/壊れている場合は None。
+    """
+    path = state_path(code)
+    if not path.exists():
+        return None
+    try:
+        return IndicatorState.from_dict(json.loads(path.read_text(encoding="utf-8")))
+    except Exception:
+        return None
+
+
+def save_state(code: str, state: IndicatorState) -> None:
+    """
+    一時ファイル → os.replace で原子的に書き込む（price_store.save と同じ流儀）。
+    """
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    path = state_path(code)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_text(json.dumps(state.to_dict(), ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            try:
+                tmp.unlink()
+            except Exception:
+                pass
+
+
+def _history_matches(state: IndicatorState, prices: pd.DataFrame) -> bool:
+    """
+    ステートの last_date の終値が価格列と一致するか（履歴の書き換え検知）。
+    """
+    if not state.last_date:
+        return False
+    idx = prices.index.tz_localize(None) if getattr(prices.index, "tz", None) is not None else prices.index
+    ts = pd.Timestamp(state.last_date)
+    hit = prices.loc[idx == ts, "Close"] if "Close" in prices.columns else None
+    if hit is None or len(hit) == 0:
+        return False
+    got = state.last.get("Close")
+    want = float(hit.iloc[-1])
+    if got is None or want != want:
+        return False
+    return abs(got - want) <= _CLOSE_RTOL * max(1.0, abs(want))
+
+
+def sync_state(
+    code: str,
+    prices: pd.DataFrame,
+    *,
+    cfg: Optional[FeatureConfig] = None,
+    rebuild: bool = False,
+    verify: bool = False,
+    rtol: float = 1e-9,
+    atol: float = 1e-9,
+    save: bool = True,
+) -> SyncResult:
+    """
+    1銘柄ぶんのステートを prices（日足ストアの中身）に追いつかせる。
+    prices を省略したい呼び出し側は sync_from_store() を使う。
+    """
+    res = SyncResult(code=str(code))
+    if prices is None or len(prices) == 0:
+        res.reason = "no prices"
+        return res
+
+    state = None if rebuild else load_state(code)
+    if state is None:
+        res.reason = "rebuild" if rebuild else "new"
+    elif not state.compatible(cfg):
+        state, res.reason = None, "config changed"
+    elif not _history_matches(state, prices):
+        state, res.reason = None, "history changed"
+
+    if state is None:
+        state = build_state(prices, cfg=cfg)
+        res.rebuilt = True
+        res.advanced = state.n_bars
+    else:
+        res.advanced = advance_frame(state, prices)
+        res.reason = res.reason or ("advanced" if res.advanced else "up to date")
+
+    res.state = state
+    if save and (res.rebuilt or res.advanced):
+        save_state(code, state)
+    if verify:
+        res.verify = verify_state(state, prices, rtol=rtol, atol=atol)
+    return res
+
+
+def latest_row(code: str, *, cfg: Optional[FeatureConfig] = None) -> Optional[Dict[str, float]]:
+    """
+    保存済みステートの最終行（make_features(...).iloc[-1] 相当）。互換でなければ None。
+    """
+    state = load_state(code)
+    if state is None or not state.compatible(cfg) or not state.last_date:
+        return None
+    row = state.row()
+    row["date"] = state.last_date  # type: ignore[assignment]
+    return row
+
+
+def sync_from_store(code: str, **kwargs) -> SyncResult:
+    """
+    日足ストア（price_store）の中身でステートを同期する（ネットには行かない）。
+    """
+    return sync_state(code, price_store.load(_to_symbol(code)), **kwargs)
+
+
+def fresh_row(
+    code: str,
+    *,
+    cfg: Optional[FeatureConfig] = None,
+    now=None,
+) -> Optional[Dict[str, float]]:
+    """
+    「今出ているはずの最新の確定足」まで進んだステートの最終行。使えなければ None。
+    - 場中は None（未確定の当日足がステートに入っていないため）
+    - last_date が price_store.expected_last_date() と違う（同期されていない）なら None
+    - FeatureConfig / バージョン違いも None（latest_row と同じ）
+    """
+    if price_store.in_session(now):
+        return None
+    row = latest_row(code, cfg=cfg)
+    if row is None or row.get("date") != price_store.expected_last_date(now).isoformat():
+        return None
+    return row
+
+
+def latest_frame(key: str, prices: pd.DataFrame, *, cfg: Optional[FeatureConfig] = None) -> pd.DataFrame:
+    """
+    prices に対する make_features の最終行を1行の DataFrame で返す。
+    - key のステートを prices まで進めて（増えた足だけ advance）その最終行を使う
+    - ステートが無い / 設定や履歴が変わった場合は sync_state が prices から作り直す
+    - それでも最終日が合わない・失敗した場合は make_features でフル再計算する
+    """
+    if prices is None or len(prices) == 0:
+        return pd.DataFrame()
+    last_date = pd.Timestamp(prices.index[-1]).strftime("%Y-%m-%d")
+    try:
+        state = sync_state(key, prices, cfg=cfg).state
+        if state is not None and state.last_date == last_date:
+            return pd.DataFrame([state.row()], index=pd.DatetimeIndex([pd.Timestamp(last_date)]))
+    except Exception:
+        pass
+    return make_features(prices, cfg=cfg).tail(1)
@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+aiapp.services.intraday_store
+- 5分足のローカル列指向ストア（1営業日 = 1ファイル、その日の全銘柄が入る）
+- 保存先: media/aiapp/intraday/5m/YYYYMMDD.parquet
+  （pyarrow が無い環境では YYYYMMDD.csv にフォールバック）
+- bars_5m（ai_sim_eval）/ price_5m（Bar5m）/ daytrade.bars_5m_daytrade の3つのキャッシュを1つにまとめたもの
+  → 各モジュールの load 関数はこのストアの薄いアダプタ
+
+正準スキーマ（列固定・code → ts の順でソート）:
+  code   : str
+  ts     : datetime64[ns, Asia/Tokyo]
+  open / high / low / close : float64
+  volume : float64（欠損は 0）
+  vwap   : float64（その日の累積VWAP近似 = cumsum(TP*vol)/cumsum(vol)、TP=(H+L+C)/3。出来高 0 の間は NaN）
+
+読み方:
+- load_day(d, codes) … その日のファイルを1回だけ読み、{code: DataFrame} を返す。足りない銘柄だけ
+  旧キャッシュ → yfinance（複数銘柄を1回の download）の順で埋めてファイルに追記する
+- load_bars(code, d) … 1銘柄版。同じ日を続けて読むときはプロセス内キャッシュに当たるので、
+  200銘柄を1銘柄ずつ呼んでもファイル読み込みは1回
+- 当日以降（JST）は取りに行かない（旧実装と同じ）
+
+書き込みは一時ファイル → os.replace で原子的に置き換える（price_store と同じ）。
+"""
+
+from __future__ import annotations
+
+import contextlib
+import datetime as dt
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+try:
+    import yfinance as yf
+except Exception:  # pragma: no cover
+    yf = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+COLS = ["code", "ts", "open", "high", "low", "close", "volume", "vwap"]
+BAR_COLS = ["ts", "open", "high", "low", "close", "volume", "vwap"]
+
+STORE_DIR = Path(settings.MEDIA_ROOT) / "aiapp" / "intraday" / "5m"
+
+# 旧キャッシュ（見つかればストアに取り込む。書き込みはもうしない）
+LEGACY_BARS_5M_DIR = Path(settings.MEDIA_ROOT) / "aiapp" / "bars_5m"                 # <code>/YYYYMMDD.parquet（ts）
+LEGACY_PRICE_5M_DIR = Path(settings.MEDIA_ROOT) / "aiapp" / "prices" / "5m"          # <code>/YYYYMMDD.jsonl
+LEGACY_DAYTRADE_DIR = Path(settings.MEDIA_ROOT) / "aiapp" / "daytrade" / "bars_5m"   # <code>/YYYYMMDD.parquet（dt + vwap）
+
+# プロセス内に置いておく日数（ai_sim_eval は同じ日の銘柄を続けて読む）
+MEM_DAYS = int(os.getenv("AIAPP_INTRADAY_MEM_DAYS", "8"))
+
+# cleanup_old_files で残す日数（ストアは ai_sim_eval / 過去の評価やり直しの元データなので長め。0 以下なら消さない）
+RETENTION_DAYS = int(os.getenv("AIAPP_INTRADAY_RETENTION_DAYS", "730"))
+
+JST = dt.timezone(dt.timedelta(hours=9))
+TZ = "Asia/Tokyo"
+
+
+def _can_parquet() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+_PARQUET = _can_parquet()
+
+# {YYYYMMDD: (mtime_ns, {code: DataFrame})}
+_MEM: "OrderedDict[str, Tuple[int, Dict[str, pd.DataFrame]]]" = OrderedDict()
+
+# _MEM の出し入れ用（bars_5m.prefetch_5m_bars が日付ごとにスレッドで読む）
+_MEM_LOCK = threading.Lock()
+
+# yfinance はモジュール内の共有状態に結果を溜めるので、download は同時に1本だけ
+_YF_LOCK = threading.Lock()
+
+# このプロセスで yfinance に取りに行って空だった (YYYYMMDD, code)（休場日などを何度も取りに行かない）
+_EMPTY: set = set()
+
+
+def _jst_today() -> dt.date:
+    return dt.datetime.now(JST).date()
+
+
+def _day_key(d: dt.date) -> str:
+    return d.strftime("%Y%m%d")
+
+
+def _norm_code(code: str) -> str:
+    return str(code).strip().upper().replace(".T", "")
+
+
+def _yf_symbol(code: str) -> str:
+    return f"{_norm_code(code)}.T"
+
+
+def day_path(d: dt.date) -> Path:
+    """
+    既存ファイルがあればその形式、無ければ parquet 優先。
+    """
+    key = _day_key(d)
+    p_parq = STORE_DIR / f"{key}.parquet"
+    p_csv = STORE_DIR / f"{key}.csv"
+    if p_parq.exists():
+        return p_parq
+    if p_csv.exists():
+        return p_csv
+    return p_parq if _PARQUET else p_csv
+
+
+_EMPTY_BARS = pd.DataFrame({c: pd.Series(dtype="float64") for c in BAR_COLS}).astype({"ts": f"datetime64[ns, {TZ}]"})
+
+
+def empty_bars() -> pd.DataFrame:
+    return _EMPTY_BARS.copy()
+
+
+# ========= 正規化 =========
+
+def _calc_intraday_vwap(df: pd.DataFrame) -> np.ndarray:
+    """
+    その日の累積VWAP（近似）。daytrade.bars_5m_daytrade と同じ定義。
+    """
+    vol = np.nan_to_num(df["volume"].to_numpy(dtype="float64"), nan=0.0)
+    tp = (df["high"].to_numpy(dtype="float64") + df["low"].to_numpy(dtype="float64") + df["close"].to_numpy(dtype="float64")) / 3.0
+    pv = np.nan_to_num(tp * vol, nan=0.0)
+    cum_vol = np.cumsum(vol)
+    cum_pv = np.cumsum(pv)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(cum_vol > 0.0, cum_pv / np.where(cum_vol > 0.0, cum_vol, 1.0), np.nan)
+
+
+def normalize_bars(df: pd.DataFrame, d: dt.date) -> pd.DataFrame:
+    """
+    ts / open / high / low / close / volume を持つ DataFrame を正準形（BAR_COLS）にする。
+    - ts を JST に（tz 無しは JST とみなす）
+    - その日（JST）の足だけ、OHLC 欠損行は落とす、volume 欠損は 0
+    - vwap はここで計算し直す（入力に vwap があっても使わない）
+    """
+    if df is None or len(df) == 0 or "ts" not in df.columns:
+        return empty_bars()
+
+    try:
+        ts = pd.DatetimeIndex(pd.to_datetime(df["ts"], errors="coerce"))
+        ts = ts.tz_localize(TZ) if ts.tz is None else ts.tz_convert(TZ)
+    except Exception:
+        return empty_bars()
+
+    out = pd.DataFrame({"ts": ts})
+    for c in ("open", "high", "low", "close", "volume"):
+        src = df[c] if c in df.columns else pd.Series(np.nan, index=df.index)
+        out[c] = pd.to_numeric(pd.Series(np.asarray(src)), errors="coerce").astype("float64")
+    out["volume"] = out["volume"].fillna(0.0)
+
+    d0 = pd.Timestamp(d, tz=TZ)
+    d1 = d0 + pd.Timedelta(days=1)
+    out = out[(out["ts"] >= d0) & (out["ts"] < d1)]
+    out = out.dropna(subset=["ts", "open", "high", "low", "close"])
+    out = out.drop_duplicates(subset=["ts"], keep="last").sort_values("ts").reset_index(drop=True)
+    out["vwap"] = _calc_intraday_vwap(out) if len(out) else np.array([], dtype="float64")
+    return out[BAR_COLS]
+
+
+# ========= ファイル I/O =========
+
+def _read_day_file(path: Path) -> Dict[str, pd.DataFrame]:
+    try:
+        if path.suffix == ".parquet":
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, dtype={"code": str})
+            df["ts"] = pd.to_datetime(df["ts"], utc=True).dt.tz_convert(TZ)
+    except Exception as e:
+        logger.warning(f"[intraday_store] failed to read {path}: {e}")
+        return {}
+    if not all(c in df.columns for c in COLS) or len(df) == 0:
+        return {}
+    df["code"] = df["code"].astype(str)
+    out: Dict[str, pd.DataFrame] = {}
+    for code, g in df.groupby("code", sort=False):
+        out[str(code)] = g[BAR_COLS].reset_index(drop=True)
+    return out
+
+
+def _write_day_file(d: dt.date, frames: Dict[str, pd.DataFrame]) -> None:
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    parts = []
+    for code in sorted(frames):
+        g = frames[code]
+        if g is None or len(g) == 0:
+            continue
+        g = g[BAR_COLS].copy()
+        g.insert(0, "code", code)
+        parts.append(g)
+    if not parts:
+        return
+    out = pd.concat(parts, ignore_index=True)
+
+    path = day_path(d)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        if path.suffix == ".parquet":
+            out.to_parquet(tmp, index=False)
+        else:
+            out.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            try:
+                tmp.unlink()
+            except Exception:
+                pass
+
+
+def _mem_get(d: dt.date) -> Dict[str, pd.DataFrame]:
+    """
+    その日のファイルを（変わっていなければ）メモリから返す。無ければ読む。
+    """
+    key = _day_key(d)
+    path = day_path(d)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        with _MEM_LOCK:
+            _MEM.pop(key, None)
+        return {}
+    with _MEM_LOCK:
+        hit = _MEM.get(key)
+        if hit is not None and hit[0] == mtime:
+            _MEM.move_to_end(key)
+            return hit[1]
+    frames = _read_day_file(path)
+    _mem_put(key, mtime, frames)
+    return frames
+
+
+def _mem_put(key: str, mtime: int, frames: Dict[str, pd.DataFrame]) -> None:
+    if MEM_DAYS <= 0:
+        return
+    with _MEM_LOCK:
+        _MEM[key] = (mtime, frames)
+        _MEM.move_to_end(key)
+        while len(_MEM) > MEM_DAYS:
+            _MEM.popitem(last=False)
+
+
+def clear_memory() -> None:
+    with _MEM_LOCK:
+        _MEM.clear()
+    _EMPTY.clear()
+
+
+# ========= 旧キャッシュの取り込み =========
+
+def _read_legacy(code: str, d: dt.date) -> Optional[pd.DataFrame]:
+    """
+    旧3キャッシュのどれかにあればそれを正準形で返す（無ければ None）。
+    """
+    key = _day_key(d)
+    p = LEGACY_DAYTRADE_DIR / code / f"{key}.parquet"
+    if p.exists():
+        try:
+            df = pd.read_parquet(p).rename(columns={"dt": "ts"})
+            return normalize_bars(df, d)
+        except Exception:
+            pass
+
+    p = LEGACY_BARS_5M_DIR / code / f"{key}.parquet"
+    if p.exists():
+        try:
+            return normalize_bars(pd.read_parquet(p), d)
+        except Exception:
+            pass
+
+    p = LEGACY_PRICE_5M_DIR / code / f"{key}.jsonl"
+    if p.exists():
+        try:
+            recs = [json.loads(line) for line in p.read_text(encoding="utf-8").splitlines() if line.strip()]
+            if recs:
+                df = pd.DataFrame(recs)
+                df["ts"] = pd.to_datetime(df["ts"], utc=True)
+                return normalize_bars(df, d)
+        except Exception:
+            pass
+    return None
+
+
+# ========= yfinance =========
+
+def _pick_1d(x) -> pd.Series:
+    if isinstance(x, pd.Series):
+        return x
+    if isinstance(x, pd.DataFrame) and x.shape[1] > 0:
+        return x.iloc[:, 0]
+    return pd.Series(dtype="float64")
+
+
+def _frame_from_yf(yf_df: pd.DataFrame, d: dt.date) -> pd.DataFrame:
+    if yf_df is None or yf_df.empty:
+        return empty_bars()
+    df = pd.DataFrame(
+        {
+            "ts": yf_df.index,
+            "open": _pick_1d(yf_df.get("Open")).to_numpy(),
+            "high": _pick_1d(yf_df.get("High")).to_numpy(),
+            "low": _pick_1d(yf_df.get("Low")).to_numpy(),
+            "close": _pick_1d(yf_df.get("Close")).to_numpy(),
+            "volume": _pick_1d(yf_df.get("Volume")).to_numpy(),
+        }
+    )
+    return normalize_bars(df, d)
+
+
+def _download_day(codes: List[str], d: dt.date) -> Dict[str, pd.DataFrame]:
+    """
+    複数銘柄を yfinance の1回の download で取る（stdout/stderr の "Failed download" は抑制）。
+    """
+    if yf is None or not codes:
+        return {}
+    start = dt.datetime.combine(d, dt.time(0, 0))
+    end = start + dt.timedelta(days=1)
+    symbols = [_yf_symbol(c) for c in codes]
+    try:
+        with _YF_LOCK, contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            raw = yf.download(
+                symbols if len(symbols) > 1 else symbols[0],
+                interval="5m",
+                start=start,
+                end=end,
+                auto_adjust=False,
+                progress=False,
+                group_by="ticker",
+                threads=len(symbols) > 1,
+            )
+    except Exception as e:
+        logger.info(f"[intraday_store] yf.download failed for {len(symbols)} symbols {d}: {e}")
+        return {}
+    if raw is None or raw.empty:
+        return {}
+
+    out: Dict[str, pd.DataFrame] = {}
+    multi = isinstance(raw.columns, pd.MultiIndex)
+    top = set(raw.columns.get_level_values(0)) if multi else set()
+    for code, sym in zip(codes, symbols):
+        if multi:
+            if sym not in top:
+                continue
+            sub = raw[sym]
+        else:
+            sub = raw
+        g = _frame_from_yf(sub, d)
+        if len(g):
+            out[code] = g
+    return out
+
+
+# ========= 公開 API =========
+
+def load_day(
+    d: dt.date,
+    codes: Optional[Iterable[str]] = None,
+    *,
+    fetch_missing: bool = True,
+    force_refresh: bool = False,
+) -> Dict[str, pd.DataFrame]:
+    """
+    指定日の 5分足を {code: DataFrame(BAR_COLS)} で返す。
+    - codes=None: ファイルにある全銘柄（取りに行かない）
+    - codes 指定: 足りない銘柄を 旧キャッシュ → yfinance（1回でまとめて）で埋め、ファイルに追記
+    - force_refresh: codes を yfinance から取り直して上書き
+    データが無い銘柄は結果に入らない（休場日・欠損）。
+    返す DataFrame はプロセス内キャッシュと共有なので、書き換えるときは copy() すること。
+    """
+    if not d:
+        return {}
+    have = dict(_mem_get(d))
+    if codes is None:
+        return have
+
+    want = [_norm_code(c) for c in codes if str(c).strip()]
+    if force_refresh:
+        missing = list(dict.fromkeys(want))
+    else:
+        missing = [c for c in dict.fromkeys(want) if c not in have]
+
+    if missing and d <= _jst_today():
+        added: Dict[str, pd.DataFrame] = {}
+        if not force_refresh:
+            for c in missing:
+                g = _read_legacy(c, d)
+                if g is not None and len(g):
+                    added[c] = g
+        if fetch_missing:
+            key = _day_key(d)
+            rest = [c for c in missing if c not in added and (force_refresh or (key, c) not in _EMPTY)]
+            got = _download_day(rest, d)
+            added.update(got)
+            if d < _jst_today():
+                _EMPTY.update((key, c) for c in rest if c not in got)
+        if added:
+            # 読んでから書くまでに他プロセスが足した銘柄も残す
+            merged = dict(_read_day_file(day_path(d))) if day_path(d).exists() else {}
+            merged.update(have)
+            merged.update(added)
+            try:
+                _write_day_file(d, merged)
+                _mem_put(_day_key(d), day_path(d).stat().st_mtime_ns, merged)
+            except Exception as e:
+                logger.warning(f"[intraday_store] failed to write {day_path(d)}: {e}")
+            have = merged
+    elif missing:
+        logger.info(f"[intraday_store] skip future date {d} for {len(missing)} codes")
+
+    return {c: have[c] for c in want if c in have}
+
+
+def load_bars(code: str, d: dt.date, *, force_refresh: bool = False) -> pd.DataFrame:
+    """
+    1銘柄・1日分（BAR_COLS）。無ければ空 DataFrame。
+    """
+    code = _norm_code(code)
+    if not code or not d:
+        return empty_bars()
+    got = load_day(d, [code], force_refresh=force_refresh)
+    g = got.get(code)
+    return g.copy() if g is not None else empty_bars()
+
+
+def cleanup_old_files(retention_days: Optional[int] = None) -> int:
+    """
+    retention_days（省略時は RETENTION_DAYS）より古い日のファイルを消す。戻り値: 消したファイル数。
+    旧キャッシュ（price_5m の jsonl など）はここでは触らない。
+    """
+    days = RETENTION_DAYS if retention_days is None else int(retention_days)
+    if days <= 0 or not STORE_DIR.exists():
+        return 0
+    threshold = _jst_today() - dt.timedelta(days=days)
+    n = 0
+    for p in list(STORE_DIR.glob("*.parquet")) + list(STORE_DIR.glob("*.csv")):
+        try:
+            d = dt.datetime.strptime(p.stem, "%Y%m%d").date()
+        except Exception:
+            continue
+        if d < threshold:
+            try:
+                p.unlink()
+            except Exception:
+                continue
+            with _MEM_LOCK:
+                _MEM.pop(p.stem, None)
+            n += 1
+    return n
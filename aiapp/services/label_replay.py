@@ -0,0 +1,234 @@
+# aiapp/services/label_replay.py
+# -*- coding: utf-8 -*-
+"""
+label_replay.py（日足パネル上で work_one の Entry/TP/SL を過去に当て、ML 用ラベルを作る）
+
+目的:
+- ai_simulate_auto → ai_sim_eval の紙トレードだけだと学習サンプルが1日数十件しか増えない
+- price_store の日足（数年分 × 全銘柄）に、work_one と同じ Entry/TP/SL 提案を「全営業日」で当て、
+  win/lose/flat, R, hold_days, tp_first を一括で付ける
+- 出力行は build_ml_dataset の Row と同じ列（+ src_hash / src_ts）
+
+やり方（1チャンク = 銘柄 N 本をまとめて処理。Django 不要なのでプロセス並列に乗せられる）:
+1) make_features_panel で (T, N) の特徴量を一括計算
+2) 各バー t の終値 / ATR14 から entry_service.compute_entry_tp_sl_vec で Entry/TP/SL
+3) t+1..t+H の OHLC を (H, T, N) に積み、約定・TP/SL の「最初に当たった日」を argmax で一括探索
+
+ai_sim_eval（5分足）との対応（日足なので近似）:
+- trade_date = シグナル翌営業日（t+1）。H 営業日目（t+H）の終値でタイムアップ
+- 約定: 1日目の始値が指値以下なら始値で約定。それ以外は Low <= entry <= High の最初の日に指値で約定
+- 決済: 約定日以降、同じ日の中では TP を先に見る（ai_sim_eval と同じ順）。どちらも無ければ t+H の終値
+- 未約定（no_fill）は ai_sim_eval では no_position → 学習対象外なので行にしない
+- タイムアップなのに t+H の終値が NaN（欠損日）の行も決済価格が無いので行にしない（stats の no_price）
+- y_hold_days は約定日 → 決済日の日数（build_ml_dataset の eval_entry_ts / eval_exit_ts と同じ定義）
+- score_100 はバーごとの再計算が重いので入れない（NaN。LightGBM は欠損として扱う）
+
+特徴量の先頭（ウォームアップ）:
+- features_panel は先頭の NaN を bfill で埋める（= 未来の値が入る）ので、各銘柄の先頭 warmup 本は使わない
+"""
+
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aiapp.models.features import FeatureConfig
+from aiapp.models.features_panel import make_features_panel
+from aiapp.services.entry_service import compute_entry_tp_sl_vec
+
+CORE_FEATURES = ("ATR14", "SLOPE_25", "RET_20", "RSI14", "BB_Z", "VWAP_GAP_PCT")
+
+# first_hit の reason
+NO_FILL = -1
+HORIZON_CLOSE = 0
+HIT_TP = 1
+HIT_SL = 2
+
+
+@dataclass(frozen=True)
+class ReplayConfig:
+    horizon_days: int = 5          # ai_sim_eval の horizon_days
+    warmup: int = 60               # 各銘柄の先頭何本を捨てるか（指標の立ち上がり + bfill 対策）
+    stride: int = 1                # 何本おきにシグナルを作るか
+    qty: int = 100                 # y_pl 用の株数（y_r は qty に依らない）
+    mode: str = "aggressive"       # entry_service の mode（work_one と同じ）
+    horizon: str = "short"         # entry_service の horizon（work_one と同じ）
+    since: Optional[str] = None    # この日付（YYYY-MM-DD）以降のシグナルだけ
+
+
+def first_hit(
+    entry: np.ndarray,
+    tp: np.ndarray,
+    sl: np.ndarray,
+    o: np.ndarray,
+    h: np.ndarray,
+    l: np.ndarray,
+    c: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    BUY 前提の約定 → TP/SL 先当たり判定をまとめて行う。
+      entry / tp / sl: (S,)
+      o / h / l / c  : (H, S)  シグナル翌日から H 日分の OHLC
+    戻り値（すべて (S,)）:
+      reason    NO_FILL / HORIZON_CLOSE / HIT_TP / HIT_SL
+      entry_off 約定日（0 始まり。未約定は -1）
+      entry_px  約定価格
+      exit_off  決済日（0 始まり）
+      exit_px   決済価格
+    """
+    H, S = o.shape
+    days = np.arange(H)[:, None]
+
+    with np.errstate(invalid="ignore"):
+        at_open = entry >= o[0]
+        touch = (l <= entry) & (h >= entry)
+    touch[0] |= at_open
+    filled = touch.any(axis=0)
+    entry_off = np.where(filled, touch.argmax(axis=0), -1)
+    entry_px = np.where(at_open, o[0], entry)
+
+    # 約定日以降だけを見る。同じ日の中は TP → SL の順（ai_sim_eval と同じ）
+    live = filled & (days >= entry_off)
+    with np.errstate(invalid="ignore"):
+        hit_tp = live & (h >= tp)
+        hit_sl = live & (l <= sl)
+    hit = hit_tp | hit_sl
+    any_hit = hit.any(axis=0)
+    hit_off = hit.argmax(axis=0)
+    cols = np.arange(S)
+    tp_first = hit_tp[hit_off, cols]
+
+    reason = np.where(~filled, NO_FILL, np.where(~any_hit, HORIZON_CLOSE, np.where(tp_first, HIT_TP, HIT_SL)))
+    exit_off = np.where(any_hit, hit_off, H - 1)
+    exit_px = np.where(reason == HIT_TP, tp, np.where(reason == HIT_SL, sl, c[H - 1]))
+    return {
+        "reason": reason.astype(np.int8),
+        "entry_off": entry_off.astype(np.int64),
+        "entry_px": entry_px,
+        "exit_off": exit_off.astype(np.int64),
+        "exit_px": exit_px,
+    }
+
+
+def _src_hash(code: str, dates: np.ndarray, cfg: ReplayConfig) -> np.ndarray:
+    salt = f"replay|{code}|{cfg.horizon_days}|{cfg.mode}|{cfg.horizon}|".encode("utf-8")
+    return np.array(
+        [hashlib.blake2b(salt + d.encode("ascii"), digest_size=10).hexdigest() for d in dates],
+        dtype=object,
+    )
+
+
+def replay_frames(
+    frames: Mapping[str, pd.DataFrame],
+    cfg: ReplayConfig,
+    *,
+    feature_cfg: Optional[FeatureConfig] = None,
+) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    {code: 日足 OHLCV} → build_ml_dataset の Row 列（id 列以外）+ src_hash / src_ts の DataFrame。
+    戻り値: (rows, stats)  stats = {"signals", "no_fill", "tp", "sl", "horizon", "no_price"}
+    """
+    stats = {"signals": 0, "no_fill": 0, "tp": 0, "sl": 0, "horizon": 0, "no_price": 0}
+    if not frames:
+        return pd.DataFrame(), stats
+
+    fcfg = feature_cfg or FeatureConfig()
+    panel = make_features_panel(frames, cfg=fcfg)
+    cols = panel.columns
+    T, N = panel.dates.shape
+    Hn = int(cfg.horizon_days)
+    if T <= Hn + 1 or N == 0:
+        return pd.DataFrame(), stats
+
+    o, hi, lo, c = cols["Open"], cols["High"], cols["Low"], cols["Close"]
+    atr = cols[f"ATR{fcfg.atr_period}"]
+
+    # シグナル位置 t（右詰めなので銘柄 j の有効範囲は T-len..T-1）
+    t_idx = np.arange(T)[:, None]
+    first = (T - panel.lengths)[None, :]
+    ok = (t_idx >= first + int(cfg.warmup)) & (t_idx <= T - 1 - Hn)
+    if cfg.stride > 1:
+        ok &= ((t_idx - first) % int(cfg.stride)) == 0
+    if cfg.since:
+        ok &= panel.dates >= np.datetime64(cfg.since)
+    ok &= np.isfinite(c) & np.isfinite(atr) & (atr > 0) & (c > 0)
+
+    ts, js = np.nonzero(ok)
+    if len(ts) == 0:
+        return pd.DataFrame(), stats
+
+    entry, tp, sl = compute_entry_tp_sl_vec(c[ts, js], atr[ts, js], cfg.mode, cfg.horizon)
+
+    # (H, S): シグナル翌日から H 日分
+    fut = ts[None, :] + np.arange(1, Hn + 1)[:, None]
+    r = first_hit(entry, tp, sl, o[fut, js], hi[fut, js], lo[fut, js], c[fut, js])
+    stats["signals"] = int(len(ts))
+    stats["no_fill"] = int(np.sum(r["reason"] == NO_FILL))
+    stats["tp"] = int(np.sum(r["reason"] == HIT_TP))
+    stats["sl"] = int(np.sum(r["reason"] == HIT_SL))
+    # t+H の終値が欠けているとタイムアップの決済価格が決まらない → 行にしない（flat 扱いにしない）
+    no_px = (r["reason"] == HORIZON_CLOSE) & ~np.isfinite(r["exit_px"])
+    stats["no_price"] = int(np.sum(no_px))
+    stats["horizon"] = int(np.sum(r["reason"] == HORIZON_CLOSE)) - stats["no_price"]
+
+    keep = (r["reason"] != NO_FILL) & ~no_px
+    ts, js = ts[keep], js[keep]
+    entry, tp, sl = entry[keep], tp[keep], sl[keep]
+    r = {k: v[keep] for k, v in r.items()}
+    if len(ts) == 0:
+        return pd.DataFrame(), stats
+
+    dates = panel.dates
+    sig_date = dates[ts, js].astype("datetime64[D]")
+    trade_date = dates[ts + 1, js].astype("datetime64[D]")
+    entry_date = dates[ts + 1 + r["entry_off"], js].astype("datetime64[D]")
+    exit_date = dates[ts + 1 + r["exit_off"], js].astype("datetime64[D]")
+
+    qty = float(cfg.qty)
+    entry_px = r["entry_px"]
+    exit_px = r["exit_px"]
+    pl = (exit_px - entry_px) * qty
+    risk = np.abs(entry - sl) * qty
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y_r = np.where(risk > 0, pl / risk, np.nan)
+        design_risk = entry - sl
+        design_reward = tp - entry
+        a = atr[ts, js]
+        risk_atr = design_risk / a
+        reward_atr = design_reward / a
+        design_rr = np.where(risk_atr > 0, reward_atr / risk_atr, np.nan)
+
+    codes = np.asarray(panel.codes, dtype=object)[js]
+    out = pd.DataFrame(
+        {
+            "run_id": "replay",
+            "code": codes,
+            "trade_date": trade_date.astype(str),
+        }
+    )
+    for name in CORE_FEATURES:
+        out[name] = cols[name][ts, js] if name in cols else np.nan
+    out["design_rr"] = design_rr
+    out["design_risk"] = design_risk
+    out["design_reward"] = design_reward
+    out["risk_atr"] = risk_atr
+    out["reward_atr"] = reward_atr
+    out["score_100"] = np.nan
+    out["y_label"] = np.where(pl > 0, "win", np.where(pl < 0, "lose", "flat"))
+    out["y_pl"] = pl
+    out["y_r"] = y_r
+    out["y_hold_days"] = (exit_date - entry_date).astype(np.int64)
+    out["y_touch_tp_first"] = np.where(r["reason"] == HIT_TP, "tp_first", np.where(r["reason"] == HIT_SL, "sl_first", "none"))
+
+    sig_s = sig_date.astype(str)
+    out["src_ts"] = sig_s
+    hashes = np.empty(len(out), dtype=object)
+    for j in np.unique(js):
+        m = js == j
+        hashes[m] = _src_hash(str(panel.codes[j]), sig_s[m], cfg)
+    out["src_hash"] = hashes
+    return out, stats
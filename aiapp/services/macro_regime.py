@@ -25,7 +25,8 @@ from django.db import transaction
 from django.utils import timezone
 
 from ..models.macro import BenchmarkMaster, BenchmarkPrice, MacroRegimeSnapshot
-from ..models.features import make_features, FeatureConfig
+from ..models.features import FeatureConfig
+from .indicator_state import latest_frame
 
 
 # =========================================================
@@ -386,6 +387,8 @@ def build_macro_regime_snapshot(days: int = 365, cfg: Optional[RegimeConfig] = N
         target_date = timezone.localdate()
 
     # ---- 特徴量を計算 ----
+    # レジーム判定は各 DF の最終行しか見ないので、ベンチマークごとの指標ステートを
+    # 増えた足だけ進めて最終行を取る（ステートが使えなければ make_features にフォールバック）
     feat_cfg = FeatureConfig(
         ma_short=5,
         ma_mid=25,
@@ -394,27 +397,28 @@ def build_macro_regime_snapshot(days: int = 365, cfg: Optional[RegimeConfig] = N
         slope_mid=25,
     )
 
-    def make_feat(df: pd.DataFrame) -> pd.DataFrame:
+    def make_feat(df: pd.DataFrame, key: str) -> pd.DataFrame:
         if df is None or df.empty:
             return pd.DataFrame()
-        return make_features(df, cfg=feat_cfg)
+        return latest_frame(f"macro_{key}", df, cfg=feat_cfg)
 
-    jp_feat_nk = make_feat(jp_df_nk)
-    jp_feat_tp = make_feat(jp_df_tp)
-    fx_feat = make_feat(fx_df)
-    vol_feat = make_feat(vol_df)
+    jp_feat_nk = make_feat(jp_df_nk, "NK225")
+    jp_feat_tp = make_feat(jp_df_tp, "TOPIX")
+    fx_feat = make_feat(fx_df, "USDJPY")
+    vol_feat = make_feat(vol_df, "VIX")
 
     # 米国株は SPX + NDX を統合（Close の平均）してから特徴量を再計算
-    us_feat_spx = make_feat(us_df_spx)
-    us_feat_ndx = make_feat(us_df_ndx)
+    us_feat_spx = make_feat(us_df_spx, "SPX")
+    us_feat_ndx = make_feat(us_df_ndx, "NDX")
     if not us_feat_spx.empty and not us_feat_ndx.empty:
-        aligned = us_feat_spx[["Close"]].join(
-            us_feat_ndx[["Close"]], how="inner", lsuffix="_spx", rsuffix="_ndx"
-        )
+        # 平均は全期間の Close で取る（ステートの1行同士では系列にならない）
+        close_spx = us_df_spx["Close"].astype("float64").ffill()
+        close_ndx = us_df_ndx["Close"].astype("float64").ffill()
+        aligned = pd.concat([close_spx, close_ndx], axis=1, join="inner")
         if not aligned.empty:
             avg_close = aligned.mean(axis=1)
             tmp = pd.DataFrame({"Close": avg_close})
-            us_feat = make_features(tmp, cfg=feat_cfg)
+            us_feat = make_feat(tmp, "US_AVG")
         else:
             us_feat = us_feat_spx
     else:
@@ -0,0 +1,303 @@
+# aiapp/services/ml_compiled.py
+# -*- coding: utf-8 -*-
+"""
+ml_compiled.py（LightGBM の木を NumPy 配列にした推論器）
+
+目的:
+- cron の picks_build / ai_simulate_auto で lightgbm の import と .txt パースを省く
+- train_lgbm_models が Booster.dump_model() から木を平らな配列にして compiled_<key>.npz を出す
+    feature / threshold / left / right / default_left / missing_type（ノード）
+    leaf_value（葉） / roots（木ごとの根）
+- CompiledBooster.predict(X) はバッチ全体を木の深さぶんのループだけで評価する（lightgbm 不要）
+
+互換:
+- Booster.predict と同じ形を返す（binary / regression: (n,), multiclass: (n, K)）
+- best_iteration / current_iteration() / num_iteration= も受ける（ml_predict がそのまま呼べる）
+- 欠損の扱いは LightGBM の NumericalDecision と同じ
+    |x| <= kZeroThreshold（1e-35）の入力は 0 に丸めてから判定する（LightGBM は疎な入力として落とす = 0）
+    missing_type=NaN  : NaN を default_left の向きへ
+    missing_type=Zero : NaN は 0 とみなし、0 を default_left の向きへ
+    missing_type=None : NaN は 0 とみなして閾値で比較
+- カテゴリ分割 / linear_tree / 未対応の objective を含むモデルは書き出さない（CompileError）
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+COMPILED_VERSION = 1
+
+# LightGBM の kZeroThreshold
+_ZERO_THRESHOLD = 1e-35
+
+_MISSING = {"None": 0, "Zero": 1, "NaN": 2}
+
+_IDENTITY_OBJECTIVES = ("regression", "regression_l1", "huber", "fair", "quantile", "mape")
+_EXP_OBJECTIVES = ("poisson", "gamma", "tweedie")
+
+
+class CompileError(ValueError):
+    pass
+
+
+def compiled_name(key: str) -> str:
+    """
+    model_<key>.txt に対応するファイル名。
+    """
+    return f"compiled_{key}.npz"
+
+
+# =========================================================
+# export
+# =========================================================
+
+def _parse_objective(obj: str) -> Tuple[str, float, int]:
+    """
+    "binary sigmoid:1" / "multiclass num_class:3" / "regression" → (transform, sigmoid, num_class)
+    """
+    parts = str(obj or "").split()
+    if not parts:
+        raise CompileError("objective missing")
+    name = parts[0]
+    params: Dict[str, str] = {}
+    for p in parts[1:]:
+        if ":" in p:
+            k, v = p.split(":", 1)
+            params[k] = v
+
+    if name == "binary":
+        return "sigmoid", float(params.get("sigmoid", 1.0)), 1
+    if name in ("cross_entropy", "xentropy"):
+        return "sigmoid", 1.0, 1
+    if name in ("multiclass", "softmax"):
+        return "softmax", 1.0, int(params.get("num_class", 1))
+    if name in _IDENTITY_OBJECTIVES:
+        if "sqrt" in parts[1:]:
+            raise CompileError(f"unsupported objective option: {obj}")
+        return "identity", 1.0, 1
+    if name in _EXP_OBJECTIVES:
+        return "exp", 1.0, 1
+    raise CompileError(f"unsupported objective: {obj}")
+
+
+def export_booster(booster: Any) -> Dict[str, Any]:
+    """
+    Booster（または dump_model() の dict）を平らな配列にする。
+    """
+    dump = booster if isinstance(booster, dict) else booster.dump_model()
+    transform, sigmoid, num_class = _parse_objective(dump.get("objective", ""))
+    num_tree_per_iteration = int(dump.get("num_tree_per_iteration", num_class) or 1)
+    if transform == "softmax" and num_tree_per_iteration != num_class:
+        raise CompileError("num_tree_per_iteration != num_class")
+    if dump.get("average_output"):
+        raise CompileError("average_output (rf) is not supported")
+
+    feature: List[int] = []
+    threshold: List[float] = []
+    left: List[int] = []
+    right: List[int] = []
+    default_left: List[bool] = []
+    missing: List[int] = []
+    leaf_value: List[float] = []
+    roots: List[int] = []
+    max_depth = 0
+
+    def add(node: Dict[str, Any], depth: int) -> int:
+        nonlocal max_depth
+        if "leaf_value" in node and "split_feature" not in node:
+            leaf_value.append(float(node["leaf_value"]))
+            max_depth = max(max_depth, depth)
+            return ~(len(leaf_value) - 1)
+
+        if node.get("decision_type") != "<=":
+            raise CompileError(f"unsupported decision_type: {node.get('decision_type')}")
+        mt = node.get("missing_type", "None")
+        if mt not in _MISSING:
+            raise CompileError(f"unsupported missing_type: {mt}")
+
+        idx = len(feature)
+        feature.append(int(node["split_feature"]))
+        threshold.append(float(node["threshold"]))
+        default_left.append(bool(node.get("default_left", False)))
+        missing.append(_MISSING[mt])
+        left.append(0)
+        right.append(0)
+        left[idx] = add(node["left_child"], depth + 1)
+        right[idx] = add(node["right_child"], depth + 1)
+        return idx
+
+    for t in dump.get("tree_info", []):
+        if t.get("is_linear"):
+            raise CompileError("linear_tree is not supported")
+        roots.append(add(t["tree_structure"], 0))
+
+    if len(roots) % num_tree_per_iteration != 0:
+        raise CompileError("tree count is not a multiple of num_tree_per_iteration")
+
+    header = {
+        "version": COMPILED_VERSION,
+        "transform": transform,
+        "sigmoid": sigmoid,
+        "num_class": num_class,
+        "num_tree_per_iteration": num_tree_per_iteration,
+        "num_feature": int(dump.get("max_feature_idx", -1)) + 1,
+        "feature_names": list(dump.get("feature_names") or []),
+        "max_depth": max_depth,
+    }
+    return {
+        "header": header,
+        "feature": np.asarray(feature, dtype=np.int32),
+        "threshold": np.asarray(threshold, dtype=np.float64),
+        "left": np.asarray(left, dtype=np.int32),
+        "right": np.asarray(right, dtype=np.int32),
+        "default_left": np.asarray(default_left, dtype=bool),
+        "missing_type": np.asarray(missing, dtype=np.int8),
+        "leaf_value": np.asarray(leaf_value, dtype=np.float64),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+
+
+def save_compiled(arrays: Dict[str, Any], path: Path) -> None:
+    """
+    npz（pickle 無し）で保存。tmp に書いてから os.replace。
+    """
+    payload = {k: v for k, v in arrays.items() if k != "header"}
+    payload["header"] = np.asarray(json.dumps(arrays["header"], ensure_ascii=False))
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez(tmp, **payload)
+    os.replace(tmp, path)
+
+
+# =========================================================
+# evaluator
+# =========================================================
+
+class CompiledBooster:
+    """
+    Booster.predict 互換の NumPy 推論器。
+    """
+
+    def __init__(self, arrays: Dict[str, Any]):
+        h = arrays["header"]
+        self.header: Dict[str, Any] = h if isinstance(h, dict) else json.loads(str(h))
+        self.feature = np.asarray(arrays["feature"], dtype=np.intp)
+        self.threshold = np.asarray(arrays["threshold"], dtype=np.float64)
+        self.left = np.asarray(arrays["left"], dtype=np.int64)
+        self.right = np.asarray(arrays["right"], dtype=np.int64)
+        self.default_left = np.asarray(arrays["default_left"], dtype=bool)
+        self.missing_type = np.asarray(arrays["missing_type"], dtype=np.int8)
+        self.leaf_value = np.asarray(arrays["leaf_value"], dtype=np.float64)
+        self.roots = np.asarray(arrays["roots"], dtype=np.int64)
+
+        self.transform = str(self.header.get("transform"))
+        self.sigmoid = float(self.header.get("sigmoid", 1.0))
+        self.num_class = int(self.header.get("num_class", 1))
+        self.k = int(self.header.get("num_tree_per_iteration", 1)) or 1
+        self.num_feature = int(self.header.get("num_feature", 0))
+        self.best_iteration = 0
+
+    def current_iteration(self) -> int:
+        return int(len(self.roots) // self.k)
+
+    def num_trees(self) -> int:
+        return int(len(self.roots))
+
+    def _leaves(self, X: np.ndarray, roots: np.ndarray) -> np.ndarray:
+        """
+        (n, T) の葉番号。全行 × 全木を同時に1段ずつ降ろす。
+        """
+        n = X.shape[0]
+        node = np.broadcast_to(roots, (n, roots.shape[0])).copy()
+        rows = np.broadcast_to(np.arange(n)[:, None], node.shape)
+        active = node >= 0
+        while active.any():
+            idx = node[active]
+            v = X[rows[active], self.feature[idx]]
+            mt = self.missing_type[idx]
+            nan = np.isnan(v)
+            v = np.where((nan & (mt != 2)) | (np.abs(v) <= _ZERO_THRESHOLD), 0.0, v)
+            is_missing = ((mt == 1) & (v == 0.0)) | ((mt == 2) & nan)
+            go_left = np.where(is_missing, self.default_left[idx], v <= self.threshold[idx])
+            node[active] = np.where(go_left, self.left[idx], self.right[idx])
+            active = node >= 0
+        return ~node
+
+    def predict_raw(self, X: Any, num_iteration: Optional[int] = None) -> np.ndarray:
+        x = np.asarray(X, dtype=np.float64)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        if self.num_feature and x.shape[1] != self.num_feature:
+            raise ValueError(f"feature count mismatch: {x.shape[1]} != {self.num_feature}")
+
+        roots = self.roots
+        if num_iteration is not None and int(num_iteration) > 0:
+            roots = roots[: int(num_iteration) * self.k]
+
+        n = x.shape[0]
+        if roots.shape[0] == 0:
+            raw = np.zeros((n, self.k), dtype=np.float64)
+        else:
+            vals = self.leaf_value[self._leaves(x, roots)]
+            # 木 t はクラス t % k に属する（LightGBM の並び）
+            raw = vals.reshape(n, -1, self.k).sum(axis=1)
+        return raw
+
+    def predict(self, X: Any, num_iteration: Optional[int] = None, raw_score: bool = False, **_kw) -> np.ndarray:
+        raw = self.predict_raw(X, num_iteration=num_iteration)
+        if not raw_score:
+            if self.transform == "sigmoid":
+                raw = 1.0 / (1.0 + np.exp(-self.sigmoid * raw))
+            elif self.transform == "softmax":
+                z = np.exp(raw - raw.max(axis=1, keepdims=True))
+                raw = z / z.sum(axis=1, keepdims=True)
+            elif self.transform == "exp":
+                raw = np.exp(raw)
+        if self.k == 1:
+            return raw[:, 0]
+        return raw
+
+
+def load_compiled(path: Path) -> CompiledBooster:
+    with np.load(path, allow_pickle=False) as z:
+        arrays = {k: z[k] for k in z.files}
+    arrays["header"] = json.loads(str(arrays["header"]))
+    if int(arrays["header"].get("version", 0)) != COMPILED_VERSION:
+        raise CompileError(f"compiled version mismatch: {path}")
+    return CompiledBooster(arrays)
+
+
+def compile_and_check(
+    booster: Any,
+    path: Path,
+    X_check: Any = None,
+    *,
+    atol: float = 1e-9,
+) -> Dict[str, Any]:
+    """
+    train_lgbm_models 用: 書き出し → 検証データで Booster.predict と突き合わせ → 一致したら保存。
+    戻り値: {"ok", "max_abs_diff", "trees", "reason"}
+    """
+    try:
+        arrays = export_booster(booster)
+    except CompileError as ex:
+        return {"ok": False, "reason": str(ex)}
+
+    cb = CompiledBooster(arrays)
+    diff = None
+    if X_check is not None and len(X_check) > 0:
+        try:
+            want = np.asarray(booster.predict(X_check), dtype=np.float64)
+            got = cb.predict(np.asarray(X_check, dtype=np.float64))
+            diff = float(np.max(np.abs(want - got))) if want.size else 0.0
+        except Exception as ex:
+            return {"ok": False, "trees": cb.num_trees(), "reason": f"check_error:{type(ex).__name__}"}
+        if not np.isfinite(diff) or diff > atol:
+            return {"ok": False, "max_abs_diff": diff, "trees": cb.num_trees(), "reason": "mismatch"}
+
+    save_compiled(arrays, path)
+    return {"ok": True, "max_abs_diff": diff, "trees": cb.num_trees(), "reason": "ok"}
@@ -4,8 +4,9 @@
 ml_infer_service.py
 
 目的:
-- media/aiapp/ml/models/latest の LightGBM Booster(.txt) をロードし、
+- media/aiapp/ml/models/latest の LightGBM Booster(.txt) を使い、
   picks_build から呼べる “推論1本化” を提供する。
+- モデルの読み込み / キャッシュ / 差し替え検知は aiapp.services.ml_registry に任せる。
 
 出力:
 - p_win: 勝つ確率（0..1）
@@ -14,21 +15,25 @@ ml_infer_service.py
 - tp_first: "tp_first" / "sl_first" / "none"（任意モデル）
 - tp_first_probs: {"none":p, "tp_first":p, "sl_first":p}
 - ml_rank: 並び替え用の統合スコア（C用）
+
+API:
+- infer_from_features(feat_df=...) : 1銘柄（最終行）
+- infer_batch({code: feat_df or 最終行}) : 全銘柄を1つの行列にして、各 Booster を1回だけ predict
+  （LightGBM は1回あたりのオーバーヘッドが支配的なので、銘柄数が多いときはこちら）
 """
 
 from __future__ import annotations
 
-import json
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple, List
+from typing import Any, Dict, Optional, Tuple, List, Mapping
 
 import numpy as np
+import pandas as pd
+
+from aiapp.services.ml_registry import ModelSet, get_models
 
-try:
-    import lightgbm as lgb
-except Exception:  # pragma: no cover
-    lgb = None  # type: ignore
+MODELS_ROOT = "media/aiapp/ml/models/latest"
 
 
 # =========================================================
@@ -69,13 +74,6 @@ def _safe_dict(d: Any) -> Dict[str, Any]:
     return d if isinstance(d, dict) else {}
 
 
-def _read_json(path: Path) -> Dict[str, Any]:
-    try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-
-
 def _sigmoid(x: float) -> float:
     try:
         return float(1.0 / (1.0 + np.exp(-float(x))))
@@ -83,112 +81,44 @@ def _sigmoid(x: float) -> float:
         return 0.5
 
 
-# =========================================================
-# loader cache
-# =========================================================
-
-_CACHE: Dict[str, Any] = {
-    "loaded": False,
-    "dir": None,
-    "feature_cols": None,
-    "label_maps": None,
-    "meta": None,
-    "m_pwin": None,
-    "m_ev": None,
-    "m_hold": None,
-    "m_tp": None,
-}
-
-
-def _load_models(models_dir: Path) -> None:
-    if _CACHE.get("loaded") and _CACHE.get("dir") == str(models_dir):
-        return
-
-    _CACHE.update(
-        {
-            "loaded": False,
-            "dir": str(models_dir),
-            "feature_cols": None,
-            "label_maps": None,
-            "meta": None,
-            "m_pwin": None,
-            "m_ev": None,
-            "m_hold": None,
-            "m_tp": None,
-        }
-    )
-
-    if lgb is None:
-        return
-
-    feature_cols_path = models_dir / "feature_cols.json"
-    label_maps_path = models_dir / "label_maps.json"
-    meta_path = models_dir / "meta.json"
-
-    m_pwin_path = models_dir / "model_pwin.txt"
-    m_ev_path = models_dir / "model_ev.txt"
-    m_hold_path = models_dir / "model_hold_days.txt"
-    m_tp_path = models_dir / "model_tp_first.txt"
-
-    feature_cols = _read_json(feature_cols_path)
-    if isinstance(feature_cols, list):
-        cols = [str(x) for x in feature_cols]
-    else:
-        cols = [str(x) for x in _safe_dict(feature_cols).get("feature_cols", [])]
-
-    _CACHE["feature_cols"] = cols
-    _CACHE["label_maps"] = _read_json(label_maps_path)
-    _CACHE["meta"] = _read_json(meta_path)
-
-    try:
-        if m_pwin_path.exists():
-            _CACHE["m_pwin"] = lgb.Booster(model_file=str(m_pwin_path))
-    except Exception:
-        _CACHE["m_pwin"] = None
-
-    try:
-        if m_ev_path.exists():
-            _CACHE["m_ev"] = lgb.Booster(model_file=str(m_ev_path))
-    except Exception:
-        _CACHE["m_ev"] = None
+def _last_row(src: Any) -> Optional[Mapping[str, Any]]:
+    """
+    feat_df（DataFrame）なら最終行、Series / dict ならそのまま。
+    """
+    if src is None:
+        return None
+    if isinstance(src, pd.DataFrame):
+        if len(src) == 0:
+            return None
+        return src.iloc[-1]
+    if isinstance(src, (pd.Series, Mapping)):
+        return src
+    return None
 
-    try:
-        if m_hold_path.exists():
-            _CACHE["m_hold"] = lgb.Booster(model_file=str(m_hold_path))
-    except Exception:
-        _CACHE["m_hold"] = None
 
+def _vectorize_rows(rows: List[Mapping[str, Any]], feature_cols: List[str]) -> Optional[np.ndarray]:
+    """
+    rows を feature_cols の順で (n, F) の連続行列にする（NaN / 非数値は0埋め）。
+    """
     try:
-        if m_tp_path.exists():
-            _CACHE["m_tp"] = lgb.Booster(model_file=str(m_tp_path))
+        if not rows:
+            return None
+        df = pd.DataFrame.from_records([dict(r) for r in rows]).reindex(columns=feature_cols)
+        df = df.apply(pd.to_numeric, errors="coerce")
+        arr = df.to_numpy(dtype="float64", na_value=np.nan)
+        return np.ascontiguousarray(np.where(np.isfinite(arr), arr, 0.0))
     except Exception:
-        _CACHE["m_tp"] = None
-
-    _CACHE["loaded"] = True
+        return None
 
 
 def _vectorize_last_row(feat_df, feature_cols: List[str]) -> Optional[np.ndarray]:
     """
     feat_df の最終行から、feature_cols の順で 1行ベクトルを作る（NaNは0埋め）。
     """
-    try:
-        if feat_df is None or len(feat_df) == 0:
-            return None
-        row = feat_df.iloc[-1]
-        xs: List[float] = []
-        for c in feature_cols:
-            try:
-                v = row.get(c)
-            except Exception:
-                v = None
-            fv = _f(v)
-            if fv is None:
-                fv = 0.0
-            xs.append(float(fv))
-        arr = np.asarray(xs, dtype="float64").reshape(1, -1)
-        return arr
-    except Exception:
+    row = _last_row(feat_df)
+    if row is None:
         return None
+    return _vectorize_rows([row], feature_cols)
 
 
 def _decode_tp_first_probs(probs: np.ndarray, label_maps: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, float]]]:
@@ -247,96 +177,133 @@ def _decode_tp_first_probs(probs: np.ndarray, label_maps: Dict[str, Any]) -> Tup
 # public API
 # =========================================================
 
+def _predict(ms: ModelSet, key: str, x: np.ndarray) -> Optional[np.ndarray]:
+    m = ms.booster(key)
+    if m is None:
+        return None
+    try:
+        return np.asarray(m.predict(x), dtype="float64")
+    except Exception:
+        return None
+
+
+def _ml_rank(p_win: Optional[float], ev: Optional[float]) -> Optional[float]:
+    # いまは「EVを主役」にしつつ、p_win があれば軽く補強。
+    try:
+        if ev is not None:
+            base = float(ev)
+            bump = 0.0
+            if p_win is not None:
+                # 0.5中心の微調整（大きく支配しない）
+                bump = float(p_win - 0.5) * 0.20
+            return float(base + bump)
+        if p_win is not None:
+            return float(p_win)
+    except Exception:
+        pass
+    return None
+
+
+def _results_from_matrix(ms: ModelSet, x: np.ndarray) -> List[MLInferResult]:
+    """
+    (n, F) 行列に対して各 Booster を1回ずつ predict し、行ごとの MLInferResult を返す。
+    """
+    n = int(x.shape[0])
+    y_pwin = _predict(ms, "pwin", x)
+    y_ev = _predict(ms, "ev", x)
+    y_hold = _predict(ms, "hold_days", x)
+    y_tp = _predict(ms, "tp_first", x)  # multiclass: shape (n, K)
+    if y_tp is not None and not (y_tp.ndim == 2 and y_tp.shape[0] == n):
+        y_tp = None
+
+    label_maps = ms.label_maps or {}
+
+    out: List[MLInferResult] = []
+    for i in range(n):
+        # binary: shape (n,)
+        p_win = _clamp01(_f(y_pwin[i])) if y_pwin is not None and y_pwin.ndim == 1 else None
+        ev = _f(y_ev[i]) if y_ev is not None and y_ev.ndim == 1 else None
+
+        hold = _f(y_hold[i]) if y_hold is not None and y_hold.ndim == 1 else None
+        if hold is not None and hold < 0:
+            hold = 0.0
+
+        tp_first, tp_probs = None, None
+        if y_tp is not None:
+            tp_first, tp_probs = _decode_tp_first_probs(y_tp[i], label_maps)
+
+        out.append(
+            MLInferResult(
+                p_win=p_win,
+                ev=ev,
+                hold_days_pred=hold,
+                tp_first=tp_first,
+                tp_first_probs=tp_probs,
+                ml_rank=_ml_rank(p_win, ev),
+            )
+        )
+    return out
+
+
+def _ready(models_root: str) -> Optional[ModelSet]:
+    models_dir = Path(models_root)
+    if not models_dir.exists():
+        return None
+    ms = get_models(models_dir)
+    if ms is None or not ms.feature_cols:
+        return None
+    return ms
+
+
 def infer_from_features(
     *,
     feat_df,
-    models_root: str = "media/aiapp/ml/models/latest",
+    models_root: str = MODELS_ROOT,
 ) -> MLInferResult:
     """
     feat_df（特徴量DataFrame）からML推論して返す。
     """
-    models_dir = Path(models_root)
-    if not models_dir.exists():
+    ms = _ready(models_root)
+    if ms is None:
         return MLInferResult()
 
-    _load_models(models_dir)
-
-    feature_cols = _CACHE.get("feature_cols") or []
-    if not isinstance(feature_cols, list) or len(feature_cols) == 0:
-        return MLInferResult()
-
-    x = _vectorize_last_row(feat_df, feature_cols)
+    x = _vectorize_last_row(feat_df, ms.feature_cols)
     if x is None:
         return MLInferResult()
 
-    # --- p_win ---
-    p_win = None
-    try:
-        m = _CACHE.get("m_pwin")
-        if m is not None:
-            y = m.predict(x)
-            # binary: shape (1,)
-            p_win = _clamp01(_f(y[0] if isinstance(y, (list, np.ndarray)) else y))
-    except Exception:
-        p_win = None
+    return _results_from_matrix(ms, x)[0]
 
-    # --- ev ---
-    ev = None
-    try:
-        m = _CACHE.get("m_ev")
-        if m is not None:
-            y = m.predict(x)
-            ev = _f(y[0] if isinstance(y, (list, np.ndarray)) else y)
-    except Exception:
-        ev = None
 
-    # --- hold_days_pred ---
-    hold = None
-    try:
-        m = _CACHE.get("m_hold")
-        if m is not None:
-            y = m.predict(x)
-            hold = _f(y[0] if isinstance(y, (list, np.ndarray)) else y)
-            if hold is not None and hold < 0:
-                hold = 0.0
-    except Exception:
-        hold = None
+def infer_batch(
+    rows: Mapping[str, Any],
+    *,
+    models_root: str = MODELS_ROOT,
+) -> Dict[str, MLInferResult]:
+    """
+    {code: feat_df（最終行を使う） / 最終行の Series / dict} をまとめて推論する。
+    戻り値: {code: MLInferResult}（行が作れなかった銘柄は空の MLInferResult）
 
-    # --- tp_first (multiclass) ---
-    tp_first = None
-    tp_probs = None
-    try:
-        m = _CACHE.get("m_tp")
-        if m is not None:
-            y = m.predict(x)
-            # multiclass: shape (1, K)
-            y_arr = np.asarray(y, dtype="float64")
-            if y_arr.ndim == 2 and y_arr.shape[0] == 1:
-                tp_first, tp_probs = _decode_tp_first_probs(y_arr[0], _CACHE.get("label_maps") or {})
-    except Exception:
-        tp_first, tp_probs = None, None
+    infer_from_features を銘柄ごとに呼ぶのと同じ値になる。
+    """
+    codes = list(rows.keys())
+    out: Dict[str, MLInferResult] = {c: MLInferResult() for c in codes}
+
+    ms = _ready(models_root)
+    if ms is None:
+        return out
+
+    valid: List[str] = []
+    valid_rows: List[Mapping[str, Any]] = []
+    for c in codes:
+        r = _last_row(rows[c])
+        if r is not None:
+            valid.append(c)
+            valid_rows.append(r)
+
+    x = _vectorize_rows(valid_rows, ms.feature_cols)
+    if x is None:
+        return out
 
-    # --- ml_rank（C用）---
-    # いまは「EVを主役」にしつつ、p_win があれば軽く補強。
-    ml_rank = None
-    try:
-        if ev is not None:
-            base = float(ev)
-            bump = 0.0
-            if p_win is not None:
-                # 0.5中心の微調整（大きく支配しない）
-                bump = float(p_win - 0.5) * 0.20
-            ml_rank = float(base + bump)
-        elif p_win is not None:
-            ml_rank = float(p_win)
-    except Exception:
-        ml_rank = None
-
-    return MLInferResult(
-        p_win=p_win,
-        ev=ev,
-        hold_days_pred=hold,
-        tp_first=tp_first,
-        tp_first_probs=tp_probs,
-        ml_rank=ml_rank,
-    )
\ No newline at end of file
+    for c, res in zip(valid, _results_from_matrix(ms, x)):
+        out[c] = res
+    return out
@@ -1,16 +1,20 @@
 # aiapp/services/ml_predict.py
+"""
+ai_simulate_auto 用の latest モデル推論（feat_last + Entry/TP/SL から1行作る）。
+
+モデルは aiapp.services.ml_registry から受け取る（候補ごとに .txt をパースしない）。
+"""
 from __future__ import annotations
 
-import json
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Optional
 
 import numpy as np
 import pandas as pd
 from django.conf import settings
 
-import lightgbm as lgb
+from aiapp.services.ml_registry import get_models
 
 
 @dataclass
@@ -39,21 +43,6 @@ def _model_latest_dir() -> Path:
     return Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "models" / "latest"
 
 
-def _load_feature_cols(latest_dir: Path) -> list[str]:
-    p = latest_dir / "feature_cols.json"
-    cols = json.loads(p.read_text(encoding="utf-8"))
-    if not isinstance(cols, list) or not cols:
-        raise ValueError("feature_cols.json invalid")
-    return [str(x) for x in cols]
-
-
-def _load_booster(latest_dir: Path, fname: str) -> Optional[lgb.Booster]:
-    p = latest_dir / fname
-    if not p.exists():
-        return None
-    return lgb.Booster(model_file=str(p))
-
-
 def _build_features_row(
     *,
     feature_cols: list[str],
@@ -145,11 +134,14 @@ def predict_latest(
         if not latest_dir.exists():
             return MLPredResult(ok=False, reason=f"latest_dir_not_found:{latest_dir}")
 
-        feat_cols = _load_feature_cols(latest_dir)
+        ms = get_models(latest_dir)
+        if ms is None or not ms.feature_cols:
+            raise ValueError("feature_cols.json invalid")
+        feat_cols = ms.feature_cols
 
-        m_pwin = _load_booster(latest_dir, "model_pwin.txt")
-        m_ev = _load_booster(latest_dir, "model_ev.txt")
-        m_tp = _load_booster(latest_dir, "model_tp_first.txt")  # optional
+        m_pwin = ms.booster("pwin")
+        m_ev = ms.booster("ev")
+        m_tp = ms.booster("tp_first")  # optional
 
         if m_pwin is None or m_ev is None:
             return MLPredResult(ok=False, reason="model_missing(pwin/ev)")
@@ -16,13 +16,11 @@ ml_predictor.py（本番：ML推論ゲート / 軽量&安全）
 
 方針
 - モデル/ファイルが無い・壊れてる → 例外を握りつぶして None 返し（LIVE/DEMO設計に合流）
-- 全銘柄で毎回ロードしない（プロセス内キャッシュ）
+- 全銘柄で毎回ロードしない（aiapp.services.ml_registry のプロセス内キャッシュ。latest 差し替えは自動で拾う）
 """
 
 from __future__ import annotations
 
-import json
-import os
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
@@ -30,10 +28,7 @@ from typing import Any, Dict, List, Optional, Tuple
 import numpy as np
 import pandas as pd
 
-try:
-    import lightgbm as lgb
-except Exception:  # pragma: no cover
-    lgb = None  # type: ignore
+from aiapp.services.ml_registry import get_models
 
 
 # =========================================================
@@ -63,7 +58,7 @@ _CACHE: Dict[str, Any] = {
     "model_dir": None,
     "feature_cols": None,     # List[str]
     "classes_tp_first": None, # List[str]
-    "models": {},             # Dict[str, lgb.Booster]
+    "models": {},             # Dict[str, lightgbm.Booster]
 }
 
 
@@ -99,15 +94,6 @@ def _norm_str(x: Any) -> str:
     return str(x or "").strip().lower()
 
 
-def _load_json(path: Path) -> Optional[Dict[str, Any]]:
-    try:
-        if not path.exists():
-            return None
-        return json.loads(path.read_text(encoding="utf-8"))
-    except Exception:
-        return None
-
-
 def _find_latest_dir(base: Path) -> Optional[Path]:
     """
     media/aiapp/ml/models/latest があればそれを採用。
@@ -134,79 +120,34 @@ def _find_latest_dir(base: Path) -> Optional[Path]:
 
 def load_models_once(model_base_dir: str = "media/aiapp/ml/models") -> bool:
     """
-    プロセス内で1回だけロードする。
+    レジストリから latest の ModelSet を受け取り、_CACHE に載せる。
+    （読み込みは ml_registry 側で1回だけ。latest が差し替わればそこで読み直される）
     """
-    if _CACHE.get("loaded"):
-        return True
-
-    if lgb is None:
-        _CACHE["loaded"] = True
-        _CACHE["model_dir"] = None
-        _CACHE["feature_cols"] = None
-        _CACHE["classes_tp_first"] = None
-        _CACHE["models"] = {}
-        return False
-
     base = Path(model_base_dir)
     mdir = _find_latest_dir(base)
-    if mdir is None or not mdir.exists():
-        _CACHE["loaded"] = True
-        _CACHE["model_dir"] = None
-        _CACHE["feature_cols"] = None
-        _CACHE["classes_tp_first"] = None
-        _CACHE["models"] = {}
-        return False
+    ms = get_models(mdir) if mdir is not None and mdir.exists() else None
 
-    feature_cols: Optional[List[str]] = None
-    classes_tp_first: Optional[List[str]] = None
-
-    # feature_cols.json（必須扱い）
-    fc = _load_json(mdir / "feature_cols.json")
-    if isinstance(fc, dict) and isinstance(fc.get("feature_cols"), list):
-        feature_cols = [str(x) for x in fc["feature_cols"] if str(x).strip()]
-    elif isinstance(fc, list):
-        feature_cols = [str(x) for x in fc if str(x).strip()]
+    _CACHE["loaded"] = True
+    _CACHE["model_dir"] = str(mdir) if mdir is not None and ms is not None else None
+    _CACHE["feature_cols"] = None
+    _CACHE["classes_tp_first"] = None
+    _CACHE["models"] = {}
+    if ms is None:
+        return False
 
     # tp_first クラス順（任意）
-    cc = _load_json(mdir / "classes_tp_first.json")
-    if isinstance(cc, dict) and isinstance(cc.get("classes"), list):
-        classes_tp_first = [str(x) for x in cc["classes"] if str(x).strip()]
-    elif isinstance(cc, list):
-        classes_tp_first = [str(x) for x in cc if str(x).strip()]
-
-    if not feature_cols:
-        # feature_cols が無いなら ML を止める（入力列順が崩れるので危険）
-        _CACHE["loaded"] = True
-        _CACHE["model_dir"] = str(mdir)
-        _CACHE["feature_cols"] = None
-        _CACHE["classes_tp_first"] = classes_tp_first
-        _CACHE["models"] = {}
-        return False
+    classes_tp_first = ms.classes_tp_first
+    _CACHE["classes_tp_first"] = classes_tp_first
 
-    # モデルファイルは *.txt を拾う（LightGBM Booster）
-    models: Dict[str, Any] = {}
-    try:
-        for p in sorted(mdir.glob("model_*.txt")):
-            key = p.stem.replace("model_", "").strip().lower()
-            if not key:
-                continue
-            try:
-                booster = lgb.Booster(model_file=str(p))
-                models[key] = booster
-            except Exception:
-                continue
-    except Exception:
-        models = {}
+    # feature_cols が無いなら ML を止める（入力列順が崩れるので危険）
+    if not ms.feature_cols:
+        _CACHE["feature_cols"] = ms.feature_cols or None
+        return False
 
+    _CACHE["feature_cols"] = list(ms.feature_cols)
     # 既定のクラス順（無ければこの順で解釈）
-    if not classes_tp_first:
-        classes_tp_first = ["none", "tp_first", "sl_first"]
-
-    _CACHE["loaded"] = True
-    _CACHE["model_dir"] = str(mdir)
-    _CACHE["feature_cols"] = feature_cols
-    _CACHE["classes_tp_first"] = classes_tp_first
-    _CACHE["models"] = models
+    _CACHE["classes_tp_first"] = classes_tp_first or ["none", "tp_first", "sl_first"]
+    _CACHE["models"] = ms.boosters
     return True
 
 
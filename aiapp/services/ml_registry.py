@@ -0,0 +1,349 @@
+# aiapp/services/ml_registry.py
+# -*- coding: utf-8 -*-
+"""
+ml_registry.py（LightGBM モデルのプロセス内レジストリ）
+
+目的:
+- media/aiapp/ml/models/latest の Booster(.txt) / feature_cols.json / label_maps.json / meta.json を
+  プロセス内で1回だけ読む（推論のたびにパースしない）
+- latest が差し替わったら（manifest.json が変わったら）丸ごと読み直し、
+  読み終わった ModelSet を1回の代入で差し替える（読みかけの状態は誰にも見せない）
+- 読み直しに失敗したら、前の ModelSet をそのまま使い続ける
+- ロード時間 / バージョン / 再ロード回数を registry_metrics() で出す
+
+engine（AIAPP_ML_ENGINE / 各コマンドの --ml-engine → set_engine）:
+- "lightgbm" : model_<key>.txt を lightgbm.Booster で読む（既定）
+- "compiled" : compiled_<key>.npz（aiapp.services.ml_compiled）を読む。lightgbm を import しない
+               compiled が無い key だけ lightgbm に落ちる
+
+利用側:
+- aiapp.services.ml_infer_service（picks_build）
+- aiapp.services.ml_predict（ai_simulate_auto）
+- aiapp.services.ml_predictor
+
+manifest.json:
+- train_lgbm_models が latest へのコピーを全部終えたあと最後に書く
+    {"version": "<学習ディレクトリ名>", "created_at": ..., "files": {name: size}}
+- 無い（古い latest）場合は、既知ファイルの (mtime, size) を変更検知に使う
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiapp.services.ml_compiled import load_compiled
+
+MANIFEST_NAME = "manifest.json"
+
+# latest の変更チェック間隔（秒）。0 なら毎回 stat する
+RELOAD_CHECK_SEC = float(os.getenv("AIAPP_ML_RELOAD_CHECK_SEC", "5"))
+
+_WATCH_FILES = ("meta.json", "feature_cols.json", "label_maps.json", "classes_tp_first.json")
+
+ENGINES = ("lightgbm", "compiled")
+_ENGINE = {"name": os.getenv("AIAPP_ML_ENGINE", "lightgbm").strip().lower() or "lightgbm"}
+
+
+def set_engine(name: Optional[str]) -> str:
+    """
+    以降の get_models が使う推論エンジンを切り替える（次の get_models で読み直す）。
+    """
+    n = str(name or "").strip().lower()
+    if n:
+        if n not in ENGINES:
+            raise ValueError(f"unknown ml engine: {name}")
+        _ENGINE["name"] = n
+    return _ENGINE["name"]
+
+
+def current_engine() -> str:
+    return _ENGINE["name"]
+
+
+def default_models_dir() -> Path:
+    """
+    settings.MEDIA_ROOT があればその下、無ければ media/ 相対。
+    """
+    try:
+        from django.conf import settings
+
+        return Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "models" / "latest"
+    except Exception:
+        return Path("media/aiapp/ml/models/latest")
+
+
+# =========================================================
+# dataclass
+# =========================================================
+
+@dataclass
+class ModelSet:
+    model_dir: str
+    version: str
+    signature: Tuple[Any, ...]
+    feature_cols: List[str] = field(default_factory=list)
+    label_maps: Dict[str, Any] = field(default_factory=dict)
+    meta: Dict[str, Any] = field(default_factory=dict)
+    classes_tp_first: Optional[List[str]] = None
+    boosters: Dict[str, Any] = field(default_factory=dict)  # key: model_<key>.txt の <key>
+    engine: str = "lightgbm"
+    engines: Dict[str, str] = field(default_factory=dict)  # key ごとの実際のエンジン
+    loaded_at: float = 0.0
+    load_sec: float = 0.0
+
+    def booster(self, *keys: str) -> Optional[Any]:
+        """
+        最初に見つかった Booster（別名を順に探す）。
+        """
+        for k in keys:
+            m = self.boosters.get(k)
+            if m is not None:
+                return m
+        return None
+
+
+# =========================================================
+# helpers
+# =========================================================
+
+def _read_json(path: Path) -> Any:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def _stat_sig(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+        return (int(st.st_mtime_ns), int(st.st_size))
+    except Exception:
+        return None
+
+
+def _signature(mdir: Path) -> Tuple[Any, ...]:
+    """
+    manifest.json があればその (mtime, size)、無ければ既知ファイル + model_*.txt の (mtime, size)。
+    """
+    man = _stat_sig(mdir / MANIFEST_NAME)
+    if man is not None:
+        return ("manifest",) + man
+    sig: List[Any] = ["files"]
+    names = list(_WATCH_FILES)
+    try:
+        names += sorted(p.name for p in mdir.glob("model_*.txt"))
+        names += sorted(p.name for p in mdir.glob("compiled_*.npz"))
+    except Exception:
+        pass
+    for name in names:
+        sig.append((name, _stat_sig(mdir / name)))
+    return tuple(sig)
+
+
+def _feature_cols(raw: Any) -> List[str]:
+    if isinstance(raw, dict):
+        raw = raw.get("feature_cols")
+    if not isinstance(raw, list):
+        return []
+    return [str(x) for x in raw if str(x).strip()]
+
+
+def _classes(raw: Any) -> Optional[List[str]]:
+    if isinstance(raw, dict):
+        raw = raw.get("classes")
+    if not isinstance(raw, list):
+        return None
+    out = [str(x) for x in raw if str(x).strip()]
+    return out or None
+
+
+def _load_boosters(mdir: Path, engine: str) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    boosters: Dict[str, Any] = {}
+    engines: Dict[str, str] = {}
+
+    if engine == "compiled":
+        for p in sorted(mdir.glob("compiled_*.npz")):
+            key = p.stem.replace("compiled_", "", 1).strip().lower()
+            if not key:
+                continue
+            try:
+                boosters[key] = load_compiled(p)
+                engines[key] = "compiled"
+            except Exception:
+                continue
+
+    rest = []
+    for p in sorted(mdir.glob("model_*.txt")):
+        key = p.stem.replace("model_", "", 1).strip().lower()
+        if key and key not in boosters:
+            rest.append((key, p))
+    if not rest:
+        return boosters, engines
+
+    try:
+        import lightgbm as lgb
+    except Exception:  # pragma: no cover
+        return boosters, engines
+
+    for key, p in rest:
+        try:
+            boosters[key] = lgb.Booster(model_file=str(p))
+            engines[key] = "lightgbm"
+        except Exception:
+            continue
+    return boosters, engines
+
+
+def _load_set(mdir: Path, sig: Tuple[Any, ...], engine: str) -> ModelSet:
+    t0 = time.perf_counter()
+
+    manifest = _read_json(mdir / MANIFEST_NAME)
+    manifest = manifest if isinstance(manifest, dict) else {}
+    meta = _read_json(mdir / "meta.json")
+    meta = meta if isinstance(meta, dict) else {}
+    label_maps = _read_json(mdir / "label_maps.json")
+
+    boosters, engines = _load_boosters(mdir, engine)
+
+    version = str(manifest.get("version") or meta.get("created_at") or "")
+    return ModelSet(
+        model_dir=str(mdir),
+        version=version,
+        signature=sig,
+        feature_cols=_feature_cols(_read_json(mdir / "feature_cols.json")),
+        label_maps=label_maps if isinstance(label_maps, dict) else {},
+        meta=meta,
+        classes_tp_first=_classes(_read_json(mdir / "classes_tp_first.json")),
+        boosters=boosters,
+        engine=engine,
+        engines=engines,
+        loaded_at=time.time(),
+        load_sec=time.perf_counter() - t0,
+    )
+
+
+# =========================================================
+# registry
+# =========================================================
+
+_LOCK = threading.Lock()
+_SETS: Dict[str, ModelSet] = {}
+_CHECKED_AT: Dict[str, float] = {}
+_METRICS: Dict[str, Any] = {
+    "loads": 0,
+    "reloads": 0,
+    "load_errors": 0,
+    "load_sec_total": 0.0,
+    "hits": 0,
+}
+
+
+def get_models(models_dir: Optional[Path | str] = None, *, force: bool = False) -> Optional[ModelSet]:
+    """
+    models_dir（既定: default_models_dir()）の ModelSet を返す。ディレクトリが無ければ None。
+    RELOAD_CHECK_SEC ごとに署名を見て、変わっていれば読み直して差し替える。
+    """
+    mdir = Path(models_dir) if models_dir is not None else default_models_dir()
+    engine = current_engine()
+    key = (str(mdir.resolve()) if mdir.exists() else str(mdir)) + "|" + engine
+
+    cur = _SETS.get(key)
+    now = time.monotonic()
+    if cur is not None and not force and now - _CHECKED_AT.get(key, 0.0) < RELOAD_CHECK_SEC:
+        _METRICS["hits"] += 1
+        return cur
+
+    if not mdir.exists():
+        return cur
+
+    with _LOCK:
+        cur = _SETS.get(key)
+        sig = _signature(mdir)
+        _CHECKED_AT[key] = time.monotonic()
+        if cur is not None and not force and cur.signature == sig:
+            _METRICS["hits"] += 1
+            return cur
+
+        try:
+            new = _load_set(mdir, sig, engine)
+        except Exception as ex:
+            _METRICS["load_errors"] += 1
+            print(f"[ml_registry] load error {mdir}: {ex}")
+            return cur
+
+        _METRICS["loads"] += 1
+        _METRICS["load_sec_total"] += new.load_sec
+        if cur is not None:
+            _METRICS["reloads"] += 1
+            print(f"[ml_registry] reloaded {mdir} version={cur.version!r} -> {new.version!r} ({new.load_sec:.3f}s)")
+
+        # 読み終わってから1回で差し替える
+        _SETS[key] = new
+        return new
+
+
+def publish_latest(src_dir: Path, latest_dir: Path, names: List[str], *, version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    学習結果 src_dir を latest_dir にコピーし、最後に manifest.json を書く（train_lgbm_models 用）。
+    - 各ファイルは tmp に書いてから os.replace（読みかけのファイルを見せない）
+    - src に無いファイルは latest からも消す（前回のモデルが混ざらないように）
+    - manifest.json が最後に変わるので、レジストリはコピー完了後の状態だけを読む
+    """
+    latest_dir.mkdir(parents=True, exist_ok=True)
+    files: Dict[str, int] = {}
+    for name in names:
+        src = src_dir / name
+        dst = latest_dir / name
+        if not src.exists():
+            if dst.exists():
+                dst.unlink()
+            continue
+        tmp = dst.with_name(dst.name + ".tmp")
+        tmp.write_bytes(src.read_bytes())
+        os.replace(tmp, dst)
+        files[name] = int(dst.stat().st_size)
+
+    manifest = {
+        "version": version or src_dir.name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "source": str(src_dir),
+        "files": files,
+    }
+    tmp = latest_dir / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, latest_dir / MANIFEST_NAME)
+    return manifest
+
+
+def clear() -> None:
+    """
+    キャッシュを捨てる（次の get_models で読み直す）。
+    """
+    with _LOCK:
+        _SETS.clear()
+        _CHECKED_AT.clear()
+
+
+def registry_metrics() -> Dict[str, Any]:
+    """
+    ロード回数 / 累計ロード時間 / 読み込み済みモデルのバージョンなど（meta やログ用）。
+    """
+    out: Dict[str, Any] = dict(_METRICS)
+    out["load_sec_total"] = round(float(out["load_sec_total"]), 4)
+    out["sets"] = {
+        k: {
+            "version": s.version,
+            "boosters": dict(sorted(s.engines.items())),
+            "n_features": len(s.feature_cols),
+            "loaded_at": s.loaded_at,
+            "load_sec": round(s.load_sec, 4),
+        }
+        for k, s in _SETS.items()
+    }
+    return out
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+A側（picks_build）の出力を読み戻すサービス。
+
+- picks_build_hybrid が「ユニバース全走査のやり直し」をせず、
+  latest_full_all.json の items（スコア・⭐️・ML・Sizing・bias 適用済み）を PickItem に戻して使う
+- 使えない場合は理由つきで None を返す（呼び出し側はフル走査にフォールバック）
+    - ファイルが無い / 壊れている
+    - style / horizon / universe が違う
+    - 生成から max_age_min 分より古い
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .schema import PickItem
+from .settings import JST, PICKS_DIR
+
+BASE_ALL_LATEST = "latest_full_all.json"
+
+# A側の結果をそのまま使ってよい最大経過時間（分）
+BASE_MAX_AGE_MIN = int(os.getenv("AIAPP_HYBRID_BASE_MAX_AGE_MIN", "180"))
+
+# 再利用時に A側 meta から引き継がないキー（B側で作り直す）
+_META_OWN_KEYS = (
+    "mode", "style", "horizon", "universe", "total", "topk",
+    "rank_mode", "topk_rule", "topk_mode", "built_at",
+)
+
+_PICK_FIELDS = {f.name for f in fields(PickItem)}
+
+
+@dataclass
+class BaseRun:
+    path: Path
+    items: List[PickItem] = field(default_factory=list)
+    meta: Dict[str, Any] = field(default_factory=dict)
+    built_at: Optional[datetime] = None
+    age_min: float = 0.0
+
+    def carry_meta(self) -> Dict[str, Any]:
+        """
+        B側 meta に引き継ぐ A側 meta（filter_stats / regime / sizing / stars 等）。
+        """
+        return {k: v for k, v in self.meta.items() if k not in _META_OWN_KEYS}
+
+
+def item_from_dict(d: Dict[str, Any]) -> Optional[PickItem]:
+    """
+    asdict(PickItem) の逆。未知のキーは捨てる（古い/新しいスキーマ差を吸収）。
+    """
+    if not isinstance(d, dict) or not d.get("code"):
+        return None
+    try:
+        return PickItem(**{k: v for k, v in d.items() if k in _PICK_FIELDS})
+    except Exception:
+        return None
+
+
+def _built_at(meta: Dict[str, Any], path: Path) -> Optional[datetime]:
+    s = meta.get("built_at")
+    if isinstance(s, str) and s.strip():
+        try:
+            t = datetime.fromisoformat(s.strip())
+            return t if t.tzinfo is not None else t.replace(tzinfo=JST)
+        except Exception:
+            pass
+    try:
+        return datetime.fromtimestamp(path.stat().st_mtime, tz=JST)
+    except Exception:
+        return None
+
+
+def load_base_run(
+    *,
+    style: str,
+    horizon: str,
+    universe: Optional[str] = None,
+    max_age_min: Optional[int] = None,
+    path: Optional[Path] = None,
+    now: Optional[datetime] = None,
+) -> Tuple[Optional[BaseRun], str]:
+    """
+    A側の全件出力を読む。戻り値: (BaseRun or None, 理由)
+    universe=None なら universe は突き合わせない（A側のものを使う）。
+    """
+    p = path or (PICKS_DIR / BASE_ALL_LATEST)
+    if not p.exists():
+        return None, "missing"
+    try:
+        data = json.loads(p.read_text(encoding="utf-8"))
+    except Exception:
+        return None, "invalid_json"
+
+    meta = data.get("meta") if isinstance(data, dict) else None
+    raw_items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(meta, dict) or not isinstance(raw_items, list):
+        return None, "invalid_json"
+
+    if str(meta.get("mode") or "") not in ("", "full"):
+        return None, f"mode_mismatch:{meta.get('mode')}"
+    if str(meta.get("style") or "").lower() != str(style).lower():
+        return None, f"style_mismatch:{meta.get('style')}"
+    if str(meta.get("horizon") or "").lower() != str(horizon).lower():
+        return None, f"horizon_mismatch:{meta.get('horizon')}"
+    if universe and str(meta.get("universe") or "") != str(universe):
+        return None, f"universe_mismatch:{meta.get('universe')}"
+
+    built_at = _built_at(meta, p)
+    if built_at is None:
+        return None, "unknown_age"
+    now = now or datetime.now(JST)
+    age_min = (now - built_at).total_seconds() / 60.0
+    limit = BASE_MAX_AGE_MIN if max_age_min is None else int(max_age_min)
+    if age_min > limit:
+        return None, f"stale:{age_min:.0f}min>{limit}min"
+
+    items = [it for it in (item_from_dict(d) for d in raw_items) if it is not None]
+    return BaseRun(path=p, items=items, meta=meta, built_at=built_at, age_min=age_min), "ok"
@@ -11,6 +11,9 @@
 - confirm_score: 0..100（大きいほど追い風）
 - confirm_flags: 何が効いたかのタグ（UI/デバッグ用）
 
+パネル版:
+- compute_confirm_panel は features_panel の (T, N) 列から全日付ぶんの confirm_score を一括で出す（バックテスト用）。
+
 注意:
 - 欠損や列名揺れがあっても落ちない。
 - “買い目線” の追い風を主に評価（売り目線は今は入れない）。
@@ -18,7 +21,8 @@
 
 from __future__ import annotations
 
-from typing import List, Optional, Tuple
+import warnings
+from typing import List, Mapping, Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -186,4 +190,96 @@ def compute_confirm(
     if not flags:
         flags = ["neutral"]
 
-    return score, flags
\ No newline at end of file
+    return score, flags
+
+
+def _prev_window(a: np.ndarray, n: int, fn) -> np.ndarray:
+    """
+    各 t について a[t-n .. t-1]（最後の足は含めない）の fn（nanmax / nanmin）。
+    窓が埋まらない位置は NaN。
+    """
+    T = a.shape[0]
+    out = np.full(a.shape, np.nan)
+    if T <= n:
+        return out
+    win = np.lib.stride_tricks.sliding_window_view(a, n, axis=0)  # (T-n+1, N, n)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        out[n:] = fn(win[:-1], axis=-1)
+    return out
+
+
+def compute_confirm_panel(
+    cols: Mapping[str, np.ndarray],
+    valid: np.ndarray,
+    *,
+    ma_short_col: str,
+    ma_mid_col: str,
+    rsi_col: str,
+    atr_col: str = "ATR14",
+) -> np.ndarray:
+    """
+    compute_confirm と同じ加減点を (T, N) で一括計算する（flags は作らない）。
+      valid: (T, N) その銘柄の足がある位置
+    戻り値: int64 の (T, N)。valid=False と「足3本未満」は 0（compute_confirm の data_short と同じ）。
+    """
+    T, N = valid.shape
+    nan = np.full((T, N), np.nan)
+
+    def col(name: str) -> np.ndarray:
+        a = cols.get(name)
+        return nan if a is None else np.where(valid, a, np.nan)
+
+    # その銘柄の何本目か（0始まり）
+    nbars = np.cumsum(valid, axis=0)
+
+    last = col("Close")
+    atrv = col(atr_col)
+    ma_s, ma_m = col(ma_short_col), col(ma_mid_col)
+    ma_s_prev = np.vstack([nan[:1], ma_s[:-1]])
+    ma_m_prev = np.vstack([nan[:1], ma_m[:-1]])
+    high, low = col("High"), col("Low")
+
+    score = np.full((T, N), 50, dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        # 1) GC / MA下
+        have_ma = np.isfinite(ma_s) & np.isfinite(ma_m) & np.isfinite(ma_s_prev) & np.isfinite(ma_m_prev) & (nbars >= 2)
+        gc = have_ma & (ma_s_prev <= ma_m_prev) & (ma_s > ma_m)
+        score += np.where(gc, 18, 0)
+        score -= np.where(have_ma & ~gc & (ma_s < ma_m), 6, 0)
+
+        # 2) 20日高値更新 / 3) 20日安値割れ（_rolling_max_prev は len >= n+1 が必要）
+        prev_high20 = np.where(nbars >= 21, _prev_window(high, 20, np.nanmax), np.nan)
+        prev_low20 = np.where(nbars >= 21, _prev_window(low, 20, np.nanmin), np.nan)
+        prev_low5 = np.where(nbars >= 6, _prev_window(low, 5, np.nanmin), np.nan)
+        # 元実装は `a or b` なので 0.0 も「無し」扱い
+        prev_high20 = np.where(prev_high20 == 0.0, np.nan, prev_high20)
+        prev_low20 = np.where(prev_low20 == 0.0, np.nan, prev_low20)
+        prev_low5 = np.where(prev_low5 == 0.0, np.nan, prev_low5)
+
+        have_last = np.isfinite(last)
+        score += np.where(have_last & np.isfinite(prev_high20) & (last >= prev_high20), 20, 0)
+        score -= np.where(have_last & np.isfinite(prev_low20) & (last <= prev_low20), 18, 0)
+
+        # 4) 押し目反発
+        tol = np.where(np.isfinite(atrv) & (atrv > 0), 0.6 * atrv, 0.015 * last)
+        pull = (
+            have_last
+            & np.isfinite(ma_m)
+            & (last > ma_m)
+            & np.isfinite(prev_low5)
+            & np.isfinite(prev_low20)
+            & (np.abs(prev_low5 - prev_low20) <= tol)
+        )
+        score += np.where(pull, 12, 0)
+
+        # 5) RSI
+        rsi = col(rsi_col)
+        score -= np.where(rsi >= 72, 8, np.where(rsi <= 32, 6, 0))
+
+        # 6) 安値切り上げ
+        score += np.where(np.isfinite(prev_low5) & np.isfinite(prev_low20) & (prev_low5 > prev_low20 * 1.01), 10, 0)
+
+    score = np.clip(score, 0, 100)
+    return np.where(valid & (nbars >= 3), score, 0)
+
@@ -3,6 +3,7 @@
 JSON 出力サービス。
 
 - latest_full_all.json / latest_full.json と timestamp 付きファイルを出す
+- --lite-only 用に latest_lite.json（一次スクリーニングの生き残り）を出す
 - meta/items の構造は従来と同じ
 """
 
@@ -10,7 +11,7 @@ from __future__ import annotations
 
 import json
 from dataclasses import asdict
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Sequence
 
 from .schema import PickItem
 from .settings import PICKS_DIR, dt_now_stamp
@@ -50,4 +51,31 @@ def emit_json(
     out_top_latest = PICKS_DIR / "latest_full.json"
     out_top_stamp = PICKS_DIR / f"{dt_now_stamp()}_{horizon}_{style}_full.json"
     out_top_latest.write_text(json.dumps(data_top, ensure_ascii=False, separators=(",", ":")))
-    out_top_stamp.write_text(json.dumps(data_top, ensure_ascii=False, separators=(",", ":")))
\ No newline at end of file
+    out_top_stamp.write_text(json.dumps(data_top, ensure_ascii=False, separators=(",", ":")))
+
+
+def emit_lite_json(
+    survivors: Sequence[Any],
+    *,
+    style: str,
+    horizon: str,
+    universe: str,
+    meta_extra: Dict[str, Any],
+) -> None:
+    meta: Dict[str, Any] = {
+        "mode": "lite",
+        "style": style,
+        "horizon": horizon,
+        "universe": universe,
+        "total": len(survivors),
+    }
+    meta.update({k: v for k, v in (meta_extra or {}).items() if v is not None})
+
+    data = {"meta": meta, "items": [asdict(x) for x in survivors]}
+
+    PICKS_DIR.mkdir(parents=True, exist_ok=True)
+
+    out_latest = PICKS_DIR / "latest_lite.json"
+    out_stamp = PICKS_DIR / f"{dt_now_stamp()}_{horizon}_{style}_lite.json"
+    out_latest.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    out_stamp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+特徴量サイドカー（latest_full_features.json）。
+
+- picks_build が出した銘柄ごとに
+    feat_last: 特徴量スナップショット（RSI/BB_Z/VWAP乖離/RET/SLOPE/ATR/GC/DC）
+    distance : Entry/TP/SL の ATR 正規化距離
+  を小さな JSON にまとめて latest_full.json の隣に出す
+- ai_simulate_auto はこれを読み、同じ銘柄で get_prices + make_features をやり直さない
+  （無い / 古い銘柄だけ従来通り取得する）
+- feat_last / distance の組み立ては ai_simulate_auto と共通（ここが正本）
+"""
+
+from __future__ import annotations
+
+import json
+import datetime as dt
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from .schema import PickItem
+from .settings import JST, PICKS_DIR, dt_now_stamp
+
+SIDECAR_LATEST = "latest_full_features.json"
+
+# distance の入力が「同じ」とみなす誤差
+_DIST_EPS = 1e-9
+
+
+def _safe_float(x) -> Optional[float]:
+    try:
+        if x is None:
+            return None
+        f = float(x)
+        if f != f:  # NaN
+            return None
+        return f
+    except Exception:
+        return None
+
+
+def feat_last_from_row(row: Mapping[str, Any], cfg) -> Tuple[Dict[str, Any], Optional[float]]:
+    """
+    make_features の最終行（dict / Series）から feat_last を作る。戻り値: (feat_last, atr)
+    """
+    keep_keys = [
+        f"RSI{getattr(cfg, 'rsi_period', 14)}",
+        "BB_Z",
+        "VWAP_GAP_PCT",
+        "RET_1",
+        "RET_5",
+        "RET_20",
+        f"SLOPE_{getattr(cfg, 'slope_short', 5)}",
+        f"SLOPE_{getattr(cfg, 'slope_mid', 25)}",
+        f"ATR{getattr(cfg, 'atr_period', 14)}",
+        "GCROSS",
+        "DCROSS",
+    ]
+
+    tmp: Dict[str, Any] = {}
+    for k in keep_keys:
+        if k in row:
+            v = row.get(k)
+            if v is None:
+                tmp[k] = None
+            else:
+                try:
+                    fv = float(v)
+                    if fv != fv:
+                        tmp[k] = None
+                    else:
+                        if k in ("GCROSS", "DCROSS"):
+                            tmp[k] = int(fv)
+                        else:
+                            tmp[k] = fv
+                except Exception:
+                    try:
+                        tmp[k] = int(v)
+                    except Exception:
+                        tmp[k] = str(v)
+
+    def pick_float(key: str) -> Optional[float]:
+        return _safe_float(tmp.get(key))
+
+    atr_key = f"ATR{getattr(cfg, 'atr_period', 14)}"
+    atr_from_feat = pick_float(atr_key)
+
+    feat_last = {
+        "RSI14": pick_float(f"RSI{getattr(cfg, 'rsi_period', 14)}"),
+        "BB_Z": pick_float("BB_Z"),
+        "VWAP_GAP_PCT": pick_float("VWAP_GAP_PCT"),
+        "RET_1": pick_float("RET_1"),
+        "RET_5": pick_float("RET_5"),
+        "RET_20": pick_float("RET_20"),
+        "SLOPE_5": pick_float(f"SLOPE_{getattr(cfg, 'slope_short', 5)}"),
+        "SLOPE_25": pick_float(f"SLOPE_{getattr(cfg, 'slope_mid', 25)}"),
+        "ATR14": atr_from_feat,
+        "GCROSS": tmp.get("GCROSS"),
+        "DCROSS": tmp.get("DCROSS"),
+        "raw": tmp,
+    }
+    return feat_last, atr_from_feat
+
+
+def distance_payload(
+    *,
+    entry: Optional[float],
+    tp: Optional[float],
+    sl: Optional[float],
+    last_close: Optional[float],
+    atr: Optional[float],
+) -> Dict[str, Any]:
+    """
+    距離妥当性（ATR正規化）。
+    """
+    atr = _safe_float(atr)
+    e = _safe_float(entry)
+    t = _safe_float(tp)
+    s = _safe_float(sl)
+    lc = _safe_float(last_close)
+
+    dist: Dict[str, Any] = {
+        "entry": e,
+        "tp": t,
+        "sl": s,
+        "last_close": lc,
+        "atr": atr,
+    }
+
+    if e is not None and t is not None and s is not None and atr is not None and atr > 0:
+        dist_tp_atr = (t - e) / atr
+        dist_sl_atr = (e - s) / atr
+        rr = None
+        if dist_sl_atr is not None and dist_sl_atr > 0:
+            rr = dist_tp_atr / dist_sl_atr
+
+        def clamp(x: Optional[float], lo: float, hi: float) -> Optional[float]:
+            if x is None or x != x:
+                return None
+            if x < lo:
+                return lo
+            if x > hi:
+                return hi
+            return x
+
+        dist["dist_tp_atr"] = clamp(_safe_float(dist_tp_atr), -50.0, 50.0)
+        dist["dist_sl_atr"] = clamp(_safe_float(dist_sl_atr), -50.0, 50.0)
+        dist["rr"] = clamp(_safe_float(rr), -50.0, 50.0)
+    else:
+        dist["dist_tp_atr"] = None
+        dist["dist_sl_atr"] = None
+        dist["rr"] = None
+
+    return dist
+
+
+def same_distance_inputs(dist: Mapping[str, Any], **inputs: Optional[float]) -> bool:
+    """
+    サイドカーの distance が、今回の entry/tp/sl/last_close/atr と同じ入力で作られたか。
+    """
+    for k, v in inputs.items():
+        a = _safe_float(dist.get(k))
+        b = _safe_float(v)
+        if a is None and b is None:
+            continue
+        if a is None or b is None or abs(a - b) > _DIST_EPS * max(1.0, abs(b)):
+            return False
+    return True
+
+
+# ========= 出力 / 読み込み =========
+
+def build_sidecar(
+    items: List[PickItem],
+    feature_rows: Mapping[str, Tuple[Any, Dict[str, Any]]],
+    *,
+    cfg,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    {code: {"date", "feat_last", "distance"}}（特徴量が無い銘柄は入れない）。
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for it in items:
+        code = str(it.code)
+        snap = feature_rows.get(code)
+        if snap is None:
+            continue
+        d, row = snap
+        feat_last, atr_feat = feat_last_from_row(row, cfg)
+        atr = atr_feat if atr_feat is not None else it.atr
+        out[code] = {
+            "date": d.isoformat() if hasattr(d, "isoformat") else str(d),
+            "feat_last": feat_last,
+            "distance": distance_payload(
+                entry=it.entry,
+                tp=it.tp,
+                sl=it.sl,
+                last_close=it.last_close,
+                atr=atr,
+            ),
+        }
+    return out
+
+
+def emit_feature_sidecar(
+    items: List[PickItem],
+    feature_rows: Mapping[str, Tuple[Any, Dict[str, Any]]],
+    *,
+    cfg,
+    style: str,
+    horizon: str,
+    meta_extra: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    latest_full_features.json と timestamp 付きファイルを出す。書いた銘柄数を返す。
+    """
+    entries = build_sidecar(items, feature_rows, cfg=cfg)
+    meta: Dict[str, Any] = {
+        "mode": "features",
+        "style": style,
+        "horizon": horizon,
+        "total": len(entries),
+        "built_at": dt.datetime.now(JST).isoformat(),
+    }
+    meta.update({k: v for k, v in (meta_extra or {}).items() if v is not None})
+    data = {"meta": meta, "items": entries}
+
+    PICKS_DIR.mkdir(parents=True, exist_ok=True)
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    (PICKS_DIR / SIDECAR_LATEST).write_text(body)
+    (PICKS_DIR / f"{dt_now_stamp()}_{horizon}_{style}_full_features.json").write_text(body)
+    return len(entries)
+
+
+def load_feature_sidecar(
+    path: Optional[Path] = None,
+    *,
+    min_date: Optional[dt.date] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    サイドカーを読む。無い / 壊れている場合は {}。
+    min_date を渡すと、それより古い足の銘柄は落とす（古いサイドカーを使わない）。
+    """
+    p = path or (PICKS_DIR / SIDECAR_LATEST)
+    if not p.exists():
+        return {}
+    try:
+        data = json.loads(p.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, dict):
+        return {}
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for code, ent in items.items():
+        if not isinstance(ent, dict) or not isinstance(ent.get("feat_last"), dict):
+            continue
+        if min_date is not None:
+            try:
+                if dt.date.fromisoformat(str(ent.get("date"))[:10]) < min_date:
+                    continue
+            except Exception:
+                continue
+        out[str(code)] = ent
+    return out
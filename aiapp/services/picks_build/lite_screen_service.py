@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+一次スクリーニング（lite stage）。
+
+- 短い窓（--nbars-lite 本）だけで picks_filters.check_all を回す
+  （流動性 / ボラ過大 / 仕手っぽい急騰）
+- 生き残った銘柄だけを重い work_one（260本の特徴量・スコア・⭐️・ML・Sizing）へ回す
+- ここで落ちた銘柄は work_one 内のフィルタと同じ reason_code で filter_stats に数える
+- ATR / 流動性は窓の長さで値が変わるので、境界付近の銘柄は full（260本）と判定が食い違うことがある
+  → picks_build では既定で無効（--nbars-lite 0）。full と同じ結果になることを確認してから使う
+- 指標ステート（indicator_state.fresh_row）が最新の確定足まで進んでいれば、その最終行で判定する
+  （価格取得も make_lite_features もしない。ステートは全履歴なので 260本の full と同じ値になる）
+  ステートが無い・古い・設定違い・場中なら従来通り --nbars-lite 本で計算する
+- jobs>=2 なら scan_service.map_codes のプロセスプールで回す（結果・集計は codes 順で直列と同じ）
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aiapp.services.fetch_price import get_prices
+from aiapp.services.indicator_state import fresh_row
+from aiapp.models.features import make_lite_features, FeatureConfig
+
+from .scan_service import map_codes, resolve_jobs
+from .settings import BUILD_LOG
+from .utils import safe_float
+
+try:
+    from aiapp.services.picks_filters import FilterContext, check_all as picks_check_all
+except Exception:  # pragma: no cover
+    FilterContext = None  # type: ignore
+    picks_check_all = None  # type: ignore
+
+
+@dataclass
+class LiteCandidate:
+    code: str
+    last: Optional[float] = None
+    atr: Optional[float] = None
+
+
+@dataclass
+class LiteScreenResult:
+    survivors: List[LiteCandidate] = field(default_factory=list)
+    n_in: int = 0
+    n_empty: int = 0
+    n_filtered: int = 0
+    n_error: int = 0
+    n_state: int = 0  # 指標ステートの最終行で判定した銘柄数（価格取得なし）
+    seconds: float = 0.0
+
+    @property
+    def codes(self) -> List[str]:
+        return [c.code for c in self.survivors]
+
+    def stage_meta(self) -> Dict[str, Any]:
+        return {
+            "in": self.n_in,
+            "out": len(self.survivors),
+            "empty": self.n_empty,
+            "filtered": self.n_filtered,
+            "error": self.n_error,
+            "state": self.n_state,
+            "sec": round(self.seconds, 3),
+        }
+
+
+def _bump(stats: Optional[Dict[str, int]], key: str) -> None:
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + 1
+
+
+# _screen_one の判定
+_OK = "ok"
+_EMPTY = "empty"
+_FILTERED = "filtered"
+_ERROR = "error"
+
+
+def _screen_one(
+    code: str,
+    *,
+    nbars_lite: int,
+    fetch: Callable[..., pd.DataFrame],
+    cfg: FeatureConfig,
+    use_state: bool = True,
+) -> Tuple[str, Optional[LiteCandidate], Optional[str], bool]:
+    """
+    1銘柄の一次スクリーニング。戻り値: (判定, 生き残り候補, reason_code or エラー文, ステートで判定したか)
+    """
+    atr_col = f"ATR{cfg.atr_period}"
+    from_state = False
+    try:
+        row = fresh_row(code, cfg=cfg) if use_state else None
+        from_state = row is not None
+        if row is None:
+            raw = fetch(code, nbars=nbars_lite, period="3y")
+            if raw is None or len(raw) == 0:
+                # 価格が無い銘柄は full でも empty になるだけなので、ここで落とす
+                return _EMPTY, None, None, False
+
+            feat = make_lite_features(raw, cfg=cfg)
+            row = feat.iloc[-1].to_dict()
+        last = safe_float(row.get("Close"))
+        atr = safe_float(row.get(atr_col))
+
+        if picks_check_all is not None and FilterContext is not None:
+            decision = picks_check_all(FilterContext(code=str(code), feat=row, last=last, atr=atr))
+            if decision and getattr(decision, "skip", False):
+                return _FILTERED, None, getattr(decision, "reason_code", None), from_state
+
+        return _OK, LiteCandidate(
+            code=str(code),
+            last=last if np.isfinite(last) else None,
+            atr=atr if np.isfinite(atr) else None,
+        ), None, from_state
+    except Exception as ex:
+        # lite で判断できない銘柄は full に回す（取りこぼさない）
+        return _ERROR, LiteCandidate(code=str(code)), str(ex), from_state
+
+
+def _screen_one_in_worker(ctx: Dict[str, Any], code: str):
+    fetch = ctx.get("price_fn") or get_prices
+    return _screen_one(
+        code,
+        nbars_lite=ctx["nbars_lite"],
+        fetch=fetch,
+        cfg=FeatureConfig(),
+        use_state=ctx["use_state"],
+    )
+
+
+def lite_screen(
+    codes: List[str],
+    *,
+    nbars_lite: int,
+    price_fn: Optional[Callable[..., pd.DataFrame]] = None,
+    filter_stats: Optional[Dict[str, int]] = None,
+    jobs: int = 1,
+    use_state: bool = True,
+) -> LiteScreenResult:
+    t0 = time.perf_counter()
+    out = LiteScreenResult(n_in=len(codes))
+    jobs = resolve_jobs(jobs)
+
+    if jobs <= 1 or len(codes) <= 1:
+        fetch = price_fn if price_fn is not None else get_prices
+        cfg = FeatureConfig()
+        results = (
+            _screen_one(code, nbars_lite=nbars_lite, fetch=fetch, cfg=cfg, use_state=use_state)
+            for code in codes
+        )
+    else:
+        ctx = {"price_fn": price_fn, "nbars_lite": nbars_lite, "use_state": use_state}
+        results = map_codes(_screen_one_in_worker, codes, jobs=jobs, ctx=ctx)
+
+    for code, (kind, cand, note, from_state) in zip(codes, results):
+        out.n_state += int(from_state)
+        if kind == _EMPTY:
+            out.n_empty += 1
+        elif kind == _FILTERED:
+            out.n_filtered += 1
+            _bump(filter_stats, note or "SKIP")
+            if BUILD_LOG:
+                print(f"[picks_build] {code}: lite filtered out ({note})")
+        else:
+            if kind == _ERROR:
+                out.n_error += 1
+                if BUILD_LOG:
+                    print(f"[picks_build] {code}: lite error {note}")
+            out.survivors.append(cand)
+
+    out.seconds = time.perf_counter() - t0
+    return out
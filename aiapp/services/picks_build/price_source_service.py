@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+価格ソース（--use-snapshot 用）。
+
+- prices_snapshot_nightly が書いた media/aiapp/prices/YYYYMMDD/<code>.csv を読む
+- 一番新しい YYYYMMDD ディレクトリを採用
+- ファイルが無い銘柄だけ get_prices（ネットワーク）にフォールバック
+- ヒット/ミス件数を meta_extra に載せられる形で返す
+"""
+
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+from aiapp.services.fetch_price import SNAP_DIR, _normalize_ohlcv, get_prices
+
+from .settings import BUILD_LOG
+from .utils import normalize_code
+
+_DAY_DIR_RE = re.compile(r"^\d{8}$")
+
+
+def find_latest_snapshot_dir(base: Optional[Path] = None) -> Optional[Path]:
+    base = Path(base or SNAP_DIR)
+    if not base.exists():
+        return None
+    days = [p for p in base.iterdir() if p.is_dir() and _DAY_DIR_RE.match(p.name)]
+    if not days:
+        return None
+    return max(days, key=lambda p: p.name)
+
+
+def read_snapshot_csv(path: Path) -> pd.DataFrame:
+    """
+    snapshot CSV（Date,open,high,low,close,volume）を get_prices と同じ形に正規化。
+    """
+    df = pd.read_csv(path, index_col=0)
+    return _normalize_ohlcv(df)
+
+
+class SnapshotPriceSource:
+    """
+    get_prices と同じシグネチャで呼べる価格ソース。
+    work_one(price_fn=...) に渡して使う。
+    """
+
+    def __init__(
+        self,
+        snap_dir: Optional[Path] = None,
+        *,
+        fallback: Callable[..., pd.DataFrame] = get_prices,
+    ):
+        self.snap_dir = Path(snap_dir) if snap_dir is not None else find_latest_snapshot_dir()
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _path_for(self, code: str) -> Optional[Path]:
+        if self.snap_dir is None:
+            return None
+        c = str(code).strip()
+        for name in (c, normalize_code(c), f"{normalize_code(c)}.T"):
+            p = self.snap_dir / f"{name}.csv"
+            if p.exists():
+                return p
+        return None
+
+    def __call__(self, code: str, nbars: Optional[int] = None, period: str = "3y") -> pd.DataFrame:
+        path = self._path_for(code)
+        if path is not None:
+            try:
+                df = read_snapshot_csv(path)
+                if not df.empty:
+                    self.hits += 1
+                    if nbars is not None and nbars > 0 and len(df) > nbars:
+                        df = df.iloc[-nbars:].copy()
+                    return df
+            except Exception as ex:
+                self.errors += 1
+                if BUILD_LOG:
+                    print(f"[picks_build] snapshot read error {path}: {ex}")
+
+        self.misses += 1
+        return self.fallback(code, nbars=nbars, period=period)
+
+    def meta(self) -> Dict[str, Any]:
+        return {
+            "price_source": "snapshot",
+            "snapshot_dir": str(self.snap_dir) if self.snap_dir is not None else None,
+            "snapshot_hits": self.hits,
+            "snapshot_misses": self.misses,
+            "snapshot_errors": self.errors,
+        }
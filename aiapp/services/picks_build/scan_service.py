@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+ユニバース走査（codes → work_one の繰り返し）。
+
+- jobs<=1 : 従来通り1プロセスで順番に回す
+- jobs>=2 : プロセスプールに work_one をばら撒く（map_codes。lite stage も同じプールの仕組みを使う）
+    - 各ワーカーは fork 後に自分の DB コネクションを張り直す
+    - 結果は codes の順番どおりに回収する（executor.map）
+    - filter_stats / sizing_meta / snapshot ヒット数も codes 順でマージするので、
+      同じ入力なら直列実行とバイト単位で同じ JSON になる
+
+feature_rows:
+- 走査した銘柄の {code: (最終足の日付, 特徴量の最終行)}（aiapp.services.feature_store に書く用）
+
+feature_engine:
+- "ticker" : 従来通り work_one の中で1銘柄ずつ make_features
+- "panel"  : 先に全銘柄の価格を集めて aiapp.models.features_panel でまとめて計算し、
+             銘柄ごとの raw / feat を work_one に渡す（結果は make_features と浮動小数誤差の範囲で一致）
+             このとき ML 推論も ml_infer_service.infer_batch で全銘柄1回にまとめ、結果を work_one に渡す
+             スコアも scoring_service.score_batch で全銘柄1回にまとめ（横断パーセンタイル付き）、work_one に渡す
+- どちらの engine でも、事前の推論結果が無ければ work_one は推論せず（defer_ml）、
+  走査後に生き残った候補の特徴量最終行（feature_rows）を infer_batch で1回にまとめて推論する
+- 事前の score_batch 結果が無ければ（ticker engine）、work_one はスコアせずにフィルタ前の feat（スコア用の列だけ）を
+  score_sink に入れ、走査後に score_batch を1回呼んで生き残った候補に score / score_100 / score_pct を付ける
+  （engine によらず score_pct / score_batch が埋まる。pct の母集団はフィルタ前の全銘柄）
+
+sizing:
+- sizing_service.build_sizing_context で UserSetting / policy / 口座サマリーを run の最初に1回だけ読む
+- work_one は sizing せずに PickItem を返し（defer_sizing）、走査後に size_items で全候補 × 3社をまとめて計算
+  （銘柄ごとの DB クエリは 0。結果は1銘柄ずつ compute_position_sizing したのと同じ）
+
+picks_build / picks_build_hybrid の両方から使う。
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import multiprocessing as mp
+
+import pandas as pd
+
+from aiapp.services.fetch_price import get_prices
+from aiapp.models.features import FeatureConfig
+from aiapp.models.features_panel import make_features_panel
+
+from aiapp.services.sizing_service import SizingContext, build_sizing_context
+
+from .schema import PickItem
+from .utils import score_to_0_100
+from .worker_service import apply_ml, score_one, size_items, work_one
+
+try:
+    from aiapp.services.ml_infer_service import infer_batch as ml_infer_batch
+except Exception:  # pragma: no cover
+    ml_infer_batch = None  # type: ignore
+
+try:
+    from aiapp.services.scoring_service import score_batch
+except Exception:  # pragma: no cover
+    score_batch = None  # type: ignore
+
+try:
+    from django.db import connections
+except Exception:  # pragma: no cover
+    connections = None  # type: ignore
+
+_SOURCE_COUNTERS = ("hits", "misses", "errors")
+
+# ワーカープロセス側の共有コンテキスト（initializer で1回だけ入れる）
+_WORKER_CTX: Dict[str, Any] = {}
+
+
+@dataclass
+class ScanResult:
+    items: List[PickItem] = field(default_factory=list)
+    filter_stats: Dict[str, int] = field(default_factory=dict)
+    sizing_meta: Dict[str, Any] = field(default_factory=dict)
+    feature_rows: Dict[str, Any] = field(default_factory=dict)
+    ml_batch: int = 0  # infer_batch でまとめて推論した銘柄数（0 = 銘柄ごと推論 / モデル無し）
+    score_batch: int = 0  # score_pct の母集団（フィルタ前にスコアした銘柄数。0 = スコア無し）
+
+
+def resolve_jobs(jobs: Optional[int]) -> int:
+    """
+    --jobs の解釈: None/1 → 直列, 0 → CPU数, N → N
+    """
+    if jobs is None:
+        return 1
+    j = int(jobs)
+    if j == 0:
+        return max(1, os.cpu_count() or 1)
+    return max(1, j)
+
+
+def _source_counts(src: Optional[Callable[..., Any]]) -> Optional[Tuple[int, ...]]:
+    if src is None or not all(hasattr(src, k) for k in _SOURCE_COUNTERS):
+        return None
+    return tuple(int(getattr(src, k)) for k in _SOURCE_COUNTERS)
+
+
+def _merge_sizing_meta(dst: Dict[str, Any], sizing_meta: Optional[Dict[str, Any]]) -> None:
+    """
+    最初に見つかった risk_pct / lot_size を採用（直列版と同じ規則）。
+    """
+    if not sizing_meta:
+        return
+    if sizing_meta.get("risk_pct") is not None and "risk_pct" not in dst:
+        dst["risk_pct"] = float(sizing_meta["risk_pct"])
+    if sizing_meta.get("lot_size") is not None and "lot_size" not in dst:
+        dst["lot_size"] = int(sizing_meta["lot_size"])
+
+
+def prepare_panel_features(
+    codes: List[str],
+    *,
+    nbars: int,
+    price_fn: Optional[Callable[..., Any]] = None,
+) -> Dict[str, Tuple[pd.DataFrame, Optional[pd.DataFrame]]]:
+    """
+    全銘柄の価格を集めてパネルで特徴量を一括計算し、{code: (raw, feat)} を返す。
+    価格が取れなかった銘柄は (空DF, None) を入れておく（work_one 側で empty price 扱い）。
+    """
+    fetch = price_fn if price_fn is not None else get_prices
+    raws: Dict[str, pd.DataFrame] = {}
+    for code in codes:
+        try:
+            raw = fetch(code, nbars=nbars, period="3y")
+        except Exception:
+            raw = None
+        raws[code] = raw if isinstance(raw, pd.DataFrame) else pd.DataFrame()
+
+    panel = make_features_panel(raws, cfg=FeatureConfig())
+    out: Dict[str, Tuple[pd.DataFrame, Optional[pd.DataFrame]]] = {}
+    for code in codes:
+        feat = panel.frame(code) if code in panel else None
+        out[code] = (raws[code], feat)
+    return out
+
+
+def prepare_ml_batch(prepared: Dict[str, Tuple[pd.DataFrame, Optional[pd.DataFrame]]]) -> Dict[str, Any]:
+    """
+    事前計算済みの feat の最終行をまとめて推論し、{code: MLInferResult} を返す。
+    フィルタ前の全銘柄を入れる（1回の predict なので、落ちる銘柄が混ざってもほぼタダ）。
+    """
+    if ml_infer_batch is None:
+        return {}
+    rows = {code: feat for code, (_raw, feat) in prepared.items() if feat is not None and len(feat) > 0}
+    if not rows:
+        return {}
+    try:
+        return ml_infer_batch(rows)
+    except Exception as ex:
+        print(f"[picks_build] ml_infer_batch error: {ex}")
+        return {}
+
+
+def _infer_deferred(out: ScanResult) -> None:
+    """
+    defer_ml で推論を飛ばした候補を、feature_rows（特徴量の最終行）から1回の predict でまとめて推論する。
+    （infer_from_features を銘柄ごとに呼ぶのと同じ値。失敗したら ML 列は空のまま = 従来の推論失敗と同じ）
+    """
+    if ml_infer_batch is None or not out.items:
+        return
+    rows: Dict[str, Any] = {}
+    for item in out.items:
+        snap = out.feature_rows.get(item.code)
+        if snap is not None:
+            rows[item.code] = snap[1]
+    if not rows:
+        return
+    try:
+        results = ml_infer_batch(rows)
+    except Exception as ex:
+        print(f"[picks_build] ml_infer_batch error: {ex}")
+        return
+    for item in out.items:
+        r = results.get(item.code)
+        if r is not None:
+            apply_ml(item, r)
+    out.ml_batch = len(results)
+
+
+def _score_deferred(out: ScanResult, feats: Dict[str, pd.DataFrame], regime: Optional[object]) -> None:
+    """
+    score_sink に集めたフィルタ前の feat を score_batch で1回にまとめてスコアし、生き残った候補に付ける。
+    （score_sample を銘柄ごとに呼ぶのと同じ値。pct の母集団は panel engine と同じくフィルタ前の全銘柄）
+    一括が落ちたら生き残りだけ1銘柄ずつ score_sample する（従来どおり。score_pct は無し）。
+    """
+    if score_batch is None or not feats:
+        return
+    try:
+        results = score_batch(feats, regime=regime)
+        out.score_batch = len(results)
+    except Exception as ex:
+        print(f"[picks_build] score_batch error: {ex}")
+        results = {
+            item.code: {"score01": score_one(feats[item.code], regime), "pct": None}
+            for item in out.items
+            if item.code in feats
+        }
+    for item in out.items:
+        r = results.get(item.code)
+        if r is None:
+            continue
+        item.score = r["score01"]
+        item.score_100 = score_to_0_100(r["score01"])
+        item.score_pct = r.get("pct")
+
+
+def _size_deferred(out: ScanResult, sizing_ctx: Optional[SizingContext]) -> None:
+    """
+    defer_sizing で集めた候補を1回でまとめて sizing する（items の順 = codes の順で meta もマージ）。
+    """
+    if sizing_ctx is None or not out.items:
+        return
+    try:
+        metas = size_items(out.items, sizing_ctx)
+    except Exception as ex:
+        # 一括が落ちたら1銘柄ずつ（従来どおり、sizing で落ちた銘柄だけ外す）
+        print(f"[picks_build] size_items error: {ex}")
+        kept: List[PickItem] = []
+        metas = []
+        for item in out.items:
+            try:
+                metas.extend(size_items([item], sizing_ctx))
+                kept.append(item)
+            except Exception as ex1:
+                print(f"[picks_build] work error for {item.code}: {ex1}")
+                out.filter_stats["work_error"] = out.filter_stats.get("work_error", 0) + 1
+        out.items = kept
+    for sizing_meta in metas:
+        _merge_sizing_meta(out.sizing_meta, sizing_meta)
+
+
+def prepare_score_batch(
+    prepared: Dict[str, Tuple[pd.DataFrame, Optional[pd.DataFrame]]],
+    *,
+    regime: Optional[object] = None,
+) -> Dict[str, Any]:
+    """
+    事前計算済みの feat を全銘柄まとめてスコアし、{code: {"score01", "stars", "pct"}} を返す。
+    pct（横断パーセンタイル）はフィルタ前の全銘柄が母集団。
+    """
+    if score_batch is None:
+        return {}
+    feats = {code: feat for code, (_raw, feat) in prepared.items() if feat is not None and len(feat) > 0}
+    if not feats:
+        return {}
+    try:
+        return score_batch(feats, regime=regime)
+    except Exception as ex:
+        print(f"[picks_build] score_batch error: {ex}")
+        return {}
+
+
+def _init_worker(ctx: Dict[str, Any]) -> None:
+    # 親から引き継いだ DB コネクションは使わない（各ワーカーが自前で張る）
+    if connections is not None:
+        try:
+            connections.close_all()
+        except Exception:
+            pass
+    _WORKER_CTX.clear()
+    _WORKER_CTX.update(ctx)
+
+
+def _run_in_worker(code: str):
+    ctx = _WORKER_CTX
+    src = ctx.get("price_fn")
+    before = _source_counts(src)
+    res = ctx["fn"](ctx, code)
+    after = _source_counts(src)
+    delta = None
+    if before is not None and after is not None:
+        delta = tuple(a - b for a, b in zip(after, before))
+    return res, delta
+
+
+def map_codes(
+    fn: Callable[[Dict[str, Any], str], Any],
+    codes: List[str],
+    *,
+    jobs: int,
+    ctx: Dict[str, Any],
+) -> Iterator[Any]:
+    """
+    fn(ctx, code) をプロセスプール（fork）で回し、結果を codes の順に返す。
+    - ctx は initializer で各ワーカーに1回だけ入れる（fork なので pickle しない）
+    - ctx["price_fn"] の hits/misses/errors はワーカー側の増分を親に足し戻す
+    """
+    ctx = dict(ctx, fn=fn)
+    price_fn = ctx.get("price_fn")
+
+    # fork 前に親のコネクションを閉じておく（子に共有させない）
+    if connections is not None:
+        try:
+            connections.close_all()
+        except Exception:
+            pass
+
+    try:
+        mp_ctx = mp.get_context("fork")
+    except ValueError:  # pragma: no cover
+        mp_ctx = None
+
+    chunksize = max(1, len(codes) // (jobs * 8))
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=mp_ctx,
+        initializer=_init_worker,
+        initargs=(ctx,),
+    ) as ex:
+        for res, delta in ex.map(_run_in_worker, codes, chunksize=chunksize):
+            if delta is not None:
+                for k, d in zip(_SOURCE_COUNTERS, delta):
+                    setattr(price_fn, k, getattr(price_fn, k) + d)
+            yield res
+
+
+def _work_one_in_worker(ctx: Dict[str, Any], code: str):
+    local_stats: Dict[str, int] = {}
+    local_rows: Dict[str, Any] = {}
+    local_score_feats: Optional[Dict[str, pd.DataFrame]] = {} if ctx.get("defer_score") else None
+    raw, feat = (ctx.get("prepared") or {}).get(code, (None, None))
+    ml_result = (ctx.get("ml_results") or {}).get(code)
+    score_result = (ctx.get("score_results") or {}).get(code)
+
+    res = work_one(
+        ctx["user"],
+        code,
+        nbars=ctx["nbars"],
+        mode_period=ctx["mode_period"],
+        mode_aggr=ctx["mode_aggr"],
+        behavior_cache=ctx["behavior_cache"],
+        filter_stats=local_stats,
+        regime=ctx["regime"],
+        price_fn=ctx.get("price_fn"),
+        raw=raw,
+        feat=feat,
+        feature_sink=local_rows,
+        ml_result=ml_result,
+        score_result=score_result,
+        score_sink=local_score_feats,
+        sizing_ctx=ctx.get("sizing_ctx"),
+        defer_sizing=ctx.get("sizing_ctx") is not None,
+        defer_ml=ctx.get("defer_ml", False),
+    )
+    return res, local_stats, local_rows, local_score_feats
+
+
+def scan_universe(
+    codes: List[str],
+    *,
+    user,
+    nbars: int,
+    mode_period: str,
+    mode_aggr: str,
+    behavior_cache: Optional[Dict[Tuple[str, str, str], Dict[str, Any]]] = None,
+    regime: Optional[object] = None,
+    price_fn: Optional[Callable[..., Any]] = None,
+    jobs: int = 1,
+    feature_engine: str = "ticker",
+    sizing_ctx: Optional[SizingContext] = None,
+) -> ScanResult:
+    out = ScanResult()
+    jobs = resolve_jobs(jobs)
+
+    if sizing_ctx is None:
+        try:
+            sizing_ctx = build_sizing_context(user)
+        except Exception as ex:
+            print(f"[picks_build] sizing context error: {ex}")
+            sizing_ctx = None
+    defer_sizing = sizing_ctx is not None
+
+    prepared: Dict[str, Tuple[pd.DataFrame, Optional[pd.DataFrame]]] = {}
+    if feature_engine == "panel" and codes:
+        prepared = prepare_panel_features(codes, nbars=nbars, price_fn=price_fn)
+    ml_results = prepare_ml_batch(prepared) if prepared else {}
+    out.ml_batch = len(ml_results)
+    # 事前推論が無い（ticker engine など）なら、走査後に生き残りだけまとめて推論する
+    defer_ml = defer_sizing and ml_infer_batch is not None and not ml_results
+    score_results = prepare_score_batch(prepared, regime=regime) if prepared else {}
+    out.score_batch = len(score_results)
+    # 事前スコアが無い（ticker engine など）なら、フィルタ前の feat を集めて走査後にまとめてスコアする
+    defer_score = score_batch is not None and not score_results
+    score_feats: Dict[str, pd.DataFrame] = {}
+
+    if jobs <= 1 or len(codes) <= 1:
+        for code in codes:
+            raw, feat = prepared.get(code, (None, None))
+            res = work_one(
+                user,
+                code,
+                nbars=nbars,
+                mode_period=mode_period,
+                mode_aggr=mode_aggr,
+                behavior_cache=behavior_cache,
+                filter_stats=out.filter_stats,
+                regime=regime,
+                price_fn=price_fn,
+                raw=raw,
+                feat=feat,
+                feature_sink=out.feature_rows,
+                ml_result=ml_results.get(code),
+                score_result=score_results.get(code),
+                score_sink=score_feats if defer_score else None,
+                sizing_ctx=sizing_ctx,
+                defer_sizing=defer_sizing,
+                defer_ml=defer_ml,
+            )
+            if res is None:
+                continue
+            item, sizing_meta = res
+            out.items.append(item)
+            _merge_sizing_meta(out.sizing_meta, sizing_meta)
+        if defer_score:
+            _score_deferred(out, score_feats, regime)
+        if defer_ml:
+            _infer_deferred(out)
+        _size_deferred(out, sizing_ctx)
+        return out
+
+    ctx = {
+        "user": user,
+        "nbars": nbars,
+        "mode_period": mode_period,
+        "mode_aggr": mode_aggr,
+        "behavior_cache": behavior_cache,
+        "regime": regime,
+        "price_fn": price_fn,
+        "prepared": prepared,
+        "ml_results": ml_results,
+        "score_results": score_results,
+        "sizing_ctx": sizing_ctx,
+        "defer_ml": defer_ml,
+        "defer_score": defer_score,
+    }
+
+    for res, local_stats, local_rows, local_score_feats in map_codes(_work_one_in_worker, codes, jobs=jobs, ctx=ctx):
+        for k, v in local_stats.items():
+            out.filter_stats[k] = out.filter_stats.get(k, 0) + v
+        out.feature_rows.update(local_rows)
+        if local_score_feats:
+            score_feats.update(local_score_feats)
+        if res is None:
+            continue
+        item, sizing_meta = res
+        out.items.append(item)
+        _merge_sizing_meta(out.sizing_meta, sizing_meta)
+
+    if defer_score:
+        _score_deferred(out, score_feats, regime)
+    if defer_ml:
+        _infer_deferred(out)
+    _size_deferred(out, sizing_ctx)
+    return out
@@ -60,6 +60,7 @@ class PickItem:
 
     score: Optional[float] = None
     score_100: Optional[int] = None
+    score_pct: Optional[float] = None  # 当日ユニバース内の score のパーセンタイル（0..1。フィルタ前の全銘柄が母集団）
     stars: Optional[int] = None
 
     ml_p_win: Optional[float] = None
@@ -14,14 +14,19 @@
 
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
 from aiapp.services.fetch_price import get_prices
 from aiapp.models.features import make_features, FeatureConfig
-from aiapp.services.sizing_service import compute_position_sizing
+from aiapp.services.sizing_service import (
+    SizingContext,
+    compute_position_sizing,
+    compute_position_sizing_batch,
+)
+from aiapp.services.feature_store import last_row_of
 
 from .settings import BUILD_LOG, CONF_DETAIL
 from .schema import PickItem
@@ -52,10 +57,12 @@ except Exception:  # pragma: no cover
 
 try:
     from aiapp.services.scoring_service import (
+        SCORE_COLS,
         score_sample as ext_score_sample,
         stars_from_score as ext_stars_from_score,
     )
 except Exception:  # pragma: no cover
+    SCORE_COLS = ()  # type: ignore
     ext_score_sample = None  # type: ignore
     ext_stars_from_score = None  # type: ignore
 
@@ -168,6 +175,89 @@ def _confirm_flags_to_ja(flags: Optional[List[str]]) -> List[str]:
     return out
 
 
+def p_tp_first_of(ml_tp_probs: Any) -> Optional[float]:
+    try:
+        if isinstance(ml_tp_probs, dict):
+            v = ml_tp_probs.get("tp_first")
+            if v is not None:
+                return float(v)
+    except Exception:
+        pass
+    return None
+
+
+def apply_sizing(item: PickItem, sizing: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    compute_position_sizing の dict を PickItem に書き込み、sizing_meta（risk_pct / lot_size）を返す。
+    """
+    for key in ("rakuten", "matsui", "sbi"):
+        setattr(item, f"qty_{key}", sizing.get(f"qty_{key}"))
+        setattr(item, f"required_cash_{key}", sizing.get(f"required_cash_{key}"))
+        setattr(item, f"est_pl_{key}", sizing.get(f"est_pl_{key}"))
+        setattr(item, f"est_loss_{key}", sizing.get(f"est_loss_{key}"))
+        setattr(item, f"ev_net_{key}", sizing.get(f"ev_net_{key}"))
+        setattr(item, f"rr_net_{key}", sizing.get(f"rr_net_{key}"))
+        setattr(item, f"ev_true_{key}", sizing.get(f"ev_true_{key}"))
+        setattr(item, f"reason_{key}", sizing.get(f"reason_{key}_msg") or "")
+
+    reasons_text = sizing.get("reasons_text")
+    item.reasons_text = reasons_text if reasons_text else None
+
+    return {
+        "risk_pct": sizing.get("risk_pct"),
+        "lot_size": sizing.get("lot_size"),
+    }
+
+
+def apply_ml(item: PickItem, r: Any) -> None:
+    """
+    MLInferResult を PickItem に書き込む（work_one の ML 部分と同じ変換）。
+    work_one(defer_ml=True) で推論を後回しにした候補用。
+    """
+    item.ml_p_win = nan_to_none(getattr(r, "p_win", None))
+    item.ml_ev = nan_to_none(getattr(r, "ev", None))
+    item.ml_rank = nan_to_none(getattr(r, "ml_rank", None))
+    item.ml_hold_days_pred = nan_to_none(getattr(r, "hold_days_pred", None))
+    item.ml_tp_first = getattr(r, "tp_first", None)
+    item.ml_tp_first_probs = getattr(r, "tp_first_probs", None)
+
+
+def size_items(items: List[PickItem], ctx: SizingContext) -> List[Dict[str, Any]]:
+    """
+    work_one(defer_sizing=True) で集めた PickItem を、全候補 × 3社まとめて sizing する。
+    戻り値: items と同じ順の sizing_meta（risk_pct / lot_size）
+    """
+    probs = [p_tp_first_of(it.ml_tp_first_probs) for it in items]
+    sizings = compute_position_sizing_batch(
+        ctx,
+        [it.code for it in items],
+        [safe_float(it.last_close) for it in items],
+        [it.atr for it in items],
+        [it.entry for it in items],
+        [it.tp for it in items],
+        [it.sl for it in items],
+        p_tp_first=probs,
+    )
+    metas: List[Dict[str, Any]] = []
+    for it, sizing, p_tp_first in zip(items, sizings, probs):
+        metas.append(apply_sizing(it, sizing))
+        if BUILD_LOG:
+            evr = as_float_or_none(it.ev_true_rakuten)
+            qtyr = int(it.qty_rakuten or 0)
+            print(f"[picks_build] {it.code} EV_true_rakuten={evr} qty_rakuten={qtyr} pTP={p_tp_first}")
+    return metas
+
+
+def score_one(feat: pd.DataFrame, regime: Optional[object]) -> float:
+    """1銘柄分の score01（scoring_service.score_sample。無ければ簡易版）。"""
+    if ext_score_sample:
+        try:
+            return float(ext_score_sample(feat, regime=regime))
+        except TypeError:
+            return float(ext_score_sample(feat))
+    return _fallback_score_sample(feat)
+
+
 def work_one(
     user,
     code: str,
@@ -178,9 +268,35 @@ def work_one(
     behavior_cache: Optional[Dict[Tuple[str, str, str], Dict[str, Any]]] = None,
     filter_stats: Optional[Dict[str, int]] = None,
     regime: Optional[object] = None,
+    price_fn: Optional[Callable[..., pd.DataFrame]] = None,
+    raw: Optional[pd.DataFrame] = None,
+    feat: Optional[pd.DataFrame] = None,
+    feature_sink: Optional[Dict[str, Any]] = None,
+    ml_result: Optional[Any] = None,
+    score_result: Optional[Dict[str, Any]] = None,
+    score_sink: Optional[Dict[str, pd.DataFrame]] = None,
+    sizing_ctx: Optional[SizingContext] = None,
+    defer_sizing: bool = False,
+    defer_ml: bool = False,
 ) -> Optional[Tuple[PickItem, Dict[str, Any]]]:
+    """
+    raw / feat を渡すとそれを使う（パネル版特徴量エンジンで事前計算済みの場合）。
+    None のときは従来通りここで get_prices / make_features する。
+    feature_sink を渡すと、フィルタ前に {code: (最終足の日付, 最終行)} を入れる（feature_store 用）。
+    ml_result（ml_infer_service.infer_batch の1銘柄分）を渡すと、ここでは推論しない。
+    score_result（scoring_service.score_batch の1銘柄分）を渡すと、ここでは score_sample しない。
+    score_sink を渡すと、ここでは score_sample せず、フィルタ前に {code: スコア用の列だけの feat} を入れる
+      （呼び出し側で score_batch を1回呼んで score / score_100 / score_pct を付ける。
+        フォールバックの★が要るとき = confidence_service が使えないときだけ、ここで score_sample する）。
+    sizing_ctx（sizing_service.build_sizing_context）を渡すと、sizing で UserSetting / policy / 口座を読み直さない。
+    defer_sizing=True なら sizing せずに返す（呼び出し側で size_items にまとめて渡す）。
+    defer_ml=True なら ML 推論せずに返す（呼び出し側で feature_sink の最終行をまとめて推論し apply_ml）。
+      ML の結果は sizing の pTP にしか効かないので、defer_sizing と一緒に使う。
+    """
     try:
-        raw = get_prices(code, nbars=nbars, period="3y")
+        if raw is None:
+            fetch = price_fn if price_fn is not None else get_prices
+            raw = fetch(code, nbars=nbars, period="3y")
         if raw is None or len(raw) == 0:
             if BUILD_LOG:
                 print(f"[picks_build] {code}: empty price")
@@ -192,12 +308,18 @@ def work_one(
         )
 
         cfg = FeatureConfig()
-        feat = make_features(raw, cfg=cfg)
+        if feat is None:
+            feat = make_features(raw, cfg=cfg)
         if feat is None or len(feat) == 0:
             if BUILD_LOG:
                 print(f"[picks_build] {code}: empty features")
             return None
 
+        if feature_sink is not None:
+            snap = last_row_of(feat)
+            if snap is not None:
+                feature_sink[normalize_code(code)] = snap
+
         close_s = safe_series(feat.get("Close"))
         atr_s = safe_series(feat.get(f"ATR{cfg.atr_period}") if f"ATR{cfg.atr_period}" in feat else None)
 
@@ -229,6 +351,17 @@ def work_one(
         high_all = nan_to_none(high_all)
         low_all = nan_to_none(low_all)
 
+        # score（事前の score_batch 結果が無く score_sink があれば、フィルタ前に入れて走査後にまとめてスコア）
+        s01: Optional[float] = None
+        s_pct = None
+        defer_score = False
+        if score_result is not None and score_result.get("score01") is not None:
+            s01 = float(score_result["score01"])
+            s_pct = score_result.get("pct")
+        elif score_sink is not None:
+            score_sink[normalize_code(code)] = feat[[c for c in SCORE_COLS if c in feat.columns]]
+            defer_score = True
+
         # filters
         if picks_check_all is not None and FilterContext is not None:
             try:
@@ -250,15 +383,10 @@ def work_one(
                     print(f"[picks_build] {code}: filter error {ex}")
 
         # score
-        if ext_score_sample:
-            try:
-                s01 = float(ext_score_sample(feat, regime=regime))
-            except TypeError:
-                s01 = float(ext_score_sample(feat))
-        else:
-            s01 = _fallback_score_sample(feat)
+        if s01 is None and not defer_score:
+            s01 = score_one(feat, regime)
 
-        score100 = score_to_0_100(s01)
+        score100 = score_to_0_100(s01) if s01 is not None else None
 
         # entry/tp/sl
         if ext_entry_tp_sl:
@@ -268,18 +396,7 @@ def work_one(
 
         code_norm = normalize_code(code)
 
-        # fallback stars
-        fallback_star = None
-        if ext_stars_from_score:
-            try:
-                fallback_star = int(ext_stars_from_score(s01))
-            except Exception:
-                fallback_star = None
-        if not isinstance(fallback_star, int) or not (1 <= fallback_star <= 5):
-            fallback_star = _fallback_stars(s01)
-
-        stars = int(fallback_star)
-
+        stars: Optional[int] = None
         conf_meta: Dict[str, Any] = {}
         if compute_confidence_star is not None:
             try:
@@ -357,7 +474,21 @@ def work_one(
             except Exception as ex:
                 if BUILD_LOG:
                     print(f"[picks_build] confidence_service error for {code_norm}: {ex}")
-                stars = int(fallback_star)
+                stars = None
+
+        # fallback stars（スコアを後回しにしていても、ここで要るときだけは1銘柄分スコアする）
+        if stars is None:
+            if s01 is None:
+                s01 = score_one(feat, regime)
+            fallback_star = None
+            if ext_stars_from_score:
+                try:
+                    fallback_star = int(ext_stars_from_score(s01))
+                except Exception:
+                    fallback_star = None
+            if not isinstance(fallback_star, int) or not (1 <= fallback_star <= 5):
+                fallback_star = _fallback_stars(s01)
+            stars = int(fallback_star)
 
         # ML
         ml_p_win = None
@@ -367,9 +498,9 @@ def work_one(
         ml_tp = None
         ml_tp_probs = None
 
-        if ml_infer_from_features is not None:
+        if not defer_ml and (ml_result is not None or ml_infer_from_features is not None):
             try:
-                r = ml_infer_from_features(feat_df=feat)
+                r = ml_result if ml_result is not None else ml_infer_from_features(feat_df=feat)
                 ml_p_win = getattr(r, "p_win", None)
                 ml_ev = getattr(r, "ev", None)
                 ml_rank = getattr(r, "ml_rank", None)
@@ -433,7 +564,7 @@ def work_one(
         if BUILD_LOG:
             msg = (
                 f"[picks_build] {code_norm} last={last} atr={atr} "
-                f"score01={s01:.3f} score100={score100} stars={stars} "
+                f"score01={'deferred' if s01 is None else f'{s01:.3f}'} score100={score100} stars={stars} "
                 f"(period={mode_period} aggr={mode_aggr}) entry_reason={entry_reason} "
                 f"confirm={confirm_score}"
             )
@@ -451,7 +582,8 @@ def work_one(
             tp=nan_to_none(t),
             sl=nan_to_none(s),
             score=nan_to_none(s01),
-            score_100=int(score100),
+            score_100=score100,
+            score_pct=nan_to_none(s_pct),
             stars=int(stars),
             ml_p_win=nan_to_none(ml_p_win),
             ml_ev=nan_to_none(ml_ev),
@@ -485,83 +617,41 @@ def work_one(
             low_all=low_all,
         )
 
-        # p_tp_first
-        p_tp_first = None
-        try:
-            if isinstance(ml_tp_probs, dict):
-                v = ml_tp_probs.get("tp_first")
-                if v is not None:
-                    p_tp_first = float(v)
-        except Exception:
-            p_tp_first = None
-
-        # sizing（互換維持）
-        try:
-            sizing = compute_position_sizing(
-                user=user,
-                code=str(code_norm),
-                last_price=last,
-                atr=atr,
-                entry=e,
-                tp=t,
-                sl=s,
-                p_tp_first=p_tp_first,
-            )
-        except TypeError:
-            sizing = compute_position_sizing(
-                user=user,
-                code=str(code_norm),
-                last_price=last,
-                atr=atr,
-                entry=e,
-                tp=t,
-                sl=s,
-            )
-
-        item.qty_rakuten = sizing.get("qty_rakuten")
-        item.required_cash_rakuten = sizing.get("required_cash_rakuten")
-        item.est_pl_rakuten = sizing.get("est_pl_rakuten")
-        item.est_loss_rakuten = sizing.get("est_loss_rakuten")
-
-        item.qty_matsui = sizing.get("qty_matsui")
-        item.required_cash_matsui = sizing.get("required_cash_matsui")
-        item.est_pl_matsui = sizing.get("est_pl_matsui")
-        item.est_loss_matsui = sizing.get("est_loss_matsui")
-
-        item.qty_sbi = sizing.get("qty_sbi")
-        item.required_cash_sbi = sizing.get("required_cash_sbi")
-        item.est_pl_sbi = sizing.get("est_pl_sbi")
-        item.est_loss_sbi = sizing.get("est_loss_sbi")
-
-        item.ev_net_rakuten = sizing.get("ev_net_rakuten")
-        item.rr_net_rakuten = sizing.get("rr_net_rakuten")
-        item.ev_net_matsui = sizing.get("ev_net_matsui")
-        item.rr_net_matsui = sizing.get("rr_net_matsui")
-        item.ev_net_sbi = sizing.get("ev_net_sbi")
-        item.rr_net_sbi = sizing.get("rr_net_sbi")
-
-        item.ev_true_rakuten = sizing.get("ev_true_rakuten")
-        item.ev_true_matsui = sizing.get("ev_true_matsui")
-        item.ev_true_sbi = sizing.get("ev_true_sbi")
-
-        reasons_text = sizing.get("reasons_text")
-        item.reasons_text = reasons_text if reasons_text else None
-
-        item.reason_rakuten = sizing.get("reason_rakuten_msg") or ""
-        item.reason_matsui = sizing.get("reason_matsui_msg") or ""
-        item.reason_sbi = sizing.get("reason_sbi_msg") or ""
-
-        sizing_meta = {
-            "risk_pct": sizing.get("risk_pct"),
-            "lot_size": sizing.get("lot_size"),
-        }
+        sizing_meta: Dict[str, Any] = {}
         if conf_meta:
             sizing_meta["confidence_detail"] = conf_meta
 
-        if BUILD_LOG:
-            evr = as_float_or_none(item.ev_true_rakuten)
-            qtyr = int(item.qty_rakuten or 0)
-            print(f"[picks_build] {code_norm} EV_true_rakuten={evr} qty_rakuten={qtyr} pTP={p_tp_first}")
+        # sizing（defer_sizing のときは scan 側で全候補まとめて size_items）
+        if not defer_sizing:
+            p_tp_first = p_tp_first_of(ml_tp_probs)
+            try:
+                sizing = compute_position_sizing(
+                    user=user,
+                    code=str(code_norm),
+                    last_price=last,
+                    atr=atr,
+                    entry=e,
+                    tp=t,
+                    sl=s,
+                    p_tp_first=p_tp_first,
+                    ctx=sizing_ctx,
+                )
+            except TypeError:
+                sizing = compute_position_sizing(
+                    user=user,
+                    code=str(code_norm),
+                    last_price=last,
+                    atr=atr,
+                    entry=e,
+                    tp=t,
+                    sl=s,
+                )
+            sizing_meta.update(apply_sizing(item, sizing))
+
+            if BUILD_LOG:
+                evr = as_float_or_none(item.ev_true_rakuten)
+                qtyr = int(item.qty_rakuten or 0)
+                print(f"[picks_build] {code_norm} EV_true_rakuten={evr} qty_rakuten={qtyr} pTP={p_tp_first}")
 
         return item, sizing_meta
 
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+aiapp.services.price_store
+- 日足OHLCVのローカル列指向ストア（1銘柄 = 1ファイル）
+- 保存先: media/aiapp/prices/daily/<code>.parquet
+  （pyarrow が無い環境では <code>.csv にフォールバック）
+- get_prices() が最初に読む。足りない「末尾」だけを yfinance から取り直す
+
+設計方針:
+- 中身は fetch_price._normalize_ohlcv 済みの DataFrame
+  index=DatetimeIndex, columns=["Open","High","Low","Close","Volume"]
+- 書き込みは一時ファイル → os.replace で原子的に置き換える
+  （prices_snapshot_nightly のスレッド並列から同時に呼ばれても壊れない）
+- 壊れたファイルは「無かったこと」にして取り直す
+- 場中の「未確定の当日足」は保存しない（確定足だけを持つ）
+  （呼び出し側に当日足を返すかどうかは fetch_price.get_prices の completed_only で決める）
+- 保存は末尾 STORE_MAX_BARS 本まで。それより長い period は fetch_price 側でストアを通さない
+"""
+
+from __future__ import annotations
+
+import os
+import datetime as dt
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+COLS = ["Open", "High", "Low", "Close", "Volume"]
+
+STORE_DIR = Path("media/aiapp/prices/daily")
+
+# 0 なら無効（常に従来通り全期間ダウンロード）
+STORE_ENABLED = str(os.getenv("AIAPP_PRICE_STORE", "1")).strip().lower() in ("1", "true", "yes", "on")
+
+# 最後の同期からこの分数以内なら、日付が足りなくてもネットに行かない（祝日対策）
+STORE_TTL_MIN = int(os.getenv("AIAPP_PRICE_STORE_TTL_MIN", "360"))
+
+# 保存しておく最大本数（約4年分）
+STORE_MAX_BARS = int(os.getenv("AIAPP_PRICE_STORE_MAX_BARS", "1000"))
+
+# 東証の寄り・大引け（大引け以降なら当日足が確定している想定）
+MARKET_OPEN_JST = dt.time(9, 0)
+MARKET_CLOSE_JST = dt.time(15, 30)
+
+JST = dt.timezone(dt.timedelta(hours=9))
+
+
+def _can_parquet() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+_PARQUET = _can_parquet()
+
+
+def _safe_code(code: str) -> str:
+    return str(code).strip().replace("/", "_")
+
+
+def store_path(code: str) -> Path:
+    """
+    既存ファイルがあればその形式、無ければ parquet 優先。
+    """
+    name = _safe_code(code)
+    p_parq = STORE_DIR / f"{name}.parquet"
+    p_csv = STORE_DIR / f"{name}.csv"
+    if p_parq.exists():
+        return p_parq
+    if p_csv.exists():
+        return p_csv
+    return p_parq if _PARQUET else p_csv
+
+
+def _empty() -> pd.DataFrame:
+    return pd.DataFrame(columns=COLS)
+
+
+def load(code: str) -> pd.DataFrame:
+    """
+    ストアから1銘柄分を読む。無い/壊れている場合は空DF。
+    """
+    path = store_path(code)
+    if not path.exists():
+        return _empty()
+    try:
+        if path.suffix == ".parquet":
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, index_col=0)
+    except Exception:
+        return _empty()
+
+    if not all(c in df.columns for c in COLS):
+        return _empty()
+
+    df = df[COLS].copy()
+    df.index = pd.to_datetime(df.index, errors="coerce")
+    df = df[~df.index.isna()]
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df
+
+
+def save(code: str, df: pd.DataFrame) -> None:
+    """
+    1銘柄分を原子的に書き込む（末尾 STORE_MAX_BARS 本だけ残す）。
+    """
+    if df is None or df.empty:
+        return
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+
+    out = df[COLS].copy()
+    out = out[~out.index.duplicated(keep="last")].sort_index()
+    if STORE_MAX_BARS > 0 and len(out) > STORE_MAX_BARS:
+        out = out.iloc[-STORE_MAX_BARS:]
+    out.index.name = "Date"
+
+    path = store_path(code)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        if path.suffix == ".parquet":
+            out.to_parquet(tmp)
+        else:
+            out.to_csv(tmp)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            try:
+                tmp.unlink()
+            except Exception:
+                pass
+
+
+def merge(base: pd.DataFrame, tail: pd.DataFrame) -> pd.DataFrame:
+    """
+    既存データに新しい末尾を重ねる（同日付は新しい方を採用）。
+    """
+    if base is None or base.empty:
+        return tail if tail is not None else _empty()
+    if tail is None or tail.empty:
+        return base
+    df = pd.concat([base[COLS], tail[COLS]])
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df
+
+
+def expected_last_date(now: Optional[dt.datetime] = None) -> dt.date:
+    """
+    「今この時点で出ているはずの最新日足」の日付（祝日は考慮しない）。
+    - 平日の大引け前なら前営業日
+    - 土日なら直前の金曜
+    """
+    now = now or dt.datetime.now(JST)
+    d = now.date()
+    if d.weekday() < 5 and now.time() < MARKET_CLOSE_JST:
+        d -= dt.timedelta(days=1)
+    while d.weekday() >= 5:
+        d -= dt.timedelta(days=1)
+    return d
+
+
+def in_session(now: Optional[dt.datetime] = None) -> bool:
+    """
+    場中か（平日の寄り〜大引け。祝日は考慮しない）。
+    場中はストアに無い「未確定の当日足」が出ている。
+    """
+    now = now or dt.datetime.now(JST)
+    return now.weekday() < 5 and MARKET_OPEN_JST <= now.time() < MARKET_CLOSE_JST
+
+
+def completed_only(df: pd.DataFrame, now: Optional[dt.datetime] = None) -> pd.DataFrame:
+    """
+    確定済みの足だけに絞る（expected_last_date より後ろは落とす）。
+    """
+    if df is None or df.empty:
+        return df
+    cutoff = pd.Timestamp(expected_last_date(now)) + pd.Timedelta(days=1)
+    tz = getattr(df.index, "tz", None)
+    if tz is not None:
+        cutoff = cutoff.tz_localize(tz)
+    return df[df.index < cutoff]
+
+
+def synced_recently(code: str, now: Optional[dt.datetime] = None) -> bool:
+    """
+    最終同期（ファイル更新時刻）が TTL 以内か。
+    """
+    path = store_path(code)
+    if not path.exists() or STORE_TTL_MIN <= 0:
+        return False
+    try:
+        mtime = dt.datetime.fromtimestamp(path.stat().st_mtime, tz=JST)
+    except Exception:
+        return False
+    now = now or dt.datetime.now(JST)
+    return (now - mtime) <= dt.timedelta(minutes=STORE_TTL_MIN)
+
+
+def is_fresh(code: str, df: pd.DataFrame, now: Optional[dt.datetime] = None) -> bool:
+    """
+    ストアの中身だけで足りるか（= ネットに行かなくてよいか）。
+    """
+    if df is None or df.empty:
+        return False
+    last = pd.Timestamp(df.index.max()).date()
+    if last >= expected_last_date(now):
+        return True
+    return synced_recently(code, now)
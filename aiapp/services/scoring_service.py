@@ -24,10 +24,12 @@ scoring_service.py
 
 score_sample(feat_df, regime=None) -> 0..1
 stars_from_score(score01) -> 1..5
+score_panel(cols, valid, window=260, regime=None) -> (T, N) の 0..1（バックテスト用・全日付一括）
+score_batch(feat_map, regime=None) -> {code: {score01, stars, pct}}（picks_build 用・横断パーセンタイル付き）
 """
 
 from __future__ import annotations
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, Mapping
 
 import numpy as np
 import pandas as pd
@@ -285,4 +287,176 @@ def stars_from_score(score01: float) -> int:
         return 3
     if s < 0.80:
         return 4
-    return 5
\ No newline at end of file
+    return 5
+
+# ====== パネル版（全日付 × 全銘柄を一括） ======
+
+def _sig_arr(x: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        return 1.0 / (1.0 + np.exp(-x))
+
+
+def _nz_arr(x: np.ndarray, default: float = 0.0) -> np.ndarray:
+    return np.where(np.isfinite(x), x, default)
+
+
+def _zscore_window(a: Optional[np.ndarray], valid: np.ndarray, window: int) -> np.ndarray:
+    """
+    各 t で「直近 window 本（欠損除く）」に対する最後の値の z（_zscore_last と同じ定義）。
+    3本未満は NaN、分散 0 は 0。
+    """
+    if a is None:
+        return np.full(valid.shape, np.nan)
+    x = np.where(valid & np.isfinite(a), a, np.nan)
+    ok = np.isfinite(x)
+    x0 = np.where(ok, x, 0.0)
+
+    def _win(c: np.ndarray) -> np.ndarray:
+        c = np.cumsum(c, axis=0)
+        if window < c.shape[0]:
+            c[window:] = c[window:] - c[:-window].copy()
+        return c
+
+    n = _win(ok.astype(np.float64))
+    s1 = _win(x0)
+    s2 = _win(x0 * x0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        m = s1 / n
+        var = np.maximum(s2 / n - m * m, 0.0)
+        sd = np.sqrt(var)
+        # 累積和の丸め誤差で「一定値なのに sd>0」にならないよう、相対的に極小なら 0 扱い
+        flat = sd <= 1e-12 * np.maximum(np.abs(m), 1.0)
+        z = np.where(flat, 0.0, (x - m) / sd)
+    # _zscore_last は dropna 後の最後の値を使う（ffill 済みの列なら t の値と同じ）
+    return np.where((n >= 3) & ok, z, np.nan)
+
+
+def score_panel(
+    cols: Mapping[str, np.ndarray],
+    valid: np.ndarray,
+    *,
+    window: int = 260,
+    regime: Optional[object] = None,
+) -> np.ndarray:
+    """
+    features_panel の列（(T, N)）から、各日付時点の score_sample を一括で出す。
+      valid : (T, N) その銘柄の足がある位置（右詰めの上側パディングは False）
+      window: z スコアを取る本数（picks_build の --nbars に合わせる）
+    戻り値: (T, N)。valid=False の位置は NaN。
+    ※ feat を window 本で作り直すわけではないので、EWM 系の立ち上がりだけ score_sample と僅かにずれる。
+    """
+    def col(name: str) -> Optional[np.ndarray]:
+        return cols.get(name)
+
+    def last(name: str) -> np.ndarray:
+        a = col(name)
+        return np.full(valid.shape, np.nan) if a is None else np.where(valid, a, np.nan)
+
+    w = max(3, int(window))
+
+    trend = 0.6 * _sig_arr(_nz_arr(_zscore_window(col("SLOPE_5"), valid, w))) + 0.4 * _sig_arr(
+        _nz_arr(_zscore_window(col("SLOPE_20"), valid, w))
+    )
+
+    rsi = last("RSI14")
+    rsi_c = (rsi - 50.0) / 10.0
+    mom = (
+        0.45 * _sig_arr(_nz_arr(_zscore_window(col("RET_5"), valid, w)))
+        + 0.35 * _sig_arr(_nz_arr(_zscore_window(col("RET_20"), valid, w)))
+        + 0.20 * _sig_arr(_nz_arr(rsi_c))
+    )
+
+    vol = last("Volume")
+    ma20 = last("MA20")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vol_ok = np.isfinite(vol) & np.isfinite(ma20) & (ma20 > 0)
+        volu = np.where(vol_ok, _sig_arr(np.where(vol_ok, vol / np.where(vol_ok, ma20, 1.0) - 1.0, 0.0)), 0.5)
+
+    atr = last("ATR14")
+    atr_a = col("ATR14")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        log_atr = None if atr_a is None else np.log(np.where(atr_a > 0, atr_a, np.nan))
+        atr_ok = np.isfinite(atr) & (atr > 0)
+    vctrl = np.where(atr_ok, _sig_arr(-_nz_arr(_zscore_window(log_atr, valid, w))), 0.5)
+
+    vgap = np.abs(last("VWAP_GAP_PCT"))
+    sd = np.where(~np.isfinite(vgap), 0.5, np.where(vgap <= 1.0, 0.55, np.where(vgap <= 3.0, 0.52, 0.5)))
+
+    g = last("GCROSS")
+    d = last("DCROSS")
+    with np.errstate(invalid="ignore"):
+        adj = np.where(np.isfinite(g) & (g > 0), 0.02, 0.0) - np.where(np.isfinite(d) & (d > 0), 0.02, 0.0)
+
+    base = np.clip(0.34 * trend + 0.28 * mom + 0.14 * volu + 0.14 * vctrl + 0.08 * sd, 0.0, 1.0)
+    mul = _regime_multiplier(_extract_regime_ctx(regime))
+    score = np.clip(base * mul + adj, 0.0, 1.0)
+    return np.where(valid, score, np.nan)
+
+
+# ====== 横断バッチ版（picks_build: 全銘柄の特徴量が揃ってから1回だけ） ======
+
+SCORE_COLS = (
+    "SLOPE_5", "SLOPE_20", "RET_5", "RET_20", "RSI14",
+    "Volume", "MA20", "ATR14", "VWAP_GAP_PCT", "GCROSS", "DCROSS",
+)
+
+
+def _rank_pct(x: np.ndarray) -> np.ndarray:
+    """有限値どうしの平均順位パーセンタイル（0..1）。NaN は NaN のまま。"""
+    out = np.full(x.shape, np.nan)
+    ok = np.isfinite(x)
+    n = int(ok.sum())
+    if n == 0:
+        return out
+    if n == 1:
+        out[ok] = 1.0
+        return out
+    r = pd.Series(x[ok]).rank(method="average").to_numpy()
+    out[ok] = (r - 1.0) / (n - 1.0)
+    return out
+
+
+def score_batch(
+    feat_map: Mapping[str, pd.DataFrame],
+    *,
+    regime: Optional[object] = None,
+    window: Optional[int] = None,
+) -> Dict[str, Dict[str, float]]:
+    """
+    ユニバース全銘柄の score_sample（最終行時点）を NumPy で一括計算し、横断パーセンタイルを付ける。
+      feat_map: {code: make_features() / FeaturePanel.frame() の DataFrame}
+      window  : z スコアを取る本数（None なら各 feat の全行 = score_sample と同じ）
+    戻り値: {code: {"score01", "stars", "pct"}}
+      pct は当日ユニバース内での score01 の相対位置（0=最下位, 1=最上位）
+    """
+    codes = [c for c, f in feat_map.items() if f is not None and len(f) > 0]
+    if not codes:
+        return {}
+
+    lens = np.array([len(feat_map[c]) for c in codes], dtype=np.int64)
+    W = int(lens.max())
+    if window is not None and int(window) > 0:
+        W = min(W, int(window))
+    lens = np.minimum(lens, W)
+    N = len(codes)
+
+    valid = np.arange(W)[:, None] >= (W - lens)[None, :]
+    cols: Dict[str, np.ndarray] = {}
+    for name in SCORE_COLS:
+        if not any(name in feat_map[c].columns for c in codes):
+            continue
+        a = np.full((W, N), np.nan)
+        for j, c in enumerate(codes):
+            f = feat_map[c]
+            if name in f.columns:
+                n = int(lens[j])
+                a[W - n:, j] = f[name].to_numpy(dtype="float64", na_value=np.nan)[-n:]
+        cols[name] = a
+
+    s01 = score_panel(cols, valid, window=W, regime=regime)[-1]
+    pct = _rank_pct(s01)
+    out: Dict[str, Dict[str, float]] = {}
+    for j, c in enumerate(codes):
+        v = float(s01[j]) if np.isfinite(s01[j]) else 0.0
+        out[c] = {"score01": v, "stars": stars_from_score(v), "pct": float(pct[j]) if np.isfinite(pct[j]) else None}
+    return out
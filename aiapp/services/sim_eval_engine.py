@@ -0,0 +1,137 @@
+# aiapp/services/sim_eval_engine.py
+# -*- coding: utf-8 -*-
+"""
+sim_eval_engine.py（ai_sim_eval の約定・TP/SL 先当たり判定を NumPy でまとめて行う）
+
+入力はすべて「1行 = 1トレード」の行列（S 件 × L 本。足りない分は NaN / live=False で埋める）:
+- 約定判定: trade_date 当日の足（評価開始〜引けだけ live=True）
+- 決済判定: horizon 営業日分の足を時刻順につないだもの（各日の評価範囲だけ live=True）
+
+ルールは ai_sim_eval のループ版と同じ:
+- 約定（marketable limit）
+  - 寄り値（yori）が指値より有利なら寄り値で約定（BUY: yori <= entry / SELL: yori >= entry）
+  - それ以外は最初の足で: 始値が有利なら始値、そうでなく low <= entry <= high なら指値
+- 決済
+  - high >= TP / low <= SL の最初の足（売買方向によらずこの比較。ループ版と同じ）
+  - 同じ足で両方当たったら TP を先に見る
+- NaN（欠損）との比較はすべて False（ループ版の _safe_float → None と同じ扱い）
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Sequence
+
+import numpy as np
+
+# entry_fills の kind
+FILL_NONE = 0
+FILL_YORI = 1    # yori_open_marketable
+FILL_OPEN = 2    # bar_open_marketable
+FILL_TOUCH = 3   # bar_touch_entry
+
+# exit_hits の reason
+EXIT_NONE = 0
+EXIT_TP = 1
+EXIT_SL = 2
+
+
+def stack_ragged(rows: Sequence[np.ndarray], *, fill=np.nan, dtype="float64") -> np.ndarray:
+    """
+    長さの違う 1次元配列を (S, L) に左詰めで積む（余りは fill）。
+    """
+    S = len(rows)
+    L = max((len(r) for r in rows), default=0)
+    out = np.full((S, L), fill, dtype=dtype)
+    for i, r in enumerate(rows):
+        if len(r):
+            out[i, : len(r)] = r
+    return out
+
+
+def first_true(mask: np.ndarray) -> np.ndarray:
+    """
+    (S, L) の各行で最初に True の列。無ければ -1。
+    """
+    if mask.shape[1] == 0:
+        return np.full(mask.shape[0], -1, dtype=np.int64)
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), -1).astype(np.int64)
+
+
+def entry_fills(
+    is_sell: np.ndarray,
+    entry: np.ndarray,
+    yori: np.ndarray,
+    o: np.ndarray,
+    h: np.ndarray,
+    l: np.ndarray,
+    live: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    marketable limit の約定判定。
+      is_sell / entry / yori: (S,)  yori は寄り判定しない件・取れなかった件を NaN
+      o / h / l / live      : (S, L)
+    戻り値（すべて (S,)）:
+      kind  FILL_NONE / FILL_YORI / FILL_OPEN / FILL_TOUCH
+      idx   約定した足の列（寄り約定・未約定は -1）
+      px    約定価格（未約定は NaN）
+    """
+    is_sell = np.asarray(is_sell, dtype=bool)
+    entry = np.asarray(entry, dtype="float64")
+    yori = np.asarray(yori, dtype="float64")
+    e = entry[:, None]
+    s = is_sell[:, None]
+
+    with np.errstate(invalid="ignore"):
+        yori_ok = np.where(is_sell, yori >= entry, yori <= entry)
+        open_ok = live & np.where(s, o >= e, o <= e)
+        touch = live & (l <= e) & (e <= h)
+
+    idx = first_true(open_ok | touch)
+    rows = np.arange(len(entry))
+    at = np.maximum(idx, 0)
+    by_open = (idx >= 0) & open_ok[rows, at] if o.shape[1] else np.zeros(len(entry), dtype=bool)
+
+    kind = np.where(idx >= 0, np.where(by_open, FILL_OPEN, FILL_TOUCH), FILL_NONE)
+    kind = np.where(yori_ok, FILL_YORI, kind)
+    px = np.where(by_open, o[rows, at] if o.shape[1] else np.nan, entry)
+    px = np.where(kind == FILL_YORI, yori, px)
+    px = np.where(kind == FILL_NONE, np.nan, px)
+    idx = np.where(kind == FILL_YORI, -1, idx)
+    return {"kind": kind.astype(np.int8), "idx": idx, "px": px}
+
+
+def exit_hits(
+    tp: np.ndarray,
+    sl: np.ndarray,
+    h: np.ndarray,
+    l: np.ndarray,
+    live: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    TP/SL の先当たり判定。
+      tp / sl   : (S,)  設定なしは NaN
+      h / l     : (S, L)
+      live      : (S, L)  評価対象の足
+    戻り値（すべて (S,)）:
+      reason    EXIT_NONE / EXIT_TP / EXIT_SL
+      idx       当たった足の列（無ければ -1）
+      last_idx  最後の live な足の列（time_stop 用。live が1本も無ければ -1）
+    """
+    tp = np.asarray(tp, dtype="float64")[:, None]
+    sl = np.asarray(sl, dtype="float64")[:, None]
+    with np.errstate(invalid="ignore"):
+        hit_tp = live & (h >= tp)
+        hit_sl = live & (l <= sl)
+
+    idx = first_true(hit_tp | hit_sl)
+    rows = np.arange(len(idx))
+    at = np.maximum(idx, 0)
+    if live.shape[1]:
+        tp_first = hit_tp[rows, at]
+    else:
+        tp_first = np.zeros(len(idx), dtype=bool)
+    reason = np.where(idx < 0, EXIT_NONE, np.where(tp_first, EXIT_TP, EXIT_SL))
+
+    L = live.shape[1]
+    last_idx = np.where(live.any(axis=1), L - 1 - live[:, ::-1].argmax(axis=1), -1) if L else np.full(len(idx), -1)
+    return {"reason": reason.astype(np.int8), "idx": idx, "last_idx": last_idx.astype(np.int64)}
@@ -0,0 +1,267 @@
+# aiapp/services/sim_policy.py
+# -*- coding: utf-8 -*-
+"""
+紙シミュ（PRO）のポリシー合成・サイズ調整・TP/SL 再配置
+
+ai_simulate_auto（起票）/ ai_sim_eval（評価）/ backtest_swing（日足バックテスト）が同じものを使う。
+- policy_path_default / get_pro_profile / merge_policy_for_mode : ポリシーの場所と learn_mode プロファイルの合成
+- apply_per_trade_cap_to_pro_res : ★C 1銘柄あたりの資金枠で qty_pro を lot 単位に丸め直す
+- reanchor_tp_sl_A : ★A案 有利ズレで約定したとき TP/SL を約定価格から同じR幅で置き直す
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+
+def _safe_float(x) -> Optional[float]:
+    try:
+        if x is None:
+            return None
+        f = float(x)
+        if f != f:  # NaN
+            return None
+        return f
+    except Exception:
+        return None
+
+
+# ========= lot ルール（policy由来） =========
+def _lot_size_from_policy(code: str, policy: Dict[str, Any]) -> int:
+    """
+    policy.lot_rule を尊重して lot を返す。
+    - ETF/ETN prefix なら etf_lot
+    - それ以外は stock_lot
+    """
+    try:
+        lr = policy.get("lot_rule") if isinstance(policy.get("lot_rule"), dict) else {}
+        prefixes = lr.get("etf_codes_prefix") or ["13", "15"]
+        etf_lot = int(lr.get("etf_lot", 1) or 1)
+        stock_lot = int(lr.get("stock_lot", 100) or 100)
+
+        s = str(code)
+        for p in prefixes:
+            if s.startswith(str(p)):
+                return max(1, etf_lot)
+        return max(1, stock_lot)
+    except Exception:
+        return 100
+
+
+# ========= PRO profile 合成 =========
+def get_pro_profile(policy: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    policy.pro.learn_mode と profiles から、現在のプロファイルを返す。
+    戻り値: (learn_mode, profile_dict)
+    """
+    pro = policy.get("pro") if isinstance(policy.get("pro"), dict) else {}
+    learn_mode = str(pro.get("learn_mode") or "collect").strip().lower()
+    if learn_mode not in ("collect", "strict"):
+        learn_mode = "collect"
+    profiles = pro.get("profiles") if isinstance(pro.get("profiles"), dict) else {}
+    prof = profiles.get(learn_mode) if isinstance(profiles.get(learn_mode), dict) else {}
+    return learn_mode, prof
+
+
+def merge_policy_for_mode(policy: Dict[str, Any], *, learn_mode: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    learn_mode/profile に合わせて policy を合成する。
+    - limits は profile.limits を最優先で policy['limits'] に反映（下流統一）
+    - strict のとき tighten を filters に上乗せ（min_reward_risk / min_net_profit_yen）
+    """
+    merged: Dict[str, Any] = dict(policy or {})
+
+    # limits を profile 側から採用
+    plimits = profile.get("limits") if isinstance(profile.get("limits"), dict) else {}
+    base_limits = merged.get("limits") if isinstance(merged.get("limits"), dict) else {}
+    limits_new = dict(base_limits)
+    for k, v in (plimits or {}).items():
+        limits_new[k] = v
+    merged["limits"] = limits_new
+
+    # strict tighten を filters に反映
+    if str(learn_mode) == "strict":
+        tighten = profile.get("tighten") if isinstance(profile.get("tighten"), dict) else {}
+        filters = merged.get("filters") if isinstance(merged.get("filters"), dict) else {}
+        filters_new = dict(filters)
+
+        # tighten: min_reward_risk / min_net_profit_yen（強化）
+        if "min_reward_risk" in tighten and tighten.get("min_reward_risk") is not None:
+            try:
+                filters_new["min_reward_risk"] = float(tighten.get("min_reward_risk"))
+            except Exception:
+                pass
+        if "min_net_profit_yen" in tighten and tighten.get("min_net_profit_yen") is not None:
+            try:
+                filters_new["min_net_profit_yen"] = float(tighten.get("min_net_profit_yen"))
+            except Exception:
+                pass
+
+        merged["filters"] = filters_new
+
+    return merged
+
+
+# ========= PRO: policy path =========
+def policy_path_default() -> Path:
+    """
+    デフォルトのポリシーパスを返す。
+
+    対応方針：
+    - 真実ソースは short_aggressive.runtime.yml（Git管理外）
+    - runtime が無ければ policy_loader 側でテンプレから自動生成される前提
+    - もし policy_loader が使えない状況でも落とさず .yml にフォールバック
+    """
+    # まず runtime を正とする（policy_loader があれば確実に作る）
+    try:
+        from aiapp.services.policy_loader import ensure_runtime_policy  # ★追加
+        runtime_path = ensure_runtime_policy("short_aggressive")
+        return Path(runtime_path)
+    except Exception:
+        pass
+
+    # フォールバック：従来通り .yml
+    base_dir = getattr(settings, "BASE_DIR", None)
+    if base_dir:
+        return Path(base_dir) / "aiapp" / "policies" / "short_aggressive.yml"
+
+    return Path(__file__).resolve().parents[1] / "policies" / "short_aggressive.yml"
+
+
+# ========= ★C: 1銘柄あたりの資金枠 =========
+def apply_per_trade_cap_to_pro_res(
+    *,
+    code: str,
+    policy: Dict[str, Any],
+    entry: Optional[float],
+    pro_res: Any,
+    cap_yen: float,
+    min_yen: float,
+) -> Tuple[Any, str]:
+    """
+    ★Cの中枢：
+    - cap_yen に収まるように qty_pro を lot 単位で丸め直す
+    - min_yen（0で無効）未満になるなら reject に倒せるよう reason を返す
+
+    戻り値: (pro_res(書き換え済), cap_reason)
+    cap_reason は "" なら変更なし
+    """
+    e = _safe_float(entry)
+    if e is None or e <= 0:
+        return pro_res, ""
+
+    try:
+        qty0 = int(getattr(pro_res, "qty_pro", 0) or 0)
+    except Exception:
+        qty0 = 0
+
+    if qty0 <= 0:
+        return pro_res, ""
+
+    lot = _lot_size_from_policy(str(code), policy)
+    lot = max(1, int(lot))
+
+    # cap が 0/負なら「資金制約でreject」
+    if cap_yen <= 0:
+        return pro_res, "cap_zero"
+
+    # cap から入れる最大株数（lot切り捨て）
+    max_qty_by_cap = int((cap_yen / e) // lot * lot)
+    if max_qty_by_cap <= 0:
+        return pro_res, "cap_too_small_for_lot"
+
+    qty1 = min(qty0, max_qty_by_cap)
+    qty1 = int(qty1 // lot * lot)
+    if qty1 <= 0:
+        return pro_res, "cap_round_to_zero"
+
+    # min_notional（0で無効）
+    if min_yen and min_yen > 0:
+        if (e * qty1) < float(min_yen):
+            return pro_res, "below_min_notional"
+
+    if qty1 == qty0:
+        return pro_res, ""
+
+    # required_cash_pro は厳密に entry*qty とする（安全側）
+    req1 = float(e * qty1)
+
+    # est_pl_pro / est_loss_pro は数量比例で近似
+    try:
+        pl0 = float(getattr(pro_res, "est_pl_pro", 0.0) or 0.0)
+    except Exception:
+        pl0 = 0.0
+    try:
+        loss0 = float(getattr(pro_res, "est_loss_pro", 0.0) or 0.0)
+    except Exception:
+        loss0 = 0.0
+
+    ratio = (float(qty1) / float(qty0)) if qty0 > 0 else 1.0
+    pl1 = pl0 * ratio
+    loss1 = loss0 * ratio
+
+    try:
+        setattr(pro_res, "qty_pro", int(qty1))
+        setattr(pro_res, "required_cash_pro", float(req1))
+        setattr(pro_res, "est_pl_pro", float(pl1))
+        setattr(pro_res, "est_loss_pro", float(loss1))
+    except Exception:
+        return pro_res, ""
+
+    return pro_res, f"cap_applied({qty0}->{qty1}, cap={cap_yen:.0f})"
+
+
+# ========= ★A案: TP/SL 再配置 =========
+def reanchor_tp_sl_A(
+    *,
+    side: str,
+    entry_plan: float,
+    tp_plan: Optional[float],
+    sl_plan: Optional[float],
+    exec_entry_px: float,
+) -> Tuple[Optional[float], Optional[float], Dict[str, Any]]:
+    """
+    A案：R基準でTP/SLを再配置（有利ズレのときのみ）
+    戻り値： (tp_use, sl_use, meta)
+    """
+    meta: Dict[str, Any] = {}
+
+    if sl_plan is None:
+        meta["a_rule"] = "no_sl_plan"
+        return tp_plan, sl_plan, meta
+
+    r = abs(float(entry_plan) - float(sl_plan))
+    if r <= 0:
+        meta["a_rule"] = "bad_r"
+        return tp_plan, sl_plan, meta
+
+    tp_ratio = None
+    if tp_plan is not None:
+        tp_ratio = abs(float(tp_plan) - float(entry_plan)) / r
+
+    meta["r_plan"] = float(r)
+    meta["tp_ratio"] = float(tp_ratio) if tp_ratio is not None else None
+
+    if side == "BUY":
+        favorable = float(exec_entry_px) < float(entry_plan)
+    else:
+        favorable = float(exec_entry_px) > float(entry_plan)
+
+    if not favorable:
+        meta["a_rule"] = "not_favorable_keep_plan"
+        return tp_plan, sl_plan, meta
+
+    if side == "BUY":
+        sl_use = float(exec_entry_px) - r
+        tp_use = (float(exec_entry_px) + r * float(tp_ratio)) if tp_ratio is not None else tp_plan
+    else:
+        sl_use = float(exec_entry_px) + r
+        tp_use = (float(exec_entry_px) - r * float(tp_ratio)) if tp_ratio is not None else tp_plan
+
+    meta["a_rule"] = "reanchored_by_exec"
+    meta["tp_use"] = float(tp_use) if tp_use is not None else None
+    meta["sl_use"] = float(sl_use) if sl_use is not None else None
+    return tp_use, sl_use, meta
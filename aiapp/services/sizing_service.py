@@ -23,13 +23,21 @@ AI Picks 用 ポジションサイズ計算サービス（短期×攻め・本
 ★重要（今回の修正）:
 - policy_loader を使い runtime 優先で読む（settings画面で変更した値と sizing を一致させる）
 - pro.learn_mode / profiles.* があれば「今の運用モードの値」を優先
+
+SizingContext（1 run で1回だけ作る）:
+- UserSetting / policy / 証券会社サマリー（Holding・現金）は run 中に変わらないので
+  build_sizing_context() でまとめて読み、compute_position_sizing(ctx=...) /
+  compute_position_sizing_batch(ctx, ...) に渡す（銘柄ごとの DB クエリ・YAML パースが 0 になる）
+- compute_position_sizing_batch は全候補 × 3社の qty / required_cash / PL / EV を NumPy で一括計算
+  （結果は compute_position_sizing を1銘柄ずつ呼んだのと同じ dict のリスト）
 """
 
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any, Dict, List, Tuple, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Sequence, Tuple, Optional
 
+import numpy as np
 from django.db import transaction
 from django.contrib.auth import get_user_model
 
@@ -236,6 +244,65 @@ def _build_broker_envs(
     return envs
 
 
+@dataclass(frozen=True)
+class SizingContext:
+    """
+    compute_position_sizing が毎回読んでいた「run 中に変わらない値」のまとめ。
+    build_sizing_context() で作る。fork したワーカーにそのまま渡せる（DB 接続を持たない）。
+    """
+    risk_pct: float
+    credit_usage_pct: float
+    min_net_profit_yen: float = DEFAULT_MIN_NET_PROFIT_YEN
+    min_reward_risk: float = DEFAULT_MIN_REWARD_RISK
+    commission_rate: float = DEFAULT_COMMISSION_RATE
+    min_commission: float = DEFAULT_MIN_COMMISSION
+    slippage_rate: float = DEFAULT_SLIPPAGE_RATE
+    envs: Dict[str, BrokerEnv] = field(default_factory=dict)
+
+
+@transaction.atomic
+def build_sizing_context(user=None) -> SizingContext:
+    """
+    UserSetting（get_or_create）/ policy（runtime 優先）/ broker_summary を1回だけ読む。
+    """
+    if user is None:
+        user = _get_or_default_user()
+
+    (
+        risk_pct,
+        credit_usage_pct,
+        rakuten_leverage,
+        rakuten_haircut,
+        matsui_leverage,
+        matsui_haircut,
+        sbi_leverage,
+        sbi_haircut,
+    ) = _load_user_setting(user)
+
+    min_net_profit_yen, min_reward_risk, commission_rate, min_commission, slippage_rate = _load_policy_values()
+
+    envs = _build_broker_envs(
+        user,
+        risk_pct=risk_pct,
+        rakuten_leverage=rakuten_leverage,
+        rakuten_haircut=rakuten_haircut,
+        matsui_leverage=matsui_leverage,
+        matsui_haircut=matsui_haircut,
+        sbi_leverage=sbi_leverage,
+        sbi_haircut=sbi_haircut,
+    )
+    return SizingContext(
+        risk_pct=float(risk_pct),
+        credit_usage_pct=float(credit_usage_pct),
+        min_net_profit_yen=float(min_net_profit_yen),
+        min_reward_risk=float(min_reward_risk),
+        commission_rate=float(commission_rate),
+        min_commission=float(min_commission),
+        slippage_rate=float(slippage_rate),
+        envs=envs,
+    )
+
+
 def _lot_size_for(code: str) -> int:
     """
     ETF/ETN (13xx / 15xx) → 1株
@@ -369,26 +436,22 @@ def compute_position_sizing(
     p_tp_first: Optional[float] = None,
     p_sl_first: Optional[float] = None,
     p_none: Optional[float] = None,
+    ctx: Optional[SizingContext] = None,
 ) -> Dict[str, Any]:
     """
     AI Picks 1銘柄分の数量と評価・理由を計算して返す。
+    ctx（build_sizing_context の結果）を渡すと UserSetting / policy / 口座サマリーを読み直さない。
     """
-    if user is None:
-        user = _get_or_default_user()
-
-    (
-        risk_pct,
-        credit_usage_pct,
-        rakuten_leverage,
-        rakuten_haircut,
-        matsui_leverage,
-        matsui_haircut,
-        sbi_leverage,
-        sbi_haircut,
-    ) = _load_user_setting(user)
+    if ctx is None:
+        ctx = build_sizing_context(user)
 
-    # ★runtime 優先でポリシーを読む（settings変更と一致）
-    MIN_NET_PROFIT_YEN, MIN_REWARD_RISK, COMMISSION_RATE, MIN_COMMISSION, SLIPPAGE_RATE = _load_policy_values()
+    risk_pct = ctx.risk_pct
+    credit_usage_pct = ctx.credit_usage_pct
+    MIN_NET_PROFIT_YEN = ctx.min_net_profit_yen
+    MIN_REWARD_RISK = ctx.min_reward_risk
+    COMMISSION_RATE = ctx.commission_rate
+    MIN_COMMISSION = ctx.min_commission
+    SLIPPAGE_RATE = ctx.slippage_rate
 
     lot = _lot_size_for(code)
 
@@ -442,16 +505,7 @@ def compute_position_sizing(
             ],
         )
 
-    envs = _build_broker_envs(
-        user,
-        risk_pct=risk_pct,
-        rakuten_leverage=rakuten_leverage,
-        rakuten_haircut=rakuten_haircut,
-        matsui_leverage=matsui_leverage,
-        matsui_haircut=matsui_haircut,
-        sbi_leverage=sbi_leverage,
-        sbi_haircut=sbi_haircut,
-    )
+    envs = ctx.envs
 
     # 1株あたりの損失幅 / 利益幅
     loss_per_share = max(entry - sl, atr * 0.6)  # 損切り距離（最低保障）
@@ -607,4 +661,223 @@ def compute_position_sizing(
             reasons_lines.append(f"・{broker_label}: {msg}")
 
     result["reasons_text"] = reasons_lines or None
-    return result
\ No newline at end of file
+    return result
+
+# ------------------------------
+# 一括 API（picks_build: 全候補をまとめて）
+# ------------------------------
+
+_BROKERS = (("楽天", "rakuten"), ("松井", "matsui"), ("SBI", "sbi"))
+
+
+def _opt_list(values: Optional[Sequence[Optional[float]]], n: int) -> List[Optional[float]]:
+    if values is None:
+        return [None] * n
+    return list(values)
+
+
+def compute_position_sizing_batch(
+    ctx: SizingContext,
+    codes: Sequence[str],
+    last_price: Sequence[float],
+    atr: Sequence[Optional[float]],
+    entry: Sequence[Optional[float]],
+    tp: Sequence[Optional[float]],
+    sl: Sequence[Optional[float]],
+    *,
+    p_tp_first: Optional[Sequence[Optional[float]]] = None,
+    p_sl_first: Optional[Sequence[Optional[float]]] = None,
+    p_none: Optional[Sequence[Optional[float]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    compute_position_sizing を全候補ぶんまとめて計算する（DB / YAML には触らない）。
+    qty / required_cash / PL / RR / EV は 候補 × 3社 を NumPy で一括、理由メッセージだけ 0株の行で組み立てる。
+    戻り値: codes と同じ順の dict リスト（compute_position_sizing(ctx=ctx) と同じ中身）
+    """
+    n = len(codes)
+    if n == 0:
+        return []
+
+    p_tp_l = _opt_list(p_tp_first, n)
+    p_sl_l = _opt_list(p_sl_first, n)
+    p_n_l = _opt_list(p_none, n)
+
+    def arr(xs: Sequence[Optional[float]]) -> np.ndarray:
+        return np.array([np.nan if x is None else float(x) for x in xs], dtype=np.float64)
+
+    last_a = arr(last_price)
+    atr_a = arr(atr)
+    e_a = arr(entry)
+    t_a = arr(tp)
+    s_a = arr(sl)
+    lot_a = np.array([_lot_size_for(str(c)) for c in codes], dtype=np.int64)
+
+    # 欠損/NaN 混じりの行は1銘柄版に任せる（NaN の比較規則まで合わせるため。数は少ない）
+    with np.errstate(invalid="ignore"):
+        fast = (
+            np.isfinite(last_a) & np.isfinite(atr_a) & np.isfinite(e_a) & np.isfinite(t_a) & np.isfinite(s_a)
+            & (atr_a > 0) & (last_a > 0)
+        )
+
+    loss_ps = np.maximum(e_a - s_a, atr_a * 0.6)
+    reward_ps = np.maximum(t_a - e_a, 0.0)
+    px_budget = np.maximum(e_a, last_a)
+
+    p_tp = [_normalize_prob(v) for v in p_tp_l]
+    p_sl = [_derive_psl(a, b, c) for a, b, c in zip(p_tp_l, p_sl_l, p_n_l)]
+    has_p = np.array([a is not None and b is not None for a, b in zip(p_tp, p_sl)])
+    p_tp_a = np.array([a if a is not None else np.nan for a in p_tp], dtype=np.float64)
+    p_sl_a = np.array([b if b is not None else np.nan for b in p_sl], dtype=np.float64)
+
+    def cost_round(qty: np.ndarray) -> np.ndarray:
+        notionals = e_a * qty
+        fee = np.maximum(float(ctx.min_commission), notionals * float(ctx.commission_rate))
+        slippage = notionals * float(ctx.slippage_rate)
+        return np.where((e_a > 0) & (qty > 0), fee + slippage, 0.0) * 2
+
+    def safe_div(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return np.divide(a, b, out=np.zeros_like(a), where=(b != 0))
+
+    per_broker: Dict[str, Dict[str, Any]] = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for broker_label, key in _BROKERS:
+            env = ctx.envs.get(broker_label)
+            out: Dict[str, Any] = {"env": env}
+            per_broker[key] = out
+            if env is None:
+                continue
+            risk_assets = max(env.cash_yen + env.stock_value, 0.0)
+            budget = max(env.credit_yoryoku, 0.0) * (ctx.credit_usage_pct / 100.0)
+            out["risk_assets"] = risk_assets
+            out["budget"] = budget
+            if risk_assets <= 0 or budget <= 0:
+                continue
+
+            risk_value = risk_assets * (ctx.risk_pct / 100.0)
+            max_by_risk = np.where(fast & (loss_ps > 0), risk_value / loss_ps // lot_a * lot_a, 0.0)
+            max_by_budget = np.where(fast, budget / px_budget // lot_a * lot_a, 0.0)
+            qty0 = np.minimum(max_by_risk, max_by_budget).astype(np.int64)
+            qty0 = np.where(qty0 < lot_a, 0, qty0)
+
+            gross = reward_ps * qty0
+            loss_value = loss_ps * qty0
+            net = gross - cost_round(qty0)
+            rr = safe_div(gross, loss_value)
+            rr_net = safe_div(net, loss_value)
+            ev_true = np.where(has_p, p_tp_a * rr_net - p_sl_a * 1.0, np.nan)
+
+            # 最小ロットで入った場合（qty=0 の理由判定用）
+            gross_t = reward_ps * lot_a
+            net_t = gross_t - cost_round(lot_a.astype(np.float64))
+            rr_t = safe_div(gross_t, loss_ps * lot_a)
+
+            code = np.where(
+                qty0 <= 0, 1,                                        # filtered
+                np.where(net <= 0, 2,                                # net_profit_negative
+                np.where(net < ctx.min_net_profit_yen, 3,            # profit_too_small
+                np.where(rr < ctx.min_reward_risk, 4, 0))),          # rr_too_low / 採用
+            )
+            out.update(
+                qty=np.where(code == 0, qty0, 0),
+                code=code,
+                net=net,
+                loss_value=loss_value,
+                rr=rr,
+                rr_net=rr_net,
+                ev_true=ev_true,
+                gross_t=gross_t,
+                net_t=net_t,
+                rr_t=rr_t,
+            )
+
+    results: List[Dict[str, Any]] = []
+    for i in range(n):
+        if not fast[i]:
+            results.append(
+                compute_position_sizing(
+                    None,
+                    str(codes[i]),
+                    last_price[i],
+                    atr[i],
+                    entry[i],
+                    tp[i],
+                    sl[i],
+                    p_tp_first=p_tp_l[i],
+                    p_sl_first=p_sl_l[i],
+                    p_none=p_n_l[i],
+                    ctx=ctx,
+                )
+            )
+            continue
+
+        result: Dict[str, Any] = {
+            "risk_pct": ctx.risk_pct,
+            "lot_size": int(lot_a[i]),
+            "policy_min_net_profit_yen": float(ctx.min_net_profit_yen),
+            "policy_min_reward_risk": float(ctx.min_reward_risk),
+            "policy_fee_commission_rate": float(ctx.commission_rate),
+            "policy_fee_min_commission": float(ctx.min_commission),
+            "policy_fee_slippage_rate": float(ctx.slippage_rate),
+        }
+        reasons_lines: List[str] = []
+        for broker_label, key in _BROKERS:
+            b = per_broker[key]
+            qty = 0
+            required_cash = est_pl = est_loss = 0.0
+            ev_net = rr_net = ev_true = None
+
+            if b["env"] is None:
+                reason_code = "no_account"
+                reason_msg = "該当する証券口座の情報が見つからないため。"
+            elif "code" not in b:
+                reason_code = "no_budget"
+                reason_msg = "信用余力が 0 円のため。"
+            else:
+                c = int(b["code"][i])
+                if c == 0:
+                    qty = int(b["qty"][i])
+                    required_cash = float(e_a[i]) * qty
+                    est_pl = float(b["net"][i])
+                    est_loss = float(b["loss_value"][i])
+                    ev_net = rr_net = float(b["rr_net"][i])
+                    ev_true = float(b["ev_true"][i]) if has_p[i] else None
+                    reason_code = reason_msg = ""
+                elif c == 1:
+                    reason_code = "filtered"
+                    reason_msg = _build_reason_for_zero(
+                        broker_label,
+                        qty=0,
+                        gross_profit=float(b["gross_t"][i]),
+                        net_profit=float(b["net_t"][i]),
+                        rr=float(b["rr_t"][i]),
+                        budget=b["budget"],
+                        min_lot=int(lot_a[i]),
+                        loss_value=float(loss_ps[i]),
+                        min_net_profit_yen=ctx.min_net_profit_yen,
+                        min_reward_risk=ctx.min_reward_risk,
+                    )
+                elif c == 2:
+                    reason_code = "net_profit_negative"
+                    reason_msg = "手数料・スリッページを考慮すると純利益がマイナスになるため。"
+                elif c == 3:
+                    reason_code = "profit_too_small"
+                    reason_msg = f"純利益が {int(ctx.min_net_profit_yen):,} 円未満と小さすぎるため。"
+                else:
+                    reason_code = "rr_too_low"
+                    reason_msg = f"利確幅に対して損切幅が大きく、R={float(b['rr'][i]):.2f} と基準未満のため。"
+
+            result[f"qty_{key}"] = int(qty)
+            result[f"required_cash_{key}"] = round(float(required_cash), 0)
+            result[f"est_pl_{key}"] = round(float(est_pl), 0)
+            result[f"est_loss_{key}"] = round(float(est_loss), 0)
+            result[f"ev_net_{key}"] = ev_net
+            result[f"rr_net_{key}"] = rr_net
+            result[f"ev_true_{key}"] = ev_true
+            result[f"reason_{key}_code"] = reason_code
+            result[f"reason_{key}_msg"] = reason_msg
+            if qty == 0 and reason_msg:
+                reasons_lines.append(f"・{broker_label}: {reason_msg}")
+
+        result["reasons_text"] = reasons_lines or None
+        results.append(result)
+    return results
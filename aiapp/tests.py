@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+aiapp のテスト（ネット・DB を使わない単体テスト）
+
+- fetch_price.download_daily_batch / get_prices_batch:
+  yf.download の代わりにローカルの代替プロバイダ（downloader）を差し込んで確認する
+- sim_eval_engine.entry_fills / exit_hits:
+  ai_sim_eval のループ版と同じ規則で1件ずつ回す参照実装と、ランダムな足（NaN・評価外の足入り）で突き合わせる
+- make_features_panel:
+  make_features（pandas 版）と列ごとに突き合わせる（横ばい区間・呼値丸め・出来高0・終値欠損入り）
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from aiapp.models.features import make_features
+from aiapp.models.features_panel import make_features_panel
+from aiapp.services import fetch_price, price_store
+from aiapp.services import sim_eval_engine as eng
+
+FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def _bars(dates, close: float) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"Open": close, "High": close + 1.0, "Low": close - 1.0, "Close": close, "Volume": 100.0},
+        index=pd.DatetimeIndex(dates),
+    )[FIELDS]
+
+
+class FakeDownloader:
+    """
+    yf.download 互換のローカル代替プロバイダ。
+    - group_by="ticker" と同じ (symbol, field) の MultiIndex 列を返す
+    - fail に入れたシンボルを含むチャンクは例外にする
+    - 呼ばれた tickers / kwargs を calls に残す
+    """
+
+    def __init__(self, end: dt.date, *, close: float = 2.0, days: int = 60, fail=()):
+        self.end = pd.Timestamp(end)
+        self.close = close
+        self.days = days
+        self.fail = set(fail)
+        self.calls = []
+
+    def __call__(self, tickers, **kwargs):
+        self.calls.append((list(tickers), dict(kwargs)))
+        if self.fail & set(tickers):
+            raise RuntimeError("provider error")
+        if "start" in kwargs:
+            dates = pd.bdate_range(start=kwargs["start"], end=self.end)
+        else:
+            dates = pd.bdate_range(end=self.end, periods=self.days)
+        frames = {t: _bars(dates, self.close) for t in tickers}
+        return pd.concat(frames, axis=1)
+
+
+class DownloadDailyBatchTests(SimpleTestCase):
+    def setUp(self):
+        self.end = dt.date.today() - dt.timedelta(days=3)
+
+    def test_splits_symbols_into_chunks(self):
+        syms = [f"{1000 + i}.T" for i in range(250)]
+        dl = FakeDownloader(self.end)
+
+        out = fetch_price.download_daily_batch(syms, period="60d", chunk_size=100, downloader=dl)
+
+        self.assertEqual([len(t) for t, _ in dl.calls], [100, 100, 50])
+        self.assertEqual(sum((t for t, _ in dl.calls), []), syms)
+        self.assertEqual(set(out), set(syms))
+        for kw in (kw for _, kw in dl.calls):
+            self.assertEqual(kw["period"], "60d")
+            self.assertEqual(kw["group_by"], "ticker")
+        self.assertEqual(list(out["1000.T"].columns), FIELDS)
+
+    def test_partial_batch_failure_keeps_other_chunks(self):
+        syms = [f"{2000 + i}.T" for i in range(5)]
+        dl = FakeDownloader(self.end, fail={"2003.T"})
+
+        out = fetch_price.download_daily_batch(
+            syms, period="60d", chunk_size=2, retries=1, backoff_sec=0.0, downloader=dl
+        )
+
+        # 失敗したチャンク [2002, 2003] だけ欠ける
+        self.assertEqual(set(out), {"2000.T", "2001.T", "2004.T"})
+        # 失敗チャンクは初回 + retries 回呼ばれる
+        failed = [t for t, _ in dl.calls if "2003.T" in t]
+        self.assertEqual(len(failed), 2)
+
+
+class GetPricesBatchStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        for patcher in (
+            mock.patch.object(price_store, "STORE_DIR", self.tmp),
+            mock.patch.object(price_store, "STORE_ENABLED", True),
+            mock.patch.object(price_store, "in_session", lambda now=None: False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.end = dt.date.today() - dt.timedelta(days=3)
+
+    def _seed_stale(self, sym: str, last: dt.date, close: float) -> pd.DataFrame:
+        df = _bars(pd.bdate_range(end=last, periods=80), close)
+        price_store.save(sym, df)
+        # 最終同期を TTL より前に見せる（= 末尾の取り直しが必要）
+        old = time.time() - 3 * 86400
+        os.utime(price_store.store_path(sym), (old, old))
+        return df
+
+    def test_stale_symbol_fetches_tail_and_merges(self):
+        last = self.end - dt.timedelta(days=21)
+        seeded = self._seed_stale("1301.T", last, close=1000.0)
+        # 許容内の訂正（0.05%）なら末尾だけ重ねる
+        dl = FakeDownloader(self.end, close=1000.5)
+
+        out = fetch_price.get_prices_batch(["1301", "1332"], period="60d", downloader=dl)
+
+        by_kind = {("start" if "start" in kw else "period"): t for t, kw in dl.calls}
+        self.assertEqual(by_kind["start"], ["1301.T"])   # 既存銘柄は末尾だけ
+        self.assertEqual(by_kind["period"], ["1332.T"])  # ストアに無い銘柄は全期間
+        tail_kw = next(kw for t, kw in dl.calls if "start" in kw)
+        self.assertEqual(tail_kw["start"], (last - dt.timedelta(days=7)).isoformat())
+
+        stored = price_store.load("1301.T")
+        self.assertEqual(stored.index.min(), seeded.index.min())
+        self.assertEqual(stored.index.max(), pd.Timestamp(pd.bdate_range(end=self.end, periods=1)[0]))
+        self.assertTrue(stored.index.is_unique)
+        # 重なった日は新しい取得分で上書き、それより前は元のまま
+        overlap = stored.index >= pd.Timestamp(last - dt.timedelta(days=7))
+        self.assertTrue((stored.loc[overlap, "Close"] == 1000.5).all())
+        self.assertTrue((stored.loc[~overlap, "Close"] == 1000.0).all())
+
+        self.assertEqual(out["1301"].index.max(), stored.index.max())
+        self.assertFalse(out["1332"].empty)
+
+    def test_tail_mismatch_refetches_full_history(self):
+        last = self.end - dt.timedelta(days=21)
+        self._seed_stale("1301.T", last, close=1000.0)
+        self._seed_stale("1332.T", last, close=1000.0)
+        calls = []
+
+        def provider(tickers, **kwargs):
+            calls.append((list(tickers), dict(kwargs)))
+            if "start" in kwargs:
+                dates = pd.bdate_range(start=kwargs["start"], end=self.end)
+            else:
+                dates = pd.bdate_range(end=self.end, periods=60)
+            # 1301 は 1:2 分割で過去分も半値に調整された想定（1332 は変化なし）
+            return pd.concat({t: _bars(dates, 500.0 if t == "1301.T" else 1000.0) for t in tickers}, axis=1)
+
+        fetch_price.get_prices_batch(["1301", "1332"], period="60d", downloader=provider)
+
+        self.assertEqual([t for t, kw in calls if "start" in kw], [["1301.T", "1332.T"]])
+        self.assertEqual([t for t, kw in calls if "period" in kw], [["1301.T"]])  # 食い違った銘柄だけ全期間
+        # 置き換え: 古い保存分（分割前の値）は残らない
+        stored = price_store.load("1301.T")
+        self.assertTrue((stored["Close"] == 500.0).all())
+        self.assertEqual(len(stored), 60)
+        self.assertTrue((price_store.load("1332.T")["Close"] == 1000.0).all())
+
+    def test_fresh_symbol_skips_network(self):
+        price_store.save("1301.T", _bars(pd.bdate_range(end=self.end, periods=40), 1.0))
+        dl = FakeDownloader(self.end)
+
+        with mock.patch.object(price_store, "is_fresh", lambda code, df, now=None: True):
+            out = fetch_price.get_prices_batch(["1301"], period="60d", downloader=dl)
+
+        self.assertEqual(dl.calls, [])
+        self.assertFalse(out["1301"].empty)
+
+
+def _ref_entry_fill(is_sell: bool, entry: float, yori: float, o, h, l, live):
+    """ai_sim_eval ループ版の約定判定（NaN との比較は False = _safe_float → None と同じ）"""
+    if (yori >= entry) if is_sell else (yori <= entry):
+        return eng.FILL_YORI, -1, yori
+    for k in range(len(o)):
+        if not live[k]:
+            continue
+        if (o[k] >= entry) if is_sell else (o[k] <= entry):
+            return eng.FILL_OPEN, k, o[k]
+        if l[k] <= entry <= h[k]:
+            return eng.FILL_TOUCH, k, entry
+    return eng.FILL_NONE, -1, np.nan
+
+
+def _ref_exit_hit(tp: float, sl: float, h, l, live):
+    """ai_sim_eval ループ版の TP/SL 先当たり（同じ足なら TP が先）"""
+    last = -1
+    hit = (eng.EXIT_NONE, -1)
+    for k in range(len(h)):
+        if not live[k]:
+            continue
+        last = k
+        if hit[0] != eng.EXIT_NONE:
+            continue
+        if h[k] >= tp:
+            hit = (eng.EXIT_TP, k)
+        elif l[k] <= sl:
+            hit = (eng.EXIT_SL, k)
+    return hit[0], hit[1], last
+
+
+class SimEvalEngineTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        S = 400
+        self.lens = rng.integers(0, 40, S)
+        self.is_sell = rng.random(S) < 0.4
+        base = 1000.0 + rng.normal(0, 20, S)
+
+        rows = {k: [] for k in ("o", "h", "l", "live")}
+        for i, n in enumerate(self.lens):
+            c = base[i] * np.exp(np.cumsum(rng.normal(0, 0.004, n)))
+            o = np.r_[base[i], c[:-1]] if n else c
+            h = np.maximum(o, c) * (1 + np.abs(rng.normal(0, 0.002, n)))
+            l = np.minimum(o, c) * (1 - np.abs(rng.normal(0, 0.002, n)))
+            for a in (o, h, l):
+                a[rng.random(n) < 0.05] = np.nan
+            live = np.ones(n, dtype=bool)
+            if n:
+                live[: rng.integers(0, n)] = False        # 評価開始前の足
+                live[rng.random(n) < 0.05] = False        # 日をまたぐ評価範囲外の足
+            for k, a in zip(("o", "h", "l", "live"), (o, h, l, live)):
+                rows[k].append(a)
+
+        self.o = eng.stack_ragged(rows["o"])
+        self.h = eng.stack_ragged(rows["h"])
+        self.l = eng.stack_ragged(rows["l"])
+        self.live = eng.stack_ragged(rows["live"], fill=False, dtype=bool)
+
+        self.entry = base * (1 + rng.normal(0, 0.006, S))
+        self.entry[rng.random(S) < 0.03] = np.nan
+        self.yori = np.where(rng.random(S) < 0.5, base * (1 + rng.normal(0, 0.004, S)), np.nan)
+        r = base * rng.choice([0.003, 0.01, 0.02], S)
+        self.tp = np.where(self.is_sell, self.entry - 2 * r, self.entry + 2 * r)
+        self.sl = np.where(self.is_sell, self.entry + r, self.entry - r)
+        self.tp[rng.random(S) < 0.05] = np.nan
+        self.sl[rng.random(S) < 0.05] = np.nan
+
+    def test_entry_fills_matches_loop(self):
+        got = eng.entry_fills(self.is_sell, self.entry, self.yori, self.o, self.h, self.l, self.live)
+
+        kinds = set()
+        for i in range(len(self.entry)):
+            n = int(self.lens[i])
+            kind, idx, px = _ref_entry_fill(
+                bool(self.is_sell[i]), self.entry[i], self.yori[i],
+                self.o[i, :n], self.h[i, :n], self.l[i, :n], self.live[i, :n],
+            )
+            kinds.add(kind)
+            self.assertEqual((int(got["kind"][i]), int(got["idx"][i])), (kind, idx), msg=f"trade {i}")
+            np.testing.assert_equal(got["px"][i], px)
+        # 4 通りの約定種別がすべて出ている（乱数が偏って検証が空振りしていない）
+        self.assertEqual(kinds, {eng.FILL_NONE, eng.FILL_YORI, eng.FILL_OPEN, eng.FILL_TOUCH})
+
+    def test_exit_hits_matches_loop(self):
+        got = eng.exit_hits(self.tp, self.sl, self.h, self.l, self.live)
+
+        reasons = set()
+        for i in range(len(self.tp)):
+            n = int(self.lens[i])
+            ref = _ref_exit_hit(self.tp[i], self.sl[i], self.h[i, :n], self.l[i, :n], self.live[i, :n])
+            reasons.add(ref[0])
+            self.assertEqual(
+                (int(got["reason"][i]), int(got["idx"][i]), int(got["last_idx"][i])), ref, msg=f"trade {i}"
+            )
+        self.assertEqual(reasons, {eng.EXIT_NONE, eng.EXIT_TP, eng.EXIT_SL})
+
+    def test_same_bar_tp_and_sl_counts_as_tp(self):
+        h = np.array([[10.0, 12.0]])
+        l = np.array([[9.0, 7.0]])
+        live = np.ones((1, 2), dtype=bool)
+
+        got = eng.exit_hits(np.array([11.0]), np.array([8.0]), h, l, live)
+
+        self.assertEqual((int(got["reason"][0]), int(got["idx"][0])), (eng.EXIT_TP, 1))
+
+    def test_touch_on_bar_high_and_low_boundaries(self):
+        # BUY: 始値は指値より上、高値ちょうどで刺さる / SELL: 始値は指値より下、安値ちょうどで刺さる
+        o = np.array([[11.0], [9.0]])
+        h = np.array([[10.0], [11.0]])
+        l = np.array([[9.0], [10.0]])
+        live = np.ones((2, 1), dtype=bool)
+
+        got = eng.entry_fills(
+            np.array([False, True]), np.array([10.0, 10.0]), np.array([np.nan, np.nan]), o, h, l, live
+        )
+
+        self.assertEqual(got["kind"].tolist(), [eng.FILL_TOUCH, eng.FILL_TOUCH])
+        self.assertEqual(got["px"].tolist(), [10.0, 10.0])
+
+
+def _tick_series(rng, i: int) -> pd.DataFrame:
+    """呼値で丸めた日足。横ばい区間・出来高0・終値欠損を混ぜる。"""
+    n = int(rng.integers(120, 400))
+    c = 1000.0 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    tick = (1.0, 0.1, 0.5)[i % 3]
+    c = np.round(c / tick) * tick
+    for _ in range(3):
+        s = int(rng.integers(0, n - 40))
+        c[s:s + int(rng.integers(5, 40))] = c[s]
+    o = np.r_[c[0], c[:-1]]
+    h = np.maximum(o, c) + rng.integers(0, 3, n)
+    l = np.minimum(o, c) - rng.integers(0, 3, n)
+    v = rng.integers(0, 100_000, n).astype(float)
+    v[rng.random(n) < 0.1] = 0.0
+    df = pd.DataFrame(
+        {"Open": o, "High": h, "Low": l, "Close": c, "Volume": v},
+        index=pd.bdate_range("2021-01-04", periods=n),
+    )
+    df.loc[df.index[rng.random(n) < 0.03], "Close"] = np.nan
+    return df
+
+
+class FeaturesPanelTests(SimpleTestCase):
+    def test_matches_make_features_per_column(self):
+        rng = np.random.default_rng(6)
+        frames = {str(1000 + i): _tick_series(rng, i) for i in range(60)}
+
+        panel = make_features_panel(frames)
+
+        for code, raw in frames.items():
+            want = make_features(raw)
+            got = panel.frame(code)
+            self.assertEqual(list(got.columns), list(want.columns), msg=code)
+            for col in want.columns:
+                x = want[col].to_numpy(dtype="float64")
+                y = got[col].to_numpy(dtype="float64")
+                if col in ("GCROSS", "DCROSS"):
+                    np.testing.assert_array_equal(y, x, err_msg=f"{code} {col}")
+                else:
+                    # pandas の rolling std は横ばい明けで 1e-8 程度ずれるので BB_Z などはその分だけ許す
+                    np.testing.assert_allclose(y, x, rtol=1e-9, atol=1e-6, err_msg=f"{code} {col}")
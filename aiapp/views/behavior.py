@@ -722,6 +722,80 @@ def _ml_explain_pack(ml_metrics: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
+def _load_ml_walkforward() -> Dict[str, Any]:
+    """
+    media/aiapp/ml/walkforward/latest_walkforward.json（train_lgbm_models --walk-forward）を読む。
+    無ければ空 dict。
+    """
+    try:
+        p = Path(settings.MEDIA_ROOT) / "aiapp" / "ml" / "walkforward" / "latest_walkforward.json"
+        j = _read_json(p) or {}
+        if not isinstance(j.get("windows"), list):
+            return {}
+        return j
+    except Exception:
+        return {}
+
+
+def _ml_walkforward_pack(report: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    walk-forward（翌月で評価）の窓ごとの数字を信号機つきで。
+    valid（同じ期間からのランダム分割）より厳しい“本番に近い”成績。
+    """
+    windows = report.get("windows") or []
+    if not windows:
+        return {}
+
+    rows: List[Dict[str, Any]] = []
+    for w in windows:
+        m = w.get("metrics") or {}
+        tm = w.get("timing") or {}
+        pw = m.get("p_win") or {}
+        ev = m.get("ev") or {}
+        auc = _safe_float(pw.get("auc"))
+        logloss = _safe_float(pw.get("logloss"))
+        rmse = _safe_float(ev.get("rmse"))
+        train_months = w.get("train_months") or []
+        train_sec = tm.get("train_sec") or {}
+        rows.append(
+            {
+                "test_month": str(w.get("test_month") or "-"),
+                "train_span": f"{train_months[0]}〜{train_months[-1]}" if train_months else "-",
+                "train_rows": int(w.get("train_rows") or 0),
+                "test_rows": int(w.get("test_rows") or 0),
+                "auc": auc,
+                "auc_signal": _rate_auc(auc)["signal"],
+                "logloss": logloss,
+                "logloss_signal": _rate_logloss(logloss)["signal"],
+                "rmse": rmse,
+                "rmse_signal": _rate_mae_rmse(rmse)["signal"],
+                "train_sec": _safe_float(sum(float(v or 0.0) for v in train_sec.values())),
+                "predict_sec": _safe_float(tm.get("predict_sec")),
+                "cache_hit": bool(tm.get("cache_hit")),
+            }
+        )
+
+    s = report.get("summary") or {}
+    auc_mean = _safe_float(s.get("p_win_auc_mean"))
+    return {
+        "name": "walk-forward（過去の月で学習 → 翌月で答え合わせ）",
+        "created_at": _fmt_jst_from_iso(str(report.get("created_at") or "")),
+        "windows": rows,
+        "auc_mean": auc_mean,
+        "logloss_mean": _safe_float(s.get("p_win_logloss_mean")),
+        "rmse_mean": _safe_float(s.get("ev_rmse_mean")),
+        "signal": _rate_auc(auc_mean)["signal"],
+        "comment": _rate_auc(auc_mean)["comment"],
+        "train_sec_total": _safe_float(s.get("train_sec_total")),
+        "wall_sec": _safe_float(s.get("wall_sec")),
+        "bullets": [
+            "validは同じ期間からのランダム抜き取り。walk-forwardは“まだ見ていない翌月”で測るので本番に近い。",
+            "月ごとにAUCが大きく上下するなら、相場の変化にモデルが追いついていないサイン。",
+            "学習秒数が月を追って急に増えるなら、データ量の増え方に注意（再学習の間隔を検討）。",
+        ],
+    }
+
+
 def _ml_latest_explain_pack(ml_latest: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     """
     「最新のML推論（実数値）」の初心者向け説明（信号機付き）。
@@ -967,6 +1041,7 @@ def behavior_dashboard(request: HttpRequest) -> HttpResponse:
     dataset_path = beh_dir / "latest_behavior.jsonl"
     ticker_path = beh_dir / "ticker" / f"latest_ticker_u{user.id}.json"
     ml_meta_path = media_root / "aiapp" / "ml" / "models" / "latest" / "meta.json"
+    ml_wf_path = media_root / "aiapp" / "ml" / "walkforward" / "latest_walkforward.json"
 
     sim_sum = _summarize_simulate_dir(sim_dir)
 
@@ -1005,6 +1080,7 @@ def behavior_dashboard(request: HttpRequest) -> HttpResponse:
     ml_meta = _load_ml_latest_meta()
     ml_metrics = _ml_metrics_view(ml_meta)
     ml_explain = _ml_explain_pack(ml_metrics)
+    ml_explain["walk_forward"] = _ml_walkforward_pack(_load_ml_walkforward())
 
     # ★ 最新ML推論（実数値）
     dataset_rows = _read_jsonl(dataset_path)
@@ -1020,6 +1096,12 @@ def behavior_dashboard(request: HttpRequest) -> HttpResponse:
             "mtime": _path_mtime_str(ml_meta_path),
             "created_at": _fmt_jst_from_iso(str(ml_meta.get("created_at") or "")),
         },
+        # train_lgbm_models --walk-forward 由来
+        "ml_walkforward": {
+            "command": "train_lgbm_models --walk-forward",
+            "mtime": _path_mtime_str(ml_wf_path),
+            "created_at": (ml_explain.get("walk_forward") or {}).get("created_at") or "-",
+        },
         # ai_simulate_auto 由来（raw log）
         "ml_infer": {
             "command": "ai_simulate_auto",
@@ -18,7 +18,7 @@ def simulate_delete(request: HttpRequest, pk: int) -> HttpResponse:
 
     方針（simulate_list と同じ）：
     - 削除対象は「PRO公式記録」のみ
-      = replay.pro.status == "accepted" かつ qty_pro > 0 のものだけ
+      = pro_status == "accepted"（replay.pro.status の非正規化列）かつ qty_pro > 0 のものだけ
     - 必ず user で絞って削除し、他ユーザー/他データ誤削除を防ぐ
     - それ以外（DEMOのみ/旧口座系/PRO未accept）は 404 にして“削除できない”扱い
     """
@@ -26,7 +26,7 @@ def simulate_delete(request: HttpRequest, pk: int) -> HttpResponse:
         VirtualTrade,
         pk=pk,
         user=request.user,
-        replay__pro__status="accepted",
+        pro_status="accepted",
         qty_pro__gt=0,
     )
     v.delete()
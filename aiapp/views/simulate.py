@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 from typing import Any, Dict, List, Optional, Tuple
-from datetime import date as _date
+from datetime import date as _date, datetime as _dt, time as _time, timedelta as _timedelta
 from pathlib import Path
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Sum
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
 from django.utils import timezone
@@ -94,59 +95,11 @@ def _get_policy_limits_default() -> Tuple[int, float]:
         return default_max_positions, default_max_total_risk_r
 
 
-def _get_pro_last_eval(v: VirtualTrade) -> Dict[str, Any]:
-    """
-    replay.pro.last_eval を安全に取り出す
-    """
-    replay = v.replay if isinstance(v.replay, dict) else {}
-    pro = replay.get("pro") if isinstance(replay.get("pro"), dict) else {}
-    last_eval = pro.get("last_eval") if isinstance(pro.get("last_eval"), dict) else {}
-    return last_eval
-
-
 def _combined_label_pro(v: VirtualTrade) -> str:
     """
-    PRO公式の「勝ち/負け/引き分け/持ち越し/見送り」統一ラベル
-
-    最優先：replay.pro.last_eval.label（ai_sim_evalが確定させる）
-    フォールバック：eval_exit_reason + 状態
+    PRO公式の「勝ち/負け/引き分け/持ち越し/見送り」統一ラベル（VirtualTrade.compute_pro_fields と同じ）
     """
-    last_eval = _get_pro_last_eval(v)
-    label = str(last_eval.get("label") or "").strip().lower()
-    if label in ("win", "lose", "flat", "carry", "skip"):
-        return label
-
-    exit_reason = str(v.eval_exit_reason or "").strip()
-
-    if exit_reason == "hit_tp":
-        return "win"
-    if exit_reason == "hit_sl":
-        return "lose"
-    if exit_reason == "time_stop":
-        plps = last_eval.get("pl_per_share")
-        try:
-            if plps is not None:
-                plps_f = float(plps)
-                if plps_f > 0:
-                    return "win"
-                if plps_f < 0:
-                    return "lose"
-                return "flat"
-        except Exception:
-            pass
-        return "skip"
-    if exit_reason == "carry":
-        return "carry"
-    if exit_reason == "no_position":
-        return "skip"
-
-    if exit_reason:
-        return "skip"
-
-    if v.closed_at is None and (v.eval_entry_px is not None):
-        return "carry"
-
-    return "skip"
+    return v.pro_fields()["pro_label"]
 
 
 def _get_pro_pl(v: VirtualTrade) -> Optional[float]:
@@ -155,35 +108,52 @@ def _get_pro_pl(v: VirtualTrade) -> Optional[float]:
     - replay.pro.last_eval.pl_pro を表示に使う
     - carry の間は None（"—"表示）
     """
-    last_eval = _get_pro_last_eval(v)
-    try:
-        pl = last_eval.get("pl_pro")
-        if pl is None:
-            return None
-        return float(pl)
-    except Exception:
-        return None
+    return v.pro_fields()["pro_pl"]
 
 
-def _accumulate_pro(summary: Dict[str, Any], v: VirtualTrade) -> None:
+def _empty_summary() -> Dict[str, Any]:
+    return {
+        "win": 0, "lose": 0, "flat": 0, "skip": 0,
+        "total_pl": 0.0, "has_data": False,
+    }
+
+
+def _accumulate_pro(summary: Dict[str, Any], row: Dict[str, Any]) -> None:
     """
-    KPI集計（PRO公式）
-    - total_pl: replay.pro.last_eval.pl_pro を足し上げ（carryは除外）
+    KPI集計（PRO公式）: 日付ごとの GROUP BY 行を足し上げる
+    - win/lose/flat 以外（carry / skip）は skip に入れる
+    - total_pl: pro_pl（= replay.pro.last_eval.pl_pro）の合計（carryは None なので除外される）
     """
-    combined = _combined_label_pro(v)
+    n = int(row.get("n") or 0)
+    win = int(row.get("win") or 0)
+    lose = int(row.get("lose") or 0)
+    flat = int(row.get("flat") or 0)
+
+    summary["win"] += win
+    summary["lose"] += lose
+    summary["flat"] += flat
+    summary["skip"] += n - win - lose - flat
+    summary["total_pl"] = float(summary["total_pl"]) + float(row.get("pl") or 0.0)
 
-    if combined == "win":
-        summary["win"] = summary.get("win", 0) + 1
-    elif combined == "lose":
-        summary["lose"] = summary.get("lose", 0) + 1
-    elif combined == "flat":
-        summary["flat"] = summary.get("flat", 0) + 1
-    else:
-        summary["skip"] = summary.get("skip", 0) + 1
 
-    pl = _get_pro_pl(v)
-    if pl is not None:
-        summary["total_pl"] = float(summary.get("total_pl", 0.0)) + float(pl)
+def _pro_daily_rows(base_qs) -> List[Dict[str, Any]]:
+    """
+    opened_at（JST）の日付ごとに件数・勝敗・PL を SQL で集計（新しい日付順）
+    """
+    return list(
+        base_qs
+        .order_by()
+        .annotate(d=TruncDate("opened_at"))
+        .values("d")
+        .annotate(
+            n=Count("id"),
+            win=Count("id", filter=Q(pro_label="win")),
+            lose=Count("id", filter=Q(pro_label="lose")),
+            flat=Count("id", filter=Q(pro_label="flat")),
+            pl=Sum("pro_pl"),
+        )
+        .order_by("-d")
+    )
 
 
 @login_required
@@ -191,10 +161,10 @@ def simulate_list(request: HttpRequest) -> HttpResponse:
     """
     シミュレ一覧（DB版 / PRO公式記録）
 
-    - 対象は PRO accepted のみ（replay.pro.status='accepted'）
+    - 対象は PRO accepted のみ（pro_status='accepted' = replay.pro.status の非正規化列）
     - opened_at（JST）を基準に日付フィルタ & 表示時刻を作る
     - mode / date / q でフィルタ
-    - KPI:
+    - KPI（opened_at の日付で GROUP BY。件数が増えても1クエリ）:
         * 選択日の成績（PROのみ）
         * 通算（全期間）（PROのみ）
     - 上部に「PRO残高パネル」（口座資金 / 建玉数 / 拘束 / 残り）を表示
@@ -217,23 +187,16 @@ def simulate_list(request: HttpRequest) -> HttpResponse:
             selected_date = None
 
     # ---- PRO公式ベースQS（KPI/日付候補/一覧の母体）----
+    # pro_status は replay.pro.status の非正規化（index: user, pro_status, opened_at）
     base_qs = (
         VirtualTrade.objects
-        .filter(user=user, replay__pro__status="accepted")
+        .filter(user=user, pro_status="accepted")
         .filter(qty_pro__gt=0)
-        .order_by("-opened_at", "-id")
     )
 
-    # 日付候補（opened_at基準）
-    date_list: List[_date] = []
-    for v in base_qs.only("opened_at"):
-        if not v.opened_at:
-            continue
-        try:
-            d = timezone.localtime(v.opened_at).date()
-            date_list.append(d)
-        except Exception:
-            continue
+    # 日付候補 + KPI を opened_at（JST）の日付で GROUP BY（1クエリ）
+    daily = _pro_daily_rows(base_qs)
+    date_list: List[_date] = [r["d"] for r in daily if r.get("d") is not None]
 
     # date_param が無い時は「最新日」を自動選択（PROのみ）
     if selected_date is None and date_list:
@@ -242,25 +205,13 @@ def simulate_list(request: HttpRequest) -> HttpResponse:
     selected_date_str = selected_date.isoformat() if selected_date is not None else ""
 
     # ---- KPI集計（PROのみ）----
-    summary_selected: Dict[str, Any] = {
-        "win": 0, "lose": 0, "flat": 0, "skip": 0,
-        "total_pl": 0.0, "has_data": False,
-    }
-    summary_total: Dict[str, Any] = {
-        "win": 0, "lose": 0, "flat": 0, "skip": 0,
-        "total_pl": 0.0, "has_data": False,
-    }
+    summary_selected: Dict[str, Any] = _empty_summary()
+    summary_total: Dict[str, Any] = _empty_summary()
 
-    for v in base_qs:
-        _accumulate_pro(summary_total, v)
-
-        try:
-            opened_local = timezone.localtime(v.opened_at) if v.opened_at else None
-        except Exception:
-            opened_local = None
-
-        if selected_date is not None and opened_local is not None and opened_local.date() == selected_date:
-            _accumulate_pro(summary_selected, v)
+    for row in daily:
+        _accumulate_pro(summary_total, row)
+        if selected_date is not None and row.get("d") == selected_date:
+            _accumulate_pro(summary_selected, row)
 
     summary_selected["has_data"] = (summary_selected["win"] + summary_selected["lose"] + summary_selected["flat"] + summary_selected["skip"]) > 0
     summary_total["has_data"] = (summary_total["win"] + summary_total["lose"] + summary_total["flat"] + summary_total["skip"]) > 0
@@ -270,12 +221,7 @@ def simulate_list(request: HttpRequest) -> HttpResponse:
 
     max_positions, max_total_risk_r = _get_policy_limits_default()
 
-    open_qs = (
-        VirtualTrade.objects
-        .filter(user=user, replay__pro__status="accepted")
-        .filter(qty_pro__gt=0)
-        .filter(closed_at=None)
-    )
+    open_qs = base_qs.filter(closed_at=None)
     open_count = int(open_qs.count())
 
     agg = open_qs.aggregate(s=Sum("required_cash_pro"))
@@ -295,12 +241,13 @@ def simulate_list(request: HttpRequest) -> HttpResponse:
     }
 
     # ---- 一覧用QS（ここからフィルタ適用 / 母体はPRO acceptedのみ） ----
-    qs = (
-        VirtualTrade.objects
-        .filter(user=user, replay__pro__status="accepted")
-        .filter(qty_pro__gt=0)
-        .order_by("-opened_at", "-id")
-    )
+    qs = base_qs.order_by("-opened_at", "-id")
+
+    # 日付フィルタ（opened_at基準。JST のその日 0:00〜翌0:00 を SQL で）
+    if selected_date is not None:
+        tz = timezone.get_current_timezone()
+        day_start = timezone.make_aware(_dt.combine(selected_date, _time.min), tz)
+        qs = qs.filter(opened_at__gte=day_start, opened_at__lt=day_start + _timedelta(days=1))
 
     if mode == "live":
         qs = qs.filter(mode__iexact="live")
@@ -310,20 +257,15 @@ def simulate_list(request: HttpRequest) -> HttpResponse:
     if q:
         qs = qs.filter(Q(code__icontains=q) | Q(name__icontains=q))
 
-    # ---- entries 作成 ----
+    # ---- entries 作成（最大100件）----
     entries_all: List[Dict[str, Any]] = []
 
-    for v in qs:
+    for v in qs[:100]:
         try:
             opened_local = timezone.localtime(v.opened_at) if v.opened_at else None
         except Exception:
             opened_local = None
 
-        # 日付フィルタ（opened_at基準）
-        if selected_date is not None:
-            if opened_local is None or opened_local.date() != selected_date:
-                continue
-
         exit_reason = str(v.eval_exit_reason or "").strip()
         exit_reason_label = _label_exit_reason(exit_reason)
         combined_label = _combined_label_pro(v)
@@ -1,14 +1,14 @@
 # portfolio/management/commands/update_last_prices.py
 from __future__ import annotations
 import sys
-from typing import Dict, List, Optional
+from typing import Dict, List
 from datetime import datetime, timedelta, timezone
 
-import pandas as pd
-import yfinance as yf
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from aiapp.services.fetch_price import download_daily_batch
+
 from portfolio.models import Holding
 from portfolio.services import trend as svc_trend  # 保有ページと同じ正規化
 
@@ -18,36 +18,23 @@ def _norm(t: str) -> str:
     return svc_trend._normalize_ticker(str(t or ""))
 
 def _download_last_close(norm_syms: List[str]) -> Dict[str, float]:
+    """
+    チャンク単位の multi-ticker 取得（リトライ付き）で直近終値を拾う。
+    """
     if not norm_syms:
         return {}
-    try:
-        df = yf.download(
-            tickers=norm_syms if len(norm_syms) > 1 else norm_syms[0],
-            period="40d", interval="1d",
-            auto_adjust=True, progress=False, group_by="ticker"
-        )
-    except Exception:
-        df = None
+    frames = download_daily_batch(norm_syms, period="40d", auto_adjust=True)
 
     out: Dict[str, float] = {}
-    def _pick_one(sym: str) -> Optional[float]:
-        if df is None: return None
-        try:
-            if isinstance(df.columns, pd.MultiIndex):
-                s = df[(sym, "Close")] if (sym, "Close") in df.columns else df.xs(sym, axis=1)["Close"]  # type: ignore[index]
-            else:
-                s = df["Close"]  # type: ignore[index]
-        except Exception:
-            return None
+    for s in norm_syms:
+        df = frames.get(s)
+        if df is None or df.empty:
+            continue
         try:
-            v = float(pd.Series(s).dropna().iloc[-1])  # type: ignore[arg-type]
-            return v if v > 0 else None
+            v = float(df["Close"].dropna().iloc[-1])
         except Exception:
-            return None
-
-    for s in norm_syms:
-        v = _pick_one(s)
-        if v is not None:
+            continue
+        if v > 0:
             out[s] = v
     return out
 